@@ -0,0 +1,179 @@
+"""
+索引迁移基准测试 - 对比 v1（无二级索引）和 v2（热点查询索引）下的查询延迟
+
+在独立的临时数据库中生成测试数据（默认 100 万条对话历史），不会影响业务库。
+需要 .env 中的 MySQL 账号有建库权限。
+
+用法:
+    python benchmarks/bench_schema_indexes.py
+    python benchmarks/bench_schema_indexes.py --rows 200000 --repeat 50
+"""
+import argparse
+import random
+import string
+import time
+from datetime import datetime, timedelta
+
+from bench_utils import drop_database, scratch_db, summarize
+from config import Config
+from db_manager import DBManager
+from db_migrations import migrate
+
+# 待测的热点查询: (名称, SQL, 参数生成函数)
+QUERIES = [
+    (
+        "history_by_buyer",
+        """SELECT role, content, coze_conversation_id, created_at
+           FROM conversation_history WHERE buyer_name = %s
+           ORDER BY created_at DESC LIMIT 10""",
+        lambda ctx: (random.choice(ctx['buyers']),),
+    ),
+    (
+        "history_count",
+        "SELECT COUNT(*) as count FROM conversation_history WHERE buyer_name = %s",
+        lambda ctx: (random.choice(ctx['buyers']),),
+    ),
+    (
+        "session_by_conversation",
+        "SELECT * FROM user_sessions WHERE conversation_id = %s",
+        lambda ctx: (random.choice(ctx['conversations']),),
+    ),
+    (
+        "user_sessions_by_last_message",
+        """SELECT * FROM user_sessions
+           WHERE user_id = %s AND conversation_id IS NOT NULL AND conversation_id != ''
+           ORDER BY last_message_at DESC""",
+        lambda ctx: (random.choice(ctx['users']),),
+    ),
+    (
+        "inactive_candidates",
+        """SELECT user_id, MAX(last_message_at) as last_time
+           FROM user_sessions
+           WHERE inactive_sent = 0
+             AND last_message_at IS NOT NULL
+             AND last_message_at < DATE_SUB(NOW(), INTERVAL %s MINUTE)
+             AND last_message_at > DATE_SUB(NOW(), INTERVAL 1 DAY)
+           GROUP BY user_id""",
+        lambda ctx: (3,),
+    ),
+]
+
+
+def random_text(length: int) -> str:
+    return ''.join(random.choices(string.ascii_letters + string.digits, k=length))
+
+
+def populate(db: DBManager, rows: int, buyers: int, sessions: int, batch: int = 5000) -> dict:
+    """生成测试数据，返回查询参数候选集"""
+    now = datetime.now()
+    buyer_names = [f"buyer_{i}" for i in range(buyers)]
+    user_ids = [str(2200000000 + i) for i in range(buyers)]
+    conversations = []
+
+    print(f"写入 {rows} 条对话历史...")
+    started_at = time.perf_counter()
+    for offset in range(0, rows, batch):
+        values = [
+            (
+                random.choice(buyer_names),
+                random.choice(('user', 'assistant')),
+                random_text(40),
+                f"conv_{random.randrange(sessions)}",
+                now - timedelta(seconds=random.randrange(180 * 86400)),
+            )
+            for _ in range(min(batch, rows - offset))
+        ]
+        with db.cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO conversation_history (buyer_name, role, content, coze_conversation_id, created_at) "
+                "VALUES (%s, %s, %s, %s, %s)",
+                values,
+            )
+    print(f"  完成 ({time.perf_counter() - started_at:.1f}秒)")
+
+    print(f"写入 {sessions} 个用户会话...")
+    values = []
+    for i in range(sessions):
+        conv_id = f"conv_{i}"
+        conversations.append(conv_id)
+        user_index = random.randrange(buyers)
+        values.append((
+            user_ids[user_index], str(890000000 + i), buyer_names[user_index], conv_id,
+            random.choice((0, 0, 0, 1)),
+            now - timedelta(seconds=random.randrange(30 * 86400)),
+        ))
+    for offset in range(0, len(values), batch):
+        with db.cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO user_sessions (user_id, item_id, buyer_name, conversation_id, inactive_sent, last_message_at) "
+                "VALUES (%s, %s, %s, %s, %s, %s)",
+                values[offset:offset + batch],
+            )
+
+    with db.cursor() as cursor:
+        cursor.execute("ANALYZE TABLE conversation_history, user_sessions")
+    return {'buyers': buyer_names, 'users': user_ids, 'conversations': conversations}
+
+
+def measure(db: DBManager, ctx: dict, repeat: int) -> dict:
+    """每个查询执行 repeat 次，返回 {名称: {'p50', 'p95', 'key'}}"""
+    results = {}
+    for name, sql, make_args in QUERIES:
+        timings = []
+        for _ in range(repeat):
+            args = make_args(ctx)
+            with db.cursor() as cursor:
+                started_at = time.perf_counter()
+                cursor.execute(sql, args)
+                cursor.fetchall()
+                timings.append((time.perf_counter() - started_at) * 1000)
+        with db.cursor() as cursor:
+            cursor.execute("EXPLAIN " + sql, make_args(ctx))
+            plan = cursor.fetchall()
+        results[name] = dict(summarize(timings), key=plan[0].get('key') or '-')
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="索引迁移前后的查询延迟对比")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="对话历史条数")
+    parser.add_argument("--buyers", type=int, default=20_000, help="买家数量")
+    parser.add_argument("--sessions", type=int, default=50_000, help="用户会话数量")
+    parser.add_argument("--repeat", type=int, default=30, help="每个查询的执行次数")
+    parser.add_argument("--database", default=f"{Config.db_name}_bench", help="临时数据库名（会被清空）")
+    parser.add_argument("--keep", action="store_true", help="结束后保留临时数据库")
+    args = parser.parse_args()
+
+    random.seed(42)
+    db = scratch_db(args.database)
+    if not db:
+        return
+
+    try:
+        migrate(db, target=1)
+        ctx = populate(db, args.rows, args.buyers, args.sessions)
+
+        print("测量 v1（无二级索引）...")
+        before = measure(db, ctx, args.repeat)
+
+        started_at = time.perf_counter()
+        migrate(db)
+        print(f"迁移到 v2 耗时 {time.perf_counter() - started_at:.1f}秒")
+
+        print("测量 v2（热点查询索引）...")
+        after = measure(db, ctx, args.repeat)
+
+        print()
+        print(f"{'查询':<32}{'v1 p50':>10}{'v1 p95':>10}{'v2 p50':>10}{'v2 p95':>10}{'加速':>8}  v2 索引")
+        for name, _, _ in QUERIES:
+            b, a = before[name], after[name]
+            speedup = b['p50'] / a['p50'] if a['p50'] else float('inf')
+            print(f"{name:<32}{b['p50']:>9.2f}ms{b['p95']:>8.2f}ms{a['p50']:>8.2f}ms{a['p95']:>8.2f}ms{speedup:>7.1f}x  {a['key']}")
+    finally:
+        db.close()
+        if not args.keep:
+            drop_database(args.database)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+会话获取/创建基准测试 - 对比旧的多次查询路径和单条 upsert
+
+旧路径: SELECT -> UPDATE（已有会话）或 COUNT/MAX -> INSERT -> SELECT（新会话），每次调用单独提交
+新路径: INSERT ... SELECT ... ON DUPLICATE KEY UPDATE + 一次 SELECT，一次提交
+
+同时做并发测试：多个线程同时为同一个新用户创建不同商品的会话，
+检查 customer_type 恰好只有一个 new。
+
+用法:
+    python benchmarks/bench_session_upsert.py
+    python benchmarks/bench_session_upsert.py --calls 5000 --existing-ratio 0.8
+"""
+import argparse
+import random
+import threading
+import time
+
+from bench_utils import drop_database, scratch_db, summarize
+from config import Config
+from db_manager import DBManager
+from db_migrations import migrate
+
+
+def legacy_get_or_create_session(db: DBManager, user_id, item_id, buyer_name=None, order_status=None, product_title=None):
+    """旧实现（逐条查询，每步提交），仅用于对比"""
+    with db.cursor() as cursor:
+        cursor.execute("SELECT * FROM user_sessions WHERE user_id = %s AND item_id = %s", (user_id, item_id))
+        session = cursor.fetchone()
+        if session:
+            if product_title:
+                cursor.execute(
+                    "UPDATE user_sessions SET last_message_at = NOW(), product_title = %s WHERE user_id = %s AND item_id = %s",
+                    (product_title, user_id, item_id)
+                )
+                session['product_title'] = product_title
+            else:
+                cursor.execute(
+                    "UPDATE user_sessions SET last_message_at = NOW() WHERE user_id = %s AND item_id = %s",
+                    (user_id, item_id)
+                )
+            cursor.connection.commit()
+            return session
+
+        cursor.execute(
+            "SELECT COUNT(*) as cnt, MAX(inactive_sent) as inactive_sent FROM user_sessions WHERE user_id = %s",
+            (user_id,)
+        )
+        result = cursor.fetchone()
+        customer_type = 'returning' if result['cnt'] > 0 else 'new'
+        inherit_inactive_sent = 1 if result['inactive_sent'] else 0
+        cursor.execute(
+            """INSERT INTO user_sessions
+               (user_id, item_id, buyer_name, product_title, customer_type, order_status, last_message_at, inactive_sent)
+               VALUES (%s, %s, %s, %s, %s, %s, NOW(), %s)""",
+            (user_id, item_id, buyer_name, product_title, customer_type, order_status, inherit_inactive_sent)
+        )
+        cursor.connection.commit()
+        cursor.execute("SELECT * FROM user_sessions WHERE user_id = %s AND item_id = %s", (user_id, item_id))
+        return cursor.fetchone()
+
+
+def make_workload(calls: int, existing_ratio: float, seeded: list, prefix: str) -> list:
+    """生成调用参数：一部分命中已有会话，其余为新会话（一半是已有用户的新商品）"""
+    workload = []
+    for i in range(calls):
+        if random.random() < existing_ratio:
+            user_id, item_id = random.choice(seeded)
+        elif random.random() < 0.5:
+            user_id, item_id = random.choice(seeded)[0], f"{prefix}_item_{i}"
+        else:
+            user_id, item_id = f"{prefix}_user_{i}", f"{prefix}_item_{i}"
+        workload.append((user_id, item_id, f"buyer_{user_id}", None, "标题"))
+    return workload
+
+
+def run(fn, db: DBManager, workload: list) -> dict:
+    timings = []
+    for user_id, item_id, buyer_name, order_status, title in workload:
+        started_at = time.perf_counter()
+        fn(db, user_id, item_id, buyer_name, order_status, title)
+        timings.append((time.perf_counter() - started_at) * 1000)
+    return summarize(timings)
+
+
+def race(fn, db: DBManager, user_id: str, threads: int) -> list:
+    """多个线程同时为同一新用户创建不同商品的会话，返回各会话的 customer_type"""
+    barrier = threading.Barrier(threads)
+    results = [None] * threads
+
+    def worker(i):
+        barrier.wait()
+        session = fn(db, user_id, f"race_item_{i}", "race_buyer", None, None)
+        results[i] = session.get('customer_type') if session else None
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="会话获取/创建：旧路径 vs 单条 upsert")
+    parser.add_argument("--seed-sessions", type=int, default=20_000, help="预先写入的会话数")
+    parser.add_argument("--calls", type=int, default=2_000, help="每种实现的调用次数")
+    parser.add_argument("--existing-ratio", type=float, default=0.9, help="命中已有会话的比例")
+    parser.add_argument("--race-threads", type=int, default=8, help="并发测试线程数")
+    parser.add_argument("--database", default=f"{Config.db_name}_bench", help="临时数据库名（会被清空）")
+    args = parser.parse_args()
+
+    random.seed(42)
+    db = scratch_db(args.database)
+    if not db:
+        return
+    db.pool.max_size = args.race_threads
+
+    try:
+        migrate(db)
+        seeded = [(str(2200000000 + i % (args.seed_sessions // 3)), str(890000000 + i)) for i in range(args.seed_sessions)]
+        with db.cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO user_sessions (user_id, item_id, buyer_name, last_message_at) VALUES (%s, %s, %s, NOW())",
+                [(u, i, f"buyer_{u}") for u, i in seeded],
+            )
+
+        def upsert(db_, *call_args):
+            return db_.get_or_create_session(*call_args)
+
+        results = {
+            'legacy': run(legacy_get_or_create_session, db, make_workload(args.calls, args.existing_ratio, seeded, 'legacy')),
+            'upsert': run(upsert, db, make_workload(args.calls, args.existing_ratio, seeded, 'upsert')),
+        }
+
+        print(f"\n{args.calls} 次调用，命中已有会话比例 {args.existing_ratio:.0%}")
+        print(f"{'实现':<10}{'p50':>10}{'p95':>10}{'p99':>10}{'平均':>10}")
+        for name, r in results.items():
+            print(f"{name:<10}{r['p50']:>8.3f}ms{r['p95']:>8.3f}ms{r['p99']:>8.3f}ms{r['mean']:>8.3f}ms")
+
+        print(f"\n并发测试：{args.race_threads} 个线程同时为同一新用户创建会话")
+        for name, fn in (('legacy', legacy_get_or_create_session), ('upsert', upsert)):
+            types = race(fn, db, f"race_{name}", args.race_threads)
+            new_count = types.count('new')
+            verdict = "正确" if new_count == 1 and None not in types else "错误"
+            print(f"  {name:<8} new={new_count} returning={types.count('returning')} 失败={types.count(None)} -> {verdict}")
+    finally:
+        db.close()
+        drop_database(args.database)
+
+
+if __name__ == "__main__":
+    main()
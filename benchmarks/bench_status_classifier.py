@@ -0,0 +1,167 @@
+"""
+订单状态 / 系统消息分类基准测试 - 预编译正则分类器 vs 逐个关键词 includes
+
+合成 --conversations 个会话列表项文本（部分带订单状态）和同样数量的聊天消息，
+对比旧实现（每次调用序列化映射表 + 逐个关键词子串查找，第一个命中的关键词生效）
+和 StatusClassifier（一个长关键词优先的正则分支），并统计两者结果不一致的条目数。
+
+--browser 时在无头 Chromium 中用 500 个会话项的页面重复执行同样的对比（需要 playwright 浏览器）。
+
+用法:
+    python benchmarks/bench_status_classifier.py
+    python benchmarks/bench_status_classifier.py --conversations 500 --rounds 200 --browser
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from bench_utils import summarize
+from config import DEFAULT_STATUS_MAPPING
+from status_classifier import SYSTEM_MESSAGE_KEYWORDS, StatusClassifier
+
+FILLER = ["在吗", "还在吗，能便宜点吗", "什么时候发货", "好的谢谢", "可以小刀吗", "包邮吗", "[图片]"]
+
+
+def simple_mapping() -> dict:
+    return {orig: value.get('mapped', '') if isinstance(value, dict) else value
+            for orig, value in DEFAULT_STATUS_MAPPING.items()}
+
+
+def synth_conversations(count: int, mapping: dict) -> list:
+    statuses = list(mapping)
+    items = []
+    for i in range(count):
+        lines = [str(random.randint(1, 9))] if i % 4 == 0 else []
+        lines.append(f"买家{i}")
+        if random.random() < 0.6:
+            lines.append(random.choice(statuses))
+        lines.append(random.choice(FILLER + list(SYSTEM_MESSAGE_KEYWORDS[:3])))
+        lines.append(f"{random.randint(0, 23):02d}:{random.randint(0, 59):02d}")
+        items.append("\n".join(lines))
+    return items
+
+
+def synth_messages(count: int) -> list:
+    pool = FILLER + list(SYSTEM_MESSAGE_KEYWORDS)
+    return [random.choice(pool) + ("" if random.random() < 0.5 else random.choice(FILLER)) for _ in range(count)]
+
+
+def legacy_status(text: str, mapping: dict) -> str:
+    for keyword in mapping:
+        if keyword in text:
+            return mapping[keyword]
+    return ''
+
+
+def legacy_is_system(text: str) -> bool:
+    return any(keyword in text for keyword in SYSTEM_MESSAGE_KEYWORDS)
+
+
+def run_python(items: list, messages: list, mapping: dict, rounds: int) -> dict:
+    classifier = StatusClassifier(mapping)
+    timings = {'legacy': [], 'classifier': []}
+    for _ in range(rounds):
+        started_at = time.perf_counter()
+        current = json.loads(json.dumps(mapping, ensure_ascii=False))  # 旧实现每次调用重新序列化映射表
+        [legacy_status(text, current) for text in items]
+        [legacy_is_system(text) for text in messages]
+        timings['legacy'].append((time.perf_counter() - started_at) * 1000)
+
+        started_at = time.perf_counter()
+        [classifier.classify_status(text) for text in items]
+        [classifier.is_system_message(text) for text in messages]
+        timings['classifier'].append((time.perf_counter() - started_at) * 1000)
+
+    differences = sum(legacy_status(text, mapping) != classifier.classify_status(text) for text in items)
+    result = {name: summarize(values) for name, values in timings.items()}
+    result['differences'] = differences
+    return result
+
+
+LEGACY_PAGE_JS = r"""
+(statusMapping) => {
+    const items = document.querySelectorAll('.conversation-item--x');
+    const out = [];
+    for (const item of items) {
+        const text = item.innerText;
+        let status = '';
+        for (const keyword of Object.keys(statusMapping)) {
+            if (text.includes(keyword)) { status = statusMapping[keyword]; break; }
+        }
+        out.push(status);
+    }
+    return out.length;
+}
+"""
+
+CLASSIFIER_PAGE_JS = r"""
+() => {
+    const items = document.querySelectorAll('.conversation-item--x');
+    const out = [];
+    for (const item of items) out.push(window.__xianyuClassifier.status(item.innerText));
+    return out.length;
+}
+"""
+
+
+async def run_browser(items: list, mapping: dict, rounds: int) -> dict:
+    from playwright.async_api import async_playwright
+
+    classifier = StatusClassifier(mapping)
+    html = "".join(f'<div class="conversation-item--x">{text.replace(chr(10), "<br>")}</div>' for text in items)
+    timings = {'legacy': [], 'classifier': []}
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True)
+        page = await browser.new_page()
+        await page.add_init_script(classifier.install_js)
+        await page.set_content(f"<html><body>{html}</body></html>")
+        for _ in range(rounds):
+            started_at = time.perf_counter()
+            # 旧实现：映射表序列化进脚本文本，每次调用重新解析
+            await page.evaluate(f"() => ({LEGACY_PAGE_JS})({json.dumps(mapping, ensure_ascii=False)})")
+            timings['legacy'].append((time.perf_counter() - started_at) * 1000)
+
+            started_at = time.perf_counter()
+            await page.evaluate(CLASSIFIER_PAGE_JS)
+            timings['classifier'].append((time.perf_counter() - started_at) * 1000)
+        await browser.close()
+    return {name: summarize(values) for name, values in timings.items()}
+
+
+def print_result(title: str, result: dict):
+    print(f"\n[{title}]")
+    print(f"  {'实现':<12}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for name in ('legacy', 'classifier'):
+        s = result[name]
+        print(f"  {name:<12}{s['p50']:>8.3f}ms{s['p95']:>8.3f}ms{s['p99']:>8.3f}ms")
+    speedup = result['legacy']['p50'] / result['classifier']['p50'] if result['classifier']['p50'] else 0
+    print(f"  p50 加速 {speedup:.1f}x")
+    if 'differences' in result:
+        print(f"  结果不一致（长关键词优先 / 最靠前关键词）: {result['differences']} 条")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="订单状态 / 系统消息分类：预编译正则 vs 逐个关键词查找")
+    parser.add_argument("--conversations", type=int, default=500, help="会话列表项数（同时生成同样数量的消息）")
+    parser.add_argument("--rounds", type=int, default=200, help="重复次数（每次分类整个列表）")
+    parser.add_argument("--browser", action="store_true", help="同时在无头 Chromium 中测试页面脚本")
+    args = parser.parse_args()
+
+    random.seed(42)
+    mapping = simple_mapping()
+    items = synth_conversations(args.conversations, mapping)
+    messages = synth_messages(args.conversations)
+
+    print(f"{args.conversations} 个会话 + {args.conversations} 条消息，{len(mapping)} 个状态关键词，重复 {args.rounds} 次")
+    print_result("Python", run_python(items, messages, mapping, args.rounds))
+    if args.browser:
+        try:
+            print_result("Chromium", asyncio.run(run_browser(items, mapping, args.rounds)))
+        except Exception as e:
+            print(f"跳过浏览器测试: {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+存储后端基准测试 - 按消息处理器的访问模式对比 MySQL 和 SQLite（WAL）
+
+每条模拟消息依次执行（与 _prepare_conversation / 写入队列 / inactive 检查相同）:
+    get_or_create_session（同一事务中重置 inactive 状态） -> get_product_block
+    -> save_replies（一条回复一个事务） -> is_inactive_sent + get_user_sessions
+默认关闭读缓存，只比较存储本身；--threads 模拟多个异步数据库线程并发处理不同买家。
+
+MySQL 使用临时数据库（需要建库权限，无法连接时跳过），SQLite 使用临时文件。
+
+用法:
+    python benchmarks/bench_storage_backends.py
+    python benchmarks/bench_storage_backends.py --messages 5000 --threads 4 --with-cache
+"""
+import argparse
+import random
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from bench_utils import drop_database, scratch_db, summarize
+from config import Config
+from db_manager import DBManager
+from db_sqlite import SQLiteDBManager
+from db_writer import ReplyRecord
+
+STEPS = ('session', 'product', 'save_reply', 'inactive_check')
+
+
+def seed(db: DBManager, buyers: int, products: int):
+    for i in range(products):
+        db.add_or_update_product(f"item_{i}", f"商品{i}", str(10 + i), "备注" if i % 2 else None)
+    for i in range(buyers):
+        db.get_or_create_session(f"user_{i}", f"item_{i % products}", f"buyer_{i}")
+
+
+def handle_message(db: DBManager, buyer: int, products: int, timings: dict):
+    user_id, buyer_name = f"user_{buyer}", f"buyer_{buyer}"
+    item_id = f"item_{random.randrange(products)}"
+
+    started_at = time.perf_counter()
+    db.get_or_create_session(user_id, item_id, buyer_name, reset_inactive=True)
+    t1 = time.perf_counter()
+    db.get_product_block(item_id)
+    t2 = time.perf_counter()
+    db.save_replies([ReplyRecord(buyer_name, user_id, item_id, "还在吗，能便宜点吗", "在的，已经是最低价了", f"conv_{buyer}")])
+    t3 = time.perf_counter()
+    db.is_inactive_sent(user_id)
+    db.get_user_sessions(user_id)
+    t4 = time.perf_counter()
+
+    for name, elapsed in zip(STEPS + ('total',), (t1 - started_at, t2 - t1, t3 - t2, t4 - t3, t4 - started_at)):
+        timings[name].append(elapsed * 1000)
+
+
+def run(db: DBManager, args) -> dict:
+    if not args.with_cache:
+        for cache in (db.product_cache, db.product_block_cache, db.session_cache, db.user_sessions_cache):
+            cache.ttl = 0
+    db.pool.max_size = max(db.pool.max_size, args.threads)
+    db.init_tables()
+    seed(db, args.buyers, args.products)
+
+    timings = {name: [] for name in STEPS + ('total',)}
+    lock = threading.Lock()
+    per_thread = args.messages // args.threads
+
+    def worker(index):
+        local = {name: [] for name in timings}
+        rng_buyers = range(index, args.buyers, args.threads)
+        for _ in range(per_thread):
+            handle_message(db, random.choice(rng_buyers), args.products, local)
+        with lock:
+            for name, values in local.items():
+                timings[name].extend(values)
+
+    started_at = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(args.threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - started_at
+
+    result = {name: summarize(values) for name, values in timings.items()}
+    result['throughput'] = per_thread * args.threads / elapsed
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MySQL vs SQLite（WAL）：消息处理器访问模式")
+    parser.add_argument("--messages", type=int, default=2_000, help="模拟消息条数")
+    parser.add_argument("--buyers", type=int, default=500, help="买家数量")
+    parser.add_argument("--products", type=int, default=50, help="商品数量")
+    parser.add_argument("--threads", type=int, default=1, help="并发线程数（对应异步数据库线程）")
+    parser.add_argument("--with-cache", action="store_true", help="开启读缓存")
+    parser.add_argument("--database", default=f"{Config.db_name}_bench", help="MySQL 临时数据库名（会被清空）")
+    args = parser.parse_args()
+
+    random.seed(42)
+    results = {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = SQLiteDBManager(Path(tmp) / "bench.db")
+        if db.connect():
+            try:
+                results['sqlite'] = run(db, args)
+            finally:
+                db.close()
+
+    try:
+        db = scratch_db(args.database)
+    except Exception as e:
+        db = None
+        print(f"跳过 MySQL: {e}")
+    if db:
+        try:
+            results['mysql'] = run(db, args)
+        finally:
+            db.close()
+            drop_database(args.database)
+
+    print(f"\n{args.messages} 条消息，{args.threads} 线程，读缓存{'开启' if args.with_cache else '关闭'}")
+    for backend, r in results.items():
+        print(f"\n[{backend}] 吞吐 {r['throughput']:.0f} 条/秒")
+        print(f"  {'步骤':<16}{'p50':>10}{'p95':>10}{'p99':>10}")
+        for name in STEPS + ('total',):
+            s = r[name]
+            print(f"  {name:<16}{s['p50']:>8.3f}ms{s['p95']:>8.3f}ms{s['p99']:>8.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
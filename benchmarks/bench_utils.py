@@ -0,0 +1,62 @@
+"""基准测试公共工具 - 临时数据库和耗时统计"""
+import statistics
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import pymysql
+from config import Config
+from db_manager import DBManager
+
+
+def _server_connection():
+    return pymysql.connect(
+        host=Config.db_host, port=int(Config.db_port),
+        user=Config.db_user, password=Config.db_password, charset='utf8mb4',
+    )
+
+
+def create_database(name: str):
+    """创建（或清空重建）临时数据库"""
+    conn = _server_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP DATABASE IF EXISTS `{name}`")
+            cursor.execute(f"CREATE DATABASE `{name}` DEFAULT CHARSET utf8mb4")
+    finally:
+        conn.close()
+
+
+def drop_database(name: str):
+    conn = _server_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP DATABASE IF EXISTS `{name}`")
+    finally:
+        conn.close()
+
+
+def scratch_db(name: str) -> DBManager:
+    """创建临时数据库并返回已连接的 DBManager（失败时返回 None）"""
+    create_database(name)
+    db = DBManager()
+    db.config.db_name = name
+    return db if db.connect() else None
+
+
+def summarize(timings_ms: list) -> dict:
+    """返回 p50/p95/p99/平均值（毫秒）"""
+    ordered = sorted(timings_ms)
+    if not ordered:
+        return {'p50': 0.0, 'p95': 0.0, 'p99': 0.0, 'mean': 0.0}
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, max(0, int(len(ordered) * q) - 1))]
+
+    return {
+        'p50': statistics.median(ordered),
+        'p95': pick(0.95),
+        'p99': pick(0.99),
+        'mean': statistics.fmean(ordered),
+    }
@@ -6,41 +6,50 @@ sys.path.insert(0, str(Path(__file__).parent))
 from db_manager import db_manager
 
 
-def clear_user_session(buyer_name: str):
-    """清除指定用户的会话ID和对话历史"""
-    print(f"正在清除用户 [{buyer_name}] 的会话...")
+def clear_user_session(user: str):
+    """清除指定用户（user_id 或昵称）的会话ID和对话历史"""
+    print(f"正在清除用户 [{user}] 的会话...")
 
     if not db_manager.connect():
         print("❌ 数据库连接失败")
         return False
 
     try:
-        # 先查看当前状态
-        with db_manager.connection.cursor() as cursor:
+        # 先查看当前状态（昵称可能重复，重名时需要指定 user_id）
+        with db_manager.cursor('clear_user_session') as cursor:
             cursor.execute(
-                "SELECT coze_conversation_id FROM users WHERE buyer_name = %s",
-                (buyer_name,)
+                "SELECT user_id, buyer_name FROM users WHERE user_id = %s OR buyer_name = %s",
+                (user, user)
             )
-            result = cursor.fetchone()
-            if result:
-                print(f"当前会话ID: {result.get('coze_conversation_id', '无')}")
-            else:
-                print(f"用户 [{buyer_name}] 不存在")
+            matches = [row for row in cursor.fetchall() if row['user_id']]
+            if not matches:
+                print(f"用户 [{user}] 不存在")
                 return False
+            if len(matches) > 1:
+                print(f"昵称 [{user}] 对应多个用户，请改用 user_id:")
+                for row in matches:
+                    print(f"  {row['user_id']}  {row['buyer_name']}")
+                return False
+            user_id = matches[0]['user_id']
 
             # 查看对话历史数量
             cursor.execute(
-                "SELECT COUNT(*) as count FROM conversation_history WHERE buyer_name = %s",
-                (buyer_name,)
+                """SELECT COUNT(*) as count FROM conversation_history h
+                   JOIN user_sessions s ON s.id = h.session_id WHERE s.user_id = %s""",
+                (user_id,)
             )
             count_result = cursor.fetchone()
-            print(f"对话历史条数: {count_result.get('count', 0)}")
+
+        # 游标归还连接后再查询会话ID（避免同时占用两个连接）
+        print(f"用户ID: {user_id}")
+        print(f"当前会话ID: {db_manager.get_conversation_id(user_id) or '无'}")
+        print(f"对话历史条数: {count_result.get('count', 0)}")
 
         # 清除会话ID和对话历史
-        success = db_manager.clear_conversation_id(buyer_name)
+        success = db_manager.clear_conversation_id(user_id)
 
         if success:
-            print(f"✅ 已清除用户 [{buyer_name}] 的会话ID和对话历史")
+            print(f"✅ 已清除用户 [{user}] 的会话ID和对话历史")
             print("下次该用户发消息时，将创建全新的会话")
         else:
             print("❌ 清除失败")
@@ -60,13 +69,15 @@ def clear_all_sessions():
         return False
 
     try:
-        with db_manager.connection.cursor() as cursor:
+        with db_manager.cursor('clear_all_sessions') as cursor:
             # 清除所有 conversation_id
+            cursor.execute("UPDATE user_sessions SET conversation_id = NULL")
             cursor.execute("UPDATE users SET coze_conversation_id = NULL")
-            # 清除所有对话历史
+            # 清除所有对话历史（包括归档计数和用户统计）
             cursor.execute("DELETE FROM conversation_history")
+            cursor.execute("DELETE FROM history_archive_summary")
+            cursor.execute("DELETE FROM user_stats")
 
-        db_manager.connection.commit()
         print("✅ 已清除所有用户的会话ID和对话历史")
         return True
 
@@ -84,11 +95,14 @@ def list_users():
         return
 
     try:
-        with db_manager.connection.cursor() as cursor:
+        with db_manager.cursor('list_users') as cursor:
             cursor.execute("""
-                SELECT u.buyer_name, u.coze_conversation_id,
-                       (SELECT COUNT(*) FROM conversation_history ch WHERE ch.buyer_name = u.buyer_name) as msg_count
+                SELECT u.buyer_name, u.user_id,
+                       COALESCE(s.message_count, 0) as msg_count,
+                       COALESCE(s.reply_count, 0) as reply_count,
+                       CASE WHEN s.latency_samples > 0 THEN s.latency_total / s.latency_samples END as avg_reply_latency
                 FROM users u
+                LEFT JOIN user_stats s ON s.user_id = u.user_id
                 ORDER BY u.updated_at DESC
             """)
             users = cursor.fetchall()
@@ -97,13 +111,43 @@ def list_users():
                 print("没有用户记录")
                 return
 
-            print(f"\n{'用户名':<20} {'会话ID':<40} {'消息数':<10}")
-            print("-" * 70)
+            print(f"\n{'用户名':<20} {'用户ID':<40} {'消息数':<10} {'回复数':<10} {'平均回复耗时':<10}")
+            print("-" * 100)
             for user in users:
                 name = user['buyer_name'][:18] if user['buyer_name'] else '未知'
-                conv_id = (user['coze_conversation_id'] or '无')[:38]
+                user_id = (user['user_id'] or '无')[:38]
                 msg_count = user['msg_count'] or 0
-                print(f"{name:<20} {conv_id:<40} {msg_count:<10}")
+                reply_count = user['reply_count'] or 0
+                latency = f"{user['avg_reply_latency']:.1f}秒" if user['avg_reply_latency'] is not None else '-'
+                print(f"{name:<20} {user_id:<40} {msg_count:<10} {reply_count:<10} {latency:<10}")
+    finally:
+        db_manager.close()
+
+
+def rebuild_stats():
+    """按对话历史重建用户统计（消息数、回复数、回复耗时）"""
+    if not db_manager.connect():
+        print("❌ 数据库连接失败")
+        return
+
+    try:
+        db_manager.init_tables()
+        count = db_manager.rebuild_user_stats()
+        print(f"✅ 已重建 {count} 个用户的统计")
+    finally:
+        db_manager.close()
+
+
+def backfill_identity():
+    """把旧数据迁移到 user_id 标识（补齐 users.user_id，对话历史关联会话）"""
+    if not db_manager.connect():
+        print("❌ 数据库连接失败")
+        return
+
+    try:
+        db_manager.init_tables()
+        result = db_manager.backfill_user_identity()
+        print(f"✅ 补齐 {result['users']} 个用户的 user_id，关联 {result['history']} 条对话历史")
     finally:
         db_manager.close()
 
@@ -116,8 +160,10 @@ if __name__ == "__main__":
     if len(sys.argv) < 2:
         print("\n用法:")
         print("  python clear_user_session.py list              - 列出所有用户")
-        print("  python clear_user_session.py clear <用户名>    - 清除指定用户的会话")
+        print("  python clear_user_session.py clear <用户ID或用户名> - 清除指定用户的会话")
         print("  python clear_user_session.py clear_all         - 清除所有用户的会话")
+        print("  python clear_user_session.py rebuild_stats     - 按对话历史重建用户统计")
+        print("  python clear_user_session.py backfill_identity - 旧数据迁移到 user_id 标识")
         print("\n示例:")
         print("  python clear_user_session.py clear 敌法师爱码")
         sys.exit(0)
@@ -127,8 +173,11 @@ if __name__ == "__main__":
     if command == "list":
         list_users()
     elif command == "clear" and len(sys.argv) >= 3:
-        buyer_name = sys.argv[2]
-        clear_user_session(buyer_name)
+        clear_user_session(sys.argv[2])
+    elif command == "rebuild_stats":
+        rebuild_stats()
+    elif command == "backfill_identity":
+        backfill_identity()
     elif command == "clear_all":
         confirm = input("确定要清除所有用户的会话吗？(y/n): ")
         if confirm.lower() == 'y':
@@ -136,4 +185,4 @@ if __name__ == "__main__":
         else:
             print("已取消")
     else:
-        print("未知命令，请使用 list / clear / clear_all")
+        print("未知命令，请使用 list / clear / clear_all / rebuild_stats / backfill_identity")
@@ -1,8 +1,14 @@
 """配置管理模块"""
 import os
 import json
+import hashlib
+import threading
+from dataclasses import dataclass
 from pathlib import Path
+from types import MappingProxyType
+from typing import Any, Mapping, Optional
 from dotenv import load_dotenv
+from status_classifier import StatusClassifier
 
 load_dotenv()
 
@@ -33,16 +39,126 @@ DEFAULT_COZE_VARS = {
 }
 
 
-def _load_vars_config():
-    """加载变量配置文件"""
-    config_path = Path(__file__).parent / "coze_vars_config.json"
-    try:
-        if config_path.exists():
-            with open(config_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-    except Exception:
-        pass
-    return {'vars': DEFAULT_COZE_VARS, 'status_mapping': DEFAULT_STATUS_MAPPING}
+# 变量配置文件（由 GUI 编辑）
+VARS_CONFIG_PATH = Path(__file__).parent / "coze_vars_config.json"
+
+
+@dataclass(frozen=True)
+class CozeVarsSnapshot:
+    """
+    变量配置快照（不可变，配置文件变化时整体替换）
+
+    build() 用到的变量名在加载时预先计算：禁用的变量为 None。
+    """
+    names: Mapping[str, str]
+    enabled: Mapping[str, bool]
+    status_mapping: Mapping[str, Any]
+    status_mapping_simple: Mapping[str, str]
+    classifier: StatusClassifier  # 订单状态 / 系统消息分类器（Python 和页面脚本共用）
+    prompt: str
+    buyer_name_var: Optional[str]
+    order_status_var: Optional[str]
+    product_info_var: Optional[str]
+
+    @classmethod
+    def parse(cls, config: dict) -> 'CozeVarsSnapshot':
+        vars_config = config.get('vars', {})
+        names = {key: value.get('name', key) for key, value in vars_config.items()}
+        enabled = {key: value.get('enabled', True) for key, value in vars_config.items()}
+        status_mapping = config.get('status_mapping', DEFAULT_STATUS_MAPPING)
+        simple_mapping = {}
+        for orig, value in status_mapping.items():
+            if isinstance(value, dict):
+                simple_mapping[orig] = value.get('mapped', '')
+            else:
+                # 兼容旧格式
+                simple_mapping[orig] = value
+
+        def var(key: str) -> Optional[str]:
+            return names.get(key, key) if enabled.get(key, True) else None
+
+        return cls(
+            names=MappingProxyType(names),
+            enabled=MappingProxyType(enabled),
+            status_mapping=MappingProxyType(status_mapping),
+            status_mapping_simple=MappingProxyType(simple_mapping),
+            classifier=StatusClassifier(simple_mapping),
+            prompt=config.get('prompt', ''),
+            buyer_name_var=var('buyer_name'),
+            order_status_var=var('order_status'),
+            product_info_var=var('product_info'),
+        )
+
+
+class VarsConfigCache:
+    """
+    变量配置文件的内存缓存（线程安全，GUI 线程和消息处理线程共用）
+
+    每次读取只检查文件的 mtime 和大小；有变化时读取文件并比较内容哈希，内容变化才重新解析生成快照。
+    invalidate() 强制下次读取时重新加载（GUI 保存配置后调用）。
+    """
+
+    def __init__(self, path: Path = None):
+        self.path = path or VARS_CONFIG_PATH
+        self._lock = threading.Lock()
+        self._snapshot: Optional[CozeVarsSnapshot] = None
+        self._stamp = None
+        self._digest = None
+        self.stats = {'hits': 0, 'reloads': 0, 'unchanged': 0}
+
+    def _file_stamp(self):
+        try:
+            stat = os.stat(self.path)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def get(self) -> CozeVarsSnapshot:
+        stamp = self._file_stamp()
+        snapshot = self._snapshot
+        if snapshot is not None and stamp == self._stamp:
+            self.stats['hits'] += 1
+            return snapshot
+        with self._lock:
+            if self._snapshot is not None and stamp == self._stamp:
+                self.stats['hits'] += 1
+                return self._snapshot
+            return self._reload(stamp)
+
+    def _reload(self, stamp) -> CozeVarsSnapshot:
+        try:
+            content = self.path.read_bytes() if stamp is not None else b''
+        except OSError:
+            content = b''
+        digest = hashlib.sha1(content).hexdigest()
+        self._stamp = stamp
+        if self._snapshot is not None and digest == self._digest:
+            # 文件被重新保存但内容没有变化
+            self.stats['unchanged'] += 1
+            return self._snapshot
+        config = None
+        if content:
+            try:
+                config = json.loads(content.decode('utf-8'))
+            except Exception:
+                config = None
+        if config is None:
+            config = {'vars': DEFAULT_COZE_VARS, 'status_mapping': DEFAULT_STATUS_MAPPING}
+        self._snapshot = CozeVarsSnapshot.parse(config)
+        self._digest = digest
+        self.stats['reloads'] += 1
+        return self._snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self._stamp = None
+            self._digest = None
+
+    def get_stats(self) -> dict:
+        return dict(self.stats)
+
+
+_vars_cache = VarsConfigCache()
 
 
 # ============================================================
@@ -50,6 +166,7 @@ def _load_vars_config():
 # 这些常量对应 Coze 工作流开始节点中定义的输入参数名称
 # 现在支持从 GUI 配置文件动态读取
 # ============================================================
+
 class CozeVars:
     """Coze 工作流变量名称常量（与工作流开始节点参数名对应）"""
 
@@ -59,52 +176,48 @@ class CozeVars:
     PRODUCT_INFO = "product_info"       # 商品信息
 
     @classmethod
-    def _get_config(cls):
-        """获取配置"""
-        return _load_vars_config()
+    def snapshot(cls) -> CozeVarsSnapshot:
+        """获取当前配置快照（配置文件未变化时不读取文件）"""
+        return _vars_cache.get()
+
+    @classmethod
+    def reload(cls):
+        """配置文件已修改（GUI 保存后调用），下次读取时重新加载"""
+        _vars_cache.invalidate()
+
+    @classmethod
+    def get_cache_stats(cls) -> dict:
+        return _vars_cache.get_stats()
 
     @classmethod
     def get_var_name(cls, var_key: str) -> str:
         """获取变量名（从配置文件读取）"""
-        config = cls._get_config()
-        vars_config = config.get('vars', {})
-        if var_key in vars_config:
-            return vars_config[var_key].get('name', var_key)
-        return var_key
+        return cls.snapshot().names.get(var_key, var_key)
 
     @classmethod
     def is_var_enabled(cls, var_key: str) -> bool:
         """检查变量是否启用"""
-        config = cls._get_config()
-        vars_config = config.get('vars', {})
-        if var_key in vars_config:
-            return vars_config[var_key].get('enabled', True)
-        return True
+        return cls.snapshot().enabled.get(var_key, True)
 
     @classmethod
     def get_status_mapping(cls) -> dict:
         """获取订单状态映射表（完整结构）"""
-        config = cls._get_config()
-        return config.get('status_mapping', DEFAULT_STATUS_MAPPING)
+        return dict(cls.snapshot().status_mapping)
 
     @classmethod
     def get_status_mapping_simple(cls) -> dict:
         """获取简化的订单状态映射表（仅原始状态 -> 映射值）"""
-        full_mapping = cls.get_status_mapping()
-        simple_mapping = {}
-        for orig, value in full_mapping.items():
-            if isinstance(value, dict):
-                simple_mapping[orig] = value.get('mapped', '')
-            else:
-                # 兼容旧格式
-                simple_mapping[orig] = value
-        return simple_mapping
+        return dict(cls.snapshot().status_mapping_simple)
+
+    @classmethod
+    def get_classifier(cls) -> StatusClassifier:
+        """获取订单状态 / 系统消息分类器（配置变化时生成新的分类器）"""
+        return cls.snapshot().classifier
 
     @classmethod
     def get_prompt(cls) -> str:
         """获取系统提示词"""
-        config = cls._get_config()
-        return config.get('prompt', '')
+        return cls.snapshot().prompt
 
     @classmethod
     def build(cls, buyer_name: str = "", product_info: dict = None, order_status: str = "") -> dict:
@@ -125,33 +238,30 @@ class CozeVars:
                 product_info={"title": "iPhone 15", "price": "5999", "order_status": "交易成功"}
             )
         """
+        # 一次构建只读取一次快照，变量名和启用状态已预先计算
+        snapshot = cls.snapshot()
         variables = {}
 
         # 买家信息
-        if buyer_name and cls.is_var_enabled('buyer_name'):
-            var_name = cls.get_var_name('buyer_name')
-            variables[var_name] = buyer_name
+        if buyer_name and snapshot.buyer_name_var:
+            variables[snapshot.buyer_name_var] = buyer_name
 
         # 商品信息
         if product_info:
             # 优先从 product_info 获取订单状态
-            if product_info.get("order_status") and cls.is_var_enabled('order_status'):
-                var_name = cls.get_var_name('order_status')
-                variables[var_name] = product_info.get("order_status", "")
+            if product_info.get("order_status") and snapshot.order_status_var:
+                variables[snapshot.order_status_var] = product_info.get("order_status", "")
             # 商品备注信息（包含标题、价格等完整信息）
-            if product_info.get("notes") and cls.is_var_enabled('product_info'):
-                var_name = cls.get_var_name('product_info')
-                variables[var_name] = product_info.get("notes", "")
+            if product_info.get("notes") and snapshot.product_info_var:
+                variables[snapshot.product_info_var] = product_info.get("notes", "")
 
         # 如果单独传入了 order_status，覆盖 product_info 中的值
-        if order_status and cls.is_var_enabled('order_status'):
-            var_name = cls.get_var_name('order_status')
-            variables[var_name] = order_status
+        if order_status and snapshot.order_status_var:
+            variables[snapshot.order_status_var] = order_status
 
         # 添加系统提示词
-        prompt = cls.get_prompt()
-        if prompt:
-            variables['prompt'] = prompt
+        if snapshot.prompt:
+            variables['prompt'] = snapshot.prompt
 
         return variables
 
@@ -164,12 +274,27 @@ class Config:
     COZE_BOT_ID: str = os.getenv("COZE_BOT_ID", "")
     COZE_API_BASE: str = "https://api.coze.cn"  # 国内版使用 coze.cn，海外版使用 coze.com
 
+    # Coze 连接池配置（复用 TLS 连接，避免每次请求重新握手）
+    COZE_HTTP2: bool = os.getenv("COZE_HTTP2", "true").lower() == "true"  # 是否启用 HTTP/2（需安装 h2）
+    COZE_POOL_MAX_CONNECTIONS: int = int(os.getenv("COZE_POOL_MAX_CONNECTIONS", "20"))  # 最大连接数
+    COZE_POOL_MAX_KEEPALIVE: int = int(os.getenv("COZE_POOL_MAX_KEEPALIVE", "10"))  # 最大保活连接数
+    COZE_POOL_KEEPALIVE_EXPIRY: float = float(os.getenv("COZE_POOL_KEEPALIVE_EXPIRY", "60"))  # 空闲连接保活时间（秒）
+    COZE_STREAM: bool = os.getenv("COZE_STREAM", "true").lower() == "true"  # 是否使用流式对话（SSE），失败时回退轮询
+    COZE_POLL_FIRST_INTERVAL: float = float(os.getenv("COZE_POLL_FIRST_INTERVAL", "0.3"))  # 轮询首次间隔（秒）
+    COZE_POLL_MAX_INTERVAL: float = float(os.getenv("COZE_POLL_MAX_INTERVAL", "2.0"))  # 轮询最大退避间隔（秒）
+
     # 闲鱼配置
     XIANYU_CHECK_INTERVAL: int = int(os.getenv("XIANYU_CHECK_INTERVAL", "10"))
+    # 未读会话推送配置（页面内 MutationObserver 监听，新消息到达立即处理）
+    UNREAD_WATCH_ENABLED: bool = os.getenv("UNREAD_WATCH_ENABLED", "true").lower() == "true"  # 是否启用推送模式
+    UNREAD_SAFETY_POLL_INTERVAL: int = int(os.getenv("UNREAD_SAFETY_POLL_INTERVAL", "60"))  # 推送模式下兜底全量轮询间隔（秒）
+    UNREAD_WATCH_DEBOUNCE_MS: int = int(os.getenv("UNREAD_WATCH_DEBOUNCE_MS", "150"))  # DOM 变化合并扫描的延迟（毫秒）
 
     # 重复消息过滤配置
     SKIP_DUPLICATE_MSG: bool = os.getenv("SKIP_DUPLICATE_MSG", "true").lower() == "true"
     MSG_EXPIRE_SECONDS: int = int(os.getenv("MSG_EXPIRE_SECONDS", "60"))
+    DEDUPE_MAX_ENTRIES: int = int(os.getenv("DEDUPE_MAX_ENTRIES", "10000"))  # 去重记录上限（超过时淘汰最早的记录）
+    DEDUPE_PERSIST: bool = os.getenv("DEDUPE_PERSIST", "true").lower() == "true"  # 是否把去重记录保存到数据库（重启后过期时间内不重复回复）
 
     XIANYU_URL: str = "https://www.goofish.com/im"  # 闲鱼网页版消息页面
 
@@ -179,17 +304,48 @@ class Config:
     INACTIVE_MESSAGE: str = os.getenv("INACTIVE_MESSAGE", "[inactive]")  # 发送给Coze的触发消息
     INACTIVE_SKIP_RESPONSE: str = os.getenv("INACTIVE_SKIP_RESPONSE", "[inact_skip]")  # Coze跳过发送的回复
 
+    # 延时任务调度配置（inactive 跟进、消息合并窗口共用一个时间轮，inactive 任务保存在数据库，重启后恢复）
+    SCHEDULER_TICK_SECONDS: float = float(os.getenv("SCHEDULER_TICK_SECONDS", "0.2"))  # 时间轮精度（秒）
+    SCHEDULER_FLUSH_INTERVAL: float = float(os.getenv("SCHEDULER_FLUSH_INTERVAL", "1"))  # 定时任务变化批量写入数据库的间隔（秒）
+
     # 新会话回忆配置（跨商品上下文传递）
     MEMORY_ENABLED: bool = os.getenv("MEMORY_ENABLED", "true").lower() == "true"  # 是否启用新会话回忆
     MEMORY_CONTEXT_ROUNDS: int = int(os.getenv("MEMORY_CONTEXT_ROUNDS", "5"))  # 获取历史对话轮数
 
+    # WebSocket 采集配置（被动解析闲鱼 IM 推送帧，无需进入会话即可获取买家 user_id / item_id）
+    WS_INGEST_ENABLED: bool = os.getenv("WS_INGEST_ENABLED", "false").lower() == "true"  # 是否启用 WebSocket 采集
+    WS_URL_KEYWORD: str = os.getenv("WS_URL_KEYWORD", "wss-goofish")  # IM WebSocket 地址关键字
+    WS_SELF_USER_ID: str = os.getenv("WS_SELF_USER_ID", "")  # 卖家自己的用户ID（用于区分买家/卖家消息，启用采集时必填）
+    WS_RECORD_FILE: str = os.getenv("WS_RECORD_FILE", "")  # 原始帧记录文件（JSONL，留空不记录）
+
     # 消息合并配置（防止用户分段发送导致AI回复混乱）
     MESSAGE_MERGE_ENABLED: bool = os.getenv("MESSAGE_MERGE_ENABLED", "true").lower() == "true"  # 是否启用消息合并
-    MESSAGE_MERGE_WAIT_SECONDS: float = float(os.getenv("MESSAGE_MERGE_WAIT_SECONDS", "3"))  # 等待合并的时间窗口（秒）
+    MESSAGE_MERGE_WAIT_SECONDS: float = float(os.getenv("MESSAGE_MERGE_WAIT_SECONDS", "3"))  # 等待合并的时间窗口（秒），窗口期内有新消息会顺延
     MESSAGE_MERGE_MIN_LENGTH: int = int(os.getenv("MESSAGE_MERGE_MIN_LENGTH", "5"))  # 低于此长度的消息触发等待
 
-    # 会话切换延迟配置（防止页面切换过快导致元素找不到）
-    CONVERSATION_ENTER_DELAY: float = float(os.getenv("CONVERSATION_ENTER_DELAY", "1.5"))  # 进入会话后等待时间（秒）
+    # 流水线处理配置（浏览器抓取与 Coze 推理并行，多个买家同时等待回复）
+    PIPELINE_ENABLED: bool = os.getenv("PIPELINE_ENABLED", "true").lower() == "true"  # 是否启用流水线处理
+    PIPELINE_COZE_WORKERS: int = int(os.getenv("PIPELINE_COZE_WORKERS", "4"))  # 同时进行的 Coze 对话数
+    PIPELINE_QUEUE_SIZE: int = int(os.getenv("PIPELINE_QUEUE_SIZE", "50"))  # 每个阶段队列的最大长度
+    PIPELINE_DRAIN_TIMEOUT: float = float(os.getenv("PIPELINE_DRAIN_TIMEOUT", "30"))  # 停止时等待队列处理完的最长时间（秒）
+
+    # 标签页池配置（多个标签页并行处理不同买家的会话，0 表示只使用主页面）
+    PAGE_POOL_SIZE: int = int(os.getenv("PAGE_POOL_SIZE", "0"))  # 标签页数量
+    PAGE_POOL_MAX_USES: int = int(os.getenv("PAGE_POOL_MAX_USES", "200"))  # 单个标签页使用多少次后重建（0 表示不重建）
+    PAGE_POOL_HEALTH_INTERVAL: float = float(os.getenv("PAGE_POOL_HEALTH_INTERVAL", "30"))  # 标签页健康检查间隔（秒）
+
+    # 页面就绪配置（进入会话、发送消息、返回列表均等待页面元素就绪，固定延迟仅作为最短等待时间）
+    CONVERSATION_ENTER_DELAY: float = float(os.getenv("CONVERSATION_ENTER_DELAY", "0"))  # 进入会话后最短等待时间（秒），0 表示就绪即继续
+    BROWSER_ACTION_MIN_DELAY: float = float(os.getenv("BROWSER_ACTION_MIN_DELAY", "0"))  # 发送消息、返回列表后最短等待时间（秒）
+    READINESS_TIMEOUT_MS: int = int(os.getenv("READINESS_TIMEOUT_MS", "5000"))  # 等待页面就绪的超时时间（毫秒）
+    SNAPSHOT_WAIT_TIMEOUT_MS: int = int(os.getenv("SNAPSHOT_WAIT_TIMEOUT_MS", "10000"))  # 等待会话页面锚点（闲鱼号链接、消息行）的超时时间（毫秒）
+
+    # 对话历史归档配置（超过保留天数的消息移到按月压缩的归档文件，0 表示不归档）
+    HISTORY_RETENTION_DAYS: int = int(os.getenv("HISTORY_RETENTION_DAYS", "0"))  # 数据库中保留最近多少天的消息
+    HISTORY_RETENTION_INTERVAL_HOURS: float = float(os.getenv("HISTORY_RETENTION_INTERVAL_HOURS", "6"))  # 归档任务执行间隔（小时）
+    HISTORY_RETENTION_BATCH_SIZE: int = int(os.getenv("HISTORY_RETENTION_BATCH_SIZE", "500"))  # 每批归档行数（每批一个短事务）
+    HISTORY_RETENTION_PAUSE: float = float(os.getenv("HISTORY_RETENTION_PAUSE", "0.2"))  # 批次之间暂停时间（秒）
+    HISTORY_ARCHIVE_DIR: str = os.getenv("HISTORY_ARCHIVE_DIR", str(Path(__file__).parent / "archives"))  # 归档文件目录
 
     # 浏览器配置
     HEADLESS: bool = os.getenv("HEADLESS", "false").lower() == "true"
@@ -197,12 +353,24 @@ class Config:
     BROWSER_WIDTH: int = int(os.getenv("BROWSER_WIDTH", "1280"))  # 浏览器窗口宽度
     BROWSER_HEIGHT: int = int(os.getenv("BROWSER_HEIGHT", "800"))  # 浏览器窗口高度
 
-    # MySQL数据库配置
+    # 数据库配置
+    db_backend: str = os.getenv("DB_BACKEND", "mysql").lower()  # 存储后端: mysql / sqlite（单机部署无需 MySQL 服务）
+    db_sqlite_path: str = os.getenv("DB_SQLITE_PATH", str(Path(__file__).parent / "data" / "xianyu.db"))  # SQLite 数据库文件
     db_host: str = os.getenv("DB_HOST", "localhost")
     db_port: str = os.getenv("DB_PORT", "3306")
     db_user: str = os.getenv("DB_USER", "root")
     db_password: str = os.getenv("DB_PASSWORD", "root")
     db_name: str = os.getenv("DB_NAME", "xianyu")
+    db_pool_size: int = int(os.getenv("DB_POOL_SIZE", "5"))  # 连接池最大连接数（同时也是异步调用的线程数）
+    db_pool_timeout: float = float(os.getenv("DB_POOL_TIMEOUT", "10"))  # 等待空闲连接的超时时间（秒）
+    db_write_behind: bool = os.getenv("DB_WRITE_BEHIND", "true").lower() == "true"  # 回复记录是否走后台写入队列
+    db_write_batch_size: int = int(os.getenv("DB_WRITE_BATCH_SIZE", "20"))  # 写入队列每批最多回复数
+    db_write_flush_interval: float = float(os.getenv("DB_WRITE_FLUSH_INTERVAL", "0.5"))  # 写入队列最长攒批时间（秒）
+    db_cache_size: int = int(os.getenv("DB_CACHE_SIZE", "1024"))  # 读缓存每类最多条目数
+    db_product_cache_ttl: float = float(os.getenv("DB_PRODUCT_CACHE_TTL", "600"))  # 商品缓存有效期（秒），0 表示不缓存
+    db_session_cache_ttl: float = float(os.getenv("DB_SESSION_CACHE_TTL", "60"))  # 会话缓存有效期（秒），0 表示不缓存
+    db_slow_query_ms: float = float(os.getenv("DB_SLOW_QUERY_MS", "200"))  # 慢查询阈值（毫秒），超过时记录语句和 EXPLAIN，0 表示不记录
+    db_write_journal_file: str = str(Path(__file__).parent / "logs" / "pending_db_writes.jsonl")  # 停止时未写入的记录
 
     @classmethod
     def validate(cls) -> bool:
@@ -0,0 +1,28 @@
+"""测试共用的 SQLite 临时数据库（测试失败时也会关闭连接和异步调用线程）"""
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from db_manager import AsyncDBManager
+from db_sqlite import SQLiteDBManager
+
+
+@pytest.fixture
+def sqlite_manager(tmp_path):
+    """已建表的 SQLite 临时数据库"""
+    manager = SQLiteDBManager(tmp_path / "test.db")
+    assert manager.connect()
+    manager.init_tables()
+    yield manager
+    manager.close()
+
+
+@pytest.fixture
+def async_db(sqlite_manager):
+    """sqlite_manager 的异步包装（测试中在 asyncio.run 里使用）"""
+    db = AsyncDBManager(sqlite_manager)
+    yield db
+    db.shutdown()
@@ -0,0 +1,156 @@
+"""会话定位模块 - 记录 user_id 对应的会话列表项特征（昵称、头像、商品缩略图），不逐个进入会话即可定位目标会话"""
+import re
+from typing import Dict, List, NamedTuple, Optional
+from logger_setup import logger
+from db_manager import AsyncDBManager, async_db
+
+# 图片地址中的尺寸/格式后缀，如 xxx.jpg_80x80q90.jpg_.webp
+_IMAGE_SUFFIX = re.compile(r"(\.(?:jpe?g|png|gif|webp|heic))_.*$", re.IGNORECASE)
+# 匹配得分：头像相同 3 分、昵称相同 2 分（昵称可以重复）、商品缩略图相同 1 分（同一商品的买家缩略图相同，区分度低）
+NAME_SCORE = 2
+AVATAR_SCORE = 3
+THUMB_SCORE = 1
+# 候选会话的最低得分（至少昵称或头像相同）
+MIN_SCORE = 2
+
+
+def normalize_image_url(url: str) -> str:
+    """去掉协议、参数和尺寸后缀，同一张图片在不同尺寸下得到相同地址"""
+    if not url:
+        return ''
+    url = url.split('?', 1)[0].split('#', 1)[0]
+    url = re.sub(r"^https?:", "", url)
+    return _IMAGE_SUFFIX.sub(r"\1", url)
+
+
+class Fingerprint(NamedTuple):
+    """会话列表项特征"""
+    buyer_name: str
+    avatar: str
+    item_thumb: str
+
+    @classmethod
+    def of(cls, conversation: dict) -> 'Fingerprint':
+        return cls(
+            conversation.get('buyer_name') or '',
+            normalize_image_url(conversation.get('avatar', '')),
+            normalize_image_url(conversation.get('item_thumb', '')),
+        )
+
+    def score(self, other: 'Fingerprint') -> int:
+        """与另一个特征的匹配得分（空值不计分）"""
+        score = 0
+        if self.buyer_name and self.buyer_name == other.buyer_name:
+            score += NAME_SCORE
+        if self.avatar and self.avatar == other.avatar:
+            score += AVATAR_SCORE
+        if self.item_thumb and self.item_thumb == other.item_thumb:
+            score += THUMB_SCORE
+        return score
+
+
+class ConversationLocator:
+    """
+    user_id -> 会话列表项特征索引
+
+    每次进入会话拿到 user_id 后调用 learn() 记录该列表项的特征（变化时写入 conversation_locator 表），
+    需要定位某个用户的会话时，candidates() 只读取会话列表按特征排序候选项，调用方进入候选会话后
+    用 get_user_id 验证：命中时只需进入一次会话，验证不符时调用 forget() 并回退到逐个进入的扫描。
+
+    昵称可以重复、头像和缩略图也可能变化，特征只用于缩小范围，不能代替 user_id 验证。
+    """
+
+    def __init__(self, db: AsyncDBManager = None):
+        self.db = db or async_db
+        self._by_user: Dict[str, Fingerprint] = {}
+        self.stats = {'learned': 0, 'hits': 0, 'misses': 0, 'stale': 0, 'scans': 0}
+
+    def __len__(self) -> int:
+        return len(self._by_user)
+
+    def get(self, user_id: str) -> Optional[Fingerprint]:
+        return self._by_user.get(user_id)
+
+    async def load(self):
+        """从数据库加载已记录的特征"""
+        if not self.db.is_connected:
+            return
+        try:
+            rows = await self.db.get_conversation_locators()
+        except Exception as e:
+            logger.error(f"[会话定位] 加载定位特征失败: {e}")
+            return
+        for row in rows:
+            self._by_user[row['user_id']] = Fingerprint(
+                row['buyer_name'] or '', row['avatar_url'] or '', row['item_thumb'] or ''
+            )
+        logger.info(f"[会话定位] 已加载 {len(rows)} 个用户的会话特征")
+
+    async def learn(self, user_id: str, conversation: dict) -> bool:
+        """
+        记录用户当前所在会话的列表项特征
+
+        Returns:
+            bool: 特征是否有变化（有变化时写入数据库）
+        """
+        if not user_id or user_id.startswith('name_'):
+            # 没有获取到 user_id 时以昵称代替，不能作为定位依据
+            return False
+        fingerprint = Fingerprint.of(conversation)
+        if not any(fingerprint) or self._by_user.get(user_id) == fingerprint:
+            return False
+        self._by_user[user_id] = fingerprint
+        self.stats['learned'] += 1
+        if self.db.is_connected:
+            await self.db.save_conversation_locator(user_id, *fingerprint)
+        return True
+
+    async def forget(self, user_id: str):
+        """删除验证不符的特征"""
+        if self._by_user.pop(user_id, None) is None:
+            return
+        self.stats['stale'] += 1
+        if self.db.is_connected:
+            await self.db.delete_conversation_locator(user_id)
+
+    def candidates(self, conversations: List[dict], user_id: str = None,
+                   reference: dict = None, limit: int = 3) -> List[dict]:
+        """
+        按特征匹配度返回候选会话（不进入会话）
+
+        Args:
+            conversations: 当前会话列表
+            user_id: 目标用户，有记录的特征时优先使用
+            reference: 没有记录的特征时使用的参考列表项（如之前读取的会话、只有昵称的字典）
+            limit: 最多返回的候选数
+
+        Returns:
+            得分从高到低的候选会话，没有任何匹配时为空列表
+        """
+        fingerprint = self._by_user.get(user_id) if user_id else None
+        if fingerprint is None and reference:
+            fingerprint = Fingerprint.of(reference)
+        if fingerprint is None:
+            return []
+        scored = []
+        for conv in conversations:
+            score = fingerprint.score(Fingerprint.of(conv))
+            if score >= MIN_SCORE:
+                scored.append((score, conv))
+        # 同分时保持列表顺序（越靠前越新）
+        scored.sort(key=lambda item: -item[0])
+        return [conv for _, conv in scored[:limit]]
+
+    def locate(self, conversations: List[dict], user_id: str = None, reference: dict = None) -> Optional[dict]:
+        """返回最匹配的会话（不验证），没有匹配时返回 None"""
+        found = self.candidates(conversations, user_id, reference, limit=1)
+        return found[0] if found else None
+
+    def record(self, hit: bool, scanned: bool = False):
+        """记录一次定位结果（命中 = 候选会话验证通过）"""
+        self.stats['hits' if hit else 'misses'] += 1
+        if scanned:
+            self.stats['scans'] += 1
+
+    def get_stats(self) -> dict:
+        return dict(self.stats, known=len(self._by_user))
@@ -0,0 +1,230 @@
+"""会话流水线模块 - 浏览器抓取、Coze 推理、发送回复三个阶段并行处理"""
+import asyncio
+import time
+from typing import Dict, Optional
+from loguru import logger
+from config import Config
+
+
+class StageStats:
+    """单个流水线阶段的耗时统计"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, elapsed: float):
+        self.count += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+
+    def snapshot(self) -> dict:
+        return {
+            'count': self.count,
+            'avg_ms': round(self.total * 1000 / self.count, 1) if self.count else 0.0,
+            'max_ms': round(self.max * 1000, 1),
+        }
+
+
+class ConversationPipeline:
+    """
+    会话处理流水线
+
+    阶段划分：
+        1. 浏览器阶段（submit，由消息循环调用）：进入会话、抓取消息、完成合并等待，生成工作项放入 Coze 队列
+        2. Coze 阶段（多个 worker 并发）：调用 Coze 获取回复，结果放入发送队列
+        3. 发送阶段（单个 worker）：按 user_id 重新进入对应会话发送回复，发送成功后保存记录
+
+    浏览器阶段和发送阶段通过 handler._browser_session 获取页面：单页面时共用浏览器锁，
+    同一时刻只有一个阶段操作页面；启用标签页池时各自租用空闲标签页并行操作。
+    Coze 推理期间页面空闲，可以继续处理下一个买家。
+
+    同一用户在回复发出前又产生新消息时，新工作项会包含之前的所有买家消息，
+    旧工作项被标记为过期：尚未调用 Coze 的直接跳过，已得到回复的不再发送。
+
+    浏览器阶段进入会话后会话即变为已读，不会再出现在未读列表中，
+    所以停止时先等待队列中的工作项处理完（最长 drain_timeout 秒），超时未处理的记录日志。
+    """
+
+    def __init__(self, handler, workers: int = None, queue_size: int = None, drain_timeout: float = None):
+        self.handler = handler
+        self.worker_count = workers or Config.PIPELINE_COZE_WORKERS
+        self.drain_timeout = Config.PIPELINE_DRAIN_TIMEOUT if drain_timeout is None else drain_timeout
+        queue_size = queue_size or Config.PIPELINE_QUEUE_SIZE
+        self.coze_queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.send_queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._tasks = []
+        # 每个用户最新工作项的序号（用于丢弃过期工作项；全局递增，用户的最新工作项处理完后移除）
+        self._generations: Dict[str, int] = {}
+        self._sequence = 0
+        # 每个用户的 Coze 调用锁（同一会话不能并发对话，与序号一起移除）
+        self._user_locks: Dict[str, asyncio.Lock] = {}
+        self.stages = {
+            'browser': StageStats(),
+            'coze_wait': StageStats(),
+            'coze': StageStats(),
+            'send_wait': StageStats(),
+            'send': StageStats(),
+            'end_to_end': StageStats(),
+        }
+        self.superseded = 0
+        # 未能发送的回复数（未找到会话、发送出错或停止时未处理完）
+        self.undelivered = 0
+
+    def start(self):
+        """启动 Coze worker 和发送 worker"""
+        for i in range(self.worker_count):
+            self._tasks.append(asyncio.create_task(self._coze_worker(i)))
+        self._tasks.append(asyncio.create_task(self._send_worker()))
+        logger.info(f"[流水线] 已启动 (Coze worker: {self.worker_count})")
+
+    async def stop(self):
+        """等待队列中的工作项处理完（最长 drain_timeout 秒），然后停止所有 worker"""
+        drained = True
+        if self._tasks:
+            try:
+                await asyncio.wait_for(self._drain(), timeout=self.drain_timeout)
+            except asyncio.TimeoutError:
+                drained = False
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks.clear()
+        if not drained:
+            self._log_dropped()
+        logger.info(f"[流水线] 已停止，统计: {self.get_stats()}")
+
+    async def _drain(self):
+        await self.coze_queue.join()
+        await self.send_queue.join()
+
+    def _log_dropped(self):
+        """记录停止时未处理完的工作项（这些会话已读，需要人工回复）"""
+        dropped = []
+        while not self.coze_queue.empty():
+            dropped.append(self.coze_queue.get_nowait())
+        while not self.send_queue.empty():
+            dropped.append(self.send_queue.get_nowait()[0])
+        dropped = [data for data in dropped if not self._is_superseded(data)]
+        self.undelivered += len(dropped)
+        logger.warning(f"[流水线] 等待 {self.drain_timeout} 秒后仍有 {len(dropped)} 个工作项未处理，已丢弃")
+        for data in dropped:
+            logger.warning(f"[流水线] 未回复: {data['buyer_name']} (user_id={data['user_id']})")
+
+    def get_stats(self) -> dict:
+        """获取队列深度和各阶段耗时"""
+        return {
+            'coze_queue': self.coze_queue.qsize(),
+            'send_queue': self.send_queue.qsize(),
+            'superseded': self.superseded,
+            'undelivered': self.undelivered,
+            'stages': {name: stats.snapshot() for name, stats in self.stages.items()},
+        }
+
+    def _is_superseded(self, data: dict) -> bool:
+        return self._generations.get(data['user_id']) != data['_generation']
+
+    def _finish(self, data: dict):
+        """用户的最新工作项处理完（已发送或出错）后移除该用户的序号和锁"""
+        user_id = data['user_id']
+        if self._generations.get(user_id) == data['_generation']:
+            del self._generations[user_id]
+            self._user_locks.pop(user_id, None)
+
+    async def submit(self, conversation: dict):
+        """浏览器阶段：抓取会话并放入 Coze 队列"""
+        started_at = time.perf_counter()
+        data: Optional[dict] = None
+        try:
+            async with self.handler._browser_session():
+                data = await self.handler._collect_conversation(conversation)
+                if data:
+                    await self.handler.browser.go_back_to_list()
+        except Exception as e:
+            logger.error(f"[流水线] 抓取会话出错: {e}")
+            await self.handler.browser.go_back_to_list()
+            return
+        self.stages['browser'].record(time.perf_counter() - started_at)
+
+        if not data:
+            return
+
+        self._sequence += 1
+        self._generations[data['user_id']] = self._sequence
+        data['_generation'] = self._sequence
+        data['_submitted_at'] = started_at
+        data['_enqueued_at'] = time.perf_counter()
+
+        await self.coze_queue.put(data)
+        logger.debug(f"[流水线] {data['buyer_name']} 已入队 (Coze队列: {self.coze_queue.qsize()}, 发送队列: {self.send_queue.qsize()})")
+
+    async def _coze_worker(self, worker_id: int):
+        """Coze 阶段 worker"""
+        while True:
+            data = await self.coze_queue.get()
+            try:
+                self.stages['coze_wait'].record(time.perf_counter() - data['_enqueued_at'])
+                user_id = data['user_id']
+                lock = self._user_locks.setdefault(user_id, asyncio.Lock())
+                async with lock:
+                    if self._is_superseded(data):
+                        self.superseded += 1
+                        logger.info(f"[流水线] {data['buyer_name']} 有更新的消息，跳过旧工作项")
+                        continue
+
+                    started_at = time.perf_counter()
+                    reply, new_conv_id = await self.handler._generate_reply(data)
+                    self.stages['coze'].record(time.perf_counter() - started_at)
+
+                data['_reply_at'] = time.perf_counter()
+                await self.send_queue.put((data, reply, new_conv_id))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[流水线] Coze worker {worker_id} 出错: {e}")
+                self._finish(data)
+            finally:
+                self.coze_queue.task_done()
+
+    async def _send_worker(self):
+        """发送阶段 worker"""
+        while True:
+            data, reply, new_conv_id = await self.send_queue.get()
+            try:
+                self.stages['send_wait'].record(time.perf_counter() - data['_reply_at'])
+                if self._is_superseded(data):
+                    self.superseded += 1
+                    logger.info(f"[流水线] {data['buyer_name']} 有更新的消息，不发送旧回复")
+                    continue
+
+                started_at = time.perf_counter()
+                async with self.handler._browser_session():
+                    await self._send_to_conversation(data, reply, new_conv_id)
+                self.stages['send'].record(time.perf_counter() - started_at)
+                self.stages['end_to_end'].record(time.perf_counter() - data['_submitted_at'])
+                self._finish(data)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.undelivered += 1
+                logger.error(f"[流水线] 发送回复出错: {e}")
+                self._finish(data)
+            finally:
+                self.send_queue.task_done()
+
+    async def _send_to_conversation(self, data: dict, reply: str, new_conv_id: Optional[str]):
+        """重新进入买家的会话（按 user_id 定位并验证，昵称可能重复）并发送回复"""
+        buyer_name = data['buyer_name']
+        conv = await self.handler.browser.find_conversation(data['user_id'], self.handler.locator, buyer_name)
+        if conv is None:
+            self.undelivered += 1
+            logger.error(f"[流水线] 未找到会话，无法发送回复: {buyer_name} (user_id={data['user_id']}) 回复: {reply}")
+            await self.handler.browser.go_back_to_list()
+            return
+        await self.handler._deliver_reply(data, reply, new_conv_id)
+        await self.handler.browser.go_back_to_list()
@@ -1,8 +1,74 @@
 """Coze API 客户端模块"""
+import json
+import time
 import httpx
-from typing import Optional
+from collections import deque
+from typing import AsyncIterator, Optional, Tuple
 from loguru import logger
 from config import Config
+from coze_poller import ChatPollScheduler
+
+# HTTP/2 依赖 h2 包（pip install httpx[http2]），未安装时退回 HTTP/1.1 keep-alive
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class TransportStats:
+    """连接池传输统计（新建连接数、TCP连接/TLS握手耗时）"""
+
+    def __init__(self):
+        self.requests = 0           # 请求总数
+        self.new_connections = 0    # 新建连接数（发生了 TCP 连接）
+        self.connect_time = 0.0     # TCP 连接累计耗时（秒）
+        self.tls_time = 0.0         # TLS 握手累计耗时（秒）
+
+    @property
+    def reused_connections(self) -> int:
+        """复用连接的请求数"""
+        return self.requests - self.new_connections
+
+    def snapshot(self) -> dict:
+        """导出统计快照"""
+        new_conn = self.new_connections
+        return {
+            'requests': self.requests,
+            'new_connections': new_conn,
+            'reused_connections': self.reused_connections,
+            'connect_ms_total': round(self.connect_time * 1000, 1),
+            'tls_ms_total': round(self.tls_time * 1000, 1),
+            'connect_ms_avg': round(self.connect_time * 1000 / new_conn, 1) if new_conn else 0.0,
+            'tls_ms_avg': round(self.tls_time * 1000 / new_conn, 1) if new_conn else 0.0,
+        }
+
+
+class ChatTimingStats:
+    """对话耗时统计（首字延迟 TTFT / 完成耗时，按模式区分）"""
+
+    def __init__(self, maxlen: int = 200):
+        # 最近的对话耗时记录: {'mode': 'stream'/'poll', 'ttft': 秒, 'total': 秒}
+        self.records = deque(maxlen=maxlen)
+
+    def record(self, mode: str, ttft: Optional[float], total: float):
+        """记录一次对话耗时"""
+        self.records.append({'mode': mode, 'ttft': ttft, 'total': total})
+
+    def snapshot(self) -> dict:
+        """导出各模式的平均耗时"""
+        result = {}
+        for mode in ('stream', 'poll'):
+            items = [r for r in self.records if r['mode'] == mode]
+            if not items:
+                continue
+            ttfts = [r['ttft'] for r in items if r['ttft'] is not None]
+            result[mode] = {
+                'count': len(items),
+                'ttft_ms_avg': round(sum(ttfts) * 1000 / len(ttfts), 1) if ttfts else None,
+                'total_ms_avg': round(sum(r['total'] for r in items) * 1000 / len(items), 1),
+            }
+        return result
 
 
 class CozeClient:
@@ -16,6 +82,92 @@ class CozeClient:
             "Authorization": f"Bearer {self.api_token}",
             "Content-Type": "application/json",
         }
+        # 长连接池（异步接口共享，open() 创建，close() 释放）
+        self._client: Optional[httpx.AsyncClient] = None
+        self.stats = TransportStats()
+        self.chat_timings = ChatTimingStats()
+        # 非流式对话的共享轮询调度器
+        self.poller = ChatPollScheduler(self)
+
+    async def open(self):
+        """创建共享连接池（keep-alive，可用时启用 HTTP/2）"""
+        if self._client is not None:
+            return
+
+        http2 = Config.COZE_HTTP2 and HTTP2_AVAILABLE
+        if Config.COZE_HTTP2 and not HTTP2_AVAILABLE:
+            logger.warning("[Coze] 未安装 h2，连接池使用 HTTP/1.1 (pip install httpx[http2])")
+
+        limits = httpx.Limits(
+            max_connections=Config.COZE_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=Config.COZE_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=Config.COZE_POOL_KEEPALIVE_EXPIRY,
+        )
+        self._client = httpx.AsyncClient(
+            headers=self.headers,
+            timeout=30.0,
+            limits=limits,
+            http2=http2,
+        )
+        logger.info(
+            f"[Coze] 连接池已创建 (HTTP/2: {http2}, 最大连接: {Config.COZE_POOL_MAX_CONNECTIONS}, "
+            f"keep-alive: {Config.COZE_POOL_MAX_KEEPALIVE})"
+        )
+
+    async def close(self):
+        """关闭共享连接池并输出传输统计"""
+        await self.poller.stop()
+        if self._client is None:
+            return
+        logger.info(f"[Coze] 轮询统计: {self.poller.get_stats()}")
+        await self._client.aclose()
+        self._client = None
+        logger.info(f"[Coze] 连接池已关闭，传输统计: {self.stats.snapshot()}")
+        logger.info(f"[Coze] 对话耗时统计: {self.chat_timings.snapshot()}")
+
+    def get_transport_stats(self) -> dict:
+        """获取连接池传输统计"""
+        return self.stats.snapshot()
+
+    def get_chat_timing_stats(self) -> dict:
+        """获取对话耗时统计（TTFT / 完成耗时）"""
+        return self.chat_timings.snapshot()
+
+    async def _request(self, method: str, url: str, stream: bool = False, **kwargs) -> httpx.Response:
+        """
+        通过共享连接池发送请求，并记录 TCP 连接 / TLS 握手耗时
+
+        未调用 open() 时自动创建连接池（兼容测试脚本直接调用）。
+        stream=True 时不读取响应体，调用方负责 aclose()。
+        """
+        if self._client is None:
+            await self.open()
+
+        started = {}
+
+        async def trace(event_name: str, info: dict):
+            # httpcore 事件: connection.connect_tcp.started/complete, connection.start_tls.started/complete
+            if event_name.endswith(".started"):
+                started[event_name[:-len(".started")]] = time.perf_counter()
+            elif event_name.endswith(".complete"):
+                step = event_name[:-len(".complete")]
+                if step not in started:
+                    return
+                elapsed = time.perf_counter() - started.pop(step)
+                if step == "connection.connect_tcp":
+                    self.stats.new_connections += 1
+                    self.stats.connect_time += elapsed
+                elif step == "connection.start_tls":
+                    self.stats.tls_time += elapsed
+
+        self.stats.requests += 1
+        request = self._client.build_request(method, url, extensions={"trace": trace}, **kwargs)
+        response = await self._client.send(request, stream=stream)
+        if stream and response.is_error:
+            await response.aread()
+            await response.aclose()
+        response.raise_for_status()
+        return response
 
     async def clear_conversation_context(self, conversation_id: str) -> bool:
         """
@@ -36,22 +188,20 @@ class CozeClient:
             return False
 
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    f"{self.base_url}/v1/conversations/{conversation_id}/clear",
-                    headers=self.headers,
-                )
-                response.raise_for_status()
-                data = response.json()
+            response = await self._request(
+                "POST",
+                f"{self.base_url}/v1/conversations/{conversation_id}/clear",
+            )
+            data = response.json()
 
-                logger.debug(f"清除上下文响应: {data}")
+            logger.debug(f"清除上下文响应: {data}")
 
-                if data.get("code") == 0:
-                    logger.info(f"[Coze] 成功清除会话上下文: {conversation_id}")
-                    return True
-                else:
-                    logger.error(f"清除上下文失败: {data}")
-                    return False
+            if data.get("code") == 0:
+                logger.info(f"[Coze] 成功清除会话上下文: {conversation_id}")
+                return True
+            else:
+                logger.error(f"清除上下文失败: {data}")
+                return False
 
         except Exception as e:
             logger.error(f"清除上下文异常: {e}")
@@ -197,25 +347,23 @@ class CozeClient:
             conversation_id 或 None
         """
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                # 必须传 bot_id，否则创建的会话无法在列表中按 bot_id 查询
-                response = await client.post(
-                    f"{self.base_url}/v1/conversation/create",
-                    headers=self.headers,
-                    json={"bot_id": self.bot_id}
-                )
-                response.raise_for_status()
-                data = response.json()
-
-                logger.debug(f"创建会话响应: {data}")
-
-                if data.get("code") == 0:
-                    conv_id = data.get("data", {}).get("id")
-                    logger.info(f"[Coze] 成功创建新会话: {conv_id}")
-                    return conv_id
-                else:
-                    logger.error(f"创建会话失败: {data}")
-                    return None
+            # 必须传 bot_id，否则创建的会话无法在列表中按 bot_id 查询
+            response = await self._request(
+                "POST",
+                f"{self.base_url}/v1/conversation/create",
+                json={"bot_id": self.bot_id}
+            )
+            data = response.json()
+
+            logger.debug(f"创建会话响应: {data}")
+
+            if data.get("code") == 0:
+                conv_id = data.get("data", {}).get("id")
+                logger.info(f"[Coze] 成功创建新会话: {conv_id}")
+                return conv_id
+            else:
+                logger.error(f"创建会话失败: {data}")
+                return None
 
         except Exception as e:
             logger.error(f"创建会话异常: {e}")
@@ -236,35 +384,33 @@ class CozeClient:
             return []
 
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                # limit 需要放在请求体中
-                response = await client.post(
-                    f"{self.base_url}/v1/conversation/message/list",
-                    headers=self.headers,
-                    params={"conversation_id": conversation_id},
-                    json={"limit": limit, "order": "desc"}  # desc: 最新的在前
-                )
-                response.raise_for_status()
-                data = response.json()
-
-                if data.get("code") == 0:
-                    messages = data.get("data", [])
-                    # 过滤出问答消息，转换格式
-                    result = []
-                    for msg in messages:
-                        msg_type = msg.get("type", "")
-                        if msg_type in ["question", "answer"]:
-                            role = "user" if msg.get("role") == "user" else "assistant"
-                            content = msg.get("content", "")
-                            result.append({"role": role, "content": content})
-
-                    # 反转顺序（因为 API 返回的是倒序，我们需要正序）
-                    result.reverse()
-                    logger.info(f"[Coze] 获取会话历史成功: conversation_id={conversation_id}, 消息数={len(result)}")
-                    return result
-                else:
-                    logger.error(f"获取会话历史失败: {data}")
-                    return []
+            # limit 需要放在请求体中
+            response = await self._request(
+                "POST",
+                f"{self.base_url}/v1/conversation/message/list",
+                params={"conversation_id": conversation_id},
+                json={"limit": limit, "order": "desc"}  # desc: 最新的在前
+            )
+            data = response.json()
+
+            if data.get("code") == 0:
+                messages = data.get("data", [])
+                # 过滤出问答消息，转换格式
+                result = []
+                for msg in messages:
+                    msg_type = msg.get("type", "")
+                    if msg_type in ["question", "answer"]:
+                        role = "user" if msg.get("role") == "user" else "assistant"
+                        content = msg.get("content", "")
+                        result.append({"role": role, "content": content})
+
+                # 反转顺序（因为 API 返回的是倒序，我们需要正序）
+                result.reverse()
+                logger.info(f"[Coze] 获取会话历史成功: conversation_id={conversation_id}, 消息数={len(result)}")
+                return result
+            else:
+                logger.error(f"获取会话历史失败: {data}")
+                return []
 
         except Exception as e:
             logger.error(f"获取会话历史异常: {e}")
@@ -300,7 +446,7 @@ class CozeClient:
         payload = {
             "bot_id": self.bot_id,
             "user_id": user_id,
-            "stream": False,
+            "stream": Config.COZE_STREAM,
             "auto_save_history": True,
             "additional_messages": [
                 {
@@ -351,111 +497,218 @@ class CozeClient:
         else:
             logger.info("[Coze] 未提供会话ID，将创建新会话")
 
+        started_at = time.perf_counter()
+
+        # 流式模式：收到 conversation.message.completed 即返回，请求未送达时回退到轮询
+        if Config.COZE_STREAM:
+            result = await self._chat_stream(url, params, payload, started_at)
+            if result:
+                return result
+            logger.warning("[Coze] 流式请求未送达，改用轮询模式")
+            payload = dict(payload, stream=False)
+
         try:
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                response = await client.post(
-                    url,
-                    headers=self.headers,
-                    params=params,
-                    json=payload,
-                )
-                response.raise_for_status()
-                data = response.json()
+            response = await self._request(
+                "POST",
+                url,
+                params=params,
+                json=payload,
+                timeout=60.0,
+            )
+            data = response.json()
+
+            logger.debug(f"Coze API 响应: {data}")
+
+            # 解析响应获取回复内容
+            if data.get("code") == 0:
+                # v3 API 返回的是 chat 对象，需要轮询获取结果
+                chat_id = data.get("data", {}).get("id")
+                conv_id = data.get("data", {}).get("conversation_id")
+                logger.info(f"[Coze] API返回会话ID: {conv_id}")
+
+                if chat_id and conv_id:
+                    reply = await self._poll_chat_result(chat_id, conv_id)
+                    total = time.perf_counter() - started_at
+                    # 轮询模式一次性拿到完整回复，首字延迟即完成耗时
+                    self.chat_timings.record('poll', total, total)
+                    logger.info(f"[Coze] 轮询模式耗时: {total * 1000:.0f}ms")
+                    return (reply, conv_id)
+
+            logger.error(f"Coze API 返回错误: {data}")
+            return ("抱歉，系统暂时无法处理您的请求，请稍后再试。", None)
 
-                logger.debug(f"Coze API 响应: {data}")
+        except httpx.TimeoutException:
+            logger.error("Coze API 请求超时")
+            return ("抱歉，响应超时，请稍后再试。", None)
+        except Exception as e:
+            logger.error(f"Coze API 请求失败: {e}")
+            return ("抱歉，系统出现错误，请稍后再试。", None)
 
-                # 解析响应获取回复内容
-                if data.get("code") == 0:
-                    # v3 API 返回的是 chat 对象，需要轮询获取结果
-                    chat_id = data.get("data", {}).get("id")
-                    conv_id = data.get("data", {}).get("conversation_id")
-                    logger.info(f"[Coze] API返回会话ID: {conv_id}")
+    async def _chat_stream(self, url: str, params: dict, payload: dict, started_at: float) -> Optional[Tuple[str, str]]:
+        """
+        流式对话：消费 /v3/chat 的 SSE 事件流
+
+        收到助手 answer 的 conversation.message.completed 事件即返回，
+        不等待后续的 follow_up / verbose 事件。
 
-                    if chat_id and conv_id:
-                        reply = await self._poll_chat_result(chat_id, conv_id)
-                        return (reply, conv_id)
+        Args:
+            url: /v3/chat 地址
+            params: URL 查询参数（conversation_id）
+            payload: 请求体（stream=True）
+            started_at: 对话开始时间（perf_counter）
 
-                logger.error(f"Coze API 返回错误: {data}")
-                return ("抱歉，系统暂时无法处理您的请求，请稍后再试。", None)
+        Returns:
+            (回复内容, conversation_id)；只有请求未送达（连接失败）或被拒绝（非 2xx）时返回 None，
+            由调用方回退到非流式请求。请求发出后的失败不能重新提交（Coze 可能已收到消息，
+            重复提交会让买家的消息在会话中出现两次）：已创建对话时轮询结果，否则返回错误回复。
+        """
+        chat_id = None
+        conv_id = None
+        ttft = None
+        response = None
 
+        try:
+            response = await self._request(
+                "POST",
+                url,
+                stream=True,
+                params=params,
+                json=payload,
+                timeout=httpx.Timeout(60.0, read=60.0),
+            )
+        except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout, httpx.HTTPStatusError) as e:
+            logger.warning(f"[Coze] 流式请求失败: {e}")
+            return None
         except httpx.TimeoutException:
-            logger.error("Coze API 请求超时")
+            logger.error("[Coze] 流式请求超时（请求可能已提交，不再重新提交）")
             return ("抱歉，响应超时，请稍后再试。", None)
         except Exception as e:
-            logger.error(f"Coze API 请求失败: {e}")
+            logger.error(f"[Coze] 流式请求失败（请求可能已提交，不再重新提交）: {e}")
             return ("抱歉，系统出现错误，请稍后再试。", None)
 
+        timed_out = False
+        try:
+            async for event, data in self._iter_sse_events(response):
+                if event == "conversation.chat.created":
+                    chat_id = data.get("id")
+                    conv_id = data.get("conversation_id")
+                    logger.info(f"[Coze] API返回会话ID: {conv_id}")
+
+                elif event == "conversation.message.delta":
+                    if ttft is None and data.get("type") == "answer":
+                        ttft = time.perf_counter() - started_at
+
+                elif event == "conversation.message.completed":
+                    if data.get("role") == "assistant" and data.get("type") == "answer":
+                        total = time.perf_counter() - started_at
+                        if ttft is None:
+                            ttft = total
+                        self.chat_timings.record('stream', ttft, total)
+                        logger.info(f"[Coze] 流式模式耗时: 首字 {ttft * 1000:.0f}ms, 完成 {total * 1000:.0f}ms")
+                        return (data.get("content", ""), conv_id or data.get("conversation_id"))
+
+                elif event in ("conversation.chat.failed", "error"):
+                    logger.error(f"Coze 聊天失败: {data}")
+                    return ("抱歉，AI处理失败，请稍后再试。", conv_id)
+
+                elif event == "done":
+                    break
+
+            logger.warning("[Coze] 事件流结束但未收到回复")
+
+        except httpx.TimeoutException:
+            timed_out = True
+            logger.warning("[Coze] 流式对话读取超时")
+        except Exception as e:
+            logger.warning(f"[Coze] 流式对话异常: {e}")
+
+        finally:
+            await response.aclose()
+
+        # 对话已创建但流中断：改为轮询该对话的结果，避免重复提问
+        if chat_id and conv_id:
+            reply = await self._poll_chat_result(chat_id, conv_id)
+            total = time.perf_counter() - started_at
+            self.chat_timings.record('poll', total, total)
+            return (reply, conv_id)
+
+        # 请求已送达但没有拿到对话ID，无法轮询，也不能重新提交
+        if timed_out:
+            return ("抱歉，响应超时，请稍后再试。", None)
+        return ("抱歉，系统出现错误，请稍后再试。", None)
+
+    @staticmethod
+    async def _iter_sse_events(response: httpx.Response) -> AsyncIterator[Tuple[str, dict]]:
+        """解析 SSE 事件流，逐个产出 (event, data)"""
+        event = ""
+        data_lines = []
+
+        async for line in response.aiter_lines():
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                data_lines.append(line[len("data:"):].strip())
+            elif not line:
+                # 空行表示一个事件结束
+                if event or data_lines:
+                    raw = "\n".join(data_lines)
+                    try:
+                        data = json.loads(raw) if raw and raw != '"[DONE]"' else {}
+                    except json.JSONDecodeError:
+                        data = {}
+                    yield event, data if isinstance(data, dict) else {}
+                event = ""
+                data_lines = []
+
     async def _poll_chat_result(
         self, chat_id: str, conversation_id: str, max_attempts: int = 30
     ) -> str:
         """
-        轮询获取聊天结果
+        轮询获取聊天结果（由共享的 ChatPollScheduler 调度）
 
         Args:
             chat_id: 聊天ID
             conversation_id: 会话ID
-            max_attempts: 最大尝试次数
+            max_attempts: 最长等待秒数（沿用原每秒一次轮询的次数上限）
 
         Returns:
             智能体回复内容
         """
-        import asyncio
-
-        for _ in range(max_attempts):
-            try:
-                async with httpx.AsyncClient(timeout=30.0) as client:
-                    response = await client.get(
-                        f"{self.base_url}/v3/chat/retrieve",
-                        headers=self.headers,
-                        params={
-                            "chat_id": chat_id,
-                            "conversation_id": conversation_id,
-                        },
-                    )
-                    response.raise_for_status()
-                    data = response.json()
-
-                    if data.get("code") == 0:
-                        status = data.get("data", {}).get("status")
-
-                        if status == "completed":
-                            # 获取消息列表
-                            return await self._get_chat_messages(chat_id, conversation_id)
-                        elif status == "failed":
-                            logger.error(f"Coze 聊天失败: {data}")
-                            return "抱歉，AI处理失败，请稍后再试。"
-
-                    await asyncio.sleep(1)
-
-            except Exception as e:
-                logger.error(f"轮询聊天结果失败: {e}")
-                await asyncio.sleep(1)
+        data = await self.poller.wait(
+            chat_id, conversation_id, workflow=self.bot_id, timeout=float(max_attempts)
+        )
+        status = data.get("status")
+
+        if status == "completed":
+            # 获取消息列表
+            return await self._get_chat_messages(chat_id, conversation_id)
+        elif status == "failed":
+            logger.error(f"Coze 聊天失败: {data}")
+            return "抱歉，AI处理失败，请稍后再试。"
 
         return "抱歉，等待回复超时，请稍后再试。"
 
     async def _get_chat_messages(self, chat_id: str, conversation_id: str) -> str:
         """获取聊天消息列表，提取助手回复"""
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.get(
-                    f"{self.base_url}/v3/chat/message/list",
-                    headers=self.headers,
-                    params={
-                        "chat_id": chat_id,
-                        "conversation_id": conversation_id,
-                    },
-                )
-                response.raise_for_status()
-                data = response.json()
-
-                if data.get("code") == 0:
-                    messages = data.get("data", [])
-                    # 找到助手的回复消息
-                    for msg in messages:
-                        if msg.get("role") == "assistant" and msg.get("type") == "answer":
-                            return msg.get("content", "")
-
-                return "抱歉，未能获取到回复内容。"
+            response = await self._request(
+                "GET",
+                f"{self.base_url}/v3/chat/message/list",
+                params={
+                    "chat_id": chat_id,
+                    "conversation_id": conversation_id,
+                },
+            )
+            data = response.json()
+
+            if data.get("code") == 0:
+                messages = data.get("data", [])
+                # 找到助手的回复消息
+                for msg in messages:
+                    if msg.get("role") == "assistant" and msg.get("type") == "answer":
+                        return msg.get("content", "")
+
+            return "抱歉，未能获取到回复内容。"
 
         except Exception as e:
             logger.error(f"获取聊天消息失败: {e}")
@@ -468,8 +721,13 @@ if __name__ == "__main__":
 
     async def test():
         client = CozeClient()
-        reply, conv_id = await client.chat("你好，这个商品还在吗？")
-        print(f"回复: {reply}")
-        print(f"会话ID: {conv_id}")
+        await client.open()
+        try:
+            reply, conv_id = await client.chat("你好，这个商品还在吗？")
+            print(f"回复: {reply}")
+            print(f"会话ID: {conv_id}")
+            print(f"传输统计: {client.get_transport_stats()}")
+        finally:
+            await client.close()
 
     asyncio.run(test())
@@ -0,0 +1,223 @@
+"""Coze 对话结果轮询调度模块 - 所有进行中的对话共用一个后台轮询任务"""
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from typing import Dict, Optional, Set
+from loguru import logger
+from config import Config
+
+
+class _PendingChat:
+    """一个等待结果的对话"""
+
+    __slots__ = ('chat_id', 'conversation_id', 'workflow', 'future',
+                 'started_at', 'deadline', 'interval', 'polls')
+
+    def __init__(self, chat_id: str, conversation_id: str, workflow: str,
+                 future: asyncio.Future, deadline: float, interval: float):
+        self.chat_id = chat_id
+        self.conversation_id = conversation_id
+        self.workflow = workflow
+        self.future = future
+        self.started_at = time.monotonic()
+        self.deadline = deadline
+        self.interval = interval
+        self.polls = 0
+
+
+class ChatPollScheduler:
+    """
+    共享的对话结果轮询器
+
+    所有进行中的 (chat_id, conversation_id) 放在一个按下次轮询时间排序的小顶堆中，
+    由单个后台任务按时间取出，每次 /v3/chat/retrieve 请求在独立任务中执行（慢请求不阻塞其他对话的轮询），
+    结束后通过 Future 唤醒等待方。
+
+    调度策略：
+        - 首次轮询时间取该工作流历史完成耗时（EMA）的一定比例，没有历史时使用短间隔
+        - 之后按 backoff 倍数退避，并加入随机抖动，避免多个对话同时请求
+    """
+
+    def __init__(self, client, first_interval: float = None, max_interval: float = None,
+                 backoff: float = 1.5, jitter: float = 0.2, ema_alpha: float = 0.3):
+        self.client = client
+        self.first_interval = first_interval if first_interval is not None else Config.COZE_POLL_FIRST_INTERVAL
+        self.max_interval = max_interval if max_interval is not None else Config.COZE_POLL_MAX_INTERVAL
+        self.backoff = backoff
+        self.jitter = jitter
+        self.ema_alpha = ema_alpha
+        # 小顶堆: (下次轮询时间, 序号, _PendingChat)
+        self._heap = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # 进行中的轮询请求（保留引用，停止时取消）
+        self._polls: Set[asyncio.Task] = set()
+        # 每个工作流的平均完成耗时（秒）
+        self._expected: Dict[str, float] = {}
+        # 统计
+        self.total_polls = 0
+        self.completed = 0
+
+    def _jittered(self, interval: float) -> float:
+        """为间隔加入随机抖动"""
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _schedule(self, pending: _PendingChat, delay: float):
+        heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), pending))
+        self._wakeup.set()
+
+    async def wait(self, chat_id: str, conversation_id: str, workflow: str = "", timeout: float = 30.0) -> dict:
+        """
+        等待对话结束
+
+        Args:
+            chat_id: 对话ID
+            conversation_id: 会话ID
+            workflow: 工作流标识（用于学习完成耗时，默认按 bot 区分）
+            timeout: 最长等待时间（秒）
+
+        Returns:
+            dict: retrieve 接口返回的 data（status 为 completed/failed），超时返回 {'status': 'timeout'}
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+        loop = asyncio.get_running_loop()
+        pending = _PendingChat(
+            chat_id, conversation_id, workflow, loop.create_future(),
+            deadline=time.monotonic() + timeout, interval=self.first_interval,
+        )
+
+        # 首次轮询：有历史耗时则在预期完成时间附近轮询，否则使用短间隔
+        expected = self._expected.get(workflow)
+        first_delay = max(self.first_interval, expected * 0.8) if expected else self.first_interval
+        self._schedule(pending, self._jittered(first_delay))
+
+        return await pending.future
+
+    async def stop(self):
+        """停止后台轮询，未完成的等待方收到取消"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._polls):
+            task.cancel()
+        if self._polls:
+            await asyncio.gather(*self._polls, return_exceptions=True)
+        for _, _, pending in self._heap:
+            if not pending.future.done():
+                pending.future.cancel()
+        self._heap.clear()
+
+    def get_stats(self) -> dict:
+        """获取轮询统计"""
+        return {
+            'in_flight': len(self._heap) + len(self._polls),
+            'completed': self.completed,
+            'total_polls': self.total_polls,
+            'polls_per_chat': round(self.total_polls / self.completed, 2) if self.completed else 0.0,
+            'expected_seconds': {k: round(v, 2) for k, v in self._expected.items()},
+        }
+
+    async def _run(self):
+        """后台轮询循环"""
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            delay = self._heap[0][0] - time.monotonic()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    # 有新对话加入时提前唤醒，重新计算最近的轮询时间
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            # 取出所有到期的对话，各自在独立任务中轮询（不等待请求完成，继续调度）
+            now = time.monotonic()
+            while self._heap and self._heap[0][0] <= now:
+                pending = heapq.heappop(self._heap)[2]
+                task = asyncio.create_task(self._poll_guarded(pending))
+                self._polls.add(task)
+                task.add_done_callback(self._polls.discard)
+
+    async def _poll_guarded(self, pending: _PendingChat):
+        """单个对话轮询失败或被取消时通知等待方（不影响共享的轮询循环）"""
+        try:
+            await self._poll_one(pending)
+        except asyncio.CancelledError:
+            if not pending.future.done():
+                pending.future.cancel()
+            raise
+        except Exception as e:
+            logger.error(f"[Coze] 对话 {pending.chat_id} 轮询异常: {e}")
+            if not pending.future.done():
+                pending.future.set_exception(e)
+
+    async def _poll_one(self, pending: _PendingChat):
+        """轮询单个对话并决定是否重新调度"""
+        if pending.future.done():
+            # 等待方已取消
+            return
+
+        data = {}
+        try:
+            response = await self.client._request(
+                "GET",
+                f"{self.client.base_url}/v3/chat/retrieve",
+                params={
+                    "chat_id": pending.chat_id,
+                    "conversation_id": pending.conversation_id,
+                },
+            )
+            body = response.json()
+            if body.get("code") == 0:
+                data = body.get("data", {}) or {}
+        except Exception as e:
+            logger.error(f"轮询聊天结果失败: {e}")
+
+        pending.polls += 1
+        self.total_polls += 1
+
+        status = data.get("status")
+        if status in ("completed", "failed"):
+            elapsed = time.monotonic() - pending.started_at
+            if status == "completed":
+                self._learn(pending.workflow, elapsed)
+            self.completed += 1
+            logger.debug(f"[Coze] 对话 {pending.chat_id} {status}，耗时 {elapsed:.2f}s，轮询 {pending.polls} 次")
+            # 请求期间等待方可能已取消
+            if not pending.future.done():
+                pending.future.set_result(data)
+            return
+
+        if pending.future.done():
+            return
+
+        if time.monotonic() >= pending.deadline:
+            self.completed += 1
+            pending.future.set_result({'status': 'timeout'})
+            return
+
+        # 退避并重新调度
+        pending.interval = min(pending.interval * self.backoff, self.max_interval)
+        self._schedule(pending, self._jittered(pending.interval))
+
+    def _learn(self, workflow: str, elapsed: float):
+        """用指数移动平均更新工作流的完成耗时"""
+        previous = self._expected.get(workflow)
+        if previous is None:
+            self._expected[workflow] = elapsed
+        else:
+            self._expected[workflow] = previous + self.ema_alpha * (elapsed - previous)
@@ -1,274 +1,355 @@
+import asyncio
+import functools
+import random
+import threading
+import time
 import pymysql
 import json
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from config import Config
+from db_cache import MISSING, TTLCache
+from db_metrics import InstrumentedCursor, QueryStats
+from db_migrations import backfill_user_ids, backfill_user_stats, legacy_user_key, migrate
+from db_pool import ConnectionPool
 from logger_setup import logger
 
+# 表示连接已断开的 MySQL 错误码（连接需要丢弃）
+CONNECTION_LOST_ERRORS = (2003, 2006, 2013, 2055)
+# 会话 upsert 遇到死锁时的最大尝试次数
+SESSION_UPSERT_ATTEMPTS = 5
+
+
+def format_product_block(product: dict) -> str:
+    """组装发送给 Coze 的商品信息文本"""
+    block = "[当前会话-商品信息]\n"
+    block += f"标题：{product.get('title', '')}\n"
+    block += f"价格：{product.get('price', '')}\n"
+    if product.get('notes'):
+        block += f"备注：{product.get('notes')}"
+    return block
+
+
 class DBManager:
+    """
+    数据存储（MySQL 后端）
+
+    其他存储后端继承本类（见 db_sqlite.SQLiteDBManager），覆盖连接创建、cursor() 和下面的方言相关 SQL，
+    业务方法和缓存逻辑共用。
+    """
+
+    # 后端名称（对应配置 DB_BACKEND）
+    backend = "mysql"
+    # 空闲连接超过该秒数时借出前先 ping
+    connection_ping_after = 60.0
+
+    # ===== 方言相关 SQL（其他后端覆盖） =====
+    # 创建或更新会话: 新会话根据该用户已有会话判断新老客户并继承 inactive_sent
+    SESSION_UPSERT_SQL = """
+        INSERT INTO user_sessions
+        (user_id, item_id, buyer_name, product_title, customer_type, order_status, last_message_at, inactive_sent)
+        SELECT %(user_id)s, %(item_id)s, %(buyer_name)s, %(product_title)s,
+               IF(COUNT(*) > 0, 'returning', 'new'),
+               %(order_status)s, NOW(), IF(MAX(prior.inactive_sent), 1, 0)
+        FROM user_sessions AS prior
+        WHERE prior.user_id = %(user_id)s
+        ON DUPLICATE KEY UPDATE
+            user_sessions.last_message_at = NOW(),
+            user_sessions.product_title = COALESCE(VALUES(product_title), user_sessions.product_title)
+    """
+    # 按 user_id 创建用户或更新昵称（参数: user_id, 昵称）
+    USER_IDENTITY_UPSERT_SQL = """
+        INSERT INTO users (user_id, buyer_name) VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE buyer_name = VALUES(buyer_name)
+    """
+    # 添加或更新商品
+    PRODUCT_UPSERT_SQL = """
+        INSERT INTO products (item_id, title, price, notes)
+        VALUES (%s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            title = VALUES(title),
+            price = VALUES(price),
+            notes = VALUES(notes),
+            updated_at = NOW()
+    """
+    # 累加用户的已归档消息数
+    ARCHIVE_SUMMARY_UPSERT_SQL = """
+        INSERT INTO history_archive_summary (user_id, message_count, reply_count, first_message_at, last_message_at)
+        VALUES (%(user_id)s, %(count)s, %(replies)s, %(first)s, %(last)s)
+        ON DUPLICATE KEY UPDATE
+            message_count = message_count + VALUES(message_count),
+            reply_count = reply_count + VALUES(reply_count),
+            first_message_at = LEAST(COALESCE(first_message_at, VALUES(first_message_at)), VALUES(first_message_at)),
+            last_message_at = GREATEST(COALESCE(last_message_at, VALUES(last_message_at)), VALUES(last_message_at))
+    """
+    # 累加用户统计（新消息数、新回复数、最后消息时间、回复耗时）
+    USER_STATS_UPSERT_SQL = """
+        INSERT INTO user_stats (user_id, message_count, reply_count, last_message_at, latency_total, latency_samples)
+        VALUES (%(user_id)s, %(messages)s, %(replies)s, %(last)s, %(latency)s, %(samples)s)
+        ON DUPLICATE KEY UPDATE
+            message_count = message_count + VALUES(message_count),
+            reply_count = reply_count + VALUES(reply_count),
+            last_message_at = GREATEST(COALESCE(last_message_at, VALUES(last_message_at)), VALUES(last_message_at)),
+            latency_total = latency_total + VALUES(latency_total),
+            latency_samples = latency_samples + VALUES(latency_samples)
+    """
+    # 最后消息时间早于 N 分钟前（参数: 分钟数）
+    MINUTES_AGO_SQL = "DATE_SUB(NOW(), INTERVAL %s MINUTE)"
+
     def __init__(self):
         self.config = Config()
-        self.connection = None
+        # 连接池（connect 时创建），每次操作借出一个连接，GUI 线程和异步调用互不共享连接
+        self.pool = None
+        # 读缓存（商品只在 GUI 中修改，会话行被反复读取），写操作显式失效，TTL 兜底其他进程的修改
+        self.product_cache = TTLCache('product', self.config.db_cache_size, self.config.db_product_cache_ttl)
+        self.product_block_cache = TTLCache('product_block', self.config.db_cache_size, self.config.db_product_cache_ttl)
+        self.session_cache = TTLCache('session', self.config.db_cache_size, self.config.db_session_cache_ttl)
+        self.user_sessions_cache = TTLCache('user_sessions', self.config.db_cache_size, self.config.db_session_cache_ttl)
+        # 每方法查询统计（所有查询都经过 cursor()）
+        self.query_stats = QueryStats(self.config.db_slow_query_ms)
+
+    def _create_connection(self):
+        return pymysql.connect(
+            host=self.config.db_host,
+            port=int(self.config.db_port),
+            user=self.config.db_user,
+            password=self.config.db_password,
+            database=self.config.db_name,
+            charset='utf8mb4',
+            cursorclass=pymysql.cursors.DictCursor
+        )
 
     def connect(self):
-        """连接数据库"""
-        try:
-            self.connection = pymysql.connect(
-                host=self.config.db_host,
-                port=int(self.config.db_port),
-                user=self.config.db_user,
-                password=self.config.db_password,
-                database=self.config.db_name,
-                charset='utf8mb4',
-                cursorclass=pymysql.cursors.DictCursor
+        """连接数据库（创建连接池并验证连接）"""
+        if self.pool:
+            return True
+        try:
+            pool = ConnectionPool(
+                self._create_connection,
+                max_size=self.config.db_pool_size,
+                timeout=self.config.db_pool_timeout,
+                ping_after=self.connection_ping_after,
             )
-            logger.info("数据库连接成功")
+            pool.release(pool.acquire())
+            self.pool = pool
+            logger.info(f"数据库连接成功 (连接池上限: {self.config.db_pool_size})")
             return True
         except Exception as e:
             logger.error(f"数据库连接失败: {e}")
             return False
 
+    @property
+    def is_connected(self) -> bool:
+        return self.pool is not None
+
     def close(self):
         """关闭数据库连接"""
-        if self.connection:
-            self.connection.close()
+        if self.pool:
+            self.pool.log_stats()
+            self.query_stats.log_summary()
+            self.pool.close_all()
+            self.pool = None
             logger.info("数据库连接已关闭")
 
-    def _ensure_connection(self):
-        """确保数据库连接有效，断开则重连"""
-        try:
-            self.connection.ping(reconnect=True)
-        except Exception as e:
-            logger.warning(f"数据库连接断开，尝试重连: {e}")
-            self.connect()
+    def get_cache_stats(self) -> dict:
+        """读缓存统计（命中/未命中/淘汰/失效次数）"""
+        caches = (self.product_cache, self.product_block_cache, self.session_cache, self.user_sessions_cache)
+        return {cache.name: cache.snapshot() for cache in caches}
 
-    def init_tables(self):
-        """初始化数据表"""
-        try:
-            with self.connection.cursor() as cursor:
-                # 创建用户表（包含白名单标记）
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS users (
-                        id INT AUTO_INCREMENT PRIMARY KEY,
-                        buyer_name VARCHAR(255) NOT NULL UNIQUE,
-                        coze_conversation_id VARCHAR(255),
-                        is_whitelist TINYINT(1) DEFAULT 0,
-                        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
-                    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
-                """)
+    def _invalidate_session(self, user_id: str, item_id: str):
+        self.session_cache.invalidate((user_id, item_id))
+        self.user_sessions_cache.invalidate(user_id)
 
-                # 检查并添加 is_whitelist 列（兼容旧表）
-                cursor.execute("""
-                    SELECT COUNT(*) as cnt FROM information_schema.columns
-                    WHERE table_schema = DATABASE()
-                    AND table_name = 'users' AND column_name = 'is_whitelist'
-                """)
-                if cursor.fetchone()['cnt'] == 0:
-                    cursor.execute("ALTER TABLE users ADD COLUMN is_whitelist TINYINT(1) DEFAULT 0")
-                    logger.info("已添加 is_whitelist 列到 users 表")
+    def _invalidate_user_sessions(self, user_id: str):
+        self.session_cache.invalidate_where(lambda key: key[0] == user_id)
+        self.user_sessions_cache.invalidate(user_id)
 
-                # 创建对话历史表（包含buyer_name方便直接查看）
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS conversation_history (
-                        id INT AUTO_INCREMENT PRIMARY KEY,
-                        buyer_name VARCHAR(255) NOT NULL,
-                        role VARCHAR(50) NOT NULL,
-                        content TEXT NOT NULL,
-                        coze_conversation_id VARCHAR(255),
-                        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-                    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
-                """)
+    def _invalidate_all_sessions(self):
+        self.session_cache.clear()
+        self.user_sessions_cache.clear()
 
-                # 创建用户会话表（新表：基于用户ID和商品ID）
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS user_sessions (
-                        id INT AUTO_INCREMENT PRIMARY KEY,
-                        user_id VARCHAR(50) NOT NULL COMMENT '闲鱼用户唯一ID',
-                        item_id VARCHAR(50) NOT NULL COMMENT '商品ID',
-                        buyer_name VARCHAR(255) COMMENT '买家昵称',
-                        product_title VARCHAR(100) COMMENT '商品标题（前15字）',
-                        conversation_id VARCHAR(255) COMMENT 'Coze会话ID',
-                        summary TEXT COMMENT '会话摘要',
-                        inactive_sent TINYINT(1) DEFAULT 0 COMMENT '是否已发送过inactive',
-                        customer_type VARCHAR(20) DEFAULT 'new' COMMENT '客户类型: new/returning',
-                        order_status VARCHAR(50) COMMENT '订单状态',
-                        last_message_at DATETIME COMMENT '最后消息时间',
-                        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                        UNIQUE KEY unique_user_item (user_id, item_id)
-                    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
-                """)
+    def invalidate_products(self, item_id: str = None):
+        """商品缓存失效（item_id 为空时全部失效）"""
+        for cache in (self.product_cache, self.product_block_cache):
+            if item_id is None:
+                cache.clear()
+            else:
+                cache.invalidate(item_id)
 
-                # 检查并添加 product_title 列（兼容旧表）
-                cursor.execute("""
-                    SELECT COUNT(*) as cnt FROM information_schema.columns
-                    WHERE table_schema = DATABASE()
-                    AND table_name = 'user_sessions' AND column_name = 'product_title'
-                """)
-                if cursor.fetchone()['cnt'] == 0:
-                    cursor.execute("ALTER TABLE user_sessions ADD COLUMN product_title VARCHAR(100) COMMENT '商品标题（前15字）' AFTER buyer_name")
-                    logger.info("已添加 product_title 列到 user_sessions 表")
+    def get_pool_stats(self) -> dict:
+        """获取连接池统计（借出次数、等待次数和等待耗时）"""
+        return self.pool.snapshot() if self.pool else {}
 
-                # 创建商品信息表
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS products (
-                        item_id VARCHAR(50) PRIMARY KEY COMMENT '商品ID',
-                        title VARCHAR(255) COMMENT '商品标题',
-                        price VARCHAR(20) COMMENT '商品价格',
-                        notes TEXT COMMENT '备注',
-                        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
-                    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
-                """)
+    def get_query_stats(self) -> dict:
+        """获取每方法查询统计（调用次数、耗时分位数、读取行数、慢查询数）"""
+        return self.query_stats.snapshot()
 
-                # 检查并添加 price 列（兼容旧表）
-                cursor.execute("""
-                    SELECT COUNT(*) as cnt FROM information_schema.columns
-                    WHERE table_schema = DATABASE()
-                    AND table_name = 'products' AND column_name = 'price'
-                """)
-                if cursor.fetchone()['cnt'] == 0:
-                    cursor.execute("ALTER TABLE products ADD COLUMN price VARCHAR(20) COMMENT '商品价格' AFTER title")
-                    logger.info("已添加 price 列到 products 表")
+    def cursor(self, name: str = 'cursor'):
+        """
+        从连接池借出连接并返回游标，正常结束时提交，出错时回滚
 
-                # 检查并添加 notes 列（备注字段）
-                cursor.execute("""
-                    SELECT COUNT(*) as cnt FROM information_schema.columns
-                    WHERE table_schema = DATABASE()
-                    AND table_name = 'products' AND column_name = 'notes'
-                """)
-                if cursor.fetchone()['cnt'] == 0:
-                    cursor.execute("ALTER TABLE products ADD COLUMN notes TEXT COMMENT '备注' AFTER price")
-                    logger.info("已添加 notes 列到 products 表")
+        每个 with 块计入 name（一般为调用方方法名）的查询统计，超过慢查询阈值的语句附 EXPLAIN 记录日志。
+
+        Usage:
+            with db_manager.cursor('get_user') as cursor:
+                cursor.execute(...)
+        """
+        return self._instrumented_cursor(name)
+
+    @contextmanager
+    def _instrumented_cursor(self, method: str):
+        started_at = time.perf_counter()
+        cursor = None
+        explain_time = 0.0
+        failed = True
+        try:
+            with self._transaction_cursor() as raw:
+                cursor = InstrumentedCursor(raw, self.query_stats)
+                yield cursor
+                if cursor.slow_statements:
+                    explain_started = time.perf_counter()
+                    cursor.explain_slow(method, self._explain_plan)
+                    explain_time = time.perf_counter() - explain_started
+            failed = False
+        finally:
+            if cursor is not None:
+                self.query_stats.record(
+                    method, time.perf_counter() - started_at - explain_time,
+                    cursor.statements, cursor.rows, len(cursor.slow_statements), error=failed,
+                )
+
+    def _explain_plan(self, cursor, sql: str, args) -> list:
+        """慢语句的执行计划（每行一个字符串）"""
+        if not sql.lstrip().lower().startswith(('select', 'insert', 'update', 'delete', 'replace')):
+            return []
+        cursor.execute("EXPLAIN " + sql, args)
+        return [", ".join(f"{k}={v}" for k, v in row.items() if v is not None) for row in cursor.fetchall()]
+
+    @contextmanager
+    def _transaction_cursor(self):
+        """借出连接并返回原始游标（cursor() 的实现，各后端覆盖）"""
+        if not self.pool:
+            raise RuntimeError("数据库未连接")
+        conn = self.pool.acquire()
+        try:
+            with conn.cursor() as cursor:
+                yield cursor
+            conn.commit()
+        except (pymysql.err.OperationalError, pymysql.err.InterfaceError) as e:
+            if isinstance(e, pymysql.err.InterfaceError) or e.args[0] in CONNECTION_LOST_ERRORS:
+                # 连接已断开，丢弃（下次借出时重新创建）
+                self.pool.discard(conn)
+                raise
+            # 死锁、锁等待超时等错误：连接仍可用
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            self.pool.release(conn)
+            raise
+        except BaseException:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            self.pool.release(conn)
+            raise
+        else:
+            self.pool.release(conn)
 
-            self.connection.commit()
-            logger.info("数据表初始化成功")
+    def init_tables(self):
+        """初始化数据表（执行未完成的结构迁移，已是最新版本时只读取一次版本号）"""
+        try:
+            version = migrate(self)
+            logger.info(f"数据表初始化成功 (结构版本 v{version})")
             return True
         except Exception as e:
             logger.error(f"数据表初始化失败: {e}")
             return False
 
-    def get_or_create_user(self, buyer_name):
-        """获取或创建用户"""
+    def get_or_create_user(self, user_id: str, buyer_name: str = None) -> dict:
+        """按 user_id 获取或创建用户（有昵称时同时更新昵称）"""
         try:
-            with self.connection.cursor() as cursor:
-                # 先查找用户
-                cursor.execute(
-                    "SELECT * FROM users WHERE buyer_name = %s",
-                    (buyer_name,)
-                )
-                user = cursor.fetchone()
-
-                if user:
-                    return user
-
-                # 创建新用户
-                cursor.execute(
-                    "INSERT INTO users (buyer_name) VALUES (%s)",
-                    (buyer_name,)
-                )
-                self.connection.commit()
-
-                # 获取新创建的用户
-                cursor.execute(
-                    "SELECT * FROM users WHERE buyer_name = %s",
-                    (buyer_name,)
-                )
+            with self.cursor('get_or_create_user') as cursor:
+                if buyer_name:
+                    cursor.execute(self.USER_IDENTITY_UPSERT_SQL, (user_id, buyer_name))
+                cursor.execute("SELECT * FROM users WHERE user_id = %s", (user_id,))
                 return cursor.fetchone()
         except Exception as e:
             logger.error(f"获取/创建用户失败: {e}")
             return None
 
-    def update_conversation_id(self, buyer_name, conversation_id):
-        """更新用户的Coze conversation_id（如果用户不存在则创建）"""
+    def clear_conversation_id(self, user_id: str) -> bool:
+        """清除用户的conversation_id并清空对话历史（用于会话轮换）"""
         try:
-            # 先确保用户存在
-            self.get_or_create_user(buyer_name)
-
-            with self.connection.cursor() as cursor:
+            with self.cursor('clear_conversation_id') as cursor:
+                # 清除 conversation_id（会话表和旧版用户表）
                 cursor.execute(
-                    "UPDATE users SET coze_conversation_id = %s WHERE buyer_name = %s",
-                    (conversation_id, buyer_name)
+                    "UPDATE user_sessions SET conversation_id = NULL WHERE user_id = %s",
+                    (user_id,)
+                )
+                cursor.execute(
+                    "UPDATE users SET coze_conversation_id = NULL WHERE user_id = %s",
+                    (user_id,)
+                )
+                # 清空该用户的对话历史（包括归档计数和统计）
+                cursor.execute(
+                    "DELETE FROM conversation_history WHERE session_id IN (SELECT id FROM user_sessions WHERE user_id = %s)",
+                    (user_id,)
                 )
-            self.connection.commit()
-            logger.info(f"更新用户 {buyer_name} 的conversation_id: {conversation_id}")
-            return True
-        except Exception as e:
-            logger.error(f"更新conversation_id失败: {e}")
-            return False
-
-    def clear_conversation_id(self, buyer_name):
-        """清除用户的conversation_id并清空对话历史（用于会话轮换）"""
-        try:
-            with self.connection.cursor() as cursor:
-                # 清除 conversation_id
                 cursor.execute(
-                    "UPDATE users SET coze_conversation_id = NULL WHERE buyer_name = %s",
-                    (buyer_name,)
+                    "DELETE FROM history_archive_summary WHERE user_id = %s",
+                    (user_id,)
                 )
-                # 清空该用户的对话历史
                 cursor.execute(
-                    "DELETE FROM conversation_history WHERE buyer_name = %s",
-                    (buyer_name,)
+                    "DELETE FROM user_stats WHERE user_id = %s",
+                    (user_id,)
                 )
-            self.connection.commit()
-            logger.info(f"已清除用户 {buyer_name} 的会话ID和对话历史")
+            self._invalidate_user_sessions(user_id)
+            logger.info(f"已清除用户 {user_id} 的会话ID和对话历史")
             return True
         except Exception as e:
             logger.error(f"清除conversation_id失败: {e}")
             return False
 
-    def get_conversation_id(self, buyer_name):
-        """获取用户的Coze conversation_id"""
+    def get_conversation_id(self, user_id: str):
+        """获取用户最近会话的Coze conversation_id，没有会话时读取旧版用户表"""
         try:
-            with self.connection.cursor() as cursor:
+            with self.cursor('get_conversation_id') as cursor:
                 cursor.execute(
-                    "SELECT coze_conversation_id FROM users WHERE buyer_name = %s",
-                    (buyer_name,)
+                    """SELECT conversation_id FROM user_sessions
+                       WHERE user_id = %s AND conversation_id IS NOT NULL
+                       ORDER BY last_message_at DESC LIMIT 1""",
+                    (user_id,)
                 )
                 result = cursor.fetchone()
-                if result and result['coze_conversation_id']:
-                    return result['coze_conversation_id']
-                return None
-        except Exception as e:
-            logger.error(f"获取conversation_id失败: {e}")
-            return None
-
-    def add_message(self, buyer_name, role, content, conversation_id=None):
-        """添加对话消息"""
-        try:
-            # 确保用户存在
-            self.get_or_create_user(buyer_name)
-
-            # 如果没传conversation_id，从用户表获取
-            if not conversation_id:
-                conversation_id = self.get_conversation_id(buyer_name)
-
-            with self.connection.cursor() as cursor:
+                if result:
+                    return result['conversation_id']
                 cursor.execute(
-                    "INSERT INTO conversation_history (buyer_name, role, content, coze_conversation_id) VALUES (%s, %s, %s, %s)",
-                    (buyer_name, role, content, conversation_id)
+                    "SELECT coze_conversation_id FROM users WHERE user_id = %s AND coze_conversation_id IS NOT NULL",
+                    (user_id,)
                 )
-            self.connection.commit()
-            logger.debug(f"保存消息 - 用户:{buyer_name}, 角色:{role}, 会话ID:{conversation_id}")
-            return True
+                result = cursor.fetchone()
+                return result['coze_conversation_id'] if result else None
         except Exception as e:
-            logger.error(f"添加消息失败: {e}")
-            return False
+            logger.error(f"获取conversation_id失败: {e}")
+            return None
 
-    def get_conversation_history(self, buyer_name, limit=10):
-        """获取用户的对话历史"""
+    def get_conversation_history(self, user_id: str, limit=10):
+        """获取用户（所有会话）的对话历史"""
         try:
-            with self.connection.cursor() as cursor:
+            with self.cursor('get_conversation_history') as cursor:
                 cursor.execute(
                     """
-                    SELECT role, content, coze_conversation_id, created_at
-                    FROM conversation_history
-                    WHERE buyer_name = %s
-                    ORDER BY created_at DESC
+                    SELECT h.role, h.content, h.coze_conversation_id, h.created_at
+                    FROM conversation_history h
+                    JOIN user_sessions s ON s.id = h.session_id
+                    WHERE s.user_id = %s
+                    ORDER BY h.created_at DESC, h.id DESC
                     LIMIT %s
                     """,
-                    (buyer_name, limit)
+                    (user_id, limit)
                 )
                 messages = cursor.fetchall()
                 # 反转顺序，让最早的消息在前面
@@ -277,27 +358,200 @@ class DBManager:
             logger.error(f"获取对话历史失败: {e}")
             return []
 
-    def get_conversation_count(self, buyer_name):
-        """获取用户的对话轮数"""
+    def get_conversation_count(self, user_id: str):
+        """获取用户的对话消息数（包括已归档的消息）"""
         try:
-            with self.connection.cursor() as cursor:
+            with self.cursor('get_conversation_count') as cursor:
                 cursor.execute(
-                    "SELECT COUNT(*) as count FROM conversation_history WHERE buyer_name = %s",
-                    (buyer_name,)
+                    "SELECT message_count as count FROM user_stats WHERE user_id = %s",
+                    (user_id,)
                 )
                 result = cursor.fetchone()
-                return result['count'] if result else 0
+                return int(result['count']) if result else 0
         except Exception as e:
             logger.error(f"获取对话轮数失败: {e}")
             return 0
 
-    def is_user_in_whitelist(self, buyer_name: str) -> bool:
+    def get_session_history(self, session_id: int, limit: int = 10) -> list:
+        """获取某个会话（user_sessions.id）的对话历史"""
+        try:
+            with self.cursor('get_session_history') as cursor:
+                cursor.execute(
+                    """
+                    SELECT role, content, coze_conversation_id, created_at
+                    FROM conversation_history
+                    WHERE session_id = %s
+                    ORDER BY id DESC
+                    LIMIT %s
+                    """,
+                    (session_id, limit)
+                )
+                return list(reversed(cursor.fetchall()))
+        except Exception as e:
+            logger.error(f"获取会话对话历史失败: {e}")
+            return []
+
+    # ========== 对话历史归档（history_retention 调用） ==========
+
+    def get_oldest_history(self, limit: int) -> list:
+        """按 id 顺序读取最早的一批对话历史（走主键，不扫描整表）"""
+        with self.cursor('get_oldest_history') as cursor:
+            cursor.execute(
+                """SELECT h.id, h.session_id, s.user_id, h.buyer_name, h.role, h.content, h.coze_conversation_id, h.created_at
+                   FROM conversation_history h
+                   LEFT JOIN user_sessions s ON s.id = h.session_id
+                   ORDER BY h.id LIMIT %s""",
+                (limit,)
+            )
+            return cursor.fetchall()
+
+    def delete_archived_history(self, rows: list) -> int:
+        """
+        删除已写入归档文件的对话历史，并在同一事务中累加每个用户的归档消息数
+
+        Args:
+            rows: get_oldest_history 返回的行
+
+        Returns:
+            int: 删除的行数
+        """
+        if not rows:
+            return 0
+        summary = {}
+        for row in rows:
+            user_id = row['user_id'] or legacy_user_key(row['buyer_name'])
+            entry = summary.setdefault(user_id, {
+                'user_id': user_id, 'count': 0, 'replies': 0,
+                'first': row['created_at'], 'last': row['created_at'],
+            })
+            entry['count'] += 1
+            if row['role'] == 'assistant':
+                entry['replies'] += 1
+            entry['first'] = min(entry['first'], row['created_at'])
+            entry['last'] = max(entry['last'], row['created_at'])
+
+        ids = [row['id'] for row in rows]
+        with self.cursor('delete_archived_history') as cursor:
+            placeholders = ", ".join(["%s"] * len(ids))
+            deleted = cursor.execute(f"DELETE FROM conversation_history WHERE id IN ({placeholders})", ids)
+            for entry in summary.values():
+                cursor.execute(self.ARCHIVE_SUMMARY_UPSERT_SQL, entry)
+        return deleted
+
+    def backfill_user_identity(self, batch_size: int = 1000) -> dict:
+        """
+        把旧数据迁移到 user_id 标识（可重复执行）
+
+        为 users 补齐 user_id（见 db_migrations.backfill_user_ids），并分批为没有 session_id 的
+        对话历史关联会话: 优先按 coze_conversation_id 匹配，否则取该昵称最近的会话，都找不到时保持为空。
+
+        Returns:
+            dict: {'users': 补齐的用户数, 'history': 关联的对话历史行数}
+        """
+        with self.cursor('backfill_user_identity') as cursor:
+            users = backfill_user_ids(cursor)
+
+        linked = 0
+        last_id = 0
+        while True:
+            with self.cursor('backfill_user_identity') as cursor:
+                cursor.execute(
+                    """SELECT id, buyer_name, coze_conversation_id FROM conversation_history
+                       WHERE id > %s AND session_id IS NULL ORDER BY id LIMIT %s""",
+                    (last_id, batch_size)
+                )
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                by_conversation = {}
+                conversation_ids = list({r['coze_conversation_id'] for r in rows if r['coze_conversation_id']})
+                if conversation_ids:
+                    placeholders = ", ".join(["%s"] * len(conversation_ids))
+                    cursor.execute(
+                        f"SELECT id, conversation_id FROM user_sessions WHERE conversation_id IN ({placeholders})",
+                        conversation_ids
+                    )
+                    by_conversation = {s['conversation_id']: s['id'] for s in cursor.fetchall()}
+                names = list({r['buyer_name'] for r in rows})
+                placeholders = ", ".join(["%s"] * len(names))
+                cursor.execute(
+                    f"""SELECT id, buyer_name FROM user_sessions WHERE buyer_name IN ({placeholders})
+                        ORDER BY last_message_at, id""",
+                    names
+                )
+                # 按时间升序覆盖，保留每个昵称最近的会话
+                by_name = {s['buyer_name']: s['id'] for s in cursor.fetchall()}
+
+                updates = []
+                for row in rows:
+                    session_id = by_conversation.get(row['coze_conversation_id']) or by_name.get(row['buyer_name'])
+                    if session_id:
+                        updates.append((session_id, row['id']))
+                if updates:
+                    cursor.executemany("UPDATE conversation_history SET session_id = %s WHERE id = %s", updates)
+            linked += len(updates)
+            if len(rows) < batch_size:
+                break
+            last_id = rows[-1]['id']
+
+        logger.info(f"用户标识迁移: 补齐 {users} 个用户的 user_id，关联 {linked} 条对话历史")
+        return {'users': users, 'history': linked}
+
+    def rebuild_user_stats(self, batch_size: int = 5000) -> int:
+        """
+        按对话历史和归档计数重建 user_stats（统计与历史不一致时使用）
+
+        统计按 user_id 记录（经 session_id 关联，没有关联会话的旧消息按昵称的替代标识计入）。
+        回复耗时按热表中"买家消息后紧跟的回复"计算，两条时间相同的旧记录（未记录接收时间）不计入；
+        已归档消息只保留计数，不再参与耗时统计。
+
+        Returns:
+            int: 重建的用户数
+        """
+        # 先按主键分批扫描热表计算回复耗时（不在重建事务中长时间持有锁）
+        latency = {}
+        previous = {}
+        last_id = 0
+        while True:
+            with self.cursor('rebuild_user_stats') as cursor:
+                cursor.execute(
+                    """SELECT h.id, s.user_id, h.buyer_name, h.role, h.created_at
+                       FROM conversation_history h
+                       LEFT JOIN user_sessions s ON s.id = h.session_id
+                       WHERE h.id > %s ORDER BY h.id LIMIT %s""",
+                    (last_id, batch_size)
+                )
+                rows = cursor.fetchall()
+            for row in rows:
+                user_id = row['user_id'] or legacy_user_key(row['buyer_name'])
+                prior = previous.get(user_id)
+                if (row['role'] == 'assistant' and prior and prior['role'] == 'user'
+                        and row['created_at'] and prior['created_at'] and row['created_at'] > prior['created_at']):
+                    entry = latency.setdefault(user_id, [0.0, 0])
+                    entry[0] += (row['created_at'] - prior['created_at']).total_seconds()
+                    entry[1] += 1
+                previous[user_id] = row
+            if len(rows) < batch_size:
+                break
+            last_id = rows[-1]['id']
+
+        with self.cursor('rebuild_user_stats') as cursor:
+            rebuilt = backfill_user_stats(cursor)
+            if latency:
+                cursor.executemany(
+                    "UPDATE user_stats SET latency_total = %s, latency_samples = %s WHERE user_id = %s",
+                    [(total, samples, user_id) for user_id, (total, samples) in latency.items()]
+                )
+        logger.info(f"已重建 {rebuilt} 个用户的统计")
+        return rebuilt
+
+    def is_user_in_whitelist(self, user_id: str) -> bool:
         """检查用户是否在白名单中"""
         try:
-            with self.connection.cursor() as cursor:
+            with self.cursor('is_user_in_whitelist') as cursor:
                 cursor.execute(
-                    "SELECT is_whitelist FROM users WHERE buyer_name = %s",
-                    (buyer_name,)
+                    "SELECT is_whitelist FROM users WHERE user_id = %s",
+                    (user_id,)
                 )
                 result = cursor.fetchone()
                 if result:
@@ -307,20 +561,22 @@ class DBManager:
             logger.error(f"检查白名单状态失败: {e}")
             return False
 
-    def set_user_whitelist(self, buyer_name: str, is_whitelist: bool) -> bool:
-        """设置用户的白名单状态"""
+    def set_user_whitelist(self, user_id: str, is_whitelist: bool) -> bool:
+        """设置用户的白名单状态（用户不存在时返回 False）"""
         try:
-            # 确保用户存在
-            self.get_or_create_user(buyer_name)
-
-            with self.connection.cursor() as cursor:
-                cursor.execute(
-                    "UPDATE users SET is_whitelist = %s WHERE buyer_name = %s",
-                    (1 if is_whitelist else 0, buyer_name)
-                )
-            self.connection.commit()
+            with self.cursor('set_user_whitelist') as cursor:
+                cursor.execute("SELECT id FROM users WHERE user_id = %s", (user_id,))
+                user = cursor.fetchone()
+                if user:
+                    cursor.execute(
+                        "UPDATE users SET is_whitelist = %s WHERE id = %s",
+                        (1 if is_whitelist else 0, user['id'])
+                    )
+            if not user:
+                logger.warning(f"设置白名单失败，用户不存在: {user_id}")
+                return False
             status = "加入" if is_whitelist else "移出"
-            logger.info(f"用户 {buyer_name} 已{status}白名单")
+            logger.info(f"用户 {user_id} 已{status}白名单")
             return True
         except Exception as e:
             logger.error(f"设置白名单状态失败: {e}")
@@ -329,7 +585,7 @@ class DBManager:
     def get_whitelist_users(self) -> list:
         """获取所有白名单用户"""
         try:
-            with self.connection.cursor() as cursor:
+            with self.cursor('get_whitelist_users') as cursor:
                 cursor.execute(
                     "SELECT buyer_name FROM users WHERE is_whitelist = 1 ORDER BY updated_at DESC"
                 )
@@ -342,13 +598,17 @@ class DBManager:
     def get_all_users_with_status(self) -> list:
         """获取所有用户及其状态（用于GUI显示）"""
         try:
-            with self.connection.cursor() as cursor:
+            with self.cursor('get_all_users_with_status') as cursor:
                 cursor.execute("""
-                    SELECT u.buyer_name, u.coze_conversation_id, u.is_whitelist,
-                           (SELECT COUNT(*) FROM conversation_history ch WHERE ch.buyer_name = u.buyer_name) as msg_count,
+                    SELECT u.user_id, u.buyer_name, u.coze_conversation_id, u.is_whitelist,
+                           COALESCE(s.message_count, 0) as msg_count,
+                           COALESCE(s.reply_count, 0) as reply_count,
+                           s.last_message_at,
+                           CASE WHEN s.latency_samples > 0 THEN s.latency_total / s.latency_samples END as avg_reply_latency,
                            u.updated_at
                     FROM users u
-                    ORDER BY u.updated_at DESC
+                    LEFT JOIN user_stats s ON s.user_id = u.user_id
+                    ORDER BY COALESCE(s.last_message_at, u.updated_at) DESC
                 """)
                 return cursor.fetchall()
         except Exception as e:
@@ -357,74 +617,72 @@ class DBManager:
 
     # ========== user_sessions 表操作方法 ==========
 
-    def get_or_create_session(self, user_id: str, item_id: str, buyer_name: str = None, order_status: str = None, product_title: str = None) -> dict:
-        """获取或创建用户会话"""
-        try:
-            with self.connection.cursor() as cursor:
-                # 先查找会话
-                cursor.execute(
-                    "SELECT * FROM user_sessions WHERE user_id = %s AND item_id = %s",
-                    (user_id, item_id)
-                )
-                session = cursor.fetchone()
-
-                if session:
-                    # 更新最后消息时间，同时始终更新 product_title（如果有新值）
-                    if product_title:
-                        cursor.execute(
-                            "UPDATE user_sessions SET last_message_at = NOW(), product_title = %s WHERE user_id = %s AND item_id = %s",
-                            (product_title, user_id, item_id)
-                        )
-                        # 更新返回的session对象
-                        session['product_title'] = product_title
-                    else:
+    def get_or_create_session(self, user_id: str, item_id: str, buyer_name: str = None, order_status: str = None,
+                              product_title: str = None, reset_inactive: bool = False) -> dict:
+        """
+        获取或创建用户会话
+
+        一条 INSERT ... SELECT ... 的 upsert（SESSION_UPSERT_SQL）完成创建或更新：
+        新会话根据该用户已有会话判断新老客户并继承 inactive_sent 状态；
+        已有会话更新最后消息时间和商品标题（有新值时）。随后读取一次会话行。
+        reset_inactive 时在同一事务中重置该用户所有会话的 inactive_sent（用户发了新消息），
+        不再单独访问一次数据库。
+        并发创建同一用户的会话时由唯一键和行锁保证结果一致，死锁时自动重试。
+        """
+        for attempt in range(SESSION_UPSERT_ATTEMPTS):
+            try:
+                with self.cursor('get_or_create_session') as cursor:
+                    cursor.execute(self.SESSION_UPSERT_SQL, {
+                        'user_id': user_id,
+                        'item_id': item_id,
+                        'buyer_name': buyer_name,
+                        'product_title': product_title,
+                        'order_status': order_status,
+                    })
+                    if reset_inactive:
                         cursor.execute(
-                            "UPDATE user_sessions SET last_message_at = NOW() WHERE user_id = %s AND item_id = %s",
-                            (user_id, item_id)
+                            "UPDATE user_sessions SET inactive_sent = 0 WHERE user_id = %s AND inactive_sent = 1",
+                            (user_id,)
                         )
-                    self.connection.commit()
-                    return session
-
-                # 检查该用户是否有其他会话（判断新老客户 + 继承inactive状态）
-                cursor.execute(
-                    "SELECT COUNT(*) as cnt, MAX(inactive_sent) as inactive_sent FROM user_sessions WHERE user_id = %s",
-                    (user_id,)
-                )
-                result = cursor.fetchone()
-                has_other_sessions = result['cnt'] > 0
-                customer_type = 'returning' if has_other_sessions else 'new'
-                # 继承用户已有的inactive_sent状态
-                inherit_inactive_sent = 1 if result['inactive_sent'] else 0
-
-                # 创建新会话（包含 product_title）
-                cursor.execute(
-                    """INSERT INTO user_sessions
-                       (user_id, item_id, buyer_name, product_title, customer_type, order_status, last_message_at, inactive_sent)
-                       VALUES (%s, %s, %s, %s, %s, %s, NOW(), %s)""",
-                    (user_id, item_id, buyer_name, product_title, customer_type, order_status, inherit_inactive_sent)
-                )
-                self.connection.commit()
-
-                # 获取新创建的会话
-                cursor.execute(
-                    "SELECT * FROM user_sessions WHERE user_id = %s AND item_id = %s",
-                    (user_id, item_id)
-                )
-                return cursor.fetchone()
-        except Exception as e:
-            logger.error(f"获取/创建会话失败: {e}")
-            return None
+                    cursor.execute(
+                        "SELECT * FROM user_sessions WHERE user_id = %s AND item_id = %s",
+                        (user_id, item_id)
+                    )
+                    session = cursor.fetchone()
+                if reset_inactive:
+                    self._invalidate_user_sessions(user_id)
+                else:
+                    self._invalidate_session(user_id, item_id)
+                if session:
+                    self.session_cache.put((user_id, item_id), dict(session))
+                return session
+            except pymysql.err.OperationalError as e:
+                # 1213 死锁 / 1205 锁等待超时：并发创建同一用户的会话时可能发生，重试即可
+                if e.args[0] in (1213, 1205) and attempt < SESSION_UPSERT_ATTEMPTS - 1:
+                    logger.debug(f"创建会话时发生锁冲突，重试: {e}")
+                    time.sleep(random.uniform(0.005, 0.02) * (attempt + 1))
+                    continue
+                logger.error(f"获取/创建会话失败: {e}")
+                return None
+            except Exception as e:
+                logger.error(f"获取/创建会话失败: {e}")
+                return None
+        return None
 
     def get_session(self, user_id: str, item_id: str) -> dict:
-        """获取指定用户和商品的会话"""
+        """获取指定用户和商品的会话（经过读缓存）"""
+        session = self.session_cache.get((user_id, item_id))
+        if session is not MISSING:
+            return dict(session) if session else None
         try:
-            self._ensure_connection()
-            with self.connection.cursor() as cursor:
+            with self.cursor('get_session') as cursor:
                 cursor.execute(
                     "SELECT * FROM user_sessions WHERE user_id = %s AND item_id = %s",
                     (user_id, item_id)
                 )
-                return cursor.fetchone()
+                session = cursor.fetchone()
+            self.session_cache.put((user_id, item_id), dict(session) if session else None)
+            return session
         except Exception as e:
             logger.error(f"获取会话失败: {e}")
             return None
@@ -432,13 +690,12 @@ class DBManager:
     def delete_session(self, user_id: str, item_id: str) -> bool:
         """删除指定用户和商品的会话"""
         try:
-            self._ensure_connection()
-            with self.connection.cursor() as cursor:
+            with self.cursor('delete_session') as cursor:
                 cursor.execute(
                     "DELETE FROM user_sessions WHERE user_id = %s AND item_id = %s",
                     (user_id, item_id)
                 )
-            self.connection.commit()
+            self._invalidate_session(user_id, item_id)
             logger.info(f"已删除会话: user_id={user_id}, item_id={item_id}")
             return True
         except Exception as e:
@@ -448,12 +705,12 @@ class DBManager:
     def update_session_conversation_id(self, user_id: str, item_id: str, conversation_id: str) -> bool:
         """更新会话的Coze conversation_id"""
         try:
-            with self.connection.cursor() as cursor:
+            with self.cursor('update_session_conversation_id') as cursor:
                 cursor.execute(
                     "UPDATE user_sessions SET conversation_id = %s WHERE user_id = %s AND item_id = %s",
                     (conversation_id, user_id, item_id)
                 )
-            self.connection.commit()
+            self._invalidate_session(user_id, item_id)
             logger.info(f"更新会话 conversation_id: user={user_id}, item={item_id}, conv={conversation_id}")
             return True
         except Exception as e:
@@ -463,26 +720,77 @@ class DBManager:
     def update_session_message_time(self, user_id: str, item_id: str) -> bool:
         """更新会话的最后消息时间"""
         try:
-            with self.connection.cursor() as cursor:
+            with self.cursor('update_session_message_time') as cursor:
                 cursor.execute(
                     "UPDATE user_sessions SET last_message_at = NOW() WHERE user_id = %s AND item_id = %s",
                     (user_id, item_id)
                 )
-            self.connection.commit()
+            self._invalidate_session(user_id, item_id)
             return True
         except Exception as e:
             logger.error(f"更新最后消息时间失败: {e}")
             return False
 
+    def save_replies(self, records: list) -> list:
+        """
+        保存一批回复记录（写入队列调用），每条回复一个事务
+
+        每条记录在同一事务中完成: 用户昵称、会话 conversation_id 和最后消息时间、
+        买家消息和回复两条对话历史（关联会话 id）、用户统计。某条失败只回滚该条，不影响同批其他记录。
+
+        Args:
+            records: ReplyRecord 列表
+
+        Returns:
+            list: 每条记录是否写入成功
+        """
+        results = []
+        for record in records:
+            try:
+                with self.cursor('save_replies') as cursor:
+                    cursor.execute(
+                        "SELECT id, conversation_id FROM user_sessions WHERE user_id = %s AND item_id = %s",
+                        (record.user_id, record.item_id)
+                    )
+                    session = cursor.fetchone()
+                    session_id = session['id'] if session else None
+                    conversation_id = record.conversation_id or (session['conversation_id'] if session else None)
+
+                    cursor.execute(self.USER_IDENTITY_UPSERT_SQL, (record.user_id, record.buyer_name))
+                    if session:
+                        cursor.execute(
+                            "UPDATE user_sessions SET conversation_id = %s, last_message_at = %s WHERE id = %s",
+                            (conversation_id, record.created_at, session_id)
+                        )
+                    received_at = record.received_at or record.created_at
+                    cursor.execute(
+                        """INSERT INTO conversation_history (session_id, buyer_name, role, content, coze_conversation_id, created_at)
+                           VALUES (%s, %s, 'user', %s, %s, %s), (%s, %s, 'assistant', %s, %s, %s)""",
+                        (session_id, record.buyer_name, record.user_message, conversation_id, received_at,
+                         session_id, record.buyer_name, record.reply, conversation_id, record.created_at)
+                    )
+                    cursor.execute(self.USER_STATS_UPSERT_SQL, {
+                        'user_id': record.user_id, 'messages': 2, 'replies': 1,
+                        'last': record.created_at.replace(microsecond=0),
+                        'latency': (record.created_at - received_at).total_seconds(),
+                        'samples': 1 if record.received_at else 0,
+                    })
+                self._invalidate_session(record.user_id, record.item_id)
+                results.append(True)
+            except Exception as e:
+                logger.error(f"保存回复记录失败 ({record.buyer_name}): {e}")
+                results.append(False)
+        return results
+
     def update_session_order_status(self, user_id: str, item_id: str, order_status: str) -> bool:
         """更新会话的订单状态"""
         try:
-            with self.connection.cursor() as cursor:
+            with self.cursor('update_session_order_status') as cursor:
                 cursor.execute(
                     "UPDATE user_sessions SET order_status = %s WHERE user_id = %s AND item_id = %s",
                     (order_status, user_id, item_id)
                 )
-            self.connection.commit()
+            self._invalidate_session(user_id, item_id)
             return True
         except Exception as e:
             logger.error(f"更新订单状态失败: {e}")
@@ -491,13 +799,12 @@ class DBManager:
     def set_inactive_sent(self, user_id: str, sent: bool = True) -> bool:
         """设置用户的inactive发送状态（针对用户的所有会话）"""
         try:
-            self._ensure_connection()
-            with self.connection.cursor() as cursor:
+            with self.cursor('set_inactive_sent') as cursor:
                 cursor.execute(
                     "UPDATE user_sessions SET inactive_sent = %s WHERE user_id = %s",
                     (1 if sent else 0, user_id)
                 )
-            self.connection.commit()
+            self._invalidate_user_sessions(user_id)
             logger.info(f"用户 {user_id} inactive_sent 设置为 {sent}")
             return True
         except Exception as e:
@@ -507,7 +814,7 @@ class DBManager:
     def is_inactive_sent(self, user_id: str) -> bool:
         """检查用户是否已发送过inactive"""
         try:
-            with self.connection.cursor() as cursor:
+            with self.cursor('is_inactive_sent') as cursor:
                 cursor.execute(
                     "SELECT inactive_sent FROM user_sessions WHERE user_id = %s LIMIT 1",
                     (user_id,)
@@ -523,7 +830,7 @@ class DBManager:
     def get_user_last_message_time(self, user_id: str) -> datetime:
         """获取用户所有会话中的最后消息时间"""
         try:
-            with self.connection.cursor() as cursor:
+            with self.cursor('get_user_last_message_time') as cursor:
                 cursor.execute(
                     "SELECT MAX(last_message_at) as last_time FROM user_sessions WHERE user_id = %s",
                     (user_id,)
@@ -548,7 +855,7 @@ class DBManager:
             paid_statuses = ['paid', '已付款', '待发货', '已发货', '交易成功']
             paid_status_str = ','.join([f"'{s}'" for s in paid_statuses])
 
-            with self.connection.cursor() as cursor:
+            with self.cursor('get_inactive_candidates') as cursor:
                 cursor.execute(f"""
                     SELECT user_id, MAX(last_message_at) as last_time,
                            MAX(buyer_name) as buyer_name,
@@ -558,7 +865,7 @@ class DBManager:
                     WHERE inactive_sent = 0
                       AND (order_status IS NULL OR order_status NOT IN ({paid_status_str}))
                       AND last_message_at IS NOT NULL
-                      AND last_message_at < DATE_SUB(NOW(), INTERVAL %s MINUTE)
+                      AND last_message_at < {self.MINUTES_AGO_SQL}
                     GROUP BY user_id
                 """, (timeout_minutes,))
                 return cursor.fetchall()
@@ -567,14 +874,19 @@ class DBManager:
             return []
 
     def get_user_sessions(self, user_id: str) -> list:
-        """获取用户的所有会话"""
+        """获取用户的所有会话（经过读缓存）"""
+        sessions = self.user_sessions_cache.get(user_id)
+        if sessions is not MISSING:
+            return [dict(session) for session in sessions]
         try:
-            with self.connection.cursor() as cursor:
+            with self.cursor('get_user_sessions') as cursor:
                 cursor.execute(
                     "SELECT * FROM user_sessions WHERE user_id = %s ORDER BY updated_at DESC",
                     (user_id,)
                 )
-                return cursor.fetchall()
+                sessions = cursor.fetchall()
+            self.user_sessions_cache.put(user_id, [dict(session) for session in sessions])
+            return list(sessions)
         except Exception as e:
             logger.error(f"获取用户会话列表失败: {e}")
             return []
@@ -582,12 +894,12 @@ class DBManager:
     def update_session_summary(self, user_id: str, item_id: str, summary: str) -> bool:
         """更新会话摘要"""
         try:
-            with self.connection.cursor() as cursor:
+            with self.cursor('update_session_summary') as cursor:
                 cursor.execute(
                     "UPDATE user_sessions SET summary = %s WHERE user_id = %s AND item_id = %s",
                     (summary, user_id, item_id)
                 )
-            self.connection.commit()
+            self._invalidate_session(user_id, item_id)
             logger.info(f"更新会话摘要: user={user_id}, item={item_id}")
             return True
         except Exception as e:
@@ -597,16 +909,15 @@ class DBManager:
     def get_all_sessions_with_status(self) -> list:
         """获取所有会话及其状态（用于GUI显示）"""
         try:
-            self._ensure_connection()
-            with self.connection.cursor() as cursor:
-                # 关联 users 表获取白名单状态
+            with self.cursor('get_all_sessions_with_status') as cursor:
+                # 按 user_id（唯一索引）关联 users 表获取白名单状态
                 cursor.execute("""
                     SELECT s.user_id, s.item_id, s.buyer_name, s.product_title, s.conversation_id,
                            s.customer_type, s.order_status, s.inactive_sent,
                            s.last_message_at, s.updated_at,
                            COALESCE(u.is_whitelist, 0) as is_whitelist
                     FROM user_sessions s
-                    LEFT JOIN users u ON s.buyer_name = u.buyer_name
+                    LEFT JOIN users u ON u.user_id = s.user_id
                     ORDER BY s.updated_at DESC
                 """)
                 return cursor.fetchall()
@@ -617,13 +928,12 @@ class DBManager:
     def reset_user_inactive_status(self, user_id: str) -> bool:
         """重置用户的inactive状态（当用户有新消息时调用）"""
         try:
-            self._ensure_connection()
-            with self.connection.cursor() as cursor:
+            with self.cursor('reset_user_inactive_status') as cursor:
                 cursor.execute(
                     "UPDATE user_sessions SET inactive_sent = 0 WHERE user_id = %s",
                     (user_id,)
                 )
-            self.connection.commit()
+            self._invalidate_user_sessions(user_id)
             return True
         except Exception as e:
             logger.error(f"重置inactive状态失败: {e}")
@@ -632,13 +942,12 @@ class DBManager:
     def update_session_buyer_name(self, user_id: str, buyer_name: str) -> bool:
         """更新用户所有会话的buyer_name（用于修正错误的名字）"""
         try:
-            self._ensure_connection()
-            with self.connection.cursor() as cursor:
+            with self.cursor('update_session_buyer_name') as cursor:
                 cursor.execute(
                     "UPDATE user_sessions SET buyer_name = %s WHERE user_id = %s",
                     (buyer_name, user_id)
                 )
-            self.connection.commit()
+            self._invalidate_user_sessions(user_id)
             logger.info(f"更新用户 {user_id} 的 buyer_name: {buyer_name}")
             return True
         except Exception as e:
@@ -657,8 +966,7 @@ class DBManager:
             list: 其他会话列表，按最后消息时间倒序排列
         """
         try:
-            self._ensure_connection()
-            with self.connection.cursor() as cursor:
+            with self.cursor('get_user_other_sessions') as cursor:
                 if exclude_item_id:
                     cursor.execute(
                         """SELECT * FROM user_sessions
@@ -686,8 +994,7 @@ class DBManager:
     def get_session_by_conversation_id(self, conversation_id: str) -> dict:
         """根据conversation_id获取会话信息"""
         try:
-            self._ensure_connection()
-            with self.connection.cursor() as cursor:
+            with self.cursor('get_session_by_conversation_id') as cursor:
                 cursor.execute(
                     "SELECT * FROM user_sessions WHERE conversation_id = %s",
                     (conversation_id,)
@@ -700,9 +1007,8 @@ class DBManager:
     def get_all_conversation_ids(self) -> list:
         """获取所有的 conversation_id（从 user_sessions 和 users 表）"""
         try:
-            self._ensure_connection()
             conversation_ids = []
-            with self.connection.cursor() as cursor:
+            with self.cursor('get_all_conversation_ids') as cursor:
                 # 从 user_sessions 表获取
                 cursor.execute("""
                     SELECT DISTINCT conversation_id, buyer_name, item_id, updated_at
@@ -748,11 +1054,10 @@ class DBManager:
     def clear_all_conversation_ids(self) -> bool:
         """清空所有表中的 conversation_id"""
         try:
-            self._ensure_connection()
-            with self.connection.cursor() as cursor:
+            with self.cursor('clear_all_conversation_ids') as cursor:
                 cursor.execute("UPDATE user_sessions SET conversation_id = NULL")
                 cursor.execute("UPDATE users SET coze_conversation_id = NULL")
-                self.connection.commit()
+                self._invalidate_all_sessions()
                 logger.info("已清空所有 conversation_id")
                 return True
         except Exception as e:
@@ -762,10 +1067,9 @@ class DBManager:
     def clear_user_sessions(self):
         """清空 user_sessions 表"""
         try:
-            self._ensure_connection()
-            with self.connection.cursor() as cursor:
+            with self.cursor('clear_user_sessions') as cursor:
                 cursor.execute("DELETE FROM user_sessions")
-                self.connection.commit()
+                self._invalidate_all_sessions()
                 logger.info("已清空 user_sessions 表")
                 return True
         except Exception as e:
@@ -775,58 +1079,163 @@ class DBManager:
     def clear_all_tables(self):
         """清空所有表的数据（保留表结构）"""
         try:
-            self._ensure_connection()
-            with self.connection.cursor() as cursor:
+            with self.cursor('clear_all_tables') as cursor:
                 # 清空所有业务表
                 cursor.execute("DELETE FROM conversation_history")
+                cursor.execute("DELETE FROM history_archive_summary")
+                cursor.execute("DELETE FROM user_stats")
                 cursor.execute("DELETE FROM user_sessions")
                 cursor.execute("DELETE FROM users")
-                self.connection.commit()
+                cursor.execute("DELETE FROM scheduled_actions")
+                cursor.execute("DELETE FROM conversation_locator")
+                cursor.execute("DELETE FROM processed_messages")
+                self._invalidate_all_sessions()
                 logger.info("已清空所有数据库表")
                 return True
         except Exception as e:
             logger.error(f"清空数据库表失败: {e}")
             return False
 
+    # ========== scheduled_actions 表操作方法（scheduler 调用） ==========
+
+    def get_scheduled_actions(self) -> list:
+        """读取所有延时任务"""
+        with self.cursor('get_scheduled_actions') as cursor:
+            cursor.execute("SELECT kind, action_key, due_at, payload FROM scheduled_actions ORDER BY due_at")
+            return cursor.fetchall()
+
+    def save_scheduled_actions(self, upserts: list, deletes: list) -> bool:
+        """
+        在一个事务中写入和删除延时任务
+
+        Args:
+            upserts: [(kind, action_key, due_at, payload_json)]
+            deletes: [(kind, action_key)]
+        """
+        try:
+            with self.cursor('save_scheduled_actions') as cursor:
+                if deletes:
+                    cursor.executemany("DELETE FROM scheduled_actions WHERE kind = %s AND action_key = %s", deletes)
+                if upserts:
+                    cursor.executemany(
+                        "REPLACE INTO scheduled_actions (kind, action_key, due_at, payload) VALUES (%s, %s, %s, %s)",
+                        upserts
+                    )
+            return True
+        except Exception as e:
+            logger.error(f"保存延时任务失败: {e}")
+            return False
+
+    # ========== conversation_locator 表操作方法（conversation_locator 模块调用） ==========
+
+    def get_conversation_locators(self) -> list:
+        """读取所有会话定位特征"""
+        with self.cursor('get_conversation_locators') as cursor:
+            cursor.execute("SELECT user_id, buyer_name, avatar_url, item_thumb FROM conversation_locator")
+            return cursor.fetchall()
+
+    def save_conversation_locator(self, user_id: str, buyer_name: str, avatar_url: str, item_thumb: str) -> bool:
+        """写入（替换）用户的会话定位特征"""
+        try:
+            with self.cursor('save_conversation_locator') as cursor:
+                cursor.execute(
+                    "REPLACE INTO conversation_locator (user_id, buyer_name, avatar_url, item_thumb) VALUES (%s, %s, %s, %s)",
+                    (user_id, buyer_name, avatar_url, item_thumb)
+                )
+            return True
+        except Exception as e:
+            logger.error(f"保存会话定位特征失败: {e}")
+            return False
+
+    def delete_conversation_locator(self, user_id: str) -> bool:
+        """删除用户的会话定位特征（验证不符时调用）"""
+        try:
+            with self.cursor('delete_conversation_locator') as cursor:
+                cursor.execute("DELETE FROM conversation_locator WHERE user_id = %s", (user_id,))
+            return True
+        except Exception as e:
+            logger.error(f"删除会话定位特征失败: {e}")
+            return False
+
+    # ========== processed_messages 表操作方法（dedupe_store 模块调用） ==========
+
+    def load_processed_messages(self, since: datetime) -> list:
+        """删除 since 之前的去重记录，返回其余记录"""
+        with self.cursor('load_processed_messages') as cursor:
+            cursor.execute("DELETE FROM processed_messages WHERE processed_at < %s", (since,))
+            cursor.execute("SELECT digest, processed_at FROM processed_messages ORDER BY processed_at")
+            return cursor.fetchall()
+
+    def save_processed_messages(self, rows: list, expired_before: datetime = None) -> bool:
+        """
+        写入去重记录
+
+        Args:
+            rows: [(digest_hex, processed_at)]
+            expired_before: 同时删除此时间之前的过期记录
+        """
+        try:
+            with self.cursor('save_processed_messages') as cursor:
+                if expired_before is not None:
+                    cursor.execute("DELETE FROM processed_messages WHERE processed_at < %s", (expired_before,))
+                if rows:
+                    cursor.executemany("REPLACE INTO processed_messages (digest, processed_at) VALUES (%s, %s)", rows)
+            return True
+        except Exception as e:
+            logger.error(f"保存消息去重记录失败: {e}")
+            return False
+
     # ========== products 表操作方法 ==========
 
     def add_or_update_product(self, item_id: str, title: str, price: str = None, notes: str = None) -> bool:
         """添加或更新商品信息"""
         try:
-            self._ensure_connection()
-            with self.connection.cursor() as cursor:
-                cursor.execute("""
-                    INSERT INTO products (item_id, title, price, notes)
-                    VALUES (%s, %s, %s, %s)
-                    ON DUPLICATE KEY UPDATE
-                        title = VALUES(title),
-                        price = VALUES(price),
-                        notes = VALUES(notes),
-                        updated_at = NOW()
-                """, (item_id, title, price, notes))
-            self.connection.commit()
+            with self.cursor('add_or_update_product') as cursor:
+                cursor.execute(self.PRODUCT_UPSERT_SQL, (item_id, title, price, notes))
+            self.invalidate_products(item_id)
             logger.info(f"保存商品: item_id={item_id}, title={title}, price={price}")
             return True
         except Exception as e:
             logger.error(f"保存商品失败: {e}")
             return False
 
+    def _load_product(self, item_id: str) -> dict:
+        """读取商品（经过读缓存），数据库错误向上抛出"""
+        product = self.product_cache.get(item_id)
+        if product is MISSING:
+            with self.cursor('_load_product') as cursor:
+                cursor.execute("SELECT * FROM products WHERE item_id = %s", (item_id,))
+                product = cursor.fetchone()
+            self.product_cache.put(item_id, product)
+        return product
+
     def get_product(self, item_id: str) -> dict:
         """获取商品信息"""
         try:
-            self._ensure_connection()
-            with self.connection.cursor() as cursor:
-                cursor.execute("SELECT * FROM products WHERE item_id = %s", (item_id,))
-                return cursor.fetchone()
+            product = self._load_product(item_id)
+            return dict(product) if product else None
         except Exception as e:
             logger.error(f"获取商品失败: {e}")
             return None
 
+    def get_product_block(self, item_id: str) -> str:
+        """获取格式化的商品信息文本（[当前会话-商品信息]），商品不存在时返回 None"""
+        block = self.product_block_cache.get(item_id)
+        if block is not MISSING:
+            return block
+        try:
+            product = self._load_product(item_id)
+        except Exception as e:
+            logger.error(f"获取商品失败: {e}")
+            return None
+        block = format_product_block(product) if product else None
+        self.product_block_cache.put(item_id, block)
+        return block
+
     def get_all_products(self) -> list:
         """获取所有商品列表"""
         try:
-            self._ensure_connection()
-            with self.connection.cursor() as cursor:
+            with self.cursor('get_all_products') as cursor:
                 cursor.execute("SELECT * FROM products ORDER BY updated_at DESC")
                 return cursor.fetchall()
         except Exception as e:
@@ -836,10 +1245,9 @@ class DBManager:
     def delete_product(self, item_id: str) -> bool:
         """删除商品"""
         try:
-            self._ensure_connection()
-            with self.connection.cursor() as cursor:
+            with self.cursor('delete_product') as cursor:
                 cursor.execute("DELETE FROM products WHERE item_id = %s", (item_id,))
-            self.connection.commit()
+            self.invalidate_products(item_id)
             logger.info(f"删除商品: item_id={item_id}")
             return True
         except Exception as e:
@@ -847,5 +1255,81 @@ class DBManager:
             return False
 
 
+class AsyncDBManager:
+    """
+    DBManager 的异步包装
+
+    方法与 DBManager 完全相同，调用时在专用线程池中执行并返回协程，
+    数据库查询不再阻塞事件循环（浏览器、Coze 协程照常运行）。
+
+    Usage:
+        session = await async_db.get_session(user_id, item_id)
+    """
+
+    def __init__(self, manager: DBManager, max_workers: int = None):
+        self._manager = manager
+        self._max_workers = max_workers or Config.db_pool_size
+        self._executor = None
+        # 统计：提交到线程池后等待执行的时间
+        self._stats_lock = threading.Lock()
+        self.calls = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="db")
+        return self._executor
+
+    def __getattr__(self, name):
+        attr = getattr(self._manager, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def call(*args, **kwargs):
+            submitted_at = time.perf_counter()
+
+            def run():
+                waited = time.perf_counter() - submitted_at
+                with self._stats_lock:
+                    self.calls += 1
+                    self.queue_wait_total += waited
+                    self.queue_wait_max = max(self.queue_wait_max, waited)
+                return attr(*args, **kwargs)
+
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), run)
+
+        return call
+
+    def get_stats(self) -> dict:
+        """线程池排队耗时 + 连接池等待耗时"""
+        return {
+            'calls': self.calls,
+            'avg_queue_wait_ms': round(self.queue_wait_total * 1000 / self.calls, 2) if self.calls else 0.0,
+            'max_queue_wait_ms': round(self.queue_wait_max * 1000, 2),
+            'pool': self._manager.get_pool_stats(),
+        }
+
+    def shutdown(self):
+        """等待进行中的操作完成并关闭线程池"""
+        if self._executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+def create_db_manager(backend: str = None) -> DBManager:
+    """按配置创建存储后端（DB_BACKEND=mysql / sqlite）"""
+    backend = (backend or Config.db_backend).lower()
+    if backend == "sqlite":
+        from db_sqlite import SQLiteDBManager
+        return SQLiteDBManager()
+    if backend != "mysql":
+        logger.warning(f"未知的存储后端 {backend}，使用 MySQL")
+    return DBManager()
+
+
 # 全局数据库管理器实例
-db_manager = DBManager()
+db_manager = create_db_manager()
+# 异步调用入口（供事件循环中的代码使用）
+async_db = AsyncDBManager(db_manager)
@@ -0,0 +1,168 @@
+"""数据库查询统计模块 - 按 DBManager 方法统计调用次数、耗时分位数和返回行数，记录慢查询"""
+import math
+import re
+import threading
+import time
+from collections import deque
+from typing import Callable, List, Optional
+from logger_setup import logger
+
+# 每个方法保留最近多少次调用的耗时（用于计算分位数）
+LATENCY_SAMPLES = 2048
+# 慢查询日志中 SQL 的最大长度
+SQL_LOG_LENGTH = 500
+
+
+def _percentile(sorted_values: list, p: float) -> float:
+    """最近秩分位数（sorted_values 非空）"""
+    rank = math.ceil(p / 100 * len(sorted_values))
+    return sorted_values[max(0, min(len(sorted_values), rank) - 1)]
+
+
+def _compact_sql(sql: str) -> str:
+    sql = re.sub(r"\s+", " ", sql).strip()
+    return sql if len(sql) <= SQL_LOG_LENGTH else sql[:SQL_LOG_LENGTH] + "..."
+
+
+class MethodStats:
+    """单个方法的统计（由 QueryStats 加锁访问）"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.statements = 0
+        self.rows = 0
+        self.slow = 0
+        self.time_total = 0.0
+        self.time_max = 0.0
+        self.samples = deque(maxlen=LATENCY_SAMPLES)
+
+    def snapshot(self) -> dict:
+        ordered = sorted(self.samples)
+        result = {
+            'calls': self.calls,
+            'errors': self.errors,
+            'statements': self.statements,
+            'rows': self.rows,
+            'slow': self.slow,
+            'avg_ms': round(self.time_total * 1000 / self.calls, 2) if self.calls else 0.0,
+            'max_ms': round(self.time_max * 1000, 2),
+        }
+        for p in (50, 95, 99):
+            result[f'p{p}_ms'] = round(_percentile(ordered, p) * 1000, 2) if ordered else 0.0
+        return result
+
+
+class QueryStats:
+    """
+    数据库调用统计（线程安全）
+
+    一次调用 = 方法中的一个 `with db.cursor(name)` 块（借出连接到提交完成），
+    statements / rows 为块内执行的语句数和读取的行数。
+    """
+
+    def __init__(self, slow_query_ms: float = 200.0):
+        self.slow_query_ms = slow_query_ms
+        self._methods = {}
+        self._lock = threading.Lock()
+
+    def record(self, method: str, elapsed: float, statements: int, rows: int, slow: int, error: bool = False):
+        with self._lock:
+            stats = self._methods.get(method)
+            if stats is None:
+                stats = self._methods[method] = MethodStats()
+            stats.calls += 1
+            stats.errors += 1 if error else 0
+            stats.statements += statements
+            stats.rows += rows
+            stats.slow += slow
+            stats.time_total += elapsed
+            stats.time_max = max(stats.time_max, elapsed)
+            stats.samples.append(elapsed)
+
+    def is_slow(self, elapsed: float) -> bool:
+        return self.slow_query_ms > 0 and elapsed * 1000 >= self.slow_query_ms
+
+    def snapshot(self) -> dict:
+        """按总耗时从高到低排序的每方法统计"""
+        with self._lock:
+            items = sorted(self._methods.items(), key=lambda item: item[1].time_total, reverse=True)
+            return {method: stats.snapshot() for method, stats in items}
+
+    def reset(self):
+        with self._lock:
+            self._methods.clear()
+
+    def format_summary(self) -> str:
+        lines = [f"{'方法':<36}{'调用':>8}{'错误':>6}{'行数':>9}{'慢':>5}{'平均ms':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'最大':>9}"]
+        for method, s in self.snapshot().items():
+            lines.append(
+                f"{method:<36}{s['calls']:>8}{s['errors']:>6}{s['rows']:>9}{s['slow']:>5}"
+                f"{s['avg_ms']:>9}{s['p50_ms']:>9}{s['p95_ms']:>9}{s['p99_ms']:>9}{s['max_ms']:>9}"
+            )
+        return "\n".join(lines)
+
+    def log_summary(self):
+        if self._methods:
+            logger.info(f"数据库查询统计:\n{self.format_summary()}")
+
+
+class InstrumentedCursor:
+    """
+    游标包装：统计语句数和读取的行数，记录超过慢查询阈值的语句
+
+    慢语句的 EXPLAIN 在块结束后执行（见 explain_slow），不影响调用方读取结果集。
+    """
+
+    def __init__(self, cursor, stats: QueryStats):
+        self._cursor = cursor
+        self._stats = stats
+        self.statements = 0
+        self.rows = 0
+        # (sql, args, 耗时)
+        self.slow_statements: List[tuple] = []
+
+    def _timed(self, func: Callable, sql: str, args):
+        started_at = time.perf_counter()
+        result = func(sql, args)
+        elapsed = time.perf_counter() - started_at
+        self.statements += 1
+        if self._stats.is_slow(elapsed):
+            self.slow_statements.append((sql, args, elapsed))
+        return result
+
+    def execute(self, sql: str, args=None):
+        return self._timed(self._cursor.execute, sql, args)
+
+    def executemany(self, sql: str, seq_of_args):
+        seq_of_args = list(seq_of_args)
+        return self._timed(self._cursor.executemany, sql, seq_of_args)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self.rows += 1
+        return row
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self.rows += len(rows)
+        return rows
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def explain_slow(self, method: str, explain: Optional[Callable]):
+        """输出慢语句日志（附 EXPLAIN 执行计划）"""
+        for sql, args, elapsed in self.slow_statements:
+            if isinstance(args, list) and args and isinstance(args[0], (tuple, list, dict)):
+                # executemany: 用第一组参数生成执行计划
+                args = args[0]
+            lines = []
+            if explain is not None:
+                try:
+                    lines = explain(self._cursor, sql, args)
+                except Exception as e:
+                    lines = [f"(EXPLAIN 失败: {e})"]
+            plan = "".join(f"\n    {line}" for line in lines)
+            logger.warning(f"[慢查询] {method} {elapsed * 1000:.0f}ms: {_compact_sql(sql)}{plan}")
@@ -0,0 +1,723 @@
+"""数据库结构迁移模块 - 按版本顺序执行迁移脚本，已是最新版本时启动不再做任何 DDL 检查"""
+import sqlite3
+from contextlib import contextmanager
+import pymysql
+from logger_setup import logger
+
+# 迁移锁名称（GUI 和机器人同时启动时只有一个执行迁移）
+MIGRATION_LOCK = "xianyu_schema_migration"
+
+
+def _column_exists(cursor, table: str, column: str) -> bool:
+    cursor.execute("""
+        SELECT COUNT(*) as cnt FROM information_schema.columns
+        WHERE table_schema = DATABASE()
+        AND table_name = %s AND column_name = %s
+    """, (table, column))
+    return cursor.fetchone()['cnt'] > 0
+
+
+def _index_exists(cursor, table: str, index: str) -> bool:
+    cursor.execute("""
+        SELECT COUNT(*) as cnt FROM information_schema.statistics
+        WHERE table_schema = DATABASE()
+        AND table_name = %s AND index_name = %s
+    """, (table, index))
+    return cursor.fetchone()['cnt'] > 0
+
+
+def _add_index(cursor, table: str, index: str, columns: str):
+    if not _index_exists(cursor, table, index):
+        cursor.execute(f"ALTER TABLE {table} ADD INDEX {index} ({columns})")
+        logger.info(f"已创建索引 {table}.{index} ({columns})")
+
+
+def migration_001_baseline(cursor):
+    """基础表结构（兼容补齐旧版本缺少的列）"""
+    # 用户表（包含白名单标记）
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            buyer_name VARCHAR(255) NOT NULL UNIQUE,
+            coze_conversation_id VARCHAR(255),
+            is_whitelist TINYINT(1) DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+    if not _column_exists(cursor, 'users', 'is_whitelist'):
+        cursor.execute("ALTER TABLE users ADD COLUMN is_whitelist TINYINT(1) DEFAULT 0")
+        logger.info("已添加 is_whitelist 列到 users 表")
+
+    # 对话历史表（包含buyer_name方便直接查看）
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS conversation_history (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            buyer_name VARCHAR(255) NOT NULL,
+            role VARCHAR(50) NOT NULL,
+            content TEXT NOT NULL,
+            coze_conversation_id VARCHAR(255),
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+
+    # 用户会话表（基于用户ID和商品ID）
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_sessions (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id VARCHAR(50) NOT NULL COMMENT '闲鱼用户唯一ID',
+            item_id VARCHAR(50) NOT NULL COMMENT '商品ID',
+            buyer_name VARCHAR(255) COMMENT '买家昵称',
+            product_title VARCHAR(100) COMMENT '商品标题（前15字）',
+            conversation_id VARCHAR(255) COMMENT 'Coze会话ID',
+            summary TEXT COMMENT '会话摘要',
+            inactive_sent TINYINT(1) DEFAULT 0 COMMENT '是否已发送过inactive',
+            customer_type VARCHAR(20) DEFAULT 'new' COMMENT '客户类型: new/returning',
+            order_status VARCHAR(50) COMMENT '订单状态',
+            last_message_at DATETIME COMMENT '最后消息时间',
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            UNIQUE KEY unique_user_item (user_id, item_id)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+    if not _column_exists(cursor, 'user_sessions', 'product_title'):
+        cursor.execute("ALTER TABLE user_sessions ADD COLUMN product_title VARCHAR(100) COMMENT '商品标题（前15字）' AFTER buyer_name")
+        logger.info("已添加 product_title 列到 user_sessions 表")
+
+    # 商品信息表
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS products (
+            item_id VARCHAR(50) PRIMARY KEY COMMENT '商品ID',
+            title VARCHAR(255) COMMENT '商品标题',
+            price VARCHAR(20) COMMENT '商品价格',
+            notes TEXT COMMENT '备注',
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+    if not _column_exists(cursor, 'products', 'price'):
+        cursor.execute("ALTER TABLE products ADD COLUMN price VARCHAR(20) COMMENT '商品价格' AFTER title")
+        logger.info("已添加 price 列到 products 表")
+    if not _column_exists(cursor, 'products', 'notes'):
+        cursor.execute("ALTER TABLE products ADD COLUMN notes TEXT COMMENT '备注' AFTER price")
+        logger.info("已添加 notes 列到 products 表")
+
+
+def migration_002_query_indexes(cursor):
+    """热点查询的二级索引"""
+    # get_conversation_history / get_conversation_count: WHERE buyer_name ORDER BY created_at
+    _add_index(cursor, 'conversation_history', 'idx_history_buyer_created', 'buyer_name, created_at')
+    # get_session_by_conversation_id: WHERE conversation_id
+    _add_index(cursor, 'user_sessions', 'idx_sessions_conversation', 'conversation_id')
+    # get_user_other_sessions / get_user_last_message_time: WHERE user_id ORDER BY last_message_at
+    _add_index(cursor, 'user_sessions', 'idx_sessions_user_last_message', 'user_id, last_message_at')
+    # get_inactive_candidates: WHERE inactive_sent = 0 AND last_message_at < ...
+    _add_index(cursor, 'user_sessions', 'idx_sessions_inactive', 'inactive_sent, last_message_at')
+
+
+def migration_003_history_archive_summary(cursor):
+    """已归档对话历史的每买家计数（归档后的行不再留在 conversation_history 中）"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS history_archive_summary (
+            buyer_name VARCHAR(255) PRIMARY KEY,
+            message_count INT NOT NULL DEFAULT 0 COMMENT '已归档消息数',
+            first_message_at DATETIME COMMENT '最早归档消息时间',
+            last_message_at DATETIME COMMENT '最晚归档消息时间',
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+
+
+# 按对话历史和归档计数填充按昵称记录的 user_stats（仅迁移 v4 使用，v9 起统计按 user_id 记录）
+USER_STATS_BACKFILL_SQL = """
+    INSERT INTO user_stats (buyer_name, message_count, reply_count, last_message_at)
+    SELECT buyer_name, SUM(messages), SUM(replies), MAX(last_at)
+    FROM (
+        SELECT buyer_name, COUNT(*) as messages,
+               SUM(CASE WHEN role = 'assistant' THEN 1 ELSE 0 END) as replies, MAX(created_at) as last_at
+        FROM conversation_history GROUP BY buyer_name
+        UNION ALL
+        SELECT buyer_name, message_count, reply_count, last_message_at FROM history_archive_summary
+    ) t
+    GROUP BY buyer_name
+"""
+
+
+def _backfill_user_stats(cursor):
+    """按现有对话历史和归档计数填充 user_stats（回复耗时由 clear_user_session.py rebuild_stats 重建）"""
+    cursor.execute("DELETE FROM user_stats")
+    cursor.execute(USER_STATS_BACKFILL_SQL)
+
+
+def migration_004_user_stats(cursor):
+    """每用户统计（消息数、回复数、最后消息时间、回复耗时），用户列表不再逐行统计对话历史"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_stats (
+            buyer_name VARCHAR(255) PRIMARY KEY,
+            message_count INT NOT NULL DEFAULT 0 COMMENT '消息数（包括已归档）',
+            reply_count INT NOT NULL DEFAULT 0 COMMENT '回复数（包括已归档）',
+            last_message_at DATETIME COMMENT '最后消息时间',
+            latency_total DOUBLE NOT NULL DEFAULT 0 COMMENT '回复耗时合计（秒）',
+            latency_samples INT NOT NULL DEFAULT 0 COMMENT '有耗时记录的回复数',
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+    if not _column_exists(cursor, 'history_archive_summary', 'reply_count'):
+        cursor.execute("ALTER TABLE history_archive_summary ADD COLUMN reply_count INT NOT NULL DEFAULT 0 COMMENT '已归档回复数' AFTER message_count")
+    _backfill_user_stats(cursor)
+
+
+def backfill_user_ids(cursor) -> int:
+    """
+    为 users 补齐 user_id（迁移 v5 和 DBManager.backfill_user_identity 共用，可重复执行）
+
+    每个 user_id 取最近会话中的昵称，认领同昵称、尚无 user_id 的旧用户行（保留白名单等属性），
+    没有可认领的行时新建用户行。
+
+    Returns:
+        int: 补齐的用户数
+    """
+    cursor.execute("SELECT user_id FROM users WHERE user_id IS NOT NULL")
+    known = {row['user_id'] for row in cursor.fetchall()}
+    cursor.execute("SELECT id, buyer_name FROM users WHERE user_id IS NULL ORDER BY updated_at DESC, id DESC")
+    unclaimed = {}
+    for row in cursor.fetchall():
+        unclaimed.setdefault(row['buyer_name'], []).append(row['id'])
+    cursor.execute("SELECT user_id, buyer_name FROM user_sessions ORDER BY last_message_at DESC, id DESC")
+    latest = {}
+    for row in cursor.fetchall():
+        latest.setdefault(row['user_id'], row['buyer_name'])
+
+    filled = 0
+    for user_id, buyer_name in latest.items():
+        if user_id in known:
+            continue
+        ids = unclaimed.get(buyer_name)
+        if ids:
+            cursor.execute("UPDATE users SET user_id = %s WHERE id = %s", (user_id, ids.pop(0)))
+        else:
+            cursor.execute("INSERT INTO users (user_id, buyer_name) VALUES (%s, %s)", (user_id, buyer_name or user_id))
+        filled += 1
+    return filled
+
+
+def migration_005_user_identity(cursor):
+    """以闲鱼 user_id 作为用户标识：users 增加 user_id（昵称改为普通属性），对话历史关联会话 id"""
+    if not _column_exists(cursor, 'users', 'user_id'):
+        cursor.execute("ALTER TABLE users ADD COLUMN user_id VARCHAR(50) NULL COMMENT '闲鱼用户唯一ID' AFTER id")
+    # buyer_name 列定义中的 UNIQUE 约束（索引名即列名），同一昵称可能属于不同用户
+    if _index_exists(cursor, 'users', 'buyer_name'):
+        cursor.execute("ALTER TABLE users DROP INDEX buyer_name")
+    _add_index(cursor, 'users', 'idx_users_buyer_name', 'buyer_name')
+    if not _column_exists(cursor, 'conversation_history', 'session_id'):
+        cursor.execute("ALTER TABLE conversation_history ADD COLUMN session_id INT NULL COMMENT 'user_sessions.id' AFTER id")
+    _add_index(cursor, 'conversation_history', 'idx_history_session', 'session_id, id')
+    # get_conversation_id / clear_conversation_id 等按昵称查会话的旧接口
+    _add_index(cursor, 'user_sessions', 'idx_sessions_buyer_name', 'buyer_name')
+    backfill_user_ids(cursor)
+    if not _index_exists(cursor, 'users', 'uk_users_user_id'):
+        cursor.execute("ALTER TABLE users ADD UNIQUE KEY uk_users_user_id (user_id)")
+
+
+def migration_006_scheduled_actions(cursor):
+    """延时任务（inactive 跟进等），重启后由调度器重新加载"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS scheduled_actions (
+            kind VARCHAR(50) NOT NULL COMMENT '任务类型',
+            action_key VARCHAR(255) NOT NULL COMMENT '任务标识（如 user_id）',
+            due_at DATETIME NOT NULL COMMENT '到期时间',
+            payload TEXT COMMENT '任务参数（JSON）',
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (kind, action_key),
+            KEY idx_scheduled_due (due_at)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+
+
+def migration_007_conversation_locator(cursor):
+    """会话定位索引：user_id 对应的会话列表项特征，用于不进入会话直接定位"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS conversation_locator (
+            user_id VARCHAR(64) NOT NULL PRIMARY KEY COMMENT '用户唯一ID（闲鱼号）',
+            buyer_name VARCHAR(255) COMMENT '列表项中的买家昵称',
+            avatar_url VARCHAR(512) COMMENT '买家头像地址（去掉尺寸后缀和参数）',
+            item_thumb VARCHAR(512) COMMENT '商品缩略图地址（去掉尺寸后缀和参数）',
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+
+
+def migration_008_processed_messages(cursor):
+    """已回复消息的摘要（消息去重），重启后在过期时间内不重复回复"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS processed_messages (
+            digest CHAR(32) NOT NULL PRIMARY KEY COMMENT '用户ID和消息内容的摘要（十六进制）',
+            processed_at DATETIME NOT NULL COMMENT '处理时间',
+            KEY idx_processed_at (processed_at)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+
+
+def legacy_user_key(buyer_name: str) -> str:
+    """只有昵称、没有关联会话的旧数据使用的用户标识（与读取不到 user_id 时的替代标识一致）"""
+    return f"name_{buyer_name}"
+
+
+def _assign_legacy_user_ids(cursor) -> int:
+    """为仍没有 user_id 的旧用户行（从未有过会话）补齐替代标识，之后所有用户行都按 user_id 关联"""
+    cursor.execute("SELECT user_id FROM users WHERE user_id IS NOT NULL")
+    known = {row['user_id'] for row in cursor.fetchall()}
+    cursor.execute("SELECT id, buyer_name FROM users WHERE user_id IS NULL ORDER BY updated_at DESC, id DESC")
+    assigned = 0
+    for row in cursor.fetchall():
+        user_id = legacy_user_key(row['buyer_name'])
+        if user_id in known:
+            continue
+        cursor.execute("UPDATE users SET user_id = %s WHERE id = %s", (user_id, row['id']))
+        known.add(user_id)
+        assigned += 1
+    return assigned
+
+
+def _archive_summary_by_user(cursor) -> list:
+    """
+    把按昵称记录的归档计数转换为按 user_id 记录
+
+    同一昵称对应多个用户时无法拆分，归到最近更新的用户；没有对应用户的昵称使用替代标识。
+    """
+    cursor.execute("SELECT user_id, buyer_name FROM users WHERE user_id IS NOT NULL ORDER BY updated_at, id")
+    # 按时间升序覆盖，保留每个昵称最近的用户
+    by_name = {row['buyer_name']: row['user_id'] for row in cursor.fetchall()}
+    cursor.execute("SELECT buyer_name, message_count, reply_count, first_message_at, last_message_at FROM history_archive_summary")
+    merged = {}
+    for row in cursor.fetchall():
+        user_id = by_name.get(row['buyer_name']) or legacy_user_key(row['buyer_name'])
+        entry = merged.setdefault(user_id, {
+            'user_id': user_id, 'count': 0, 'replies': 0,
+            'first': row['first_message_at'], 'last': row['last_message_at'],
+        })
+        entry['count'] += row['message_count']
+        entry['replies'] += row['reply_count']
+        entry['first'] = min(filter(None, (entry['first'], row['first_message_at'])), default=None)
+        entry['last'] = max(filter(None, (entry['last'], row['last_message_at'])), default=None)
+    return list(merged.values())
+
+
+def backfill_user_stats(cursor, stats_table: str = 'user_stats', archive_table: str = 'history_archive_summary') -> int:
+    """
+    按对话历史（经 session_id 关联到 user_id）和归档计数重新填充 user_stats 的计数列
+    （迁移 v9 和 DBManager.rebuild_user_stats 共用；没有关联会话的旧消息按昵称的替代标识计入，
+    迁移时写入替换前的新表）
+
+    Returns:
+        int: 填充的用户数
+    """
+    cursor.execute("""
+        SELECT s.user_id, h.buyer_name, COUNT(*) as messages,
+               SUM(CASE WHEN h.role = 'assistant' THEN 1 ELSE 0 END) as replies, MAX(h.created_at) as last_at
+        FROM conversation_history h
+        LEFT JOIN user_sessions s ON s.id = h.session_id
+        GROUP BY s.user_id, h.buyer_name
+    """)
+    rows = cursor.fetchall()
+    cursor.execute(f"SELECT user_id, message_count as messages, reply_count as replies, last_message_at as last_at FROM {archive_table}")
+    rows += cursor.fetchall()
+
+    totals = {}
+    for row in rows:
+        user_id = row['user_id'] or legacy_user_key(row['buyer_name'])
+        entry = totals.setdefault(user_id, [0, 0, None])
+        entry[0] += int(row['messages'] or 0)
+        entry[1] += int(row['replies'] or 0)
+        entry[2] = max(filter(None, (entry[2], row['last_at'])), default=None)
+
+    cursor.execute(f"DELETE FROM {stats_table}")
+    if totals:
+        cursor.executemany(
+            f"INSERT INTO {stats_table} (user_id, message_count, reply_count, last_message_at) VALUES (%s, %s, %s, %s)",
+            [(user_id, messages, replies, last) for user_id, (messages, replies, last) in totals.items()]
+        )
+    return len(totals)
+
+
+def _insert_archive_summary(cursor, rows: list, table: str = 'history_archive_summary'):
+    if rows:
+        cursor.executemany(
+            f"""INSERT INTO {table} (user_id, message_count, reply_count, first_message_at, last_message_at)
+               VALUES (%(user_id)s, %(count)s, %(replies)s, %(first)s, %(last)s)""",
+            rows
+        )
+
+
+def migration_009_user_keyed_stats(cursor):
+    """
+    用户统计和归档计数改为按 user_id 记录（昵称变化或重名不再拆分/合并统计）
+
+    MySQL 的 DDL 会隐式提交，新结构先写入 *_new 表，填充完成后一条 RENAME TABLE 原子替换；
+    中途失败时旧表不变，可以重新执行。
+    """
+    if not _column_exists(cursor, 'history_archive_summary', 'buyer_name'):
+        # 上次执行已完成替换（只差清理旧表和记录版本号）
+        cursor.execute("DROP TABLE IF EXISTS history_archive_summary_old, user_stats_old")
+        return
+    _assign_legacy_user_ids(cursor)
+    archived = _archive_summary_by_user(cursor)
+    cursor.execute("DROP TABLE IF EXISTS history_archive_summary_new, user_stats_new")
+    cursor.execute("""
+        CREATE TABLE history_archive_summary_new (
+            user_id VARCHAR(50) PRIMARY KEY COMMENT '闲鱼用户唯一ID',
+            message_count INT NOT NULL DEFAULT 0 COMMENT '已归档消息数',
+            reply_count INT NOT NULL DEFAULT 0 COMMENT '已归档回复数',
+            first_message_at DATETIME COMMENT '最早归档消息时间',
+            last_message_at DATETIME COMMENT '最晚归档消息时间',
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+    _insert_archive_summary(cursor, archived, 'history_archive_summary_new')
+    cursor.execute("""
+        CREATE TABLE user_stats_new (
+            user_id VARCHAR(50) PRIMARY KEY COMMENT '闲鱼用户唯一ID',
+            message_count INT NOT NULL DEFAULT 0 COMMENT '消息数（包括已归档）',
+            reply_count INT NOT NULL DEFAULT 0 COMMENT '回复数（包括已归档）',
+            last_message_at DATETIME COMMENT '最后消息时间',
+            latency_total DOUBLE NOT NULL DEFAULT 0 COMMENT '回复耗时合计（秒）',
+            latency_samples INT NOT NULL DEFAULT 0 COMMENT '有耗时记录的回复数',
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+    backfill_user_stats(cursor, 'user_stats_new', 'history_archive_summary_new')
+    cursor.execute("""
+        RENAME TABLE history_archive_summary TO history_archive_summary_old,
+                     history_archive_summary_new TO history_archive_summary,
+                     user_stats TO user_stats_old,
+                     user_stats_new TO user_stats
+    """)
+    cursor.execute("DROP TABLE history_archive_summary_old, user_stats_old")
+
+
+# ===== SQLite 后端 =====
+# SQLite 没有 ON UPDATE CURRENT_TIMESTAMP，updated_at 由触发器维护（时间统一使用本地时间）
+
+def _sqlite_updated_at_trigger(cursor, table: str, key: str):
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_updated_at
+        AFTER UPDATE ON {table} FOR EACH ROW WHEN NEW.updated_at IS OLD.updated_at
+        BEGIN
+            UPDATE {table} SET updated_at = datetime('now', 'localtime') WHERE {key} = NEW.{key};
+        END
+    """)
+
+
+def sqlite_migration_001_baseline(cursor):
+    """基础表结构"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            buyer_name TEXT NOT NULL UNIQUE,
+            coze_conversation_id TEXT,
+            is_whitelist INTEGER DEFAULT 0,
+            created_at DATETIME DEFAULT (datetime('now', 'localtime')),
+            updated_at DATETIME DEFAULT (datetime('now', 'localtime'))
+        )
+    """)
+    _sqlite_updated_at_trigger(cursor, 'users', 'id')
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS conversation_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            buyer_name TEXT NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            coze_conversation_id TEXT,
+            created_at DATETIME DEFAULT (datetime('now', 'localtime'))
+        )
+    """)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            item_id TEXT NOT NULL,
+            buyer_name TEXT,
+            product_title TEXT,
+            conversation_id TEXT,
+            summary TEXT,
+            inactive_sent INTEGER DEFAULT 0,
+            customer_type TEXT DEFAULT 'new',
+            order_status TEXT,
+            last_message_at DATETIME,
+            created_at DATETIME DEFAULT (datetime('now', 'localtime')),
+            updated_at DATETIME DEFAULT (datetime('now', 'localtime')),
+            UNIQUE (user_id, item_id)
+        )
+    """)
+    _sqlite_updated_at_trigger(cursor, 'user_sessions', 'id')
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS products (
+            item_id TEXT PRIMARY KEY,
+            title TEXT,
+            price TEXT,
+            notes TEXT,
+            created_at DATETIME DEFAULT (datetime('now', 'localtime')),
+            updated_at DATETIME DEFAULT (datetime('now', 'localtime'))
+        )
+    """)
+    _sqlite_updated_at_trigger(cursor, 'products', 'item_id')
+
+
+def sqlite_migration_002_query_indexes(cursor):
+    """热点查询的二级索引（与 MySQL v2 相同）"""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_history_buyer_created ON conversation_history (buyer_name, created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_conversation ON user_sessions (conversation_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_user_last_message ON user_sessions (user_id, last_message_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_inactive ON user_sessions (inactive_sent, last_message_at)")
+
+
+def sqlite_migration_003_history_archive_summary(cursor):
+    """已归档对话历史的每买家计数"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS history_archive_summary (
+            buyer_name TEXT PRIMARY KEY,
+            message_count INTEGER NOT NULL DEFAULT 0,
+            first_message_at DATETIME,
+            last_message_at DATETIME,
+            updated_at DATETIME DEFAULT (datetime('now', 'localtime'))
+        )
+    """)
+    _sqlite_updated_at_trigger(cursor, 'history_archive_summary', 'buyer_name')
+
+
+def sqlite_migration_004_user_stats(cursor):
+    """每用户统计"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_stats (
+            buyer_name TEXT PRIMARY KEY,
+            message_count INTEGER NOT NULL DEFAULT 0,
+            reply_count INTEGER NOT NULL DEFAULT 0,
+            last_message_at DATETIME,
+            latency_total REAL NOT NULL DEFAULT 0,
+            latency_samples INTEGER NOT NULL DEFAULT 0,
+            updated_at DATETIME DEFAULT (datetime('now', 'localtime'))
+        )
+    """)
+    _sqlite_updated_at_trigger(cursor, 'user_stats', 'buyer_name')
+    cursor.execute("ALTER TABLE history_archive_summary ADD COLUMN reply_count INTEGER NOT NULL DEFAULT 0")
+    _backfill_user_stats(cursor)
+
+
+def sqlite_migration_005_user_identity(cursor):
+    """以闲鱼 user_id 作为用户标识（SQLite 无法删除列上的 UNIQUE 约束，重建 users 表）"""
+    cursor.execute("""
+        CREATE TABLE users_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT,
+            buyer_name TEXT NOT NULL,
+            coze_conversation_id TEXT,
+            is_whitelist INTEGER DEFAULT 0,
+            created_at DATETIME DEFAULT (datetime('now', 'localtime')),
+            updated_at DATETIME DEFAULT (datetime('now', 'localtime'))
+        )
+    """)
+    cursor.execute("""
+        INSERT INTO users_new (id, buyer_name, coze_conversation_id, is_whitelist, created_at, updated_at)
+        SELECT id, buyer_name, coze_conversation_id, is_whitelist, created_at, updated_at FROM users
+    """)
+    cursor.execute("DROP TABLE users")
+    cursor.execute("ALTER TABLE users_new RENAME TO users")
+    _sqlite_updated_at_trigger(cursor, 'users', 'id')
+    cursor.execute("CREATE INDEX idx_users_buyer_name ON users (buyer_name)")
+    cursor.execute("ALTER TABLE conversation_history ADD COLUMN session_id INTEGER")
+    cursor.execute("CREATE INDEX idx_history_session ON conversation_history (session_id, id)")
+    cursor.execute("CREATE INDEX idx_sessions_buyer_name ON user_sessions (buyer_name)")
+    backfill_user_ids(cursor)
+    cursor.execute("CREATE UNIQUE INDEX uk_users_user_id ON users (user_id)")
+
+
+def sqlite_migration_006_scheduled_actions(cursor):
+    """延时任务"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS scheduled_actions (
+            kind TEXT NOT NULL,
+            action_key TEXT NOT NULL,
+            due_at DATETIME NOT NULL,
+            payload TEXT,
+            created_at DATETIME DEFAULT (datetime('now', 'localtime')),
+            PRIMARY KEY (kind, action_key)
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_scheduled_due ON scheduled_actions (due_at)")
+
+
+def sqlite_migration_007_conversation_locator(cursor):
+    """会话定位索引"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS conversation_locator (
+            user_id TEXT NOT NULL PRIMARY KEY,
+            buyer_name TEXT,
+            avatar_url TEXT,
+            item_thumb TEXT,
+            updated_at DATETIME DEFAULT (datetime('now', 'localtime'))
+        )
+    """)
+    _sqlite_updated_at_trigger(cursor, 'conversation_locator', 'user_id')
+
+
+def sqlite_migration_008_processed_messages(cursor):
+    """已回复消息的摘要"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS processed_messages (
+            digest TEXT NOT NULL PRIMARY KEY,
+            processed_at DATETIME NOT NULL
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_processed_at ON processed_messages (processed_at)")
+
+
+def sqlite_migration_009_user_keyed_stats(cursor):
+    """用户统计和归档计数改为按 user_id 记录"""
+    _assign_legacy_user_ids(cursor)
+    archived = _archive_summary_by_user(cursor)
+    cursor.execute("DROP TABLE history_archive_summary")
+    cursor.execute("""
+        CREATE TABLE history_archive_summary (
+            user_id TEXT PRIMARY KEY,
+            message_count INTEGER NOT NULL DEFAULT 0,
+            reply_count INTEGER NOT NULL DEFAULT 0,
+            first_message_at DATETIME,
+            last_message_at DATETIME,
+            updated_at DATETIME DEFAULT (datetime('now', 'localtime'))
+        )
+    """)
+    _sqlite_updated_at_trigger(cursor, 'history_archive_summary', 'user_id')
+    _insert_archive_summary(cursor, archived)
+    cursor.execute("DROP TABLE user_stats")
+    cursor.execute("""
+        CREATE TABLE user_stats (
+            user_id TEXT PRIMARY KEY,
+            message_count INTEGER NOT NULL DEFAULT 0,
+            reply_count INTEGER NOT NULL DEFAULT 0,
+            last_message_at DATETIME,
+            latency_total REAL NOT NULL DEFAULT 0,
+            latency_samples INTEGER NOT NULL DEFAULT 0,
+            updated_at DATETIME DEFAULT (datetime('now', 'localtime'))
+        )
+    """)
+    _sqlite_updated_at_trigger(cursor, 'user_stats', 'user_id')
+    backfill_user_stats(cursor)
+
+
+# 迁移脚本列表（按版本号顺序执行，已发布的迁移不要修改，新增结构变化请追加新版本）
+# 每个版本需要同时提供 MySQL 和 SQLite 两个实现，版本号保持一致
+MIGRATIONS = [
+    (1, "基础表结构", migration_001_baseline),
+    (2, "热点查询索引", migration_002_query_indexes),
+    (3, "对话历史归档计数", migration_003_history_archive_summary),
+    (4, "用户统计表", migration_004_user_stats),
+    (5, "以 user_id 作为用户标识", migration_005_user_identity),
+    (6, "延时任务表", migration_006_scheduled_actions),
+    (7, "会话定位索引", migration_007_conversation_locator),
+    (8, "消息去重记录", migration_008_processed_messages),
+    (9, "用户统计按 user_id 记录", migration_009_user_keyed_stats),
+]
+
+SQLITE_MIGRATIONS = [
+    (1, "基础表结构", sqlite_migration_001_baseline),
+    (2, "热点查询索引", sqlite_migration_002_query_indexes),
+    (3, "对话历史归档计数", sqlite_migration_003_history_archive_summary),
+    (4, "用户统计表", sqlite_migration_004_user_stats),
+    (5, "以 user_id 作为用户标识", sqlite_migration_005_user_identity),
+    (6, "延时任务表", sqlite_migration_006_scheduled_actions),
+    (7, "会话定位索引", sqlite_migration_007_conversation_locator),
+    (8, "消息去重记录", sqlite_migration_008_processed_messages),
+    (9, "用户统计按 user_id 记录", sqlite_migration_009_user_keyed_stats),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+assert SQLITE_MIGRATIONS[-1][0] == LATEST_VERSION, "SQLite 迁移版本与 MySQL 不一致"
+
+SCHEMA_VERSION_DDL = {
+    'mysql': """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INT PRIMARY KEY,
+            description VARCHAR(255),
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    'sqlite': """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at DATETIME DEFAULT (datetime('now', 'localtime'))
+        )
+    """,
+}
+
+
+def _migrations_for(db) -> list:
+    return SQLITE_MIGRATIONS if db.backend == 'sqlite' else MIGRATIONS
+
+
+@contextmanager
+def _migration_lock(cursor, backend: str):
+    """迁移期间加锁，避免多个进程重复执行"""
+    if backend == 'sqlite':
+        # 立即获取写锁，整个迁移在一个事务中完成
+        cursor.execute("BEGIN IMMEDIATE")
+        yield
+        return
+    cursor.execute("SELECT GET_LOCK(%s, 60) as locked", (MIGRATION_LOCK,))
+    try:
+        yield
+    finally:
+        cursor.execute("SELECT RELEASE_LOCK(%s)", (MIGRATION_LOCK,))
+
+
+def get_schema_version(db) -> int:
+    """读取当前结构版本（schema_version 表不存在时为 0）"""
+    try:
+        with db.cursor('get_schema_version') as cursor:
+            cursor.execute("SELECT MAX(version) as version FROM schema_version")
+            row = cursor.fetchone()
+            return (row['version'] or 0) if row else 0
+    except (pymysql.err.ProgrammingError, sqlite3.OperationalError):
+        return 0
+
+
+def migrate(db, target: int = None) -> int:
+    """
+    执行未完成的迁移
+
+    Args:
+        db: DBManager 实例（需已连接）
+        target: 目标版本，默认迁移到最新版本
+
+    Returns:
+        int: 迁移后的结构版本
+    """
+    target = LATEST_VERSION if target is None else target
+    current = get_schema_version(db)
+    if current >= target:
+        logger.debug(f"数据库结构已是最新版本 (v{current})")
+        return current
+
+    with db.cursor('migrate') as cursor:
+        # 加锁后重新读取版本，避免多个进程重复执行
+        with _migration_lock(cursor, db.backend):
+            cursor.execute(SCHEMA_VERSION_DDL[db.backend])
+            cursor.execute("SELECT MAX(version) as version FROM schema_version")
+            current = cursor.fetchone()['version'] or 0
+
+            for version, description, apply in _migrations_for(db):
+                if version <= current or version > target:
+                    continue
+                logger.info(f"执行数据库迁移 v{version}: {description}")
+                apply(cursor)
+                cursor.execute(
+                    "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                    (version, description)
+                )
+                current = version
+
+    logger.info(f"数据库结构已迁移到 v{current}")
+    return current
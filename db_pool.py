@@ -0,0 +1,119 @@
+"""数据库连接池模块 - 线程安全的 pymysql 连接池，供 DBManager 和异步包装使用"""
+import threading
+import time
+from typing import Callable, List, Tuple
+from logger_setup import logger
+
+
+class PoolTimeoutError(Exception):
+    """等待空闲连接超时"""
+
+
+class ConnectionPool:
+    """
+    有界的 pymysql 连接池（线程安全）
+
+    连接按需创建，最多 max_size 个；全部借出时调用方阻塞等待，超过 timeout 抛出 PoolTimeoutError。
+    空闲超过 ping_after 秒的连接在借出前先 ping（自动重连），出错的连接直接丢弃。
+    """
+
+    def __init__(self, factory: Callable, max_size: int = 5, timeout: float = 10.0, ping_after: float = 60.0):
+        self._factory = factory
+        self.max_size = max_size
+        self.timeout = timeout
+        self.ping_after = ping_after
+        # 空闲连接: (connection, 归还时间)，后进先出以便少量连接保持活跃
+        self._idle: List[Tuple[object, float]] = []
+        self._lock = threading.Lock()
+        # 归还或丢弃连接时通知等待方（空闲连接和空出的名额都可以满足等待）
+        self._available = threading.Condition(self._lock)
+        self._created = 0
+        # 统计
+        self.acquires = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def acquire(self):
+        """借出一个连接"""
+        started_at = time.perf_counter()
+        deadline = time.monotonic() + self.timeout
+        waited_once = False
+        with self._available:
+            while not self._idle and self._created >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeoutError(f"等待数据库连接超时 ({self.timeout}秒)")
+                waited_once = True
+                self._available.wait(remaining)
+            if waited_once:
+                self.waits += 1
+            if self._idle:
+                conn, returned_at = self._idle.pop()
+            else:
+                conn, returned_at = None, None
+                self._created += 1
+
+        if conn is None:
+            try:
+                conn = self._factory()
+            except Exception:
+                self._release_slot()
+                raise
+        elif time.monotonic() - returned_at > self.ping_after:
+            try:
+                conn.ping(reconnect=True)
+            except Exception:
+                self.discard(conn)
+                raise
+
+        waited = time.perf_counter() - started_at
+        with self._lock:
+            self.acquires += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+        return conn
+
+    def release(self, conn):
+        """归还连接"""
+        with self._available:
+            self._idle.append((conn, time.monotonic()))
+            self._available.notify()
+
+    def _release_slot(self):
+        with self._available:
+            self._created -= 1
+            self._available.notify()
+
+    def discard(self, conn):
+        """丢弃出错的连接（空出的名额可以重新创建）"""
+        self._release_slot()
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def close_all(self):
+        """关闭所有空闲连接"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self.discard(conn)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'size': self._created,
+                'max_size': self.max_size,
+                'idle': len(self._idle),
+                'acquires': self.acquires,
+                'waits': self.waits,
+                'timeouts': self.timeouts,
+                'avg_wait_ms': round(self.wait_total * 1000 / self.acquires, 2) if self.acquires else 0.0,
+                'max_wait_ms': round(self.wait_max * 1000, 2),
+            }
+
+    def log_stats(self):
+        logger.info(f"数据库连接池统计: {self.snapshot()}")
@@ -0,0 +1,185 @@
+"""SQLite 存储后端 - 单机部署时替代 MySQL（WAL 模式，无需数据库服务）"""
+import re
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+from db_manager import DBManager
+from logger_setup import logger
+
+# 时间统一按本地时间、秒精度保存（与 MySQL DATETIME 一致，字符串比较即时间比较）
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+# 以这些后缀命名的列读出时转换为 datetime（包括 MAX(last_message_at) as last_time 这类聚合结果）
+DATETIME_COLUMN_SUFFIXES = ('_at', '_time')
+
+sqlite3.register_adapter(datetime, lambda value: value.strftime(DATETIME_FORMAT))
+
+
+@lru_cache(maxsize=256)
+def _translate(sql: str) -> str:
+    """把 pymysql 风格的参数占位符（%s / %(name)s）转换为 sqlite3 风格（? / :name）"""
+    sql = re.sub(r"%\((\w+)\)s", r":\1", sql)
+    return sql.replace("%s", "?").replace("%%", "%")
+
+
+def _parse_datetime(value):
+    if isinstance(value, str):
+        try:
+            return datetime.strptime(value[:19], DATETIME_FORMAT)
+        except ValueError:
+            return value
+    return value
+
+
+class SQLiteCursor:
+    """sqlite3 游标包装，接口与 pymysql DictCursor 一致（%s 占位符、字典行）"""
+
+    def __init__(self, connection: sqlite3.Connection):
+        self.connection = connection
+        self._cursor = connection.cursor()
+
+    def execute(self, sql: str, args=None) -> int:
+        self._cursor.execute(_translate(sql), args if args is not None else ())
+        return self._cursor.rowcount
+
+    def executemany(self, sql: str, seq_of_args) -> int:
+        self._cursor.executemany(_translate(sql), seq_of_args)
+        return self._cursor.rowcount
+
+    def _to_dict(self, row) -> dict:
+        if row is None:
+            return None
+        return {
+            key: _parse_datetime(row[key]) if key.endswith(DATETIME_COLUMN_SUFFIXES) else row[key]
+            for key in row.keys()
+        }
+
+    def fetchone(self) -> dict:
+        return self._to_dict(self._cursor.fetchone())
+
+    def fetchall(self) -> list:
+        return [self._to_dict(row) for row in self._cursor.fetchall()]
+
+    @property
+    def rowcount(self) -> int:
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self) -> int:
+        return self._cursor.lastrowid
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteDBManager(DBManager):
+    """
+    SQLite 存储后端（配置 DB_BACKEND=sqlite）
+
+    数据库文件开启 WAL：读不阻塞写，写事务之间按 busy_timeout 等待。
+    连接池中每个连接同一时刻只被一个线程使用（check_same_thread=False）。
+    """
+
+    backend = "sqlite"
+    # 本地文件连接不会断开，不需要 ping
+    connection_ping_after = float('inf')
+
+    SESSION_UPSERT_SQL = """
+        INSERT INTO user_sessions
+        (user_id, item_id, buyer_name, product_title, customer_type, order_status, last_message_at, inactive_sent)
+        SELECT %(user_id)s, %(item_id)s, %(buyer_name)s, %(product_title)s,
+               CASE WHEN COUNT(*) > 0 THEN 'returning' ELSE 'new' END,
+               %(order_status)s, NOW(), CASE WHEN MAX(prior.inactive_sent) THEN 1 ELSE 0 END
+        FROM user_sessions AS prior
+        WHERE prior.user_id = %(user_id)s
+        ON CONFLICT (user_id, item_id) DO UPDATE SET
+            last_message_at = NOW(),
+            product_title = COALESCE(excluded.product_title, user_sessions.product_title)
+    """
+    USER_IDENTITY_UPSERT_SQL = """
+        INSERT INTO users (user_id, buyer_name) VALUES (%s, %s)
+        ON CONFLICT (user_id) DO UPDATE SET buyer_name = excluded.buyer_name
+        WHERE buyer_name IS NOT excluded.buyer_name
+    """
+    PRODUCT_UPSERT_SQL = """
+        INSERT INTO products (item_id, title, price, notes)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (item_id) DO UPDATE SET
+            title = excluded.title,
+            price = excluded.price,
+            notes = excluded.notes,
+            updated_at = NOW()
+    """
+    USER_STATS_UPSERT_SQL = """
+        INSERT INTO user_stats (user_id, message_count, reply_count, last_message_at, latency_total, latency_samples)
+        VALUES (%(user_id)s, %(messages)s, %(replies)s, %(last)s, %(latency)s, %(samples)s)
+        ON CONFLICT (user_id) DO UPDATE SET
+            message_count = message_count + excluded.message_count,
+            reply_count = reply_count + excluded.reply_count,
+            last_message_at = MAX(COALESCE(last_message_at, excluded.last_message_at), excluded.last_message_at),
+            latency_total = latency_total + excluded.latency_total,
+            latency_samples = latency_samples + excluded.latency_samples
+    """
+    ARCHIVE_SUMMARY_UPSERT_SQL = """
+        INSERT INTO history_archive_summary (user_id, message_count, reply_count, first_message_at, last_message_at)
+        VALUES (%(user_id)s, %(count)s, %(replies)s, %(first)s, %(last)s)
+        ON CONFLICT (user_id) DO UPDATE SET
+            message_count = message_count + excluded.message_count,
+            reply_count = reply_count + excluded.reply_count,
+            first_message_at = MIN(COALESCE(first_message_at, excluded.first_message_at), excluded.first_message_at),
+            last_message_at = MAX(COALESCE(last_message_at, excluded.last_message_at), excluded.last_message_at)
+    """
+    MINUTES_AGO_SQL = "datetime('now', 'localtime', '-' || %s || ' minutes')"
+
+    def __init__(self, path: str = None):
+        super().__init__()
+        self.path = Path(path or self.config.db_sqlite_path)
+
+    def _create_connection(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(
+            str(self.path),
+            timeout=self.config.db_pool_timeout,
+            check_same_thread=False,
+            # 写语句前自动 BEGIN IMMEDIATE，避免读后写事务升级锁时死锁
+            isolation_level="IMMEDIATE",
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.create_function("NOW", 0, lambda: datetime.now().strftime(DATETIME_FORMAT))
+        return conn
+
+    def connect(self):
+        connected = super().connect()
+        if connected:
+            logger.info(f"SQLite 数据库: {self.path}")
+        return connected
+
+    def _explain_plan(self, cursor, sql: str, args) -> list:
+        if not sql.lstrip().lower().startswith(('select', 'insert', 'update', 'delete', 'replace')):
+            return []
+        cursor.execute("EXPLAIN QUERY PLAN " + sql, args)
+        return [row['detail'] for row in cursor.fetchall()]
+
+    @contextmanager
+    def _transaction_cursor(self):
+        """从连接池借出连接并返回游标，正常结束时提交，出错时回滚"""
+        if not self.pool:
+            raise RuntimeError("数据库未连接")
+        conn = self.pool.acquire()
+        cursor = SQLiteCursor(conn)
+        try:
+            yield cursor
+            conn.commit()
+        except BaseException:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            raise
+        finally:
+            cursor.close()
+            self.pool.release(conn)
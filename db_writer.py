@@ -0,0 +1,192 @@
+"""数据库写入队列模块 - 回复相关的记录异步批量写入，数据库延迟不再影响回复发送"""
+import asyncio
+import json
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional, Tuple
+from logger_setup import logger
+from config import Config
+from db_manager import AsyncDBManager, async_db
+
+
+@dataclass
+class ReplyRecord:
+    """一次回复需要保存的全部数据（写入时在同一个事务中完成）"""
+    buyer_name: str
+    user_id: str
+    item_id: str
+    user_message: str
+    reply: str
+    conversation_id: Optional[str] = None
+    created_at: datetime = field(default_factory=datetime.now)
+    # 买家消息的接收时间（回复耗时 = created_at - received_at），未知时为 None
+    received_at: Optional[datetime] = None
+
+    def to_json(self) -> str:
+        data = asdict(self)
+        data['created_at'] = self.created_at.isoformat()
+        data['received_at'] = self.received_at.isoformat() if self.received_at else None
+        return json.dumps(data, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, line: str) -> 'ReplyRecord':
+        data = json.loads(line)
+        data['created_at'] = datetime.fromisoformat(data['created_at'])
+        if data.get('received_at'):
+            data['received_at'] = datetime.fromisoformat(data['received_at'])
+        return cls(**data)
+
+
+class WriteBehindQueue:
+    """
+    回复记录写入队列
+
+    submit() 立即返回一个 Future（写入确认），记录在后台按批写入：
+    达到 batch_size 条或第一条记录等待超过 flush_interval 秒时提交一批，每条回复一个事务。
+    stop() 会写完队列中的所有记录；写入失败（如数据库不可用）的记录保存到日志文件，
+    下次启动时自动重新写入。
+    """
+
+    def __init__(self, batch_size: int = None, flush_interval: float = None, journal_path: str = None,
+                 db: AsyncDBManager = None):
+        self.db = db or async_db
+        self.batch_size = batch_size or Config.db_write_batch_size
+        self.flush_interval = flush_interval if flush_interval is not None else Config.db_write_flush_interval
+        self.journal_path = Path(journal_path or Config.db_write_journal_file)
+        # 队列元素: (记录, 写入确认)；None 表示停止
+        self._queue: asyncio.Queue = asyncio.Queue()
+        # 队列攒满一批（或正在停止）时触发，提前结束等待
+        self._batch_ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # 写入失败的记录（停止时保存到日志文件）
+        self._failed: List[ReplyRecord] = []
+        # 统计
+        self.submitted = 0
+        self.written = 0
+        self.failures = 0
+        self.batches = 0
+        self.flush_time_total = 0.0
+        self.flush_time_max = 0.0
+
+    async def start(self):
+        """启动后台写入任务，并重新写入上次遗留的记录"""
+        self._task = asyncio.create_task(self._run())
+        for record in self._load_journal():
+            self.submit(record)
+
+    def submit(self, record: ReplyRecord) -> asyncio.Future:
+        """提交一条回复记录，返回写入确认（True 已提交事务 / False 写入失败）"""
+        ack = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((record, ack))
+        self.submitted += 1
+        if self._queue.qsize() >= self.batch_size - 1:
+            self._batch_ready.set()
+        return ack
+
+    async def stop(self):
+        """写完队列中的所有记录后停止，失败的记录保存到日志文件"""
+        if self._task:
+            # 不取消后台任务（可能正在写入），让它写完当前批次后退出
+            self._queue.put_nowait(None)
+            self._batch_ready.set()
+            await self._task
+            self._task = None
+
+        remaining = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None:
+                remaining.append(item)
+        if remaining:
+            await self._flush(remaining)
+
+        self._save_journal()
+        logger.info(f"[写入队列] 已停止，统计: {self.get_stats()}")
+
+    def get_stats(self) -> dict:
+        return {
+            'submitted': self.submitted,
+            'written': self.written,
+            'failures': self.failures,
+            'pending': self._queue.qsize(),
+            'batches': self.batches,
+            'avg_batch': round((self.written + self.failures) / self.batches, 1) if self.batches else 0.0,
+            'avg_flush_ms': round(self.flush_time_total * 1000 / self.batches, 1) if self.batches else 0.0,
+            'max_flush_ms': round(self.flush_time_max * 1000, 1),
+        }
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            # 第一条记录到达后最多等待 flush_interval 秒攒批，攒满提前写入
+            if self._queue.qsize() < self.batch_size - 1:
+                self._batch_ready.clear()
+                try:
+                    await asyncio.wait_for(self._batch_ready.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            batch = [item]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[Tuple[ReplyRecord, asyncio.Future]]):
+        records = [record for record, _ in batch]
+        started_at = time.perf_counter()
+        if self.db.is_connected:
+            results = await self.db.save_replies(records)
+        else:
+            results = [False] * len(records)
+        elapsed = time.perf_counter() - started_at
+
+        self.batches += 1
+        self.flush_time_total += elapsed
+        self.flush_time_max = max(self.flush_time_max, elapsed)
+        for (record, ack), ok in zip(batch, results):
+            if ok:
+                self.written += 1
+            else:
+                self.failures += 1
+                self._failed.append(record)
+            if not ack.done():
+                ack.set_result(ok)
+        logger.debug(f"[写入队列] 写入 {len(batch)} 条回复记录 ({elapsed * 1000:.1f}ms)")
+
+    def _load_journal(self) -> List[ReplyRecord]:
+        if not self.journal_path.exists():
+            return []
+        records = []
+        try:
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        records.append(ReplyRecord.from_json(line))
+            self.journal_path.unlink()
+        except Exception as e:
+            logger.error(f"[写入队列] 读取遗留记录失败: {e}")
+            return []
+        if records:
+            logger.info(f"[写入队列] 重新写入上次遗留的 {len(records)} 条回复记录")
+        return records
+
+    def _save_journal(self):
+        if not self._failed:
+            return
+        try:
+            self.journal_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.journal_path, 'a', encoding='utf-8') as f:
+                for record in self._failed:
+                    f.write(record.to_json() + '\n')
+            logger.warning(f"[写入队列] {len(self._failed)} 条回复记录写入失败，已保存到 {self.journal_path}，下次启动时重新写入")
+            self._failed.clear()
+        except Exception as e:
+            logger.error(f"[写入队列] 保存未写入记录失败: {e}")
@@ -0,0 +1,172 @@
+"""消息去重模块 - 以固定长度摘要记录已回复的买家消息，按时间分桶过期，可选保存到数据库"""
+import asyncio
+import hashlib
+import sys
+import time
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional, Tuple
+from logger_setup import logger
+from db_manager import AsyncDBManager, async_db
+
+# 摘要长度（字节），128 位足以避免不同消息碰撞
+DIGEST_SIZE = 16
+# 过期时间划分的桶数（过期粒度 = ttl / BUCKETS）
+BUCKETS = 16
+
+
+def message_digest(user_id: str, message: str, image_urls: List[str] = None) -> bytes:
+    """用户 ID + 买家消息内容（不含历史上下文前缀）的摘要"""
+    parts = [user_id or '', message or '', *(image_urls or [])]
+    return hashlib.blake2b('\x1f'.join(parts).encode('utf-8'), digest_size=DIGEST_SIZE).digest()
+
+
+class DedupeStore:
+    """
+    已处理消息的去重记录（非线程安全，只在事件循环中使用）
+
+    记录按处理时间放入宽度为 ttl / BUCKETS 的时间桶，桶按时间顺序排列：
+    过期时整桶从队首弹出，每条记录只被检查一次（均摊 O(1)），不需要每轮遍历全部记录。
+    同一摘要再次记录时只更新时间，旧桶中的引用在弹出时跳过。超过 max_entries 时从最早的桶开始淘汰。
+
+    persist=True 时新记录由后台任务批量写入 processed_messages 表（add 不等待数据库，
+    进程内的去重只依赖内存记录），启动时 load() 加载未过期的记录，停止时 flush() 写完剩余记录。
+    """
+
+    def __init__(self, ttl: float, max_entries: int = 10000, persist: bool = False, db: AsyncDBManager = None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.persist = persist
+        self.db = db or async_db
+        self.bucket_width = max(ttl / BUCKETS, 0.001)
+        # 摘要 -> (最近一次处理时间, 所在桶编号)
+        self._entries: Dict[bytes, Tuple[float, int]] = {}
+        # (桶编号, 桶内摘要)，按桶编号递增
+        self._buckets: Deque[Tuple[int, Deque[bytes]]] = deque()
+        self._last_purge = 0.0
+        # 等待写入数据库的记录 [(摘要十六进制, 处理时间)] 和需要删除的过期时间点
+        self._pending: List[Tuple[str, datetime]] = []
+        self._pending_purge: Optional[datetime] = None
+        self._write_task: Optional[asyncio.Task] = None
+        self.stats = {'checks': 0, 'hits': 0, 'added': 0, 'expired': 0, 'evicted': 0, 'loaded': 0, 'writes': 0}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _drop(self, bucket: int, digest: bytes) -> bool:
+        """删除桶中的引用对应的记录（记录已移到更新的桶时不删除）"""
+        entry = self._entries.get(digest)
+        if entry is None or entry[1] != bucket:
+            return False
+        del self._entries[digest]
+        return True
+
+    def _expire(self, now: float):
+        """弹出整桶都已过期的桶"""
+        while self._buckets and (self._buckets[0][0] + 1) * self.bucket_width + self.ttl <= now:
+            bucket, digests = self._buckets.popleft()
+            for digest in digests:
+                if self._drop(bucket, digest):
+                    self.stats['expired'] += 1
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries and self._buckets:
+            bucket, digests = self._buckets[0]
+            if not digests:
+                self._buckets.popleft()
+                continue
+            if self._drop(bucket, digests.popleft()):
+                self.stats['evicted'] += 1
+
+    def _insert(self, digest: bytes, timestamp: float):
+        bucket = int(timestamp // self.bucket_width)
+        if self._buckets and self._buckets[-1][0] >= bucket:
+            # 时钟回拨时放入最新的桶（晚一点过期，保持桶的顺序）
+            bucket = self._buckets[-1][0]
+            self._buckets[-1][1].append(digest)
+        else:
+            self._buckets.append((bucket, deque([digest])))
+        self._entries[digest] = (timestamp, bucket)
+        self._evict()
+
+    def check(self, digest: bytes, now: float = None) -> Optional[float]:
+        """
+        检查消息是否在过期时间内处理过
+
+        Returns:
+            距离上次处理的秒数；没有处理过（或已过期）返回 None
+        """
+        now = time.time() if now is None else now
+        self._expire(now)
+        self.stats['checks'] += 1
+        entry = self._entries.get(digest)
+        if entry is None or now - entry[0] >= self.ttl:
+            return None
+        self.stats['hits'] += 1
+        return now - entry[0]
+
+    def add(self, digest: bytes, now: float = None):
+        """记录消息已处理（启用持久化时放入后台写入，不等待数据库）"""
+        now = time.time() if now is None else now
+        self._expire(now)
+        self._insert(digest, now)
+        self.stats['added'] += 1
+        if self.persist and self.db.is_connected:
+            self._pending.append((digest.hex(), datetime.fromtimestamp(now)))
+            # 顺带删除数据库中过期的记录（每个过期周期最多一次）
+            if now - self._last_purge >= self.ttl:
+                self._last_purge = now
+                self._pending_purge = datetime.fromtimestamp(now - self.ttl)
+            if self._write_task is None or self._write_task.done():
+                self._write_task = asyncio.create_task(self._write_pending())
+
+    async def _write_pending(self):
+        """后台写入：写入期间新增的记录在下一轮合并写入"""
+        while self._pending:
+            rows, self._pending = self._pending, []
+            expired_before, self._pending_purge = self._pending_purge, None
+            await self.db.save_processed_messages(rows, expired_before)
+            self.stats['writes'] += 1
+
+    async def flush(self):
+        """等待后台写入完成（停止时在关闭数据库之前调用）"""
+        if self._write_task is not None:
+            await self._write_task
+            self._write_task = None
+
+    async def load(self):
+        """从数据库加载未过期的记录（同时删除已过期的记录）"""
+        if not self.persist or not self.db.is_connected:
+            return
+        now = time.time()
+        try:
+            rows = await self.db.load_processed_messages(datetime.fromtimestamp(now - self.ttl))
+        except Exception as e:
+            logger.error(f"[消息去重] 加载去重记录失败: {e}")
+            return
+        self._last_purge = now
+        for row in rows:
+            self._insert(bytes.fromhex(row['digest']), row['processed_at'].timestamp())
+        self.stats['loaded'] += len(rows)
+        if rows:
+            logger.info(f"[消息去重] 已加载 {len(rows)} 条未过期的去重记录")
+
+    def memory_bytes(self) -> int:
+        """估算占用的内存（字典、桶和摘要对象）"""
+        size = sys.getsizeof(self._entries) + sys.getsizeof(self._buckets)
+        for _, digests in self._buckets:
+            size += sys.getsizeof(digests)
+        # 每条记录：摘要（bytes）、(时间戳, 桶编号) 元组和其中的 float / int
+        per_entry = sys.getsizeof(b'\0' * DIGEST_SIZE) + sys.getsizeof((0.0, 0)) + sys.getsizeof(0.0) + sys.getsizeof(2 ** 40)
+        size += len(self._entries) * per_entry
+        return size
+
+    def get_stats(self) -> dict:
+        checks = self.stats['checks']
+        return dict(
+            self.stats,
+            entries=len(self._entries),
+            buckets=len(self._buckets),
+            hit_rate=round(self.stats['hits'] / checks, 4) if checks else 0.0,
+            memory_kb=round(self.memory_bytes() / 1024, 1),
+        )
@@ -242,9 +242,9 @@ def create_document():
     db_data = [
         ('connect()', '连接 MySQL 数据库'),
         ('init_tables()', '初始化数据表'),
-        ('get_or_create_user()', '获取或创建用户'),
-        ('update_conversation_id()', '更新用户的 Coze 会话 ID'),
-        ('add_message()', '添加对话消息'),
+        ('get_or_create_user()', '按 user_id 获取或创建用户'),
+        ('get_conversation_id()', '获取用户最近的 Coze 会话 ID'),
+        ('save_replies()', '保存回复记录（对话历史、会话状态和用户统计）'),
         ('get_conversation_history()', '获取对话历史'),
     ]
 
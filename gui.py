@@ -16,7 +16,7 @@ sys.path.insert(0, str(Path(__file__).parent))
 from dotenv import load_dotenv, set_key
 from loguru import logger
 from logger_setup import set_gui_conversation_callback, rebind_console_output
-from config import DEFAULT_STATUS_MAPPING, DEFAULT_COZE_VARS, Config
+from config import DEFAULT_STATUS_MAPPING, DEFAULT_COZE_VARS, Config, CozeVars
 
 
 def _extract_status_mapping_values(value):
@@ -360,12 +360,12 @@ class XianyuGUI:
         row4 = ttk.Frame(settings_frame)
         row4.pack(fill="x", pady=8)
         ttk.Label(row4, text="会话切入延迟:", width=15).pack(side="left")
-        self.enter_delay_var = tk.StringVar(value="1.5")
-        enter_delay_spinbox = ttk.Spinbox(row4, from_=0.5, to=5.0, increment=0.5,
+        self.enter_delay_var = tk.StringVar(value="0")
+        enter_delay_spinbox = ttk.Spinbox(row4, from_=0, to=5.0, increment=0.5,
                                           textvariable=self.enter_delay_var, width=6)
         enter_delay_spinbox.pack(side="left")
         enter_delay_spinbox.bind("<FocusOut>", lambda e: self._auto_save_config())
-        ttk.Label(row4, text="秒 (进入会话后等待页面加载)").pack(side="left", padx=5)
+        ttk.Label(row4, text="秒 (最短等待时间，页面就绪后即继续)").pack(side="left", padx=5)
 
         # 系统提示词
         prompt_frame = ttk.LabelFrame(page, text="系统提示词 (prompt)", padding=15)
@@ -683,10 +683,9 @@ AI：已经是最低价了呢，质量绝对有保障。
             return
 
         try:
-            db_manager._ensure_connection()
-            with db_manager.connection.cursor() as cursor:
+            with db_manager.cursor('_clear_products_list') as cursor:
                 cursor.execute("DELETE FROM products")
-            db_manager.connection.commit()
+            db_manager.invalidate_products()
             self._refresh_products_list()
             messagebox.showinfo("成功", "已清空所有商品")
         except Exception as e:
@@ -857,7 +856,7 @@ AI：已经是最低价了呢，质量绝对有保障。
         """保存商品到数据库"""
         from db_manager import db_manager
 
-        if not db_manager.connection:
+        if not db_manager.is_connected:
             db_manager.connect()
 
         # 确保表结构是最新的（会自动添加缺失的列）
@@ -925,7 +924,7 @@ AI：已经是最低价了呢，质量绝对有保障。
         """刷新商品列表"""
         from db_manager import db_manager
 
-        if not db_manager.connection:
+        if not db_manager.is_connected:
             db_manager.connect()
 
         # 清空现有数据
@@ -980,7 +979,7 @@ AI：已经是最低价了呢，质量绝对有保障。
         """编辑商品对话框"""
         from db_manager import db_manager
 
-        if not db_manager.connection:
+        if not db_manager.is_connected:
             db_manager.connect()
 
         # 确保表结构是最新的
@@ -1218,7 +1217,7 @@ AI：已经是最低价了呢，质量绝对有保障。
         self.msg_expire_var.set(os.getenv("MSG_EXPIRE_SECONDS", "60"))
         self.inactive_enabled_var.set(os.getenv("INACTIVE_ENABLED", "true").lower() == "true")
         self.inactive_timeout_var.set(os.getenv("INACTIVE_TIMEOUT_MINUTES", "3"))
-        self.enter_delay_var.set(os.getenv("CONVERSATION_ENTER_DELAY", "1.5"))
+        self.enter_delay_var.set(os.getenv("CONVERSATION_ENTER_DELAY", "0"))
         self.db_host_var.set(os.getenv("DB_HOST", "localhost"))
         self.db_port_var.set(os.getenv("DB_PORT", "3306"))
         self.db_user_var.set(os.getenv("DB_USER", "root"))
@@ -1425,6 +1424,8 @@ AI：已经是最低价了呢，质量绝对有保障。
             }
             with open(self.vars_config_path, 'w', encoding='utf-8') as f:
                 json.dump(data, f, ensure_ascii=False, indent=2)
+            # 通知运行中的机器人重新加载变量配置
+            CozeVars.reload()
 
             return True
         except Exception as e:
@@ -1580,7 +1581,7 @@ AI：已经是最低价了呢，质量绝对有保障。
                 self.root.after(0, lambda: self._log(f"获取Coze会话列表失败: {e}"))
 
             # 2. 清空本地数据库
-            if not db_manager.connection:
+            if not db_manager.is_connected:
                 db_manager.connect()
             db_result = db_manager.clear_all_tables()
 
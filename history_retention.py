@@ -0,0 +1,185 @@
+"""
+对话历史归档 - 把超过保留天数的 conversation_history 移到按月压缩的归档文件
+
+每批只处理主键最小的 batch_size 行（最早的消息）：先追加写入归档文件并落盘，
+再在一个短事务中按主键删除这些行、累加 history_archive_summary 中的每用户计数，
+批次之间暂停，不会长时间锁住热表。
+
+归档文件: <HISTORY_ARCHIVE_DIR>/conversation_history-YYYY-MM.jsonl.gz，每行一条消息（JSON）。
+每批追加一个 gzip 成员，可直接用 gzip/zcat 读取；写入文件后、删除前进程中断时，
+下次会重复归档这几行，读取时按 id 去重（见 read_archive）。
+
+用法:
+    python history_retention.py --days 90
+    python history_retention.py --days 90 --dry-run
+    python history_retention.py --read archives/conversation_history-2025-01.jsonl.gz
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterator
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from config import Config
+from db_manager import DBManager, db_manager
+from logger_setup import logger
+
+
+class HistoryRetention:
+    """对话历史归档任务（同步执行，调用方放在线程中运行）"""
+
+    def __init__(self, db: DBManager = None, days: int = None, batch_size: int = None,
+                 pause: float = None, archive_dir: str = None):
+        self.db = db or db_manager
+        self.days = days if days is not None else Config.HISTORY_RETENTION_DAYS
+        self.batch_size = batch_size or Config.HISTORY_RETENTION_BATCH_SIZE
+        self.pause = pause if pause is not None else Config.HISTORY_RETENTION_PAUSE
+        self.archive_dir = Path(archive_dir or Config.HISTORY_ARCHIVE_DIR)
+        self._stop = threading.Event()
+        # 累计统计
+        self.runs = 0
+        self.archived = 0
+        self.batches = 0
+        self.last_run_at = None
+
+    def stop(self):
+        """请求停止（当前批次完成后退出）"""
+        self._stop.set()
+
+    def run_once(self, max_batches: int = None, dry_run: bool = False) -> dict:
+        """
+        归档所有早于保留期限的消息
+
+        Args:
+            max_batches: 最多处理的批次数（None 表示直到没有过期消息）
+            dry_run: 只统计不归档（只检查第一批）
+
+        Returns:
+            dict: {'archived': 行数, 'batches': 批次数, 'files': 写入的归档文件, 'elapsed': 秒}
+        """
+        self._stop.clear()
+        cutoff = datetime.now() - timedelta(days=self.days)
+        started_at = time.perf_counter()
+        result = {'archived': 0, 'batches': 0, 'files': set(), 'cutoff': cutoff}
+
+        while not self._stop.is_set():
+            if max_batches is not None and result['batches'] >= max_batches:
+                break
+            rows = self.db.get_oldest_history(self.batch_size)
+            # id 顺序即写入顺序，遇到第一条未过期的消息就停止
+            expired = []
+            for row in rows:
+                if row['created_at'] is None or row['created_at'] >= cutoff:
+                    break
+                expired.append(row)
+            if not expired:
+                break
+            if dry_run:
+                result['archived'] = len(expired)
+                break
+
+            result['files'].update(self._write_archive(expired))
+            deleted = self.db.delete_archived_history(expired)
+            result['archived'] += deleted
+            result['batches'] += 1
+            logger.debug(f"[历史归档] 第 {result['batches']} 批: {deleted} 条")
+
+            if len(expired) < len(rows) or len(rows) < self.batch_size:
+                break
+            self._stop.wait(self.pause)
+
+        result['elapsed'] = time.perf_counter() - started_at
+        result['files'] = sorted(str(f) for f in result['files'])
+        if not dry_run:
+            self.runs += 1
+            self.archived += result['archived']
+            self.batches += result['batches']
+            self.last_run_at = datetime.now()
+        if result['archived']:
+            logger.info(
+                f"[历史归档] {'待归档' if dry_run else '已归档'} {result['archived']} 条 {self.days} 天前的消息 "
+                f"({result['batches']} 批, {result['elapsed']:.1f}秒)"
+            )
+        return result
+
+    def _archive_path(self, created_at: datetime) -> Path:
+        return self.archive_dir / f"conversation_history-{created_at:%Y-%m}.jsonl.gz"
+
+    def _write_archive(self, rows: list) -> set:
+        """按月追加写入归档文件并落盘，返回写入的文件"""
+        by_month = {}
+        for row in rows:
+            by_month.setdefault(self._archive_path(row['created_at']), []).append(row)
+
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        for path, month_rows in by_month.items():
+            lines = "".join(
+                json.dumps(dict(row, created_at=row['created_at'].isoformat(sep=' ')), ensure_ascii=False) + "\n"
+                for row in month_rows
+            )
+            with open(path, "ab") as f:
+                f.write(gzip.compress(lines.encode("utf-8")))
+                f.flush()
+                os.fsync(f.fileno())
+        return set(by_month)
+
+    def get_stats(self) -> dict:
+        return {
+            'days': self.days,
+            'runs': self.runs,
+            'archived': self.archived,
+            'batches': self.batches,
+            'last_run_at': self.last_run_at.strftime("%Y-%m-%d %H:%M:%S") if self.last_run_at else None,
+        }
+
+
+def read_archive(path: str) -> Iterator[dict]:
+    """读取归档文件（按 id 去重）"""
+    seen = set()
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            row = json.loads(line)
+            if row['id'] in seen:
+                continue
+            seen.add(row['id'])
+            yield row
+
+
+def main():
+    parser = argparse.ArgumentParser(description="把过期的对话历史归档到按月压缩文件")
+    parser.add_argument("--days", type=int, default=Config.HISTORY_RETENTION_DAYS or 90, help="保留最近多少天的消息")
+    parser.add_argument("--batch-size", type=int, default=Config.HISTORY_RETENTION_BATCH_SIZE, help="每批行数")
+    parser.add_argument("--max-batches", type=int, default=None, help="最多处理批次数")
+    parser.add_argument("--dry-run", action="store_true", help="只统计第一批待归档的行数")
+    parser.add_argument("--read", metavar="FILE", help="打印归档文件内容")
+    args = parser.parse_args()
+
+    if args.read:
+        for row in read_archive(args.read):
+            print(f"[{row['created_at']}] {row['buyer_name']} ({row['role']}): {row['content']}")
+        return
+
+    if not db_manager.connect():
+        print("❌ 数据库连接失败")
+        return
+    try:
+        db_manager.init_tables()
+        retention = HistoryRetention(days=args.days, batch_size=args.batch_size)
+        result = retention.run_once(max_batches=args.max_batches, dry_run=args.dry_run)
+        action = "待归档" if args.dry_run else "已归档"
+        print(f"{action} {result['archived']} 条早于 {result['cutoff']:%Y-%m-%d %H:%M} 的消息")
+        for path in result['files']:
+            print(f"  {path}")
+    finally:
+        db_manager.close()
+
+
+if __name__ == "__main__":
+    main()
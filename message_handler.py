@@ -1,13 +1,26 @@
 """消息处理模块 - 监控和自动回复逻辑"""
 import asyncio
-from typing import Dict, Optional
+from contextlib import asynccontextmanager
+from datetime import datetime
+from contextvars import ContextVar
+from typing import Dict, Optional, Set
 from loguru import logger
 import time
 from xianyu_browser import XianyuBrowser
 from coze_client import CozeClient
 from logger_setup import log_conversation, log_system_message
 from config import Config, CozeVars
-from db_manager import db_manager
+from db_manager import db_manager, async_db
+from db_writer import ReplyRecord, WriteBehindQueue
+from history_retention import HistoryRetention
+from conversation_pipeline import ConversationPipeline
+from page_pool import PagePool
+from scheduler import ActionScheduler
+from conversation_locator import ConversationLocator, Fingerprint
+from dedupe_store import DedupeStore, message_digest
+
+# 当前协程租用的标签页（标签页池模式下由 _browser_session 设置）
+_tab_browser: ContextVar[Optional[XianyuBrowser]] = ContextVar('_tab_browser', default=None)
 
 
 async def build_memory_context(coze_client: CozeClient, user_id: str, current_item_id: str, current_message: str) -> Optional[dict]:
@@ -44,7 +57,7 @@ async def build_memory_context(coze_client: CozeClient, user_id: str, current_it
         return None
 
     # 获取用户的其他会话（有conversation_id的）
-    other_sessions = db_manager.get_user_other_sessions(user_id, current_item_id)
+    other_sessions = await async_db.get_user_other_sessions(user_id, current_item_id)
     if not other_sessions:
         logger.debug(f"[新会话回忆] 用户 {user_id} 没有其他会话")
         return None
@@ -107,17 +120,58 @@ async def build_memory_context(coze_client: CozeClient, user_id: str, current_it
     }
 
 
+class MergeWindow:
+    """
+    单个买家的消息合并窗口（截止时间对象，按 user_id 区分）
+
+    买家发送短消息时开启，窗口期内检测到的新消息会把截止时间顺延，
+    到期后才重新进入该买家的会话，把窗口期内的所有买家消息合并为一次回复。
+    会话列表项没有 user_id，新消息按列表项的昵称和头像归入窗口（昵称可以重复）。
+    """
+
+    def __init__(self, buyer_name: str, user_id: str, conversation: dict, wait_seconds: float):
+        self.buyer_name = buyer_name
+        self.user_id = user_id
+        self.conversation = conversation
+        self.fingerprint = Fingerprint.of(conversation)
+        self.wait_seconds = wait_seconds
+        self.opened_at = time.monotonic()
+        self.deadline = self.opened_at + wait_seconds
+        # 窗口期内检测到的新消息次数
+        self.extensions = 0
+
+    def extend(self, conversation: dict = None):
+        """检测到新消息，顺延截止时间"""
+        self.deadline = time.monotonic() + self.wait_seconds
+        self.extensions += 1
+        if conversation:
+            self.conversation = conversation
+            self.fingerprint = Fingerprint.of(conversation)
+
+    def matches(self, conversation: dict) -> bool:
+        """会话列表项是否属于本窗口的买家（昵称和头像都相同）"""
+        other = Fingerprint.of(conversation)
+        return (other.buyer_name, other.avatar) == (self.fingerprint.buyer_name, self.fingerprint.avatar)
+
+    def remaining(self) -> float:
+        return self.deadline - time.monotonic()
+
+
 class MessageHandler:
     """消息处理器"""
 
     def __init__(self):
-        self.browser = XianyuBrowser()
+        self._browser = XianyuBrowser()
         self.coze_client = CozeClient()
-        # 已处理的消息标识 -> 处理时间戳 (用于过期检测)
-        self.processed_messages: Dict[str, float] = {}
         # 从配置读取重复消息过滤设置
         self.skip_duplicate_msg = Config.SKIP_DUPLICATE_MSG
         self.message_expire_seconds = Config.MSG_EXPIRE_SECONDS
+        # 已处理的消息摘要（按时间分桶过期，可保存到数据库）
+        self.processed_messages = DedupeStore(
+            self.message_expire_seconds,
+            max_entries=Config.DEDUPE_MAX_ENTRIES,
+            persist=Config.DEDUPE_PERSIST,
+        )
         # Inactive 配置
         self.inactive_enabled = Config.INACTIVE_ENABLED
         self.inactive_timeout_minutes = Config.INACTIVE_TIMEOUT_MINUTES
@@ -128,21 +182,100 @@ class MessageHandler:
         self.is_paused = False
         # inactive 处理锁，避免与消息处理冲突
         self._inactive_lock = asyncio.Lock()
-        # 每个用户的 inactive 定时器
-        self._inactive_timers: Dict[str, asyncio.Task] = {}
+        # 浏览器页面锁（同一时刻只允许一个协程操作页面）
+        self._browser_lock = asyncio.Lock()
+        # ===== 流水线处理 =====
+        self.pipeline_enabled = Config.PIPELINE_ENABLED
+        self.pipeline: Optional[ConversationPipeline] = None
+        # ===== 标签页池 =====
+        self.page_pool_size = Config.PAGE_POOL_SIZE
+        self.page_pool: Optional[PagePool] = None
+        # 正在标签页中处理的买家（避免同一会话被重复分派）
+        self._active_buyers: Set[str] = set()
+        self._pool_tasks: Set[asyncio.Task] = set()
+        # ===== 数据库写入队列（回复记录后台批量写入） =====
+        self.db_writer: Optional[WriteBehindQueue] = None
+        # ===== 对话历史归档（定期在线程中执行） =====
+        self.history_retention: Optional[HistoryRetention] = None
+        self._retention_task: Optional[asyncio.Task] = None
+        self._retention_run: Optional[asyncio.Future] = None
+        # ===== 延时任务调度（inactive 定时器按 user_id、合并窗口按买家昵称） =====
+        self.scheduler = ActionScheduler()
+        self.scheduler.register('inactive', self._on_inactive_due)
+        self.scheduler.register('merge', self._on_merge_due)
+        # ===== 会话定位（user_id -> 会话列表项特征） =====
+        self.locator = ConversationLocator()
         # ===== 消息合并功能 =====
         # 消息合并配置
         self.merge_enabled = Config.MESSAGE_MERGE_ENABLED
         self.merge_wait_seconds = Config.MESSAGE_MERGE_WAIT_SECONDS
         self.merge_min_length = Config.MESSAGE_MERGE_MIN_LENGTH
-        # 消息合并队列: user_id -> {'messages': [], 'conversation': dict, 'data': dict}
-        self._merge_queues: Dict[str, dict] = {}
-        # 消息合并定时器: user_id -> asyncio.Task
-        self._merge_timers: Dict[str, asyncio.Task] = {}
-        # 消息合并锁
-        self._merge_lock = asyncio.Lock()
-        # 已入队消息跟踪: user_id -> set of message contents (用于增量入队，避免重复)
-        self._queued_messages: Dict[str, set] = {}
+        # 消息合并窗口: user_id -> MergeWindow（会话列表项按昵称和头像匹配窗口）
+        self._merge_windows: Dict[str, MergeWindow] = {}
+        # 合并窗口统计
+        self.merge_stats = {'opened': 0, 'extended': 0, 'closed': 0}
+
+    @property
+    def browser(self) -> XianyuBrowser:
+        """当前协程操作的浏览器页面（标签页池模式下为租用的标签页，否则为主页面）"""
+        return _tab_browser.get() or self._browser
+
+    @asynccontextmanager
+    async def _browser_session(self):
+        """
+        获取一个可独占操作的页面
+
+        标签页池模式下租用一个空闲标签页，期间 self.browser 指向该标签页；
+        否则持有主页面的浏览器锁。
+        """
+        if self.page_pool:
+            async with self.page_pool.lease() as tab:
+                token = _tab_browser.set(tab.browser)
+                try:
+                    yield tab.browser
+                finally:
+                    _tab_browser.reset(token)
+        else:
+            async with self._browser_lock:
+                yield self._browser
+
+    def _dispatch_to_tab(self, conversation: dict):
+        """标签页池模式：为会话创建独立任务，在租用的标签页中处理"""
+        buyer_name = conversation.get("buyer_name")
+        if buyer_name in self._active_buyers:
+            logger.debug(f"[标签页池] {buyer_name} 正在处理中，跳过")
+            return
+        self._active_buyers.add(buyer_name)
+
+        async def run():
+            try:
+                if self.pipeline:
+                    await self.pipeline.submit(conversation)
+                else:
+                    async with self._browser_session():
+                        await self._handle_conversation(conversation)
+            finally:
+                self._active_buyers.discard(buyer_name)
+
+        task = asyncio.create_task(run())
+        self._pool_tasks.add(task)
+        task.add_done_callback(self._pool_tasks.discard)
+
+    async def _process_conversation(self, conversation: dict):
+        """按当前模式处理一个有新消息的会话（合并窗口期内只顺延窗口）"""
+        if self._extend_merge_window(conversation):
+            return
+
+        if self.page_pool:
+            # 标签页池模式：每个会话在独立的标签页中并行处理
+            self._dispatch_to_tab(conversation)
+        elif self.pipeline:
+            # 流水线模式：抓取后入队，Coze 推理和发送由 worker 完成
+            await self.pipeline.submit(conversation)
+        else:
+            # 顺序模式：直接处理
+            async with self._browser_lock:
+                await self._handle_conversation(conversation)
 
     async def start(self):
         """启动消息处理器"""
@@ -166,13 +299,29 @@ class MessageHandler:
         else:
             logger.info("消息合并: 已关闭")
 
+        # 显示流水线配置
+        if self.pipeline_enabled:
+            logger.info(f"流水线处理: 已启用 (Coze并发: {Config.PIPELINE_COZE_WORKERS})")
+        else:
+            logger.info("流水线处理: 已关闭")
+
         # 连接数据库
         if db_manager.connect():
             db_manager.init_tables()
             logger.info("数据库连接成功，对话记忆功能已启用")
+            if Config.db_write_behind:
+                self.db_writer = WriteBehindQueue()
+                await self.db_writer.start()
+            if Config.HISTORY_RETENTION_DAYS > 0:
+                self.history_retention = HistoryRetention()
+                self._retention_task = asyncio.create_task(self._retention_loop())
+                logger.info(f"对话历史归档: 已启用 (保留 {Config.HISTORY_RETENTION_DAYS} 天)")
         else:
             logger.warning("数据库连接失败，将不保存对话历史")
 
+        # 创建 Coze 连接池
+        await self.coze_client.open()
+
         # 启动浏览器
         await self.browser.start()
 
@@ -187,19 +336,85 @@ class MessageHandler:
                 await self.stop()
                 return
 
+        # 启用未读会话推送（失败时自动使用轮询）
+        if Config.UNREAD_WATCH_ENABLED:
+            await self.browser.enable_unread_watch()
+
+        # 打开标签页池（主页面只负责会话列表）
+        if self.page_pool_size > 0:
+            self.page_pool = PagePool(self._browser, size=self.page_pool_size)
+            await self.page_pool.start()
+
         self.running = True
         logger.info("消息处理器已启动，开始监控新消息...")
 
+        # 启动流水线 worker
+        if self.pipeline_enabled:
+            self.pipeline = ConversationPipeline(self)
+            self.pipeline.start()
+
+        # 加载会话定位特征，启动延时任务调度（恢复上次运行未到期的 inactive 定时器）
+        await self.locator.load()
+        if self.skip_duplicate_msg:
+            await self.processed_messages.load()
+        await self.scheduler.start()
+        if self.inactive_enabled and db_manager.is_connected:
+            await self._recover_inactive_timers()
+
         # 启动消息监控循环
         await self._message_loop()
 
     async def stop(self):
         """停止消息处理器"""
         self.running = False
+        for task in list(self._pool_tasks):
+            task.cancel()
+        await self.scheduler.stop()
+        if self.pipeline:
+            await self.pipeline.stop()
+            self.pipeline = None
+        if self.page_pool:
+            await self.page_pool.close()
+            self.page_pool = None
         await self.browser.close()
+        await self.coze_client.close()
+        # 等待正在执行的归档批次结束，再关闭数据库
+        if self._retention_task:
+            self.history_retention.stop()
+            self._retention_task.cancel()
+            if self._retention_run and not self._retention_run.done():
+                await asyncio.wait([self._retention_run])
+            logger.info(f"对话历史归档统计: {self.history_retention.get_stats()}")
+            self._retention_task = None
+        # 先写完队列中的回复记录，再关闭数据库
+        if self.db_writer:
+            await self.db_writer.stop()
+            self.db_writer = None
+        logger.info(f"会话定位统计: {self.locator.get_stats()}")
+        if self.skip_duplicate_msg:
+            await self.processed_messages.flush()
+            logger.info(f"消息去重统计: {self.processed_messages.get_stats()}")
+        logger.info(f"数据库异步调用统计: {async_db.get_stats()}")
+        logger.info(f"数据库读缓存统计: {db_manager.get_cache_stats()}")
+        logger.info(f"变量配置缓存统计: {CozeVars.get_cache_stats()}")
+        async_db.shutdown()
         db_manager.close()
         logger.info("消息处理器已停止")
 
+    async def _retention_loop(self):
+        """定期归档过期的对话历史（在线程中分批执行，不占用数据库异步调用线程）"""
+        interval = Config.HISTORY_RETENTION_INTERVAL_HOURS * 3600
+        while True:
+            # shield: stop() 取消本任务时，线程中的当前批次仍会完成，stop() 等待它结束
+            self._retention_run = asyncio.ensure_future(asyncio.to_thread(self.history_retention.run_once))
+            try:
+                await asyncio.shield(self._retention_run)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[历史归档] 执行失败: {e}")
+            await asyncio.sleep(interval)
+
     async def _message_loop(self):
         """消息监控主循环"""
         while self.running:
@@ -211,7 +426,15 @@ class MessageHandler:
                     continue
 
                 # 获取未读会话
-                unread_conversations = await self.browser.get_unread_conversations()
+                if self.browser.push_enabled:
+                    # 推送模式：等待页面推送变化的会话（等待期间不持有浏览器锁），超时则全量轮询兜底
+                    unread_conversations = await self.browser.wait_for_unread_changes(
+                        Config.UNREAD_SAFETY_POLL_INTERVAL
+                    )
+                    if unread_conversations is None:
+                        unread_conversations = await self._read_unread_conversations()
+                else:
+                    unread_conversations = await self._read_unread_conversations()
 
                 for conv in unread_conversations:
                     if not self.running:
@@ -222,43 +445,43 @@ class MessageHandler:
                         logger.info("[暂停] 检测到暂停，停止处理当前批次")
                         break
 
-                    # 直接处理每个未读会话
-                    await self._handle_conversation(conv)
+                    await self._process_conversation(conv)
 
-                # 清理过期的已处理标记（仅在开启重复消息过滤时执行）
-                if self.skip_duplicate_msg:
-                    current_time = time.time()
-                    expired_keys = [
-                        key for key, timestamp in self.processed_messages.items()
-                        if current_time - timestamp > self.message_expire_seconds
-                    ]
-                    for key in expired_keys:
-                        del self.processed_messages[key]
+                if self.pipeline and unread_conversations:
+                    logger.info(f"[流水线] 状态: {self.pipeline.get_stats()}")
+                if self.page_pool and unread_conversations:
+                    logger.info(f"[标签页池] 状态: {self.page_pool.get_stats()}")
 
-                    if expired_keys:
-                        logger.debug(f"清理了 {len(expired_keys)} 条过期消息标记")
-
-                # 等待下一次检查
-                await asyncio.sleep(Config.XIANYU_CHECK_INTERVAL)
+                # 等待下一次检查（推送模式下由 wait_for_unread_changes 等待）
+                if not self.browser.push_enabled:
+                    await asyncio.sleep(Config.XIANYU_CHECK_INTERVAL)
 
             except Exception as e:
                 logger.error(f"消息循环出错: {e}")
                 await asyncio.sleep(5)
 
+    async def _read_unread_conversations(self) -> list:
+        """
+        读取主页面的未读会话列表
+
+        单页面模式下主页面同时被流水线、inactive 发送等协程使用（可能正停留在某个会话中），
+        读取时需要持有浏览器锁；标签页池模式下会话在各自的标签页中处理，主页面只用于检测。
+        """
+        if self.page_pool:
+            return await self._browser.get_unread_conversations()
+        async with self._browser_lock:
+            return await self._browser.get_unread_conversations()
+
     def _cancel_inactive_timer(self, user_id: str):
         """取消用户的 inactive 定时器"""
-        if user_id in self._inactive_timers:
-            self._inactive_timers[user_id].cancel()
-            del self._inactive_timers[user_id]
+        if self.scheduler.cancel('inactive', user_id):
             logger.debug(f"[Inactive] 取消定时器: user_id={user_id}")
 
     # ===== 消息合并相关方法 =====
 
     def _cancel_merge_timer(self, user_id: str):
         """取消用户的消息合并定时器"""
-        if user_id in self._merge_timers:
-            self._merge_timers[user_id].cancel()
-            del self._merge_timers[user_id]
+        if self.scheduler.cancel('merge', user_id):
             logger.debug(f"[消息合并] 取消定时器: user_id={user_id}")
 
     def _should_trigger_merge_wait(self, message: str) -> bool:
@@ -269,224 +492,108 @@ class MessageHandler:
         clean_msg = message.strip()
         return len(clean_msg) < self.merge_min_length
 
-    async def _add_to_merge_queue(self, user_id: str, message: str, conversation: dict, data: dict):
-        """将消息添加到合并队列，并启动/重置定时器"""
-        async with self._merge_lock:
-            if user_id not in self._merge_queues:
-                self._merge_queues[user_id] = {
-                    'messages': [],
-                    'conversation': conversation,
-                    'data': data,
-                }
-
-            # 添加消息到队列
-            self._merge_queues[user_id]['messages'].append(message)
-            # 更新最新的 conversation 和 data
-            self._merge_queues[user_id]['conversation'] = conversation
-            self._merge_queues[user_id]['data'] = data
-
-            logger.info(f"[消息合并] 用户 {data.get('buyer_name', user_id)} 消息入队: '{message}' (队列长度: {len(self._merge_queues[user_id]['messages'])})")
-
-            # 取消旧的定时器（如果有）
-            self._cancel_merge_timer(user_id)
-
-            # 创建新的定时任务
-            async def delayed_process():
-                await asyncio.sleep(self.merge_wait_seconds)
-                await self._on_merge_timeout(user_id)
-
-            task = asyncio.create_task(delayed_process())
-            self._merge_timers[user_id] = task
-            logger.debug(f"[消息合并] 设置定时器: user_id={user_id}, {self.merge_wait_seconds}秒后处理")
-
-    async def _on_merge_timeout(self, user_id: str):
-        """合并定时器触发：处理合并后的消息"""
-        try:
-            # 从定时器列表中移除
-            if user_id in self._merge_timers:
-                del self._merge_timers[user_id]
-
-            async with self._merge_lock:
-                if user_id not in self._merge_queues:
-                    return
-
-                queue_data = self._merge_queues.pop(user_id)
-                messages = queue_data['messages']
-                data = queue_data['data']
-
-                if not messages:
-                    return
-
-                # 合并所有消息
-                merged_message = ''.join(messages)
-                buyer_name = data.get('buyer_name', '未知')
-
-                logger.info(f"[消息合并] 用户 {buyer_name} 合并 {len(messages)} 条消息: {messages} -> '{merged_message}'")
-
-                # 清空已入队消息集合
-                if user_id in self._queued_messages:
-                    self._queued_messages[user_id].clear()
-
-            # 处理合并后的消息
-            await self._process_merged_message(data, merged_message)
-
-        except asyncio.CancelledError:
-            logger.debug(f"[消息合并] 定时器已取消: user_id={user_id}")
-        except Exception as e:
-            logger.error(f"[消息合并] 处理超时出错: {e}")
-
-    async def _flush_merge_queue(self, user_id: str, new_message: str) -> Optional[str]:
-        """立即刷新合并队列，返回合并后的完整消息（包含新消息）"""
-        async with self._merge_lock:
-            # 取消定时器
-            self._cancel_merge_timer(user_id)
-
-            if user_id not in self._merge_queues:
-                return new_message
-
-            queue_data = self._merge_queues.pop(user_id)
-            messages = queue_data['messages']
-
-            if not messages:
-                return new_message
-
-            # 合并所有排队消息 + 新消息
-            messages.append(new_message)
-            merged_message = ''.join(messages)
-
-            logger.info(f"[消息合并] 立即合并 {len(messages)} 条消息: '{merged_message}'")
-            return merged_message
-
-    async def _flush_merge_queue_incremental(self, user_id: str, new_messages: list) -> str:
-        """立即刷新合并队列（增量模式），返回合并后的完整消息"""
-        async with self._merge_lock:
-            # 取消定时器
-            self._cancel_merge_timer(user_id)
-
-            all_messages = []
-
-            # 获取队列中已有的消息
-            if user_id in self._merge_queues:
-                queue_data = self._merge_queues.pop(user_id)
-                all_messages = queue_data['messages']
-
-            # 添加新消息（去重）
-            existing_set = set(all_messages)
-            for msg in new_messages:
-                if msg not in existing_set:
-                    all_messages.append(msg)
-
-            if not all_messages:
-                return ''.join(new_messages) if new_messages else ""
-
-            merged_message = ''.join(all_messages)
-            logger.info(f"[消息合并] 增量合并 {len(all_messages)} 条消息: {all_messages} -> '{merged_message}'")
-            return merged_message
+    def _open_merge_window(self, conversation: dict, buyer_name: str, user_id: str):
+        """开启合并窗口，到期后再进入会话处理"""
+        self._cancel_merge_timer(user_id)
+        window = MergeWindow(buyer_name, user_id, conversation, self.merge_wait_seconds)
+        self._merge_windows[user_id] = window
+        # 合并窗口依赖当前页面状态，不持久化
+        self.scheduler.schedule('merge', user_id, self.merge_wait_seconds, persist=False)
+        self.merge_stats['opened'] += 1
+        logger.info(f"[消息合并] {buyer_name} 发送了短消息，等待 {self.merge_wait_seconds} 秒内的后续消息")
+
+    def _find_merge_window(self, conversation: dict) -> Optional[MergeWindow]:
+        """按 user_id（没有时按列表项的昵称和头像）查找会话所属的合并窗口"""
+        user_id = conversation.get('_user_id')
+        if user_id:
+            return self._merge_windows.get(user_id)
+        return next((window for window in self._merge_windows.values() if window.matches(conversation)), None)
+
+    def _extend_merge_window(self, conversation: dict, window: MergeWindow = None) -> bool:
+        """
+        会话在合并窗口期内又有新消息时顺延窗口（不进入会话）
 
-    async def _process_merged_message(self, data: dict, merged_message: str):
-        """处理合并后的消息（发送给 Coze 并回复）"""
+        Returns:
+            bool: 该买家是否处于合并窗口中
+        """
+        window = window or self._find_merge_window(conversation)
+        if not window:
+            return False
+        window.extend(conversation)
+        self.scheduler.schedule('merge', window.user_id, window.remaining(), persist=False)
+        self.merge_stats['extended'] += 1
+        logger.info(f"[消息合并] {window.buyer_name} 有新消息，窗口顺延 {self.merge_wait_seconds} 秒")
+        return True
+
+    async def _on_merge_due(self, user_id: str, payload: dict):
+        """合并窗口到期，重新进入会话（按 user_id 验证）一次性处理窗口期内的所有消息"""
+        window = self._merge_windows.get(user_id)
+        if not window:
+            return
+        if self.is_paused and self.running:
+            # 暂停期间保持窗口，稍后再检查
+            self.scheduler.schedule('merge', user_id, 1, persist=False)
+            return
         try:
-            buyer_name = data['buyer_name']
-            user_id = data['user_id']
-            item_id = data['item_id']
-            conversation_id = data['conversation_id']
-            custom_vars = data['custom_vars']
-
-            # 更新消息内容为合并后的
-            data['full_message'] = merged_message
-            data['last_buyer_message'] = merged_message
-
-            # 重复消息检查
-            msg_id = f"{buyer_name}:{merged_message}"
-            if self.skip_duplicate_msg and msg_id in self.processed_messages:
-                last_processed_time = self.processed_messages[msg_id]
-                time_since = time.time() - last_processed_time
-                if time_since < self.message_expire_seconds:
-                    logger.debug(f"[消息合并] 消息刚处理过 ({time_since:.0f}秒前)，跳过")
-                    return
-
-            # 调用 Coze 获取回复
-            reply, new_conv_id = await self.coze_client.chat(
-                user_message=merged_message,
-                user_id=buyer_name,
-                conversation_id=conversation_id,
-                custom_variables=custom_vars,
-            )
-
-            logger.info(f"[消息合并] AI回复: {reply}")
-
-            # 保存对话记录
-            if new_conv_id:
-                db_manager.update_conversation_id(buyer_name, new_conv_id)
-                db_manager.update_session_conversation_id(user_id, item_id, new_conv_id)
-            db_manager.add_message(buyer_name, "user", merged_message, new_conv_id)
-            db_manager.add_message(buyer_name, "assistant", reply, new_conv_id)
-
-            # 更新会话的最后消息时间
-            db_manager.update_session_message_time(user_id, item_id)
-
-            # 标记消息为已处理
-            if self.skip_duplicate_msg:
-                self.processed_messages[msg_id] = time.time()
-
-            # 进入会话发送回复
-            conversations = await self.browser.get_conversation_list()
-            for conv in conversations:
-                if conv.get('buyer_name') == buyer_name:
-                    if await self.browser.enter_conversation(conv):
-                        if await self.browser.send_message(reply):
-                            log_conversation(
-                                buyer_id=buyer_name,
-                                buyer_msg=merged_message,
-                                bot_reply=reply,
-                                product_info=data['product_info'].get("title", ""),
-                                order_status=data['order_status'],
-                                conversation_id=new_conv_id or conversation_id,
-                                user_msg_time=data.get('user_msg_time'),
-                            )
-                        else:
-                            logger.error(f"[消息合并] 发送回复失败: {buyer_name}")
-
-                        # 设置 inactive 定时器
-                        self._schedule_inactive_check(user_id, buyer_name, new_conv_id or conversation_id)
-
-                        await self.browser.go_back_to_list()
-                    break
-
+            self._merge_windows.pop(user_id, None)
+            self.merge_stats['closed'] += 1
+            waited = time.monotonic() - window.opened_at
+            logger.info(f"[消息合并] {window.buyer_name} 窗口结束 (等待 {waited:.1f} 秒, 新消息 {window.extensions} 次)，进入会话处理")
+
+            if self.running:
+                # 读取不到 user_id 时窗口按昵称的替代标识记录，只能按列表项特征重新定位
+                user_id = None if window.user_id == f"name_{window.buyer_name}" else window.user_id
+                await self._process_conversation(dict(window.conversation, _merge_closed=True, _user_id=user_id))
+        except asyncio.CancelledError:
+            logger.debug(f"[消息合并] 窗口已取消: {window.buyer_name}")
         except Exception as e:
-            logger.error(f"[消息合并] 处理消息出错: {e}")
+            logger.error(f"[消息合并] 处理合并窗口出错: {e}")
 
-    def _schedule_inactive_check(self, user_id: str, buyer_name: str, conversation_id: str):
-        """为用户设置 inactive 定时检查（3分钟后触发）"""
+    def _schedule_inactive_check(self, user_id: str, buyer_name: str, conversation_id: str, delay: float = None):
+        """为用户设置 inactive 定时检查（默认 INACTIVE_TIMEOUT_MINUTES 后触发，替换旧的定时器）"""
         if not self.inactive_enabled:
             return
+        if delay is None:
+            delay = self.inactive_timeout_minutes * 60
+        self.scheduler.schedule('inactive', user_id, delay, {
+            'buyer_name': buyer_name,
+            'conversation_id': conversation_id,
+        })
+        logger.debug(f"[Inactive] 设置定时器: user_id={user_id}, {delay / 60:.1f}分钟后检查")
 
-        # 取消旧的定时器（如果有）
-        self._cancel_inactive_timer(user_id)
-
-        # 创建新的定时任务
-        async def delayed_check():
-            await asyncio.sleep(self.inactive_timeout_minutes * 60)
-            await self._on_inactive_timeout(user_id, buyer_name, conversation_id)
+    async def _recover_inactive_timers(self):
+        """
+        补设最近错过的 inactive 定时器（升级前或定时任务未写入数据库时停止的会话）
 
-        task = asyncio.create_task(delayed_check())
-        self._inactive_timers[user_id] = task
-        logger.debug(f"[Inactive] 设置定时器: user_id={user_id}, {self.inactive_timeout_minutes}分钟后检查")
+        只处理最后消息在两个超时周期内的会话，更早的会话不再主动跟进。
+        """
+        timeout = self.inactive_timeout_minutes * 60
+        recovered = 0
+        for candidate in await async_db.get_inactive_candidates(self.inactive_timeout_minutes):
+            user_id = candidate['user_id']
+            elapsed = (datetime.now() - candidate['last_time']).total_seconds()
+            if elapsed > timeout * 2 or self.scheduler.is_scheduled('inactive', user_id):
+                continue
+            conversation_ids = (candidate.get('conversation_ids') or '').split(',')
+            self._schedule_inactive_check(user_id, candidate.get('buyer_name') or '', conversation_ids[0], delay=0)
+            recovered += 1
+        if recovered:
+            logger.info(f"[Inactive] 补设 {recovered} 个错过的定时器")
+
+    async def _on_inactive_due(self, user_id: str, payload: dict):
+        """调度器回调：inactive 定时器到期"""
+        await self._on_inactive_timeout(user_id, payload.get('buyer_name', ''), payload.get('conversation_id', ''))
 
     async def _on_inactive_timeout(self, user_id: str, buyer_name: str, conversation_id: str):
         """定时器触发：检查并发送 inactive 消息"""
         try:
-            # 从定时器列表中移除
-            if user_id in self._inactive_timers:
-                del self._inactive_timers[user_id]
-
             # 检查是否已发送过 inactive
-            if db_manager.is_inactive_sent(user_id):
+            if await async_db.is_inactive_sent(user_id):
                 logger.debug(f"[Inactive] 用户 {user_id} 已发送过 inactive，跳过")
                 return
 
             # 检查订单状态（排除已付款用户）
-            sessions = db_manager.get_user_sessions(user_id)
+            sessions = await async_db.get_user_sessions(user_id)
             for session in sessions:
                 order_status = session.get('order_status', '')
                 if order_status in ['paid', '已付款', '待发货', '已发货', '交易成功']:
@@ -524,7 +631,7 @@ class MessageHandler:
                 await self._send_inactive_message_to_user(user_id, buyer_name, reply, conversation_id)
 
             # 标记该用户已发送过 inactive
-            db_manager.set_inactive_sent(user_id, True)
+            await async_db.set_inactive_sent(user_id, True)
 
         except asyncio.CancelledError:
             # 定时器被取消（用户有新消息了）
@@ -533,53 +640,15 @@ class MessageHandler:
             logger.error(f"[Inactive] 处理超时出错: {e}")
 
     async def _send_inactive_message_to_user(self, user_id: str, buyer_name: str, message: str, conversation_id: str = ""):
-        """发送 inactive 消息给用户（需要进入对应会话）"""
-        async with self._inactive_lock:
+        """发送 inactive 消息给用户（需要进入对应会话，按 user_id 定位）"""
+        async with self._inactive_lock, self._browser_session():
             try:
-                # 获取会话列表
-                conversations = await self.browser.get_conversation_list()
-
-                # 优先通过 buyer_name 快速定位（效率更高）
-                target_conv = None
-                for conv in conversations:
-                    if conv.get('buyer_name') == buyer_name:
-                        target_conv = conv
-                        break
-
-                found = False
-
-                # 1. 先尝试通过 buyer_name 匹配的会话
-                if target_conv:
-                    if await self.browser.enter_conversation(target_conv):
-                        conv_user_id = await self.browser.get_user_id()
-                        if conv_user_id == user_id:
-                            # buyer_name 和 user_id 都匹配，直接发送
-                            found = True
-                            await self._do_send_inactive_message(user_id, buyer_name, message)
-                        await self.browser.go_back_to_list()
-
-                # 2. 如果 buyer_name 没找到或 user_id 不匹配，再遍历查找
-                if not found:
-                    for conv in conversations:
-                        # 跳过已经尝试过的
-                        if conv == target_conv:
-                            continue
-
-                        if not await self.browser.enter_conversation(conv):
-                            continue
-
-                        conv_user_id = await self.browser.get_user_id()
-                        if conv_user_id == user_id:
-                            found = True
-                            actual_buyer_name = conv.get('buyer_name', buyer_name)
-                            await self._do_send_inactive_message(user_id, actual_buyer_name, message)
-                            await self.browser.go_back_to_list()
-                            break
-
-                        await self.browser.go_back_to_list()
-                        await asyncio.sleep(0.3)
-
-                if not found:
+                target_conv = await self.browser.find_conversation(user_id, self.locator, buyer_name)
+                if target_conv is not None:
+                    actual_buyer_name = target_conv.get('buyer_name') or buyer_name
+                    await self._do_send_inactive_message(user_id, actual_buyer_name, message)
+                    await self.browser.go_back_to_list()
+                else:
                     logger.warning(f"[Inactive] 未找到 user_id={user_id} 的会话")
 
             except Exception as e:
@@ -597,7 +666,7 @@ class MessageHandler:
                 buyer_id=buyer_name,
                 message=message,
             )
-            db_manager.update_session_buyer_name(user_id, buyer_name)
+            await async_db.update_session_buyer_name(user_id, buyer_name)
         else:
             logger.error(f"[Inactive] 发送消息失败: {buyer_name}")
 
@@ -609,48 +678,72 @@ class MessageHandler:
             dict: 包含所有准备好的数据，或 None 如果应该跳过这个会话
         """
         import datetime
-        # 记录用户消息的接收时间（用于日志显示）
-        user_msg_time = datetime.datetime.now().strftime("%H:%M:%S")
+        # 记录用户消息的接收时间（用于日志显示和回复耗时统计）
+        received_at = datetime.datetime.now()
+        user_msg_time = received_at.strftime("%H:%M:%S")
 
         buyer_name = conversation.get("buyer_name", "未知买家")
         conv_order_status = conversation.get("order_status", "")
         logger.info(f"处理会话: {buyer_name} (订单状态: {conv_order_status or '未知'})")
 
-        # 进入会话
-        if not await self.browser.enter_conversation(conversation):
-            logger.error(f"无法进入会话: {buyer_name}")
-            return None
-
-        # 获取商品信息
-        product_info = await self.browser.get_product_info()
+        # 标签页中的会话列表顺序可能与主页面不同，合并窗口到期时列表也可能已变化：
+        # 已知 user_id 时按 user_id 进入并验证（昵称可能重复），否则按列表项的昵称、头像和缩略图重新定位
+        expected_user_id = conversation.get('_user_id')
+        if expected_user_id:
+            found = await self.browser.find_conversation(expected_user_id, self.locator, buyer_name)
+            if found is None:
+                logger.error(f"未找到 user_id={expected_user_id} 的会话: {buyer_name}")
+                return None
+            # 保留合并窗口标记
+            conversation = dict(found, _merge_closed=conversation.get('_merge_closed'), _user_id=expected_user_id)
+        else:
+            if _tab_browser.get() is not None or conversation.get('_merge_closed'):
+                conversations = await self.browser.get_conversation_list()
+                found = self.locator.locate(conversations, None, conversation)
+                if found:
+                    conversation = dict(found, _merge_closed=conversation.get('_merge_closed'))
+
+            # 进入会话
+            if not await self.browser.enter_conversation(conversation):
+                logger.error(f"无法进入会话: {buyer_name}")
+                return None
+
+        # 一次页面调用获取商品信息、用户ID、商品ID和消息历史
+        # （WebSocket 记录的标识按昵称索引，昵称可能重复，只在页面读取不到时使用）
+        ws_hint = self.browser.pop_ws_hint(buyer_name)
+        snapshot = await self.browser.get_conversation_snapshot()
+        product_info = snapshot['product']
         order_status = product_info.get("order_status") or conv_order_status
 
-        # 获取用户唯一ID和商品ID
-        user_id = await self.browser.get_user_id()
-        item_id = await self.browser.get_item_id()
-        logger.debug(f"获取到 user_id={user_id}, item_id={item_id}")
+        if expected_user_id and snapshot['user_id'] and snapshot['user_id'] != expected_user_id:
+            logger.warning(f"进入的会话用户ID {snapshot['user_id']} 与预期 {expected_user_id} 不一致，跳过: {buyer_name}")
+            await self.browser.go_back_to_list()
+            return None
+
+        user_id = snapshot['user_id'] or ws_hint.get('user_id')
+        item_id = snapshot['item_id'] or ws_hint.get('item_id')
+        if snapshot['user_id'] and ws_hint.get('user_id') and ws_hint['user_id'] != snapshot['user_id']:
+            logger.warning(f"[WS] {buyer_name} 的 WebSocket 用户ID {ws_hint['user_id']} 与页面不一致，使用页面用户ID {snapshot['user_id']}")
+        logger.debug(f"获取到 user_id={user_id}, item_id={item_id} (页面等待 {snapshot['waited_ms']:.0f}ms)")
 
         # 如果无法获取 user_id，使用 buyer_name 作为替代
         if not user_id:
             logger.warning(f"无法获取用户ID，使用买家昵称: {buyer_name}")
             user_id = f"name_{buyer_name}"
+        else:
+            # 记录该用户的会话列表项特征，之后主动发消息时可直接定位
+            await self.locator.learn(user_id, conversation)
 
         # 如果无法获取 item_id，使用 'unknown' 作为替代
         if not item_id:
             logger.debug("无法获取商品ID（可能是已完成交易），使用 unknown")
             item_id = "unknown"
 
-        # 从数据库获取商品信息并组装格式化字符串
+        # 从数据库获取格式化的商品信息（已缓存时不访问数据库）
         if item_id and item_id != "unknown":
-            db_product = db_manager.get_product(item_id)
-            if db_product:
-                # 组装格式化的商品信息
-                formatted_info = "[当前会话-商品信息]\n"
-                formatted_info += f"标题：{db_product.get('title', '')}\n"
-                formatted_info += f"价格：{db_product.get('price', '')}\n"
-                if db_product.get('notes'):
-                    formatted_info += f"备注：{db_product.get('notes')}"
-                product_info["notes"] = formatted_info
+            product_block = await async_db.get_product_block(item_id)
+            if product_block:
+                product_info["notes"] = product_block
                 logger.debug(f"获取到商品信息: {item_id}")
 
         # 构建自定义变量
@@ -660,8 +753,8 @@ class MessageHandler:
             order_status=order_status
         )
 
-        # 获取消息历史
-        messages = await self.browser.get_current_conversation_messages()
+        # 消息历史
+        messages = snapshot['messages']
         if not messages:
             logger.warning(f"未获取到消息: {buyer_name}")
             await self.browser.go_back_to_list()
@@ -695,6 +788,21 @@ class MessageHandler:
             await self.browser.go_back_to_list()
             return None
 
+        # 该用户已有合并窗口（列表项的昵称或头像变化，未能在进入前匹配）：顺延窗口，到期后统一回复
+        window = self._merge_windows.get(user_id)
+        if self.merge_enabled and window and not conversation.get('_merge_closed'):
+            self._extend_merge_window(conversation, window)
+            await self.browser.go_back_to_list()
+            return None
+
+        # 短消息：开启合并窗口并释放页面，窗口到期后再进入会话统一回复
+        if (self.merge_enabled and last_buyer_message and not conversation.get('_merge_closed')
+                and self._should_trigger_merge_wait(last_buyer_message)):
+            self._cancel_inactive_timer(user_id)
+            self._open_merge_window(conversation, buyer_name, user_id)
+            await self.browser.go_back_to_list()
+            return None
+
         # 构建完整消息（包含图片URL）
         full_message = last_buyer_message or ""
         if last_buyer_images:
@@ -711,12 +819,13 @@ class MessageHandler:
             logger.info(f"买家发送图片: {last_buyer_images}")
 
         # ===== 新的会话管理系统 =====
-        # 使用 user_id + item_id 来管理会话
-        session = db_manager.get_or_create_session(
+        # 使用 user_id + item_id 来管理会话（用户发了新消息，同一事务中重置 inactive 状态）
+        session = await async_db.get_or_create_session(
             user_id=user_id,
             item_id=item_id,
             buyer_name=buyer_name,
-            order_status=order_status
+            order_status=order_status,
+            reset_inactive=True,
         )
 
         if session:
@@ -724,8 +833,7 @@ class MessageHandler:
             conversation_id = session.get('conversation_id')
             logger.info(f"[会话] 用户类型: {customer_type}, conversation_id: {conversation_id}")
 
-            # 用户发了新消息，重置 inactive 状态并取消定时器
-            db_manager.reset_user_inactive_status(user_id)
+            # 取消 inactive 定时器
             self._cancel_inactive_timer(user_id)
         else:
             conversation_id = None
@@ -738,7 +846,7 @@ class MessageHandler:
             logger.info(f"[会话] 为用户 {buyer_name} 创建新的 Coze 会话...")
             conversation_id = await self.coze_client.create_conversation(buyer_name)
             if conversation_id:
-                db_manager.update_session_conversation_id(user_id, item_id, conversation_id)
+                await async_db.update_session_conversation_id(user_id, item_id, conversation_id)
                 logger.info(f"[会话] 新会话已创建: {conversation_id}")
 
             # 如果是回头客的新会话，获取历史上下文
@@ -756,9 +864,6 @@ class MessageHandler:
         # 添加客户类型到自定义变量
         custom_vars['customer_type'] = customer_type
 
-        # 同时保持旧的 users 表兼容
-        db_manager.update_conversation_id(buyer_name, conversation_id)
-
         return {
             'buyer_name': buyer_name,
             'user_id': user_id,
@@ -766,7 +871,7 @@ class MessageHandler:
             'product_info': product_info,
             'order_status': order_status,
             'custom_vars': custom_vars,
-            'buyer_messages': buyer_messages,  # 原始消息列表（用于增量入队）
+            'buyer_messages': buyer_messages,  # 原始消息列表
             'last_buyer_message': last_buyer_message,  # 合并后的消息（用于非合并模式）
             'last_buyer_images': last_buyer_images,
             'full_message': full_message,
@@ -774,130 +879,111 @@ class MessageHandler:
             'customer_type': customer_type,
             'memory_prefix': memory_prefix,  # 历史上下文前缀（如有）
             'user_msg_time': user_msg_time,  # 用户消息接收时间
+            'received_at': received_at,
         }
 
-    async def _handle_conversation(self, conversation: dict):
-        """处理单个会话（自动模式）"""
-        try:
-            # 准备数据
-            data = await self._prepare_conversation(conversation)
-            if not data:
-                return
+    async def _collect_conversation(self, conversation: dict) -> Optional[dict]:
+        """
+        浏览器阶段：进入会话并抓取消息（短消息会开启合并窗口，窗口到期后再次调用）
 
-            buyer_name = data['buyer_name']
-            user_id = data['user_id']
-            item_id = data['item_id']
-            full_message = data['full_message']
-            last_buyer_message = data['last_buyer_message'] or ""
-            buyer_messages = data.get('buyer_messages', [])  # 原始消息列表
-            memory_prefix = data.get('memory_prefix')  # 历史上下文前缀（如有）
-
-            # ===== 消息合并逻辑（新版：在会话中等待）=====
-            if self.merge_enabled and last_buyer_message:
-                # 检查当前消息是否是短消息
-                if self._should_trigger_merge_wait(last_buyer_message):
-                    total_seconds = int(self.merge_wait_seconds)
-                    logger.info(f"[消息合并] 检测到短消息，开始等待 {total_seconds} 秒...")
-
-                    # 简单计数器倒计时（避免time.time()受get_messages耗时影响）
-                    remaining = total_seconds
-                    last_message_count = len(buyer_messages)
-
-                    while remaining > 0:
-                        logger.info(f"[消息合并] 倒计时: {remaining}")
-                        await asyncio.sleep(1)
-                        remaining -= 1
-
-                        # 重新获取消息检测是否有新消息
-                        messages = await self.browser.get_current_conversation_messages()
-                        if not messages:
-                            continue
-
-                        # 重新提取买家消息（找最后一条卖家消息之后的所有买家消息）
-                        new_buyer_messages = []
-                        last_seller_idx = -1
-                        for i, msg in enumerate(messages):
-                            if msg.sender == "seller" and not msg.is_system:
-                                last_seller_idx = i
-                        for i, msg in enumerate(messages):
-                            if i > last_seller_idx and msg.sender == "buyer" and not msg.is_system:
-                                if msg.content:
-                                    new_buyer_messages.append(msg.content)
-
-                        current_count = len(new_buyer_messages)
-
-                        if current_count > last_message_count:
-                            # 有新消息，重置倒计时
-                            new_msgs = new_buyer_messages[last_message_count:]
-                            logger.info(f"[消息合并] 检测到新消息: {new_msgs}，重置倒计时")
-                            remaining = total_seconds
-                            last_message_count = current_count
-                            buyer_messages = new_buyer_messages
-
-                    # 等待结束，合并所有消息
-                    merged_message = ''.join(buyer_messages)
-                    logger.info(f"[消息合并] 等待结束，合并 {len(buyer_messages)} 条消息: {merged_message}")
-
-                    # 如果有历史上下文前缀，拼接到合并后的消息前面
-                    if memory_prefix:
-                        full_message = memory_prefix + merged_message
-                        logger.info(f"[消息合并] 已拼接历史上下文前缀")
-                    else:
-                        full_message = merged_message
-
-                    data['full_message'] = full_message
-                    data['last_buyer_message'] = merged_message  # 保持原始消息用于日志显示
-
-            # 重复消息检查（仅自动模式）
-            msg_id = f"{buyer_name}:{full_message}"
-            if self.skip_duplicate_msg and msg_id in self.processed_messages:
-                last_processed_time = self.processed_messages[msg_id]
-                time_since = time.time() - last_processed_time
-                if time_since < self.message_expire_seconds:
-                    logger.debug(f"消息刚处理过 ({time_since:.0f}秒前)，跳过")
-                    await self.browser.go_back_to_list()
-                    return
+        Returns:
+            dict: 待回复的会话数据（此时仍停留在该会话中），或 None 如果无需回复
+        """
+        # 准备数据
+        data = await self._prepare_conversation(conversation)
+        if not data:
+            return None
 
-            # 调用 Coze 获取回复
-            reply, new_conv_id = await self.coze_client.chat(
-                user_message=full_message,
-                user_id=buyer_name,
-                conversation_id=data['conversation_id'],
-                custom_variables=data['custom_vars'],
-            )
+        buyer_name = data['buyer_name']
 
-            logger.info(f"AI回复: {reply}")
+        # 重复消息检查（仅自动模式）：按 user_id 和买家消息原文（不含历史上下文前缀）的摘要判断
+        msg_id = message_digest(data['user_id'], data['last_buyer_message'], data['last_buyer_images'])
+        if self.skip_duplicate_msg:
+            time_since = self.processed_messages.check(msg_id)
+            if time_since is not None:
+                logger.debug(f"消息刚处理过 ({time_since:.0f}秒前)，跳过: {buyer_name}")
+                await self.browser.go_back_to_list()
+                return None
 
-            # 保存对话记录（同时更新新旧两套系统）
-            if new_conv_id:
-                db_manager.update_conversation_id(buyer_name, new_conv_id)
-                db_manager.update_session_conversation_id(user_id, item_id, new_conv_id)
-            db_manager.add_message(buyer_name, "user", full_message, new_conv_id)
-            db_manager.add_message(buyer_name, "assistant", reply, new_conv_id)
+        data['msg_id'] = msg_id
+        return data
 
-            # 更新会话的最后消息时间
-            db_manager.update_session_message_time(user_id, item_id)
+    async def _generate_reply(self, data: dict) -> tuple:
+        """
+        Coze 阶段：获取 AI 回复（对话记录在发送成功后才保存）
 
-            # 标记消息为已处理
-            if self.skip_duplicate_msg:
-                self.processed_messages[msg_id] = time.time()
+        Returns:
+            tuple: (回复内容, 新的 conversation_id)
+        """
+        # 调用 Coze 获取回复
+        reply, new_conv_id = await self.coze_client.chat(
+            user_message=data['full_message'],
+            user_id=data['buyer_name'],
+            conversation_id=data['conversation_id'],
+            custom_variables=data['custom_vars'],
+        )
 
-            # 发送回复
-            if await self.browser.send_message(reply):
-                log_conversation(
-                    buyer_id=buyer_name,
-                    buyer_msg=data['last_buyer_message'],
-                    bot_reply=reply,
-                    product_info=data['product_info'].get("title", ""),
-                    order_status=data['order_status'],
-                    conversation_id=new_conv_id or data['conversation_id'],
-                    user_msg_time=data.get('user_msg_time'),
-                )
-            else:
-                logger.error(f"发送回复失败: {buyer_name}")
+        logger.info(f"AI回复: {reply}")
+        return reply, new_conv_id
+
+    async def _save_reply(self, record: ReplyRecord) -> asyncio.Future:
+        """
+        保存一次回复的对话记录和会话状态
+
+        启用写入队列时立即返回写入确认（Future），由队列按批写入；
+        否则直接写入，返回已完成的 Future。
+        """
+        if self.db_writer:
+            return self.db_writer.submit(record)
+        ack = asyncio.get_running_loop().create_future()
+        ack.set_result((await async_db.save_replies([record]))[0] if db_manager.is_connected else False)
+        return ack
+
+    async def _mark_replied(self, data: dict, reply: str, new_conv_id: Optional[str]):
+        """回复发送成功后保存对话记录（写入队列后台提交，不等待数据库）并标记消息为已处理"""
+        await self._save_reply(ReplyRecord(
+            buyer_name=data['buyer_name'],
+            user_id=data['user_id'],
+            item_id=data['item_id'],
+            user_message=data['full_message'],
+            reply=reply,
+            conversation_id=new_conv_id or data['conversation_id'],
+            received_at=data['received_at'],
+        ))
+        if self.skip_duplicate_msg and data.get('msg_id'):
+            self.processed_messages.add(data['msg_id'])
+
+    async def _deliver_reply(self, data: dict, reply: str, new_conv_id: Optional[str]):
+        """发送阶段：在当前会话中发送回复，并设置 inactive 定时器"""
+        buyer_name = data['buyer_name']
+
+        # 发送回复
+        if await self.browser.send_message(reply):
+            log_conversation(
+                buyer_id=buyer_name,
+                buyer_msg=data['last_buyer_message'],
+                bot_reply=reply,
+                product_info=data['product_info'].get("title", ""),
+                order_status=data['order_status'],
+                conversation_id=new_conv_id or data['conversation_id'],
+                user_msg_time=data.get('user_msg_time'),
+            )
+            await self._mark_replied(data, reply, new_conv_id)
+        else:
+            logger.error(f"发送回复失败: {buyer_name}")
 
-            # 设置 inactive 定时器（3分钟后检查用户是否回复）
-            self._schedule_inactive_check(user_id, buyer_name, new_conv_id or data['conversation_id'])
+        # 设置 inactive 定时器（3分钟后检查用户是否回复）
+        self._schedule_inactive_check(data['user_id'], buyer_name, new_conv_id or data['conversation_id'])
+
+    async def _handle_conversation(self, conversation: dict):
+        """处理单个会话（自动模式，顺序执行：抓取 -> Coze -> 发送）"""
+        try:
+            data = await self._collect_conversation(conversation)
+            if not data:
+                return
+
+            reply, new_conv_id = await self._generate_reply(data)
+            await self._deliver_reply(data, reply, new_conv_id)
 
             await self.browser.go_back_to_list()
 
@@ -909,6 +995,13 @@ class MessageHandler:
 class ManualMessageHandler(MessageHandler):
     """手动模式消息处理器 - 需要人工确认才发送"""
 
+    def __init__(self):
+        super().__init__()
+        # 手动确认需要逐个会话交互，不使用流水线、标签页池和消息合并窗口
+        self.pipeline_enabled = False
+        self.merge_enabled = False
+        self.page_pool_size = 0
+
     async def _handle_conversation(self, conversation: dict):
         """处理单个会话（手动确认模式）"""
         try:
@@ -918,8 +1011,6 @@ class ManualMessageHandler(MessageHandler):
                 return
 
             buyer_name = data['buyer_name']
-            user_id = data['user_id']
-            item_id = data['item_id']
             full_message = data['full_message']
 
             # 调用 Coze 获取回复
@@ -953,16 +1044,6 @@ class ManualMessageHandler(MessageHandler):
             else:
                 final_reply = confirm
 
-            # 保存对话记录（同时更新新旧两套系统）
-            if new_conv_id:
-                db_manager.update_conversation_id(buyer_name, new_conv_id)
-                db_manager.update_session_conversation_id(user_id, item_id, new_conv_id)
-            db_manager.add_message(buyer_name, "user", full_message, new_conv_id)
-            db_manager.add_message(buyer_name, "assistant", final_reply, new_conv_id)
-
-            # 更新会话的最后消息时间
-            db_manager.update_session_message_time(user_id, item_id)
-
             # 发送回复
             if await self.browser.send_message(final_reply):
                 log_conversation(
@@ -974,6 +1055,7 @@ class ManualMessageHandler(MessageHandler):
                     conversation_id=new_conv_id or data.get('conversation_id', ''),
                     user_msg_time=data.get('user_msg_time'),
                 )
+                await self._mark_replied(data, final_reply, new_conv_id)
             else:
                 logger.error(f"发送回复失败: {buyer_name}")
 
@@ -0,0 +1,162 @@
+"""标签页池模块 - 在同一个持久化上下文中打开多个消息页标签，不同买家的会话并行处理"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import List
+from loguru import logger
+from config import Config
+from xianyu_browser import XianyuBrowser
+
+
+class PooledTab:
+    """池中的单个标签页"""
+
+    def __init__(self, index: int, browser: XianyuBrowser):
+        self.index = index
+        # 操作该标签页的浏览器视图（与主浏览器共享上下文）
+        self.browser = browser
+        # 标签页锁（租用期间持有）
+        self.lock = asyncio.Lock()
+        self.uses = 0
+        self.last_checked = time.monotonic()
+        # 上次租用期间出错，下次租用前必须做健康检查
+        self.suspect = False
+
+    @property
+    def page(self):
+        return self.browser.page
+
+
+class PagePool:
+    """
+    标签页池
+
+    在主浏览器的 launch_persistent_context 中额外打开 N 个消息页标签（共享登录状态），
+    每个会话租用一个空闲标签页，租用期间标签页加锁，抓取、合并等待和发送都在该标签页中完成，
+    不同买家的会话因此可以并行处理。主页面只负责会话列表轮询和未读推送。
+
+    标签页在租用前做健康检查（页面已关闭、脚本无响应、会话列表消失时重建），
+    使用次数达到上限后也会重建，避免长时间运行的页面内存增长。
+    """
+
+    def __init__(self, browser: XianyuBrowser, size: int = None, max_uses: int = None,
+                 health_interval: float = None):
+        self.browser = browser
+        self.size = size or Config.PAGE_POOL_SIZE
+        self.max_uses = max_uses if max_uses is not None else Config.PAGE_POOL_MAX_USES
+        self.health_interval = health_interval if health_interval is not None else Config.PAGE_POOL_HEALTH_INTERVAL
+        self.tabs: List[PooledTab] = []
+        self._free: asyncio.Queue = asyncio.Queue()
+        # 统计
+        self.leases = 0
+        self.recycled = 0
+        self.health_failures = 0
+        self.lease_wait_total = 0.0
+        self.lease_wait_max = 0.0
+
+    async def start(self):
+        """打开所有标签页"""
+        for i in range(self.size):
+            tab = await self._open_tab(i)
+            self.tabs.append(tab)
+            self._free.put_nowait(tab)
+        logger.info(f"[标签页池] 已打开 {self.size} 个标签页")
+
+    async def close(self):
+        """关闭所有标签页（主页面由 XianyuBrowser.close 关闭）"""
+        for tab in self.tabs:
+            await self._close_page(tab)
+        self.tabs.clear()
+        logger.info(f"[标签页池] 已关闭，统计: {self.get_stats()}")
+
+    def get_stats(self) -> dict:
+        return {
+            'size': self.size,
+            'free': self._free.qsize(),
+            'leases': self.leases,
+            'recycled': self.recycled,
+            'health_failures': self.health_failures,
+            'avg_lease_wait_ms': round(self.lease_wait_total * 1000 / self.leases, 1) if self.leases else 0.0,
+            'max_lease_wait_ms': round(self.lease_wait_max * 1000, 1),
+        }
+
+    @asynccontextmanager
+    async def lease(self):
+        """
+        租用一个空闲标签页（没有空闲标签页时等待）
+
+        Usage:
+            async with pool.lease() as tab:
+                await tab.browser.enter_conversation(conv)
+        """
+        started_at = time.perf_counter()
+        tab = await self._free.get()
+        waited = time.perf_counter() - started_at
+        self.leases += 1
+        self.lease_wait_total += waited
+        self.lease_wait_max = max(self.lease_wait_max, waited)
+        try:
+            tab = await self._ensure_usable(tab)
+            async with tab.lock:
+                tab.uses += 1
+                try:
+                    yield tab
+                except Exception:
+                    tab.suspect = True
+                    raise
+        finally:
+            self._free.put_nowait(tab)
+
+    async def _ensure_usable(self, tab: PooledTab) -> PooledTab:
+        """租用前检查标签页，不可用或达到使用上限时重建"""
+        if self.max_uses and tab.uses >= self.max_uses:
+            logger.info(f"[标签页池] 标签页 {tab.index} 已使用 {tab.uses} 次，重建")
+            return await self._recycle(tab)
+
+        now = time.monotonic()
+        if tab.suspect or now - tab.last_checked >= self.health_interval:
+            if not await self._check_health(tab):
+                self.health_failures += 1
+                logger.warning(f"[标签页池] 标签页 {tab.index} 健康检查失败，重建")
+                return await self._recycle(tab)
+            tab.last_checked = now
+            tab.suspect = False
+        return tab
+
+    async def _check_health(self, tab: PooledTab) -> bool:
+        """页面未关闭、脚本能响应、会话列表存在"""
+        if tab.page.is_closed():
+            return False
+        try:
+            return await asyncio.wait_for(
+                tab.page.evaluate("() => !!document.querySelector('[class*=\"conversation-item--\"]')"),
+                timeout=Config.READINESS_TIMEOUT_MS / 1000,
+            )
+        except Exception:
+            return False
+
+    async def _open_tab(self, index: int) -> PooledTab:
+        page = await self.browser.context.new_page()
+        await page.goto(Config.XIANYU_URL, wait_until="domcontentloaded")
+        try:
+            await page.wait_for_selector('[class*="conversation-item--"]', timeout=Config.SNAPSHOT_WAIT_TIMEOUT_MS)
+        except Exception:
+            logger.warning(f"[标签页池] 标签页 {index} 会话列表加载超时")
+        return PooledTab(index, self.browser.for_page(page))
+
+    async def _close_page(self, tab: PooledTab):
+        try:
+            if not tab.page.is_closed():
+                await tab.page.close()
+        except Exception as e:
+            logger.debug(f"[标签页池] 关闭标签页 {tab.index} 失败: {e}")
+
+    async def _recycle(self, tab: PooledTab) -> PooledTab:
+        """关闭旧标签页并在原位置打开新标签页（旧标签页已从空闲队列取出）"""
+        # 重建失败时旧标签页会被放回队列，下次租用时再次检查
+        tab.suspect = True
+        await self._close_page(tab)
+        new_tab = await self._open_tab(tab.index)
+        self.tabs[self.tabs.index(tab)] = new_tab
+        self.recycled += 1
+        return new_tab
@@ -0,0 +1,241 @@
+"""延时任务调度模块 - 时间轮统一调度 inactive 跟进、消息合并窗口等延时操作，需要时持久化到数据库"""
+import asyncio
+import json
+import math
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+from logger_setup import logger
+from config import Config
+from db_manager import AsyncDBManager, async_db
+
+# 到期处理函数: handler(key, payload)
+ActionHandler = Callable[[str, dict], Awaitable[Any]]
+# 每类任务保留最近多少次触发延迟（用于计算 p95）
+LAG_SAMPLES = 1024
+
+
+class TimerWheel:
+    """
+    哈希时间轮（非线程安全，只在事件循环中使用）
+
+    到期时间按 tick 取整放入 slots 个槽之一，超过一圈的条目留在槽中等下一圈；
+    add / remove 都是 O(1)，advance 每个 tick 只检查一个槽。
+    时间使用 time.time()（与持久化的到期时间一致）。
+    """
+
+    def __init__(self, tick: float = 0.2, slots: int = 512):
+        self.tick = tick
+        self.slots = slots
+        # 槽: key -> (到期时间, 值)
+        self._buckets: List[Dict[Hashable, Tuple[float, Any]]] = [{} for _ in range(slots)]
+        # key -> 所在槽
+        self._index: Dict[Hashable, int] = {}
+        # 已处理到的 tick
+        self._current = math.floor(time.time() / tick)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._index
+
+    def add(self, key: Hashable, due: float, value: Any = None):
+        """添加或替换定时条目"""
+        self.remove(key)
+        # 已过期的条目放到下一个 tick
+        slot = max(math.ceil(due / self.tick), self._current + 1) % self.slots
+        self._buckets[slot][key] = (due, value)
+        self._index[key] = slot
+
+    def remove(self, key: Hashable) -> Optional[Tuple[float, Any]]:
+        """取消定时条目，返回 (到期时间, 值)，不存在时返回 None"""
+        slot = self._index.pop(key, None)
+        if slot is None:
+            return None
+        return self._buckets[slot].pop(key)
+
+    def advance(self, now: float = None) -> List[Tuple[Hashable, float, Any]]:
+        """推进到 now，返回到期的条目 [(key, 到期时间, 值)]（按到期时间排序）"""
+        now = time.time() if now is None else now
+        target = math.floor(now / self.tick)
+        if target <= self._current:
+            return []
+        # 长时间没有推进（如系统休眠）时每个槽最多检查一次
+        ticks = range(self._current + 1, target + 1) if target - self._current < self.slots else range(self.slots)
+        self._current = target
+        expired = []
+        for tick in ticks:
+            bucket = self._buckets[tick % self.slots]
+            if not bucket:
+                continue
+            for key, (due, value) in list(bucket.items()):
+                if due <= now:
+                    del bucket[key]
+                    del self._index[key]
+                    expired.append((key, due, value))
+        expired.sort(key=lambda item: item[1])
+        return expired
+
+
+class ActionScheduler:
+    """
+    延时任务调度服务
+
+    每类任务（kind）注册一个处理函数，schedule(kind, key, delay) 在 delay 秒后调用 handler(key, payload)；
+    同一 (kind, key) 重复 schedule 会替换原来的定时，cancel 取消。一个后台任务按 tick 推进时间轮，
+    到期的处理函数在独立的任务中执行。
+
+    persist=True 的任务同时保存在 scheduled_actions 表（合并后定期批量写入），
+    重启后 start() 重新加载，重启期间已到期的任务立即执行。
+    """
+
+    def __init__(self, tick: float = None, flush_interval: float = None, db: AsyncDBManager = None):
+        self.db = db or async_db
+        self.wheel = TimerWheel(tick or Config.SCHEDULER_TICK_SECONDS)
+        self.flush_interval = flush_interval if flush_interval is not None else Config.SCHEDULER_FLUSH_INTERVAL
+        self._handlers: Dict[str, ActionHandler] = {}
+        # 待写入数据库的变化: (kind, key) -> (到期时间, payload)，None 表示删除
+        self._dirty: Dict[Tuple[str, str], Optional[Tuple[float, dict]]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._running: set = set()
+        # 统计（按 kind）
+        self.stats: Dict[str, dict] = {}
+
+    def register(self, kind: str, handler: ActionHandler):
+        self._handlers[kind] = handler
+
+    def _kind_stats(self, kind: str) -> dict:
+        stats = self.stats.get(kind)
+        if stats is None:
+            stats = self.stats[kind] = {
+                'scheduled': 0, 'cancelled': 0, 'fired': 0, 'failed': 0,
+                'lag_total': 0.0, 'lag_max': 0.0, 'lags': deque(maxlen=LAG_SAMPLES),
+            }
+        return stats
+
+    def schedule(self, kind: str, key: str, delay: float, payload: dict = None, persist: bool = True):
+        """delay 秒后执行（替换同一 key 的原定时）"""
+        due = time.time() + max(0.0, delay)
+        payload = payload or {}
+        self.wheel.add((kind, key), due, (payload, persist))
+        self._kind_stats(kind)['scheduled'] += 1
+        if persist:
+            self._dirty[(kind, key)] = (due, payload)
+        elif (kind, key) in self._dirty:
+            self._dirty[(kind, key)] = None
+
+    def cancel(self, kind: str, key: str) -> bool:
+        """取消定时，返回是否存在"""
+        entry = self.wheel.remove((kind, key))
+        if entry is None:
+            return False
+        self._kind_stats(kind)['cancelled'] += 1
+        if entry[1][1]:
+            self._dirty[(kind, key)] = None
+        return True
+
+    def is_scheduled(self, kind: str, key: str) -> bool:
+        return (kind, key) in self.wheel
+
+    @property
+    def persistent(self) -> bool:
+        return self.db.is_connected
+
+    async def start(self):
+        """加载数据库中的任务并启动调度"""
+        if self.persistent:
+            try:
+                rows = await self.db.get_scheduled_actions()
+            except Exception as e:
+                logger.error(f"[调度] 加载定时任务失败: {e}")
+                rows = []
+            for row in rows:
+                payload = json.loads(row['payload']) if row['payload'] else {}
+                self.wheel.add((row['kind'], row['action_key']), row['due_at'].timestamp(), (payload, True))
+            if rows:
+                overdue = sum(1 for row in rows if row['due_at'] <= datetime.now())
+                logger.info(f"[调度] 已恢复 {len(rows)} 个定时任务（{overdue} 个已到期）")
+        self._task = asyncio.create_task(self._run())
+        if self.persistent:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """停止调度（未到期的持久化任务保留在数据库中，下次启动继续）"""
+        for task in (self._task, self._flush_task):
+            if task:
+                task.cancel()
+        for task in list(self._running):
+            task.cancel()
+        await asyncio.gather(*[t for t in (self._task, self._flush_task) if t], *self._running, return_exceptions=True)
+        self._task = self._flush_task = None
+        if self.persistent:
+            await self.flush()
+        logger.info(f"[调度] 统计: {self.get_stats()}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.wheel.tick)
+            now = time.time()
+            for (kind, key), due, (payload, persist) in self.wheel.advance(now):
+                stats = self._kind_stats(kind)
+                lag = now - due
+                stats['fired'] += 1
+                stats['lag_total'] += lag
+                stats['lag_max'] = max(stats['lag_max'], lag)
+                stats['lags'].append(lag)
+                if persist:
+                    self._dirty[(kind, key)] = None
+                handler = self._handlers.get(kind)
+                if handler is None:
+                    logger.warning(f"[调度] 没有 {kind} 的处理函数，丢弃: {key}")
+                    continue
+                task = asyncio.create_task(self._fire(kind, key, handler, payload))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+
+    async def _fire(self, kind: str, key: str, handler: ActionHandler, payload: dict):
+        try:
+            await handler(key, payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._kind_stats(kind)['failed'] += 1
+            logger.error(f"[调度] {kind} 任务执行出错 ({key}): {e}")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        """把积累的变化批量写入 scheduled_actions（同一任务多次变化只写最后一次）"""
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        upserts = [
+            (kind, key, datetime.fromtimestamp(entry[0]), json.dumps(entry[1], ensure_ascii=False))
+            for (kind, key), entry in dirty.items() if entry is not None
+        ]
+        deletes = [(kind, key) for (kind, key), entry in dirty.items() if entry is None]
+        if not await self.db.save_scheduled_actions(upserts, deletes):
+            # 写入失败：放回队列下次重试（期间的新变化优先）
+            for item, entry in dirty.items():
+                self._dirty.setdefault(item, entry)
+
+    def get_stats(self) -> dict:
+        result = {'pending': len(self.wheel), 'running': len(self._running), 'unsaved': len(self._dirty)}
+        for kind, stats in self.stats.items():
+            lags = sorted(stats['lags'])
+            result[kind] = {
+                'scheduled': stats['scheduled'],
+                'cancelled': stats['cancelled'],
+                'fired': stats['fired'],
+                'failed': stats['failed'],
+                'avg_lag_ms': round(stats['lag_total'] * 1000 / stats['fired'], 1) if stats['fired'] else 0.0,
+                'p95_lag_ms': round(lags[max(0, math.ceil(0.95 * len(lags)) - 1)] * 1000, 1) if lags else 0.0,
+                'max_lag_ms': round(stats['lag_max'] * 1000, 1),
+            }
+        return result
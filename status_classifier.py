@@ -0,0 +1,145 @@
+"""订单状态 / 系统消息分类模块 - 关键词预编译为一个正则（长关键词优先），Python 和页面脚本使用同一份规则"""
+import hashlib
+import json
+import re
+from typing import Mapping, Optional, Sequence
+
+# 闲鱼系统消息关键词（下单、付款、发货等系统通知）
+SYSTEM_MESSAGE_KEYWORDS = (
+    '我已拍下，待付款',
+    '我已付款，等待你发货',
+    '请双方沟通及时确认价格',
+    '请包装好商品',
+    '你已发货',
+    '已发货，等待买家确认',
+    '买家已确认收货',
+    '交易成功',
+    '交易关闭',
+    '订单已取消',
+    '退款成功',
+    '申请退款',
+    '你撤回了一条消息',
+    '对方撤回了一条消息',
+    '对方正在输入',
+)
+
+# 页面中分类器挂载的全局变量名
+CLASSIFIER_GLOBAL = '__xianyuClassifier'
+# 页面中按规则重建分类器的函数名
+CLASSIFIER_INSTALLER = '__xianyuInstallClassifier'
+# 修改后的规则在页面 localStorage 中的键（同源页面刷新、新建后读取）
+CLASSIFIER_STORAGE_KEY = '__xianyuClassifierRules'
+
+# 页面加载脚本（每个浏览器上下文注册一次）：定义 installer(rules)，
+# 优先使用本次运行写入 localStorage 的规则（按 session 区分，忽略之前运行留下的），否则使用注册时的规则
+# 安装结果：window.__xianyuClassifier = {version, status(text), isSystem(text)}
+_LOADER_JS = r"""
+(() => {
+    const install = (rules) => {
+        const statusRegex = rules.statusSource ? new RegExp(rules.statusSource) : null;
+        const systemRegex = rules.systemSource ? new RegExp(rules.systemSource) : null;
+        const statusMapping = rules.statusMapping;
+        window.%(name)s = {
+            version: rules.version,
+            // 返回映射后的订单状态，没有匹配时返回空字符串
+            status: (text) => {
+                if (!statusRegex || !text) return '';
+                const match = statusRegex.exec(text);
+                return match ? statusMapping[match[0]] : '';
+            },
+            isSystem: (text) => !!(systemRegex && text && systemRegex.test(text)),
+        };
+    };
+    window.%(installer)s = install;
+    let rules = %(rules)s;
+    try {
+        const stored = JSON.parse(localStorage.getItem(%(key)s) || 'null');
+        if (stored && stored.session === %(session)s) rules = stored.rules;
+    } catch (e) {}
+    install(rules);
+})();
+"""
+
+# 规则更新脚本（参数 {session, rules}）：写入 localStorage 供之后加载的页面使用，并重建当前页面的分类器
+CLASSIFIER_UPDATE_JS = r"""
+(payload) => {
+    try {
+        localStorage.setItem(%(key)s, JSON.stringify(payload));
+    } catch (e) {}
+    window.%(installer)s(payload.rules);
+}
+""" % {'key': json.dumps(CLASSIFIER_STORAGE_KEY), 'installer': CLASSIFIER_INSTALLER}
+
+
+def loader_js(rules: dict, session: str = '') -> str:
+    """生成页面加载脚本，rules 为 StatusClassifier.rules（没有本次运行写入的规则时使用）"""
+    return _LOADER_JS % {
+        'name': CLASSIFIER_GLOBAL,
+        'installer': CLASSIFIER_INSTALLER,
+        'key': json.dumps(CLASSIFIER_STORAGE_KEY),
+        'session': json.dumps(session),
+        'rules': json.dumps(rules, ensure_ascii=False),
+    }
+
+
+# JavaScript 正则中需要转义的字符
+_JS_SPECIAL = re.compile(r"[.*+?^${}()|\[\]\\/]")
+
+
+def _alternation(keywords: Sequence[str], escape) -> str:
+    """关键词按长度降序组成分支（同一位置上较长的关键词优先匹配）"""
+    ordered = sorted({k for k in keywords if k}, key=lambda k: (-len(k), k))
+    return '|'.join(escape(k) for k in ordered)
+
+
+def _js_escape(keyword: str) -> str:
+    return _JS_SPECIAL.sub(lambda m: '\\' + m.group(0), keyword)
+
+
+class StatusClassifier:
+    """
+    订单状态和系统消息分类器（不可变）
+
+    每类关键词预编译为一个正则分支，一次扫描文本：返回文本中最靠前的关键词，
+    同一位置有多个关键词时取最长的（如"等待买家付款"优先于"待付款"）。
+    rules 为等价的页面规则：浏览器只注册一次加载脚本（loader_js），规则变化时把新规则传入已打开的页面。
+    """
+
+    def __init__(self, status_mapping: Mapping[str, str], system_keywords: Sequence[str] = SYSTEM_MESSAGE_KEYWORDS):
+        self.status_mapping = dict(status_mapping)
+        self.system_keywords = tuple(system_keywords)
+        status_source = _alternation(self.status_mapping, re.escape)
+        system_source = _alternation(self.system_keywords, re.escape)
+        self._status_regex: Optional[re.Pattern] = re.compile(status_source) if status_source else None
+        self._system_regex: Optional[re.Pattern] = re.compile(system_source) if system_source else None
+
+        # 规则相同的分类器版本号相同（浏览器据此判断是否需要更新页面中的规则）
+        rules = json.dumps([self.status_mapping, self.system_keywords], ensure_ascii=False, sort_keys=True)
+        self.version = hashlib.sha1(rules.encode('utf-8')).hexdigest()[:12]
+        # 页面脚本使用的规则（可 JSON 序列化，作为参数传给页面）
+        self.rules = {
+            'version': self.version,
+            'statusSource': _alternation(self.status_mapping, _js_escape),
+            'systemSource': _alternation(self.system_keywords, _js_escape),
+            'statusMapping': self.status_mapping,
+        }
+
+    @property
+    def install_js(self) -> str:
+        """独立安装本分类器的页面脚本"""
+        return loader_js(self.rules)
+
+    def match_status(self, text: str) -> Optional[str]:
+        """返回匹配到的原始状态关键词，没有匹配时返回 None"""
+        if not text or self._status_regex is None:
+            return None
+        match = self._status_regex.search(text)
+        return match.group(0) if match else None
+
+    def classify_status(self, text: str) -> str:
+        """返回映射后的订单状态，没有匹配时返回空字符串"""
+        keyword = self.match_status(text)
+        return self.status_mapping[keyword] if keyword is not None else ''
+
+    def is_system_message(self, text: str) -> bool:
+        return bool(text) and self._system_regex is not None and self._system_regex.search(text) is not None
@@ -0,0 +1,56 @@
+"""测试会话定位（列表项特征匹配 + conversation_locator 持久化，使用 SQLite 临时数据库）"""
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from conversation_locator import ConversationLocator, normalize_image_url
+
+AVATAR_A = "https://img.alicdn.com/bao/uploaded/i1/avatar_a.jpg_80x80q90.jpg_.webp"
+AVATAR_B = "https://img.alicdn.com/bao/uploaded/i1/avatar_b.jpg_80x80q90.jpg_.webp"
+THUMB = "https://img.alicdn.com/bao/uploaded/i2/item.png_120x120.png?t=1"
+
+
+def _conv(index, buyer_name, avatar="", item_thumb=""):
+    return {'index': index, 'buyer_name': buyer_name, 'avatar': avatar, 'item_thumb': item_thumb}
+
+
+def test_normalize_image_url():
+    assert normalize_image_url(AVATAR_A) == "//img.alicdn.com/bao/uploaded/i1/avatar_a.jpg"
+    assert normalize_image_url(THUMB) == "//img.alicdn.com/bao/uploaded/i2/item.png"
+    assert normalize_image_url("http://img.alicdn.com/bao/uploaded/i1/avatar_a.jpg_200x200.jpg") == \
+        normalize_image_url(AVATAR_A)
+    assert normalize_image_url(None) == ''
+
+
+def test_locator_learns_and_reloads(sqlite_manager, async_db):
+    manager, db = sqlite_manager, async_db
+
+    async def run():
+        locator = ConversationLocator(db=db)
+        # 两个同名买家，只能靠头像区分
+        assert await locator.learn("u1", _conv(3, "小明", AVATAR_A, THUMB))
+        assert await locator.learn("u2", _conv(5, "小明", AVATAR_B, THUMB))
+        assert not await locator.learn("u1", _conv(0, "小明", AVATAR_A, THUMB))
+        assert not await locator.learn("name_小明", _conv(0, "小明", AVATAR_A))
+
+        # 列表顺序变化、昵称变化后仍按头像定位
+        conversations = [_conv(0, "小明", AVATAR_B, THUMB), _conv(1, "路人"), _conv(2, "明明", AVATAR_A, THUMB)]
+        assert locator.locate(conversations, "u1")['index'] == 2
+        assert locator.locate(conversations, "u2")['index'] == 0
+        # 没有记录的用户按参考列表项（昵称）匹配
+        assert locator.candidates(conversations, "u9", {'buyer_name': "路人"}) == [conversations[1]]
+        assert locator.candidates(conversations, "u9", {'buyer_name': "不存在"}) == []
+
+        # 重新加载后特征一致，验证不符时删除
+        reloaded = ConversationLocator(db=db)
+        await reloaded.load()
+        assert len(reloaded) == 2
+        assert reloaded.get("u1") == locator.get("u1")
+        await reloaded.forget("u2")
+        return reloaded.get_stats()
+
+    stats = asyncio.run(run())
+    assert stats['known'] == 1 and stats['stale'] == 1
+    assert [row['user_id'] for row in manager.get_conversation_locators()] == ["u1"]
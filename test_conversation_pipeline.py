@@ -0,0 +1,85 @@
+"""测试会话流水线（停止时处理完队列、超时丢弃的工作项计数、未找到会话、用户序号和锁的移除）"""
+import asyncio
+import sys
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from conversation_pipeline import ConversationPipeline
+
+
+class FakeBrowser:
+    def __init__(self, missing=()):
+        self.missing = set(missing)
+        self.back = 0
+
+    async def go_back_to_list(self):
+        self.back += 1
+
+    async def find_conversation(self, user_id, locator, buyer_name=""):
+        return None if user_id in self.missing else {'buyer_name': buyer_name}
+
+
+class FakeHandler:
+    """按会话的 user_id 生成工作项，Coze 回复耗时 coze_delay 秒"""
+
+    def __init__(self, coze_delay: float = 0.0, missing=()):
+        self.browser = FakeBrowser(missing)
+        self.locator = None
+        self.coze_delay = coze_delay
+        self.sent = []
+
+    @asynccontextmanager
+    async def _browser_session(self):
+        yield self.browser
+
+    async def _collect_conversation(self, conversation):
+        return {'user_id': conversation['user_id'], 'buyer_name': conversation['buyer_name']}
+
+    async def _generate_reply(self, data):
+        await asyncio.sleep(self.coze_delay)
+        return f"回复{data['user_id']}", None
+
+    async def _deliver_reply(self, data, reply, new_conv_id):
+        self.sent.append((data['user_id'], reply))
+
+
+def _conversation(user_id: str) -> dict:
+    return {'user_id': user_id, 'buyer_name': f"买家{user_id}"}
+
+
+def test_stop_drains_queued_items_and_evicts_users():
+    handler = FakeHandler(coze_delay=0.02, missing={'u3'})
+    pipeline = ConversationPipeline(handler, workers=2, queue_size=10, drain_timeout=5)
+
+    async def run():
+        pipeline.start()
+        for user_id in ('u1', 'u2', 'u3'):
+            await pipeline.submit(_conversation(user_id))
+        # 停止前队列中的工作项全部处理完
+        await pipeline.stop()
+
+    asyncio.run(run())
+    assert sorted(handler.sent) == [('u1', '回复u1'), ('u2', '回复u2')]
+    # 抓取后 3 次、发送后 2 次，未找到会话时也返回列表并计入未发送
+    assert handler.browser.back == 6
+    stats = pipeline.get_stats()
+    assert stats['undelivered'] == 1 and stats['coze_queue'] == stats['send_queue'] == 0
+    assert pipeline._generations == {} and pipeline._user_locks == {}
+
+
+def test_stop_timeout_counts_dropped_items():
+    handler = FakeHandler(coze_delay=1)
+    pipeline = ConversationPipeline(handler, workers=1, queue_size=10, drain_timeout=0.05)
+
+    async def run():
+        pipeline.start()
+        for user_id in ('u1', 'u2', 'u3'):
+            await pipeline.submit(_conversation(user_id))
+        await pipeline.stop()
+
+    asyncio.run(run())
+    assert handler.sent == []
+    # 正在调用 Coze 的工作项随 worker 取消，队列中剩余的两个记录为未回复
+    assert pipeline.get_stats()['undelivered'] == 2
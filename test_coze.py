@@ -29,12 +29,11 @@ async def test_new_conversation():
     if db_manager.connect():
         # 清除 conversation_id
         try:
-            with db_manager.connection.cursor() as cursor:
+            with db_manager.cursor() as cursor:
                 cursor.execute(
                     "UPDATE users SET coze_conversation_id = NULL WHERE buyer_name = %s",
                     (buyer_name,)
                 )
-            db_manager.connection.commit()
             print(f"[OK] Cleared conversation ID for {buyer_name}")
         except Exception as e:
             print(f"[FAIL] Clear failed: {e}")
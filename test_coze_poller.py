@@ -0,0 +1,119 @@
+"""测试 Coze 对话结果共享轮询（退避间隔、超时、等待方取消或请求挂起时不影响其他对话）"""
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from coze_poller import ChatPollScheduler
+
+
+class _Response:
+    def __init__(self, body: dict):
+        self._body = body
+
+    def json(self) -> dict:
+        return self._body
+
+
+class FakeClient:
+    """按 chat_id 返回预设的状态序列，可选在请求期间挂起"""
+
+    base_url = "https://coze.test"
+
+    def __init__(self, statuses: dict, delay: float = 0.0):
+        self.statuses = statuses
+        self.delay = delay
+        self.calls = []
+
+    async def _request(self, method, url, **kwargs):
+        chat_id = kwargs['params']['chat_id']
+        self.calls.append(chat_id)
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        sequence = self.statuses[chat_id]
+        status = sequence.pop(0) if len(sequence) > 1 else sequence[0]
+        if isinstance(status, Exception):
+            raise status
+        return _Response({'code': 0, 'data': {'status': status, 'id': chat_id}})
+
+
+def test_backoff_until_completed():
+    client = FakeClient({'c1': ['in_progress', 'in_progress', 'completed']})
+    poller = ChatPollScheduler(client, first_interval=0.01, max_interval=0.03, backoff=2.0, jitter=0.0)
+
+    async def run():
+        result = await poller.wait('c1', 'conv1', workflow='bot', timeout=5)
+        await poller.stop()
+        return result
+
+    result = asyncio.run(run())
+    assert result['status'] == 'completed'
+    assert client.calls == ['c1', 'c1', 'c1']
+    stats = poller.get_stats()
+    assert stats['completed'] == 1 and stats['total_polls'] == 3
+    assert 'bot' in stats['expected_seconds']
+
+
+def test_deadline_and_request_errors():
+    client = FakeClient({'slow': ['in_progress'], 'broken': [RuntimeError("boom"), 'completed']})
+    poller = ChatPollScheduler(client, first_interval=0.01, max_interval=0.02, jitter=0.0)
+
+    async def run():
+        results = await asyncio.gather(
+            poller.wait('slow', 'conv1', timeout=0.05),
+            poller.wait('broken', 'conv2', timeout=5),
+        )
+        await poller.stop()
+        return results
+
+    slow, broken = asyncio.run(run())
+    assert slow == {'status': 'timeout'}
+    # 请求异常时按空结果处理并继续退避轮询
+    assert broken['status'] == 'completed'
+
+
+def test_cancelled_waiter_does_not_stop_loop():
+    client = FakeClient({'c1': ['completed'], 'c2': ['in_progress', 'completed']}, delay=0.05)
+    poller = ChatPollScheduler(client, first_interval=0.01, max_interval=0.02, jitter=0.0)
+
+    async def run():
+        cancelled = asyncio.create_task(poller.wait('c1', 'conv1', timeout=5))
+        other = asyncio.create_task(poller.wait('c2', 'conv2', timeout=5))
+        # 在 c1 的请求进行中取消等待方
+        await asyncio.sleep(0.03)
+        cancelled.cancel()
+        result = await asyncio.wait_for(other, timeout=2)
+        task = poller._task
+        await poller.stop()
+        return cancelled, result, task
+
+    cancelled, result, task = asyncio.run(run())
+    assert cancelled.cancelled()
+    assert result['status'] == 'completed'
+    assert task is not None
+
+
+def test_slow_request_does_not_block_other_chats():
+    class HangingClient(FakeClient):
+        async def _request(self, method, url, **kwargs):
+            if kwargs['params']['chat_id'] == 'hung':
+                await asyncio.sleep(10)
+            return await super()._request(method, url, **kwargs)
+
+    client = HangingClient({'hung': ['completed'], 'fast': ['in_progress', 'in_progress', 'completed']})
+    poller = ChatPollScheduler(client, first_interval=0.01, max_interval=0.02, jitter=0.0)
+
+    async def run():
+        hung = asyncio.create_task(poller.wait('hung', 'conv1', timeout=30))
+        # 挂起的请求进行中，其他对话仍按退避间隔轮询
+        result = await asyncio.wait_for(poller.wait('fast', 'conv2', timeout=5), timeout=1)
+        in_flight = poller.get_stats()['in_flight']
+        await poller.stop()
+        return hung, result, in_flight
+
+    hung, result, in_flight = asyncio.run(run())
+    assert result['status'] == 'completed'
+    assert in_flight == 1
+    # 停止时取消进行中的请求，等待方收到取消
+    assert hung.cancelled()
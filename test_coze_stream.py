@@ -0,0 +1,64 @@
+"""测试 Coze 流式对话失败时的处理（只有请求未送达或被拒绝时才改用非流式请求重新提交）"""
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from config import Config
+from coze_client import CozeClient
+
+
+class _BrokenStream(httpx.AsyncByteStream):
+    """返回一个事件后连接中断（对话创建事件之前）"""
+
+    async def __aiter__(self):
+        yield b"event: conversation.message.delta\ndata: {}\n\n"
+        raise httpx.ReadError("connection reset")
+
+
+def _run_chat(monkeypatch, first_response):
+    """第一次 POST（流式）按 first_response 处理，之后的非流式 POST 返回业务错误"""
+    monkeypatch.setattr(Config, 'COZE_STREAM', True)
+    posts = []
+
+    def handler(request: httpx.Request):
+        payload = json.loads(request.content)
+        posts.append(payload['stream'])
+        if payload['stream']:
+            return first_response(request)
+        return httpx.Response(200, json={'code': 4000, 'msg': 'bad request'})
+
+    async def run():
+        client = CozeClient()
+        client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            return await client.chat("在吗", user_id="u1")
+        finally:
+            await client.close()
+
+    return asyncio.run(run()), posts
+
+
+def test_connect_error_falls_back_to_polling(monkeypatch):
+    def refuse(request):
+        raise httpx.ConnectError("connection refused", request=request)
+
+    (reply, _), posts = _run_chat(monkeypatch, refuse)
+    assert posts == [True, False]
+    assert reply.startswith("抱歉")
+
+
+def test_error_status_falls_back_to_polling(monkeypatch):
+    (_, _), posts = _run_chat(monkeypatch, lambda request: httpx.Response(503))
+    assert posts == [True, False]
+
+
+def test_stream_broken_after_send_is_not_resubmitted(monkeypatch):
+    (reply, conv_id), posts = _run_chat(monkeypatch, lambda request: httpx.Response(200, stream=_BrokenStream()))
+    # 请求已送达，重新提交会让买家的消息在会话中出现两次
+    assert posts == [True]
+    assert reply == "抱歉，系统出现错误，请稍后再试。" and conv_id is None
@@ -0,0 +1,64 @@
+"""测试变量配置缓存（mtime / 内容哈希检测、GUI 保存后重新加载、预先计算的 build 变量名）"""
+import json
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+import config
+from config import CozeVars, DEFAULT_COZE_VARS, VarsConfigCache
+
+
+def _write(path: Path, data: dict, mtime_ns: int):
+    path.write_text(json.dumps(data, ensure_ascii=False), encoding='utf-8')
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_cache_reloads_only_on_change(tmp_path, monkeypatch):
+    path = tmp_path / "coze_vars_config.json"
+    cache = VarsConfigCache(path)
+    monkeypatch.setattr(config, '_vars_cache', cache)
+
+    # 文件不存在时使用默认配置
+    assert CozeVars.get_var_name('buyer_name') == 'buyer_name'
+    assert CozeVars.get_status_mapping_simple()['交易成功'] == '已完成'
+
+    data = {
+        'vars': dict(DEFAULT_COZE_VARS, buyer_name={'name': 'nick', 'enabled': True},
+                     product_info={'name': 'product_info', 'enabled': False}),
+        'status_mapping': {'交易成功': {'mapped': '已完成'}, '已付款': '已付款'},
+        'prompt': '你是客服',
+    }
+    _write(path, data, 1_000_000_000)
+    variables = CozeVars.build("张三", {'order_status': "已付款", 'notes': "商品"}, "")
+    assert variables == {'nick': "张三", 'order_status': "已付款", 'prompt': '你是客服'}
+    assert CozeVars.get_status_mapping_simple() == {'交易成功': '已完成', '已付款': '已付款'}
+    assert CozeVars.get_classifier().classify_status("订单交易成功") == "已完成"
+    reloads = cache.get_stats()['reloads']
+    assert reloads == 2
+
+    # 文件未变化：只检查 mtime
+    for _ in range(10):
+        CozeVars.get_prompt()
+    assert cache.get_stats()['reloads'] == reloads
+
+    # 重新保存但内容相同：比较哈希后不重新解析
+    _write(path, data, 2_000_000_000)
+    CozeVars.get_prompt()
+    assert cache.get_stats()['reloads'] == reloads
+    assert cache.get_stats()['unchanged'] == 1
+
+    # 内容变化后重新加载；GUI 保存后 reload() 强制重新加载
+    _write(path, dict(data, prompt='新提示词'), 3_000_000_000)
+    assert CozeVars.get_prompt() == '新提示词'
+    CozeVars.reload()
+    CozeVars.get_prompt()
+    stats = cache.get_stats()
+    assert stats['reloads'] == reloads + 2
+    assert stats['unchanged'] == 1
+    assert stats['hits'] >= 10
+
+    # 快照不可变，返回的映射表是副本
+    CozeVars.get_status_mapping_simple()['交易成功'] = 'x'
+    assert CozeVars.snapshot().status_mapping_simple['交易成功'] == '已完成'
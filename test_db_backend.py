@@ -0,0 +1,347 @@
+"""
+测试存储后端（同一组用例分别在 SQLite 和 MySQL 上运行）
+
+SQLite 使用临时文件，总是运行；MySQL 使用 .env 中的账号创建临时数据库 <DB_NAME>_test，
+无法连接 MySQL 时跳过。
+"""
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+import pymysql
+from config import Config
+from db_manager import DBManager
+from db_migrations import LATEST_VERSION, get_schema_version, migrate
+from db_sqlite import SQLiteDBManager
+from db_writer import ReplyRecord
+from history_retention import HistoryRetention, read_archive
+from logger_setup import logger
+
+
+def _mysql_server():
+    return pymysql.connect(
+        host=Config.db_host, port=int(Config.db_port),
+        user=Config.db_user, password=Config.db_password, charset='utf8mb4',
+        connect_timeout=2,
+    )
+
+
+@pytest.fixture(params=["sqlite", "mysql"])
+def db(request, tmp_path):
+    if request.param == "sqlite":
+        manager = SQLiteDBManager(tmp_path / "test.db")
+        assert manager.connect()
+        manager.init_tables()
+        yield manager
+        manager.close()
+        return
+
+    name = f"{Config.db_name}_test"
+    try:
+        server = _mysql_server()
+    except pymysql.err.OperationalError:
+        pytest.skip("无法连接 MySQL")
+    with server.cursor() as cursor:
+        cursor.execute(f"DROP DATABASE IF EXISTS `{name}`")
+        cursor.execute(f"CREATE DATABASE `{name}` DEFAULT CHARSET utf8mb4")
+    manager = DBManager()
+    manager.config.db_name = name
+    assert manager.connect()
+    manager.init_tables()
+    yield manager
+    manager.close()
+    with server.cursor() as cursor:
+        cursor.execute(f"DROP DATABASE IF EXISTS `{name}`")
+    server.close()
+
+
+def test_migrations_are_idempotent(db):
+    assert get_schema_version(db) == LATEST_VERSION
+    assert db.init_tables()
+    assert get_schema_version(db) == LATEST_VERSION
+
+
+def test_session_upsert_customer_type(db):
+    first = db.get_or_create_session("u1", "item1", "买家A", product_title="标题1")
+    assert first['customer_type'] == 'new'
+    assert isinstance(first['last_message_at'], datetime)
+
+    # 同一用户的新商品：回头客，继承 inactive_sent
+    db.set_inactive_sent("u1", True)
+    second = db.get_or_create_session("u1", "item2", "买家A")
+    assert second['customer_type'] == 'returning'
+    assert second['inactive_sent'] == 1
+
+    # 已有会话：保留原标题
+    again = db.get_or_create_session("u1", "item1", "买家A")
+    assert again['id'] == first['id']
+    assert again['product_title'] == "标题1"
+
+    assert len(db.get_user_sessions("u1")) == 2
+    assert db.is_inactive_sent("u1")
+    db.reset_user_inactive_status("u1")
+    assert not db.is_inactive_sent("u1")
+
+    # 新消息：upsert 同一事务中重置该用户所有会话的 inactive_sent
+    db.set_inactive_sent("u1", True)
+    assert db.get_session("u1", "item2")['inactive_sent'] == 1
+    third = db.get_or_create_session("u1", "item3", "买家A", reset_inactive=True)
+    assert third['customer_type'] == 'returning'
+    assert third['inactive_sent'] == 0
+    assert not db.is_inactive_sent("u1")
+    assert db.get_session("u1", "item2")['inactive_sent'] == 0
+
+
+def test_session_updates_visible_through_cache(db):
+    db.get_or_create_session("u2", "item1", "买家B")
+    assert db.get_session("u2", "item1")['conversation_id'] is None
+
+    db.update_session_conversation_id("u2", "item1", "conv_1")
+    db.update_session_order_status("u2", "item1", "已付款")
+    session = db.get_session("u2", "item1")
+    assert session['conversation_id'] == "conv_1"
+    assert session['order_status'] == "已付款"
+    assert db.get_session_by_conversation_id("conv_1")['user_id'] == "u2"
+
+    db.get_or_create_session("u2", "item2", "买家B")
+    db.update_session_conversation_id("u2", "item2", "conv_2")
+    others = db.get_user_other_sessions("u2", exclude_item_id="item1")
+    assert [s['conversation_id'] for s in others] == ["conv_2"]
+
+    assert db.delete_session("u2", "item1")
+    assert db.get_session("u2", "item1") is None
+
+
+def test_save_replies_writes_one_transaction_per_reply(db):
+    db.get_or_create_session("u3", "item1", "买家C")
+    created_at = datetime.now().replace(microsecond=0)
+    results = db.save_replies([
+        ReplyRecord("买家C", "u3", "item1", "在吗", "在的", conversation_id="conv_3", created_at=created_at),
+        ReplyRecord("买家C", "u3", "item1", "多少钱", "99", created_at=created_at + timedelta(seconds=1)),
+    ])
+    assert results == [True, True]
+
+    history = db.get_conversation_history("u3", limit=10)
+    assert [m['content'] for m in history] == ["在吗", "在的", "多少钱", "99"]
+    assert {m['coze_conversation_id'] for m in history} == {"conv_3"}
+    assert db.get_conversation_count("u3") == 4
+    assert db.get_conversation_id("u3") == "conv_3"
+
+    session = db.get_session("u3", "item1")
+    assert session['conversation_id'] == "conv_3"
+    assert db.get_user_last_message_time("u3") == created_at + timedelta(seconds=1)
+
+
+def test_inactive_candidates(db):
+    db.get_or_create_session("u4", "item1", "买家D")
+    db.get_or_create_session("u5", "item1", "买家E")
+    db.update_session_order_status("u5", "item1", "已付款")
+    db.save_replies([
+        ReplyRecord("买家D", "u4", "item1", "a", "b", created_at=datetime.now() - timedelta(minutes=10)),
+        ReplyRecord("买家E", "u5", "item1", "a", "b", created_at=datetime.now() - timedelta(minutes=10)),
+    ])
+    candidates = db.get_inactive_candidates(timeout_minutes=3)
+    assert [c['user_id'] for c in candidates] == ["u4"]
+    assert isinstance(candidates[0]['last_time'], datetime)
+    assert db.get_inactive_candidates(timeout_minutes=30) == []
+
+
+def test_products_and_cached_block(db):
+    assert db.get_product_block("p1") is None
+    assert db.add_or_update_product("p1", "耳机", "99", "全新")
+    assert db.get_product_block("p1") == "[当前会话-商品信息]\n标题：耳机\n价格：99\n备注：全新"
+
+    assert db.add_or_update_product("p1", "耳机", "89")
+    assert db.get_product("p1")['price'] == "89"
+    assert "备注" not in db.get_product_block("p1")
+    assert len(db.get_all_products()) == 1
+
+    assert db.delete_product("p1")
+    assert db.get_product("p1") is None
+
+
+def test_users_and_whitelist(db):
+    assert db.get_or_create_user("uF", "买家F")['buyer_name'] == "买家F"
+    assert db.get_or_create_user("uF")['buyer_name'] == "买家F"
+    assert db.set_user_whitelist("uF", True)
+    assert not db.set_user_whitelist("不存在", True)
+    assert db.is_user_in_whitelist("uF")
+    assert db.get_whitelist_users() == ["买家F"]
+    db.get_or_create_session("uF", "item1", "买家F")
+    db.save_replies([ReplyRecord("买家F", "uF", "item1", "你好", "您好", conversation_id="conv_f")])
+    users = db.get_all_users_with_status()
+    assert users[0]['msg_count'] == 2
+
+    assert db.clear_conversation_id("uF")
+    assert db.get_conversation_id("uF") is None
+    assert db.get_conversation_count("uF") == 0
+    assert db.get_conversation_history("uF") == []
+
+
+def test_user_identity_keyed_by_user_id(db):
+    session = db.get_or_create_session("u8", "item1", "买家I")
+    db.save_replies([ReplyRecord("买家I", "u8", "item1", "你好", "您好", conversation_id="conv_8")])
+    # 改昵称后仍是同一个用户
+    db.update_session_buyer_name("u8", "买家I2")
+    db.save_replies([ReplyRecord("买家I2", "u8", "item1", "在吗", "在的")])
+
+    users = [u for u in db.get_all_users_with_status() if u['user_id'] == "u8"]
+    assert [u['buyer_name'] for u in users] == ["买家I2"]
+    # 统计不因改昵称拆分
+    assert users[0]['msg_count'] == 4
+    assert db.get_conversation_id("u8") == "conv_8"
+
+    history = db.get_session_history(session['id'])
+    assert [m['content'] for m in history] == ["你好", "您好", "在吗", "在的"]
+    assert {m['coze_conversation_id'] for m in history} == {"conv_8"}
+
+    assert db.set_user_whitelist("u8", True)
+    listed = next(s for s in db.get_all_sessions_with_status() if s['user_id'] == "u8")
+    assert listed['is_whitelist'] == 1
+
+
+def test_backfill_user_identity(db):
+    # 旧数据: 只有昵称的用户行和对话历史
+    with db.cursor() as cursor:
+        cursor.execute("INSERT INTO users (buyer_name, is_whitelist) VALUES (%s, 1)", ("买家J",))
+        cursor.execute(
+            "INSERT INTO conversation_history (buyer_name, role, content, coze_conversation_id) VALUES (%s, 'user', %s, %s)",
+            ("买家J", "旧消息", "conv_j")
+        )
+    session = db.get_or_create_session("u9", "item1", "买家J")
+    db.update_session_conversation_id("u9", "item1", "conv_j")
+
+    assert db.backfill_user_identity(batch_size=1) == {'users': 1, 'history': 1}
+    user = next(u for u in db.get_all_users_with_status() if u['buyer_name'] == "买家J")
+    assert user['user_id'] == "u9"
+    assert user['is_whitelist'] == 1
+    assert [m['content'] for m in db.get_session_history(session['id'])] == ["旧消息"]
+    assert db.backfill_user_identity() == {'users': 0, 'history': 0}
+
+
+def test_user_keyed_stats_migration(tmp_path):
+    """v9 把按昵称记录的统计和归档计数转换为按 user_id 记录"""
+    manager = SQLiteDBManager(tmp_path / "legacy.db")
+    assert manager.connect()
+    assert migrate(manager, target=8) == 8
+    with manager.cursor() as cursor:
+        cursor.execute("INSERT INTO users (user_id, buyer_name) VALUES ('u1', '新昵称')")
+        cursor.execute("INSERT INTO users (buyer_name) VALUES ('老买家')")
+        cursor.execute("INSERT INTO user_sessions (user_id, item_id, buyer_name) VALUES ('u1', 'item1', '新昵称')")
+        session_id = cursor.lastrowid
+        # 改昵称前后的消息原来分在两行统计中
+        cursor.executemany(
+            "INSERT INTO conversation_history (session_id, buyer_name, role, content) VALUES (%s, %s, %s, %s)",
+            [(session_id, "旧昵称", "user", "在吗"), (session_id, "新昵称", "assistant", "在的"),
+             (None, "老买家", "user", "很久以前的消息")]
+        )
+        cursor.execute(
+            """INSERT INTO history_archive_summary (buyer_name, message_count, reply_count, last_message_at)
+               VALUES ('新昵称', 10, 5, '2024-01-01 00:00:00')"""
+        )
+    assert migrate(manager) == LATEST_VERSION
+
+    users = {u['user_id']: u for u in manager.get_all_users_with_status()}
+    assert (users['u1']['msg_count'], users['u1']['reply_count']) == (12, 6)
+    assert users['name_老买家']['msg_count'] == 1
+    assert manager.get_conversation_count("u1") == 12
+    assert manager.rebuild_user_stats() == 2
+    assert manager.get_conversation_count("u1") == 12
+    manager.close()
+
+
+def test_user_stats_incremental_and_rebuild(db):
+    db.get_or_create_session("u7", "item1", "买家H")
+    received_at = datetime.now().replace(microsecond=0) - timedelta(seconds=30)
+    db.save_replies([
+        ReplyRecord("买家H", "u7", "item1", "在吗", "在的",
+                    received_at=received_at, created_at=received_at + timedelta(seconds=4)),
+        ReplyRecord("买家H", "u7", "item1", "包邮吗", "包邮",
+                    received_at=received_at + timedelta(seconds=10), created_at=received_at + timedelta(seconds=12)),
+        # 没有接收时间的回复不计入耗时
+        ReplyRecord("买家H", "u7", "item1", "好的", "好的亲", created_at=received_at + timedelta(seconds=20)),
+    ])
+
+    def stats():
+        return next(u for u in db.get_all_users_with_status() if u['buyer_name'] == "买家H")
+
+    incremental = stats()
+    assert incremental['msg_count'] == 6
+    assert incremental['reply_count'] == 3
+    assert incremental['avg_reply_latency'] == pytest.approx(3.0)
+    assert isinstance(incremental['last_message_at'], datetime)
+    assert db.get_conversation_count("u7") == 6
+
+    # 重建结果与增量维护一致
+    assert db.rebuild_user_stats(batch_size=2) == 1
+    rebuilt = stats()
+    assert (rebuilt['msg_count'], rebuilt['reply_count']) == (6, 3)
+    assert rebuilt['avg_reply_latency'] == pytest.approx(3.0)
+
+
+def test_history_retention_archives_in_batches(db, tmp_path):
+    old = datetime.now() - timedelta(days=40)
+    db.get_or_create_session("u6", "item1", "买家G")
+    db.save_replies([
+        ReplyRecord("买家G", "u6", "item1", f"问{i}", f"答{i}", created_at=old + timedelta(minutes=i))
+        for i in range(5)
+    ] + [ReplyRecord("买家G", "u6", "item1", "新问题", "新回复")])
+
+    retention = HistoryRetention(db, days=30, batch_size=3, pause=0, archive_dir=tmp_path / "archives")
+    assert retention.run_once(dry_run=True)['archived'] == 3
+    result = retention.run_once()
+    assert result['archived'] == 10
+    assert result['batches'] == 4
+
+    # 热表只剩未过期的消息，总数包括归档计数
+    assert [m['content'] for m in db.get_conversation_history("u6")] == ["新问题", "新回复"]
+    assert db.get_conversation_count("u6") == 12
+    assert db.get_all_users_with_status()[0]['msg_count'] == 12
+    assert db.get_all_users_with_status()[0]['reply_count'] == 6
+    # 重建后归档计数仍然计入
+    db.rebuild_user_stats()
+    assert db.get_conversation_count("u6") == 12
+
+    archived = [row for path in result['files'] for row in read_archive(path)]
+    assert [row['content'] for row in archived][:2] == ["问0", "答0"]
+    assert len(archived) == 10
+
+    # 没有过期消息时不做任何事
+    assert retention.run_once()['archived'] == 0
+
+
+def test_query_stats_and_slow_query_log(db):
+    db.query_stats.reset()
+    db.get_or_create_session("u10", "item1", "买家K")
+    db.update_session_conversation_id("u10", "item1", "conv_10")
+    db.get_user_sessions("u10")
+    db.get_user_sessions("u10")
+
+    stats = db.get_query_stats()
+    assert stats['get_user_sessions']['calls'] == 1  # 第二次命中缓存
+    assert stats['get_user_sessions']['rows'] == 1
+    assert stats['get_or_create_session']['statements'] >= 1
+    assert stats['get_or_create_session']['p99_ms'] >= stats['get_or_create_session']['p50_ms']
+
+    # 阈值为 0.0001ms 时每条语句都是慢查询，EXPLAIN 在块结束后执行，不影响结果集
+    messages = []
+    handler = logger.add(lambda message: messages.append(str(message)), level="WARNING")
+    db.query_stats.slow_query_ms = 0.0001
+    try:
+        assert db.get_session_by_conversation_id("missing") is None
+        assert [s['item_id'] for s in db.get_user_other_sessions("u10")] == ["item1"]
+    finally:
+        db.query_stats.slow_query_ms = 0
+        logger.remove(handler)
+    assert db.get_query_stats()['get_user_other_sessions']['slow'] == 1
+    slow = [m for m in messages if "[慢查询] get_user_other_sessions" in m]
+    assert slow and "user_sessions" in slow[0].split("\n", 1)[1]
+
+    with pytest.raises(Exception):
+        with db.cursor("broken_query") as cursor:
+            cursor.execute("SELECT * FROM no_such_table")
+    assert db.get_query_stats()['broken_query']['errors'] == 1
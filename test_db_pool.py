@@ -0,0 +1,66 @@
+"""测试数据库连接池（丢弃连接后空出的名额唤醒等待方、等待超时）"""
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from db_pool import ConnectionPool, PoolTimeoutError
+
+
+class FakeConnection:
+    def __init__(self, index: int):
+        self.index = index
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def _factory():
+    created = []
+
+    def make():
+        conn = FakeConnection(len(created))
+        created.append(conn)
+        return conn
+
+    return make, created
+
+
+def test_discard_wakes_blocked_waiter():
+    make, created = _factory()
+    pool = ConnectionPool(make, max_size=1, timeout=5)
+    first = pool.acquire()
+    result = {}
+
+    def waiter():
+        result['conn'] = pool.acquire()
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    time.sleep(0.05)
+    # 丢弃出错的连接后，等待方立即用空出的名额新建连接，而不是等到超时
+    started_at = time.monotonic()
+    pool.discard(first)
+    thread.join(timeout=2)
+    assert not thread.is_alive()
+    assert time.monotonic() - started_at < 1
+    assert first.closed and result['conn'] is created[1]
+    stats = pool.snapshot()
+    assert (stats['size'], stats['waits'], stats['timeouts']) == (1, 1, 0)
+
+
+def test_release_reuses_connection_and_timeout():
+    make, created = _factory()
+    pool = ConnectionPool(make, max_size=1, timeout=0.05)
+    conn = pool.acquire()
+    with pytest.raises(PoolTimeoutError):
+        pool.acquire()
+    pool.release(conn)
+    assert pool.acquire() is conn
+    assert len(created) == 1
+    assert pool.snapshot()['timeouts'] == 1
@@ -0,0 +1,101 @@
+"""测试回复记录写入队列（攒批触发、写入确认、失败记录保存到日志文件并在重启后重新写入，使用 SQLite 临时数据库）"""
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from db_manager import AsyncDBManager
+from db_sqlite import SQLiteDBManager
+from db_writer import ReplyRecord, WriteBehindQueue
+
+
+@pytest.fixture
+def manager(sqlite_manager):
+    sqlite_manager.get_or_create_session("u1", "item1", "买家A")
+    return sqlite_manager
+
+
+@pytest.fixture
+def offline_db(tmp_path):
+    """未连接的数据库（写入全部失败）"""
+    db = AsyncDBManager(SQLiteDBManager(tmp_path / "offline.db"))
+    yield db
+    db.shutdown()
+
+
+def _record(i: int) -> ReplyRecord:
+    return ReplyRecord("买家A", "u1", "item1", f"问{i}", f"答{i}")
+
+
+def test_full_batch_flushes_before_interval(manager, async_db, tmp_path):
+    db = async_db
+    queue = WriteBehindQueue(batch_size=3, flush_interval=30, journal_path=tmp_path / "journal.jsonl", db=db)
+
+    async def run():
+        await queue.start()
+        acks = [queue.submit(_record(i)) for i in range(3)]
+        # 攒满一批立即写入，不等 flush_interval
+        results = await asyncio.wait_for(asyncio.gather(*acks), timeout=5)
+        # 不满一批时等待 flush_interval 后写入
+        queue.flush_interval = 0.05
+        single = await asyncio.wait_for(queue.submit(_record(3)), timeout=5)
+        await queue.stop()
+        return results, single
+
+    results, single = asyncio.run(run())
+    assert results == [True, True, True] and single is True
+    stats = queue.get_stats()
+    assert (stats['written'], stats['batches'], stats['pending']) == (4, 2, 0)
+    assert manager.get_conversation_count("u1") == 8
+
+
+def test_failed_records_ack_false_and_replay_after_restart(manager, async_db, offline_db, tmp_path):
+    journal = tmp_path / "journal.jsonl"
+    db, offline = async_db, offline_db
+
+    async def first_run():
+        queue = WriteBehindQueue(batch_size=10, flush_interval=0.01, journal_path=journal, db=db)
+        await queue.start()
+        # content 不能为空：中间这一条写入失败，不影响同批其他记录
+        acks = [
+            queue.submit(_record(0)),
+            queue.submit(ReplyRecord("买家A", "u1", "item1", None, "答")),
+            queue.submit(_record(2)),
+        ]
+        results = await asyncio.gather(*acks)
+        await queue.stop()
+        return queue, results
+
+    queue, results = asyncio.run(first_run())
+    assert results == [True, False, True]
+    assert queue.get_stats()['failures'] == 1
+    assert journal.exists()
+
+    # 数据库不可用时全部失败并保存到日志文件
+
+    async def offline_run():
+        queue = WriteBehindQueue(batch_size=10, flush_interval=0.01, journal_path=journal, db=offline)
+        await queue.start()
+        ack = queue.submit(_record(3))
+        result = await ack
+        await queue.stop()
+        return result
+
+    assert asyncio.run(offline_run()) is False
+    assert len(journal.read_text(encoding='utf-8').splitlines()) == 2
+
+    # 重启后重新写入日志中的记录（失败的那条仍然失败，重新保存）
+    async def restart():
+        queue = WriteBehindQueue(batch_size=10, flush_interval=0.01, journal_path=journal, db=db)
+        await queue.start()
+        await queue.stop()
+        return queue
+
+    queue = asyncio.run(restart())
+    assert queue.get_stats()['submitted'] == 2
+    assert queue.get_stats()['written'] == 1
+    assert [m['content'] for m in manager.get_conversation_history("u1", limit=20)][-2:] == ["问3", "答3"]
+    assert len(journal.read_text(encoding='utf-8').splitlines()) == 1
@@ -0,0 +1,70 @@
+"""测试消息去重（分桶过期、容量淘汰和 processed_messages 持久化，使用 SQLite 临时数据库）"""
+import asyncio
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from dedupe_store import DedupeStore, message_digest
+
+
+def test_message_digest():
+    assert len(message_digest("u1", "你好")) == 16
+    assert message_digest("u1", "你好") == message_digest("u1", "你好", [])
+    assert message_digest("u1", "你好") != message_digest("u2", "你好")
+    assert message_digest("u1", "你好", ["https://img/1.jpg"]) != message_digest("u1", "你好")
+
+
+def test_expiry_and_eviction():
+    store = DedupeStore(ttl=60, max_entries=3)
+    now = 1_000_000.0
+    a, b, c, d = (message_digest("u", text) for text in "abcd")
+
+    store.add(a, now)
+    store.add(b, now + 10)
+    assert store.check(a, now + 30) == 30
+    assert store.check(c, now + 30) is None
+    # 再次处理只更新时间，旧桶中的引用不会让它提前过期
+    store.add(a, now + 40)
+    assert store.check(a, now + 90) == 50
+    assert store.check(b, now + 90) is None
+    assert len(store) == 1
+    # 超过容量时淘汰最早的记录
+    store.add(b, now + 91)
+    store.add(c, now + 92)
+    store.add(d, now + 93)
+    assert store.check(a, now + 94) is None
+    assert store.check(d, now + 94) == 1
+
+    stats = store.get_stats()
+    assert stats['entries'] == 3
+    assert stats['expired'] == 1 and stats['evicted'] == 1
+    assert stats['hits'] == 3 and stats['checks'] == 6
+    assert stats['memory_kb'] > 0
+
+
+def test_persisted_records_survive_restart(sqlite_manager, async_db):
+    manager, db = sqlite_manager, async_db
+    fresh, stale = message_digest("u1", "在吗"), message_digest("u2", "还在吗")
+
+    async def run():
+        store = DedupeStore(ttl=60, persist=True, db=db)
+        store.add(fresh)
+        store.add(stale, time.time() - 120)
+        # add 不等待数据库，写入在后台合并完成
+        assert store.get_stats()['writes'] == 0
+        await store.flush()
+        assert store.get_stats()['writes'] == 1
+
+        restarted = DedupeStore(ttl=60, persist=True, db=db)
+        await restarted.load()
+        return restarted
+
+    restarted = asyncio.run(run())
+    assert restarted.check(fresh) is not None
+    assert restarted.check(stale) is None
+    assert restarted.get_stats()['loaded'] == 1
+    # 加载时删除了过期记录
+    assert len(manager.load_processed_messages(datetime(2000, 1, 1))) == 1
@@ -0,0 +1,31 @@
+"""测试消息合并窗口（按 user_id 记录，重名买家按头像区分，窗口顺延）"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from message_handler import MessageHandler
+
+
+def _item(buyer_name: str, avatar: str) -> dict:
+    return {'buyer_name': buyer_name, 'avatar': f"//img.test/{avatar}.jpg_80x80q90.jpg_.webp", 'index': 0}
+
+
+def test_windows_keyed_by_user_id():
+    handler = MessageHandler()
+    handler._open_merge_window(_item("买家A", "a1"), "买家A", "u1")
+    handler._open_merge_window(_item("买家A", "a2"), "买家A", "u2")
+    assert set(handler._merge_windows) == {"u1", "u2"}
+    assert handler.scheduler.is_scheduled('merge', "u1") and handler.scheduler.is_scheduled('merge', "u2")
+
+    # 同名买家按头像归入各自的窗口（头像地址尺寸后缀不同也视为同一张）
+    assert handler._find_merge_window(dict(_item("买家A", "a2"), avatar="https://img.test/a2.jpg")).user_id == "u2"
+    assert handler._extend_merge_window(_item("买家A", "a1"))
+    assert (handler._merge_windows["u1"].extensions, handler._merge_windows["u2"].extensions) == (1, 0)
+
+    # 同名但头像不同的新买家不并入已有窗口，需要进入会话处理
+    assert not handler._extend_merge_window(_item("买家A", "a3"))
+    # 已知 user_id 时按 user_id 查找
+    assert handler._find_merge_window({'buyer_name': "改名了", '_user_id': "u1"}).user_id == "u1"
+    handler._cancel_merge_timer("u1")
+    assert not handler.scheduler.is_scheduled('merge', "u1")
@@ -0,0 +1,76 @@
+"""测试延时任务调度（时间轮 + scheduled_actions 持久化，使用 SQLite 临时数据库）"""
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from scheduler import ActionScheduler, TimerWheel
+
+
+def test_timer_wheel_rounds_and_cancel():
+    wheel = TimerWheel(tick=1.0, slots=8)
+    start = wheel._current * 1.0
+    wheel.add("a", start + 3, "A")
+    wheel.add("b", start + 3 + 8 * 2, "B")  # 两圈之后，同一个槽
+    wheel.add("c", start + 5, "C")
+    assert wheel.remove("c") == (start + 5, "C")
+    assert len(wheel) == 2
+
+    assert wheel.advance(start + 2) == []
+    assert [key for key, _, _ in wheel.advance(start + 3)] == ["a"]
+    assert wheel.advance(start + 3 + 8) == []
+    assert [key for key, _, _ in wheel.advance(start + 3 + 8 * 2)] == ["b"]
+    assert len(wheel) == 0
+
+    # 已过期的条目在下一个 tick 触发；长时间未推进时也不会遗漏
+    wheel.add("late", start - 100)
+    wheel.add("far", start + 20 + 8 * 4)
+    expired = wheel.advance(start + 1000)
+    assert [key for key, _, _ in expired] == ["late", "far"]
+
+
+def test_scheduler_persists_and_reloads(sqlite_manager, async_db):
+    manager, db = sqlite_manager, async_db
+    fired = []
+
+    async def handler(key, payload):
+        fired.append((key, payload))
+
+    async def first_run():
+        scheduler = ActionScheduler(tick=0.01, flush_interval=60, db=db)
+        scheduler.register('inactive', handler)
+        await scheduler.start()
+        scheduler.schedule('inactive', "u1", 0.05, {'buyer_name': "买家A"})
+        scheduler.schedule('inactive', "u2", 3600, {'buyer_name': "买家B"})
+        scheduler.schedule('inactive', "u3", 3600)
+        assert scheduler.cancel('inactive', "u3")
+        scheduler.schedule('merge', "买家C", 3600, persist=False)
+        await asyncio.sleep(0.2)
+        stats = scheduler.get_stats()
+        await scheduler.stop()
+        return stats
+
+    stats = asyncio.run(first_run())
+    assert fired == [("u1", {'buyer_name': "买家A"})]
+    assert stats['inactive']['fired'] == 1
+    assert stats['inactive']['max_lag_ms'] >= 0
+    # 只有未到期的持久化任务留在数据库中
+    assert [(r['kind'], r['action_key']) for r in manager.get_scheduled_actions()] == [('inactive', "u2")]
+
+    # 模拟停机期间到期：重启后立即执行
+    manager.save_scheduled_actions([('inactive', "u2", manager.get_scheduled_actions()[0]['due_at'].replace(year=2000), '{"buyer_name": "买家B"}')], [])
+
+    async def second_run():
+        scheduler = ActionScheduler(tick=0.01, flush_interval=0.01, db=db)
+        scheduler.register('inactive', handler)
+        await scheduler.start()
+        await asyncio.sleep(0.2)
+        stats = scheduler.get_stats()
+        await scheduler.stop()
+        return stats
+
+    stats = asyncio.run(second_run())
+    assert fired[-1] == ("u2", {'buyer_name': "买家B"})
+    assert stats['inactive']['max_lag_ms'] > 1000
+    assert manager.get_scheduled_actions() == []
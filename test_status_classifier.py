@@ -0,0 +1,42 @@
+"""测试订单状态 / 系统消息分类器（长关键词优先、最靠前的关键词生效、页面脚本版本和规则）"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from status_classifier import CLASSIFIER_GLOBAL, CLASSIFIER_INSTALLER, StatusClassifier, loader_js
+
+MAPPING = {'待付款': '待付款', '等待买家付款': '待付款(拍下)', '交易成功': '已完成', '已发货': '已发货', 'a.b': '特殊'}
+
+
+def test_longest_keyword_at_earliest_position_wins():
+    classifier = StatusClassifier(MAPPING)
+    assert classifier.match_status("买家\n等待买家付款\n在吗") == '等待买家付款'
+    # 列表项中状态行在消息内容之前，最靠前的关键词生效
+    assert classifier.classify_status("买家\n已发货\n我已拍下，待付款") == '已发货'
+    assert classifier.classify_status("没有状态") == ''
+    assert classifier.classify_status("") == ''
+    # 关键词按字面匹配
+    assert classifier.classify_status("axb") == ''
+    assert classifier.classify_status("a.b") == '特殊'
+
+
+def test_system_messages_and_install_script():
+    classifier = StatusClassifier(MAPPING)
+    assert classifier.is_system_message("我已付款，等待你发货")
+    assert classifier.is_system_message("对方撤回了一条消息")
+    assert not classifier.is_system_message("什么时候发货")
+    assert not classifier.is_system_message("")
+    assert not StatusClassifier({}, ()).is_system_message("交易成功")
+
+    assert f"window.{CLASSIFIER_GLOBAL} = " in classifier.install_js
+    assert '"等待买家付款|交易成功|' in classifier.install_js
+    assert StatusClassifier(dict(MAPPING)).version == classifier.version
+    changed = StatusClassifier(dict(MAPPING, 已收货='已收货'))
+    assert changed.version != classifier.version
+    assert changed.rules['version'] == changed.version and changed.rules['statusMapping']['已收货'] == '已收货'
+
+    # 加载脚本定义按规则重建分类器的函数，本次运行写入的规则按 session 区分
+    script = loader_js(classifier.rules, 'run-1')
+    assert f"window.{CLASSIFIER_INSTALLER} = install" in script
+    assert 'stored.session === "run-1"' in script
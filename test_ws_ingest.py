@@ -0,0 +1,78 @@
+"""测试 WebSocket 帧解码（使用 fixtures/ws_frames.jsonl 离线回放，无需浏览器）"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+import pytest
+
+from xianyu_ws import FrameDecoder, GoofishFrameDecoder, WebSocketIngest, decode_recorded_frames, load_recorded_frames
+
+FIXTURE = Path(__file__).parent / "fixtures" / "ws_frames.jsonl"
+SELF_USER_ID = "1100000000"
+
+
+def test_decode_recorded_frames():
+    """回放记录的帧：心跳和加密帧被跳过，文本/图片/卖家消息被正确解析"""
+    messages = decode_recorded_frames(FIXTURE, GoofishFrameDecoder(SELF_USER_ID))
+    assert len(messages) == 3
+
+    text, image, seller = messages
+    assert text.sender == "buyer"
+    assert text.content == "这个还在吗"
+    assert text.buyer_name == "敌法师爱码"
+    assert text.user_id == "2200000001"
+    assert text.item_id == "890000001"
+    assert text.chat_id == "48830001"
+
+    assert image.content == ""
+    assert image.image_urls == ["https://img.alicdn.com/bao/uploaded/i1/test.jpg"]
+    assert image.item_id == "890000002"
+
+    assert seller.sender == "seller"
+
+
+def test_ingest_feed_queues_messages():
+    """WebSocketIngest.feed 把解码出的消息放入队列并回调"""
+    received = []
+    ingest = WebSocketIngest(decoder=GoofishFrameDecoder(SELF_USER_ID), on_message=received.append)
+    for payload in load_recorded_frames(FIXTURE):
+        ingest.feed(payload)
+
+    stats = ingest.get_stats()
+    assert stats["frames_received"] == 5
+    assert stats["messages_decoded"] == 3
+    assert stats["queued"] == 3
+    assert [m.buyer_name for m in received] == ["敌法师爱码", "小鱼买家", "我的小店"]
+
+
+def test_decoder_ignores_garbage():
+    """非 JSON / 结构不符的帧返回空列表"""
+    decoder = GoofishFrameDecoder()
+    assert decoder.decode("not json") == []
+    assert decoder.decode(b"\xff\xfe") == []
+    assert decoder.decode('{"body": {"syncPushPackage": {"data": [{"data": "!!!"}]}}}') == []
+
+
+def test_ingest_queue_is_bounded():
+    """没有消费者时队列只保留最近的消息"""
+    ingest = WebSocketIngest(decoder=GoofishFrameDecoder(SELF_USER_ID), max_queued=2)
+    for _ in range(2):
+        for payload in load_recorded_frames(FIXTURE):
+            ingest.feed(payload)
+
+    stats = ingest.get_stats()
+    assert stats["messages_decoded"] == 6
+    assert stats["queued"] == 2
+    assert stats["dropped"] == 4
+    assert ingest.messages.get_nowait().buyer_name == "小鱼买家"
+
+    with pytest.raises(TypeError):
+        FrameDecoder()
+
+
+if __name__ == "__main__":
+    for test in (test_decode_recorded_frames, test_ingest_feed_queues_messages, test_decoder_ignores_garbage,
+                 test_ingest_queue_is_bounded):
+        test()
+        print(f"[OK] {test.__name__}")
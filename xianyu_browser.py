@@ -1,11 +1,428 @@
 """闲鱼浏览器自动化模块"""
 import asyncio
-import json
-from typing import Optional, List, Dict
+import bisect
+import time
+import uuid
+from typing import Optional, List, Dict, Set
 from dataclasses import dataclass, field
 from playwright.async_api import async_playwright, Browser, Page, BrowserContext
 from loguru import logger
 from config import Config, CozeVars
+from status_classifier import CLASSIFIER_GLOBAL, CLASSIFIER_UPDATE_JS, loader_js
+
+
+# 解析单个会话列表项的 JavaScript 函数（会话列表轮询和未读监听共用）
+# 返回 {index, buyer_name, last_message, time, unread_count, order_status}，通知消息返回 null
+CONVERSATION_ITEM_PARSER_JS = r"""
+(item, index) => {
+    const allText = item.innerText;
+    const lines = allText.split('\n').filter(l => l.trim());
+
+    // 检查未读徽章
+    const badge = item.querySelector('.ant-badge-count');
+    let unreadCount = 0;
+    if (badge) {
+        const num = parseInt(badge.innerText);
+        unreadCount = isNaN(num) ? 1 : num;
+    }
+
+    // 提取订单状态并转换为简化状态（页面已安装的分类器）
+    const classifier = window.%(classifier)s;
+    const orderStatus = classifier ? classifier.status(allText) : '';
+
+    // 解析文本行
+    // 格式: [未读数] 名称 [状态] 消息内容 时间
+    let buyerName = '';
+    let lastMessage = '';
+    let timeStr = '';
+
+    if (lines.length >= 2) {
+        // 第一行可能是未读数或名称
+        let startIdx = 0;
+        if (/^\d+$/.test(lines[0])) {
+            startIdx = 1; // 跳过未读数
+        }
+        buyerName = lines[startIdx] || '';
+
+        // 最后一行是时间
+        timeStr = lines[lines.length - 1] || '';
+
+        // 倒数第二行通常是消息内容
+        if (lines.length > startIdx + 1) {
+            lastMessage = lines[lines.length - 2] || '';
+        }
+    }
+
+    // 跳过通知消息
+    if (buyerName === '通知消息') {
+        return null;
+    }
+
+    // 头像和商品缩略图（会话定位特征）：头像优先取 avatar 容器内的图片，否则取第一张；
+    // 商品缩略图为头像之外的最后一张图片
+    const images = Array.from(item.querySelectorAll('img')).map(img => img.src || '').filter(Boolean);
+    const avatarImg = item.querySelector('[class*="avatar"] img');
+    const avatar = avatarImg ? avatarImg.src : (images[0] || '');
+    const thumbs = images.filter(src => src !== avatar);
+    const itemThumb = thumbs.length ? thumbs[thumbs.length - 1] : '';
+
+    return {
+        index: index,
+        buyer_name: buyerName,
+        last_message: lastMessage,
+        time: timeStr,
+        unread_count: unreadCount,
+        order_status: orderStatus,
+        avatar: avatar,
+        item_thumb: itemThumb,
+    };
+}
+""" % {'classifier': CLASSIFIER_GLOBAL}
+
+
+# 读取整个会话列表（跳过通知消息）
+CONVERSATION_LIST_JS = r"""
+() => {
+    const items = document.querySelectorAll('[class*="conversation-item--"]');
+    const parseConversationItem = %(parser)s;
+    const result = [];
+    for (let i = 0; i < items.length; i++) {
+        const conv = parseConversationItem(items[i], i);
+        if (conv) {
+            result.push(conv);
+        }
+    }
+    return result;
+}
+""" % {'parser': CONVERSATION_ITEM_PARSER_JS}
+
+
+# 会话页面抓取脚本（单独调用和 get_conversation_snapshot 共用），参数 main 为聊天区域 <main> 元素
+
+# 提取当前会话的消息列表（包括图片）
+MESSAGES_JS = r"""
+(main) => {
+    const messages = [];
+    if (!main) return messages;
+
+    // 系统消息（下单、付款、发货等系统通知）由页面已安装的分类器识别
+    const classifier = window.%(classifier)s;
+
+    // 闲鱼消息结构: 使用 message-row 作为消息容器
+    // 通过头像位置区分买家/卖家: 头像在右边是卖家消息，头像在左边是买家消息
+    const msgRows = main.querySelectorAll('[class*="message-row--"]');
+
+    msgRows.forEach(row => {
+        // 获取消息内容元素
+        const contentEl = row.querySelector('[class*="message-content--"]');
+        const imageContainer = row.querySelector('[class*="image-container--"]');
+
+        // 通过头像位置判断发送者（更可靠，不受"已读"状态影响）
+        const avatar = row.querySelector('[class*="avatar"]');
+        let sender = 'buyer';  // 默认为买家
+        if (avatar && contentEl) {
+            const avatarRect = avatar.getBoundingClientRect();
+            const contentRect = contentEl.getBoundingClientRect();
+            // 头像在消息内容右边 = 卖家消息
+            sender = avatarRect.left > contentRect.left ? 'seller' : 'buyer';
+        }
+
+        // 提取图片URL（只提取原始格式，过滤掉处理过的webp预览版本）
+        const imageUrls = [];
+        if (imageContainer) {
+            const images = imageContainer.querySelectorAll('img');
+            images.forEach(img => {
+                const src = img.src || img.getAttribute('data-src');
+                if (src && src.includes('alicdn')) {
+                    // 过滤掉：占位图、缩略图、处理过的webp预览版本
+                    // 只保留原始格式（如 .heic, .jpg, .png 等，不带处理后缀）
+                    if (!src.includes('2-tps-2-2') &&
+                        !src.includes('_230x') &&
+                        !src.includes('_.webp')) {
+                        imageUrls.push(src);
+                    }
+                }
+            });
+        }
+
+        // 提取文本内容（去掉"已读"和"未读"标记）
+        let text = '';
+        if (contentEl) {
+            text = contentEl.innerText.replace('已读', '').replace('未读', '').trim();
+            // 如果内容只是"图片"两个字，说明是纯图片消息
+            if (text === '图片' && imageUrls.length > 0) {
+                text = '';
+            }
+        }
+
+        // 如果既没有文本也没有图片，跳过
+        if (!text && imageUrls.length === 0) return;
+
+        // 检查是否为系统消息
+        const isSystemMsg = !!(text && classifier && classifier.isSystem(text));
+
+        messages.push({
+            sender: sender,
+            content: text,
+            is_system: isSystemMsg,
+            image_urls: imageUrls
+        });
+    });
+
+    return messages;
+}
+""" % {'classifier': CLASSIFIER_GLOBAL}
+
+# 提取当前会话关联的商品信息（订单状态由页面已安装的分类器识别）
+PRODUCT_INFO_JS = r"""
+(main) => {
+    // 查找商品卡片（通常在聊天区域顶部）
+    if (!main) return {};
+
+    // 尝试多种选择器查找商品卡片
+    const card = main.querySelector('a[href*="item"], [class*="product"], [class*="goods"], [class*="item-card"], [class*="order-card"]');
+    if (!card) return {};
+
+    const text = card.innerText;
+    const lines = text.split('\n').filter(l => l.trim());
+
+    // 提取价格
+    let price = '';
+    const priceMatch = text.match(/[¥￥]([\d.]+)/);
+    if (priceMatch) {
+        price = priceMatch[1];
+    }
+
+    // 提取订单状态并转换为简化状态
+    const classifier = window.%(classifier)s;
+    const orderStatus = classifier ? classifier.status(text) : '';
+
+    return {
+        title: lines[0] || '',
+        price: price,
+        order_status: orderStatus,
+        info: text
+    };
+}
+""" % {'classifier': CLASSIFIER_GLOBAL}
+
+# 从"闲鱼号"链接中提取用户ID
+USER_ID_JS = r"""
+(main) => {
+    if (!main) return null;
+
+    // 查找包含 "闲鱼号" 的链接
+    const links = main.querySelectorAll('a[href*="personal?userId="]');
+    for (const link of links) {
+        const href = link.href || link.getAttribute('href');
+        if (href) {
+            const match = href.match(/userId=(\d+)/);
+            if (match) {
+                return match[1];
+            }
+        }
+    }
+
+    // 备选：查找所有链接，找包含 userId 参数的
+    const allLinks = main.querySelectorAll('a');
+    for (const link of allLinks) {
+        const href = link.href || link.getAttribute('href');
+        if (href && href.includes('userId=')) {
+            const match = href.match(/userId=(\d+)/);
+            if (match) {
+                return match[1];
+            }
+        }
+    }
+
+    return null;
+}
+"""
+
+# 从商品卡片链接中提取商品ID
+ITEM_ID_JS = r"""
+(main) => {
+    if (!main) return null;
+
+    // 查找商品链接
+    const itemLink = main.querySelector('a[href*="item?id="], a[href*="item.htm?id="]');
+    if (itemLink) {
+        const href = itemLink.href || itemLink.getAttribute('href');
+        if (href) {
+            const match = href.match(/[?&]id=(\d+)/);
+            if (match) {
+                return match[1];
+            }
+        }
+    }
+
+    // 备选：查找所有包含 item 和 id 的链接
+    const allLinks = main.querySelectorAll('a[href*="item"]');
+    for (const link of allLinks) {
+        const href = link.href || link.getAttribute('href');
+        if (href) {
+            const match = href.match(/[?&]id=(\d+)/);
+            if (match) {
+                return match[1];
+            }
+        }
+    }
+
+    return null;
+}
+"""
+
+
+# 页面就绪判断脚本（配合 page.wait_for_function 使用）
+
+# 进入会话就绪：头部"闲鱼号"链接和消息行已出现，且已切换到点击的买家，输入框可用
+# 参数 {prevHref: 点击前的闲鱼号链接, buyerName: 买家昵称}
+# 点击的序号可能已过期（列表重新排序），已知昵称时必须在会话中看到该昵称
+CONVERSATION_READY_JS = r"""
+({prevHref, buyerName}) => {
+    const main = document.querySelector('main');
+    if (!main) return false;
+    const link = main.querySelector('a[href*="personal?userId="]');
+    if (!link || !main.querySelector('[class*="message-row--"]')) return false;
+    if (!document.querySelector('textarea, [contenteditable="true"]')) return false;
+    if (buyerName) return main.innerText.includes(buyerName);
+    // 不知道昵称时以链接变化确认已切换到新会话
+    return link.href !== prevHref;
+}
+"""
+
+# 返回列表就绪：切到通知消息时闲鱼号链接消失，切到其他会话时链接出现
+GO_BACK_READY_JS = r"""
+(target) => {
+    const link = document.querySelector('main a[href*="personal?userId="]');
+    return target === 'notice' ? !link : !!link;
+}
+"""
+
+# 卖家消息状态（发送前记录，用于确认发送成功）
+SELLER_STATE_JS = r"""
+() => {
+    const messages = (%(messages_js)s)(document.querySelector('main'));
+    const sellers = messages.filter(m => m.sender === 'seller' && !m.is_system);
+    return {count: sellers.length, last: sellers.length ? sellers[sellers.length - 1].content : null};
+}
+""" % {'messages_js': MESSAGES_JS}
+
+# 发送确认：最后一条卖家消息包含已发送的内容，且与发送前的状态不同
+# 参数 {count, last: 发送前的卖家消息状态, content: 发送的内容}
+SEND_CONFIRMED_JS = r"""
+({count, last, content}) => {
+    const norm = s => (s || '').replace(/\s+/g, '');
+    const messages = (%(messages_js)s)(document.querySelector('main'));
+    const sellers = messages.filter(m => m.sender === 'seller' && !m.is_system);
+    if (!sellers.length) return false;
+    const current = sellers[sellers.length - 1].content;
+    const needle = norm(content).slice(0, 30);
+    if (!needle || !norm(current).includes(needle)) return false;
+    return sellers.length > count || current !== last;
+}
+""" % {'messages_js': MESSAGES_JS}
+
+# 未读会话监听脚本（注入页面）：监听会话列表 DOM 变化，把未读状态发生变化的会话推送给 Python
+# 通过 %(binding)s 绑定回调，%(parser)s 在安装时填入
+UNREAD_WATCH_JS = r"""
+(() => {
+    if (window.__xianyuUnreadWatch) return;
+    window.__xianyuUnreadWatch = true;
+
+    const parseConversationItem = %(parser)s;
+    const ITEM_SELECTOR = '[class*="conversation-item--"]';
+    // 上一次推送时每个会话的状态签名: buyer_name -> 签名
+    const lastSignatures = new Map();
+    let listObserver = null;
+    let listContainer = null;
+    let scanTimer = null;
+
+    const scan = () => {
+        scanTimer = null;
+        const items = document.querySelectorAll(ITEM_SELECTOR);
+        const changed = [];
+        for (let i = 0; i < items.length; i++) {
+            const conv = parseConversationItem(items[i], i);
+            if (!conv) continue;
+            const signature = conv.unread_count + '|' + conv.last_message + '|' + conv.time;
+            if (lastSignatures.get(conv.buyer_name) !== signature) {
+                lastSignatures.set(conv.buyer_name, signature);
+                if (conv.unread_count > 0) changed.push(conv);
+            }
+        }
+        if (changed.length > 0 && window.%(binding)s) {
+            window.%(binding)s(changed);
+        }
+    };
+
+    // 合并短时间内的多次 DOM 变化，只扫描一次
+    const scheduleScan = () => {
+        if (scanTimer === null) scanTimer = setTimeout(scan, %(debounce_ms)d);
+    };
+
+    // 会话列表容器可能被重新渲染，容器变化时重新绑定
+    const attach = () => {
+        const first = document.querySelector(ITEM_SELECTOR);
+        const container = first ? first.parentElement : null;
+        if (!container || container === listContainer) return;
+        if (listObserver) listObserver.disconnect();
+        listContainer = container;
+        listObserver = new MutationObserver(scheduleScan);
+        listObserver.observe(container, {childList: true, subtree: true, characterData: true});
+        scheduleScan();
+    };
+
+    const start = () => {
+        attach();
+        // 仅监听结构变化，用于发现会话列表容器的创建/替换
+        new MutationObserver(attach).observe(document.body, {childList: true, subtree: true});
+    };
+
+    if (document.body) {
+        start();
+    } else {
+        document.addEventListener('DOMContentLoaded', start);
+    }
+})();
+"""
+
+
+class LatencyHistogram:
+    """页面就绪耗时直方图（按事件分别统计，单位毫秒）"""
+
+    BUCKETS_MS = (50, 100, 200, 500, 1000, 2000, 5000)
+
+    def __init__(self):
+        self._events: Dict[str, Dict] = {}
+
+    def record(self, event: str, elapsed_ms: float, ready: bool = True):
+        stats = self._events.setdefault(event, {
+            'count': 0,
+            'timeouts': 0,
+            'total_ms': 0.0,
+            'max_ms': 0.0,
+            'buckets': [0] * (len(self.BUCKETS_MS) + 1),
+        })
+        stats['count'] += 1
+        if not ready:
+            stats['timeouts'] += 1
+        stats['total_ms'] += elapsed_ms
+        stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+        stats['buckets'][bisect.bisect_left(self.BUCKETS_MS, elapsed_ms)] += 1
+
+    def snapshot(self) -> dict:
+        labels = [f"<={b}ms" for b in self.BUCKETS_MS] + [f">{self.BUCKETS_MS[-1]}ms"]
+        result = {}
+        for event, stats in self._events.items():
+            result[event] = {
+                'count': stats['count'],
+                'timeouts': stats['timeouts'],
+                'avg_ms': round(stats['total_ms'] / stats['count'], 1) if stats['count'] else 0.0,
+                'max_ms': round(stats['max_ms'], 1),
+                'histogram': {label: n for label, n in zip(labels, stats['buckets']) if n},
+            }
+        return result
 
 
 @dataclass
@@ -16,6 +433,11 @@ class Message:
     timestamp: str = ""
     is_system: bool = False  # 是否为系统消息（如下单通知等）
     image_urls: List[str] = field(default_factory=list)  # 图片URL列表
+    # 以下字段仅 WebSocket 采集模式填充（DOM 抓取时为空）
+    user_id: str = ""  # 发送者用户ID
+    item_id: str = ""  # 关联商品ID
+    buyer_name: str = ""  # 买家昵称
+    chat_id: str = ""  # IM 会话ID
 
 
 class XianyuBrowser:
@@ -27,11 +449,157 @@ class XianyuBrowser:
         self.context: Optional[BrowserContext] = None
         self.page: Optional[Page] = None
         self.is_logged_in = False
+        # 未读会话推送（MutationObserver 监听模式）
+        self.unread_watch_enabled = False
+        self._unread_event = asyncio.Event()
+        # 推送过来但尚未处理的会话: buyer_name -> 会话信息
+        self._pushed_conversations: Dict[str, Dict] = {}
+        self.unread_push_count = 0
+        # WebSocket 采集模式（被动解析 IM 推送帧）
+        self.ws_ingest = None
+        # WebSocket 获取到的买家标识: buyer_name -> {'user_id', 'item_id'}
+        self._ws_hints: Dict[str, Dict] = {}
+        # 定位 WebSocket 消息对应会话的后台任务（保留引用，避免任务被回收）
+        self._ws_tasks: Set[asyncio.Task] = set()
+        # 页面就绪耗时统计（进入会话、发送确认、返回列表、会话快照）
+        self.readiness = LatencyHistogram()
+        # 已安装到浏览器上下文的分类器版本和加载脚本的 session（视图共用）
+        self._classifier_state = {'version': None, 'session': None}
+
+    @property
+    def push_enabled(self) -> bool:
+        """是否有推送来源（未读监听或 WebSocket 采集），有则消息循环改为等待推送"""
+        return self.unread_watch_enabled or self.ws_ingest is not None
+
+    def for_page(self, page: Page) -> 'XianyuBrowser':
+        """
+        创建操作指定标签页的浏览器视图（标签页池使用）
+
+        视图与当前浏览器共享上下文、WebSocket 买家标识和就绪耗时统计，
+        不负责启动或关闭浏览器。
+        """
+        view = XianyuBrowser()
+        view.playwright = self.playwright
+        view.context = self.context
+        view.page = page
+        view.is_logged_in = self.is_logged_in
+        view._ws_hints = self._ws_hints
+        view._classifier_state = self._classifier_state
+        view.readiness = self.readiness
+        return view
+
+    async def find_conversation(self, user_id: str, locator, buyer_name: str = "") -> Optional[Dict]:
+        """
+        进入 user_id 对应的会话，找到时停留在该会话中并返回它（昵称可能重复，进入后都会验证 user_id）
+
+        先按 locator（ConversationLocator）记录的会话特征（没有记录时按昵称）选出候选会话；
+        候选都不符时才逐个进入其余会话查找，扫描过程中顺便记录每个会话的特征。
+        """
+        conversations = await self.get_conversation_list()
+
+        # 1. 候选会话：按特征匹配度排序
+        candidates = locator.candidates(conversations, user_id, {'buyer_name': buyer_name})
+        target_conv = await self._enter_user_conversation(user_id, candidates, locator)
+        if target_conv is None and locator.get(user_id):
+            # 记录的特征已失效（头像、昵称变化或会话被删除）
+            await locator.forget(user_id)
+
+        # 2. 候选都不符时遍历其余会话
+        if target_conv is None:
+            remaining = [conv for conv in conversations if conv not in candidates]
+            locator.record(hit=False, scanned=bool(remaining))
+            if remaining:
+                logger.info(f"[定位] 未能直接定位 user_id={user_id}，逐个检查 {len(remaining)} 个会话")
+            target_conv = await self._enter_user_conversation(user_id, remaining, locator, delay=0.3)
+        else:
+            locator.record(hit=True)
+        return target_conv
+
+    async def _enter_user_conversation(self, user_id: str, conversations: List[Dict], locator,
+                                       delay: float = 0.0) -> Optional[Dict]:
+        """
+        依次进入会话验证 user_id，找到时停留在该会话中并返回它
+
+        每个进入过的会话都会记录定位特征（包括不符的会话，供之后定位其他用户）。
+        """
+        for conv in conversations:
+            if not await self.enter_conversation(conv):
+                continue
+            # enter_conversation 已等待闲鱼号链接出现，读取一次即可（不再每个会话重试十秒）
+            conv_user_id = await self.get_user_id(max_retries=1)
+            if conv_user_id:
+                await locator.learn(conv_user_id, conv)
+            if conv_user_id == user_id:
+                return conv
+            await self.go_back_to_list()
+            if delay:
+                await asyncio.sleep(delay)
+        return None
+
+    def get_readiness_stats(self) -> dict:
+        """获取页面就绪耗时统计"""
+        return self.readiness.snapshot()
+
+    async def _wait_ready(self, event: str, predicate: str, arg=None,
+                          timeout_ms: int = None, min_delay: float = 0.0) -> bool:
+        """
+        等待页面就绪条件成立，并记录耗时
 
-    def _get_status_mapping_js(self) -> str:
-        """获取订单状态映射的 JavaScript 对象字符串（仅映射值）"""
-        status_mapping = CozeVars.get_status_mapping_simple()
-        return json.dumps(status_mapping, ensure_ascii=False)
+        Args:
+            event: 统计事件名
+            predicate: 传给 page.wait_for_function 的判断脚本
+            arg: 判断脚本的参数
+            timeout_ms: 超时时间（毫秒），默认 Config.READINESS_TIMEOUT_MS
+            min_delay: 最短等待时间（秒），就绪后不足此时间则补足
+
+        Returns:
+            bool: 是否在超时前就绪
+        """
+        if timeout_ms is None:
+            timeout_ms = Config.READINESS_TIMEOUT_MS
+
+        started_at = time.perf_counter()
+        ready = True
+        try:
+            await self.page.wait_for_function(predicate, arg=arg, timeout=timeout_ms)
+        except Exception:
+            ready = False
+        elapsed = time.perf_counter() - started_at
+        self.readiness.record(event, elapsed * 1000, ready)
+
+        if elapsed < min_delay:
+            await asyncio.sleep(min_delay - elapsed)
+        return ready
+
+    async def _ensure_classifier(self):
+        """
+        在浏览器上下文中安装订单状态 / 系统消息分类器
+
+        加载脚本只通过 add_init_script 注册一次，之后新建或刷新的页面自动安装；已打开的页面立即安装一次。
+        变量配置修改后分类器版本变化，只把新规则传入已打开的页面（同时写入 localStorage，
+        之后加载的同源页面由加载脚本读取），不再重复注册脚本。
+        """
+        classifier = CozeVars.get_classifier()
+        state = self._classifier_state
+        if state['version'] == classifier.version or not self.context:
+            return
+        state['version'] = classifier.version
+        if state['session'] is None:
+            state['session'] = uuid.uuid4().hex
+            script = loader_js(classifier.rules, state['session'])
+            await self.context.add_init_script(script)
+            await self._evaluate_in_pages(script)
+        else:
+            await self._evaluate_in_pages(CLASSIFIER_UPDATE_JS, {'session': state['session'], 'rules': classifier.rules})
+        logger.debug(f"已安装订单状态分类器: {classifier.version}")
+
+    async def _evaluate_in_pages(self, script: str, arg=None):
+        """在已打开的页面中执行分类器脚本（失败的页面加载后由加载脚本安装）"""
+        for page in self.context.pages:
+            try:
+                await page.evaluate(script, arg)
+            except Exception as e:
+                logger.debug(f"安装分类器失败（页面加载后由初始化脚本安装）: {e}")
 
     async def start(self):
         """启动浏览器"""
@@ -51,10 +619,20 @@ class XianyuBrowser:
         else:
             self.page = await self.context.new_page()
 
+        # 订单状态 / 系统消息分类器在页面加载前注册，所有页面自动安装
+        await self._ensure_classifier()
+
+        # WebSocket 采集需在页面加载前监听，才能捕获 IM 连接
+        if Config.WS_INGEST_ENABLED:
+            self.enable_ws_ingest()
+
         logger.info("浏览器已启动")
 
     async def close(self):
         """关闭浏览器"""
+        logger.info(f"页面就绪耗时统计: {self.readiness.snapshot()}")
+        for task in list(self._ws_tasks):
+            task.cancel()
         if self.context:
             await self.context.close()
         if self.playwright:
@@ -105,82 +683,11 @@ class XianyuBrowser:
     async def get_conversation_list(self) -> List[Dict]:
         """获取会话列表"""
         try:
-            # 获取可配置的状态映射
-            status_mapping_js = self._get_status_mapping_js()
+            # 订单状态分类器随变量配置更新（未变化时不重新安装）
+            await self._ensure_classifier()
 
             # 使用JavaScript获取会话列表
-            conversations = await self.page.evaluate(f"""
-                () => {{
-                    const items = document.querySelectorAll('[class*="conversation-item--"]');
-                    const result = [];
-
-                    // 订单状态映射表：从配置文件动态加载
-                    const statusMapping = {status_mapping_js};
-                    const orderStatusKeywords = Object.keys(statusMapping);
-
-                    for (let i = 0; i < items.length; i++) {{
-                        const item = items[i];
-                        const allText = item.innerText;
-                        const lines = allText.split('\\n').filter(l => l.trim());
-
-                        // 检查未读徽章
-                        const badge = item.querySelector('.ant-badge-count');
-                        let unreadCount = 0;
-                        if (badge) {{
-                            const num = parseInt(badge.innerText);
-                            unreadCount = isNaN(num) ? 1 : num;
-                        }}
-
-                        // 提取订单状态并转换为简化状态
-                        let orderStatus = '';
-                        for (const keyword of orderStatusKeywords) {{
-                            if (allText.includes(keyword)) {{
-                                orderStatus = statusMapping[keyword];
-                                break;
-                            }}
-                        }}
-
-                        // 解析文本行
-                        // 格式: [未读数] 名称 [状态] 消息内容 时间
-                        let buyerName = '';
-                        let lastMessage = '';
-                        let timeStr = '';
-
-                        if (lines.length >= 2) {{
-                            // 第一行可能是未读数或名称
-                            let startIdx = 0;
-                            if (/^\\d+$/.test(lines[0])) {{
-                                startIdx = 1; // 跳过未读数
-                            }}
-                            buyerName = lines[startIdx] || '';
-
-                            // 最后一行是时间
-                            timeStr = lines[lines.length - 1] || '';
-
-                            // 倒数第二行通常是消息内容
-                            if (lines.length > startIdx + 1) {{
-                                lastMessage = lines[lines.length - 2] || '';
-                            }}
-                        }}
-
-                        // 跳过通知消息
-                        if (buyerName === '通知消息') {{
-                            continue;
-                        }}
-
-                        result.push({{
-                            index: i,
-                            buyer_name: buyerName,
-                            last_message: lastMessage,
-                            time: timeStr,
-                            unread_count: unreadCount,
-                            order_status: orderStatus,
-                        }});
-                    }}
-
-                    return result;
-                }}
-            """)
+            conversations = await self.page.evaluate(CONVERSATION_LIST_JS)
 
             # 使用 debug 级别，避免日志刷屏
             logger.debug(f"找到 {len(conversations)} 个会话")
@@ -199,32 +706,144 @@ class XianyuBrowser:
             logger.info(f"找到 {len(unread)} 个未读会话")
         return unread
 
+    async def enable_unread_watch(self) -> bool:
+        """
+        启用未读会话推送模式
+
+        在页面中注入 MutationObserver 监听会话列表和未读徽章，
+        有变化时通过 page.expose_binding 回调推送给 Python，由 wait_for_unread_changes 取出。
+        脚本通过 add_init_script 注册，页面刷新后会自动重新安装。
+
+        Returns:
+            是否启用成功
+        """
+        if self.unread_watch_enabled:
+            return True
+        try:
+            await self.page.expose_binding("__xianyuUnreadChanged", self._on_unread_changed)
+            script = UNREAD_WATCH_JS % {
+                'binding': '__xianyuUnreadChanged',
+                'parser': CONVERSATION_ITEM_PARSER_JS,
+                'debounce_ms': Config.UNREAD_WATCH_DEBOUNCE_MS,
+            }
+            await self.page.add_init_script(script)
+            # 当前页面已加载完成，立即安装一次
+            await self.page.evaluate(script)
+            self.unread_watch_enabled = True
+            logger.info("未读会话推送已启用 (MutationObserver)")
+            return True
+        except Exception as e:
+            logger.warning(f"启用未读会话推送失败，使用轮询模式: {e}")
+            return False
+
+    def _on_unread_changed(self, source, conversations: List[Dict]):
+        """页面推送回调：记录发生变化的未读会话并唤醒等待方"""
+        for conv in conversations or []:
+            self._pushed_conversations[conv.get('buyer_name', '')] = conv
+        self.unread_push_count += 1
+        self._unread_event.set()
+
+    def enable_ws_ingest(self, decoder=None):
+        """
+        启用 WebSocket 采集模式
+
+        被动解析 IM 推送帧，买家消息到达时记录 user_id / item_id 并唤醒消息循环，
+        处理会话时页面读取不到用户ID和商品ID时使用记录的标识。
+        使用默认解码器时需要配置 WS_SELF_USER_ID，否则不启用。
+        """
+        from xianyu_ws import WebSocketIngest
+
+        if decoder is None and not Config.WS_SELF_USER_ID:
+            # 无法区分卖家自己的消息，所有消息都会被当作买家消息
+            logger.error("[WS] 未配置 WS_SELF_USER_ID，无法区分买家/卖家消息，不启用 WebSocket 采集")
+            return
+
+        self.ws_ingest = WebSocketIngest(
+            decoder=decoder,
+            record_path=Config.WS_RECORD_FILE or None,
+            on_message=self._on_ws_message,
+        )
+        self.ws_ingest.attach(self.page)
+
+    def _on_ws_message(self, message: Message):
+        """WebSocket 解码出消息：记录买家标识，并定位对应会话推送给消息循环"""
+        if message.sender != 'buyer' or not message.buyer_name:
+            return
+        self._ws_hints[message.buyer_name] = {
+            'user_id': message.user_id,
+            'item_id': message.item_id,
+        }
+        logger.debug(f"[WS] 收到买家消息: {message.buyer_name} (user_id={message.user_id}, item_id={message.item_id})")
+        task = asyncio.create_task(self._push_ws_conversation(message.buyer_name))
+        self._ws_tasks.add(task)
+        task.add_done_callback(self._ws_tasks.discard)
+
+    async def _push_ws_conversation(self, buyer_name: str):
+        """在会话列表中查找 WebSocket 消息对应的会话（只读列表，不进入会话）"""
+        for conv in await self.get_conversation_list():
+            if conv.get('buyer_name') == buyer_name:
+                self._pushed_conversations[buyer_name] = conv
+                self._unread_event.set()
+                return
+
+    def pop_ws_hint(self, buyer_name: str) -> Dict:
+        """取出 WebSocket 记录的买家标识（user_id / item_id），没有时返回空字典"""
+        return self._ws_hints.pop(buyer_name, {})
+
+    async def wait_for_unread_changes(self, timeout: float) -> Optional[List[Dict]]:
+        """
+        等待页面推送未读会话变化
+
+        Args:
+            timeout: 最长等待时间（秒）
+
+        Returns:
+            发生变化的未读会话列表；超时返回 None（调用方应执行一次全量轮询兜底）
+        """
+        if not self._pushed_conversations:
+            self._unread_event.clear()
+            try:
+                await asyncio.wait_for(self._unread_event.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                return None
+
+        changed = list(self._pushed_conversations.values())
+        self._pushed_conversations.clear()
+        self._unread_event.clear()
+        if changed:
+            logger.info(f"收到 {len(changed)} 个未读会话推送")
+        return changed
+
     async def enter_conversation(self, conversation: Dict) -> bool:
         """进入指定会话"""
         try:
             index = conversation.get("index", 0)
-            # 点击对应的会话项
-            result = await self.page.evaluate(f"""
-                (idx) => {{
+            buyer_name = conversation.get("buyer_name")
+            # 点击对应的会话项（同时记录点击前的闲鱼号链接，用于判断是否已切换）
+            result = await self.page.evaluate("""
+                (idx) => {
                     const items = document.querySelectorAll('[class*="conversation-item--"]');
-                    if (items[idx]) {{
-                        items[idx].click();
-                        return true;
-                    }}
-                    return false;
-                }}
+                    if (!items[idx]) return null;
+                    const link = document.querySelector('main a[href*="personal?userId="]');
+                    const prevHref = link ? link.href : null;
+                    items[idx].click();
+                    return {prevHref};
+                }
             """, index)
 
-            if result:
-                # 使用配置的延迟时间，等待会话内容和输入框加载
-                enter_delay = Config.CONVERSATION_ENTER_DELAY
-                await asyncio.sleep(enter_delay)
-                # 等待输入框出现
-                try:
-                    await self.page.wait_for_selector('textarea, [contenteditable="true"]', timeout=3000)
-                except:
-                    logger.warning(f"等待输入框超时，但仍继续: {conversation.get('buyer_name')}")
-                logger.info(f"进入会话: {conversation.get('buyer_name')}")
+            if result is not None:
+                # 等待会话就绪（闲鱼号链接、消息行、输入框），CONVERSATION_ENTER_DELAY 作为最短等待时间
+                ready = await self._wait_ready(
+                    'enter',
+                    CONVERSATION_READY_JS,
+                    arg={'prevHref': result.get('prevHref'), 'buyerName': buyer_name},
+                    min_delay=Config.CONVERSATION_ENTER_DELAY,
+                )
+                if not ready:
+                    # 超时：会话未加载完成，或进入的不是该买家的会话（列表已重新排序）
+                    logger.warning(f"等待会话加载超时或进入的会话不是该买家: {buyer_name}")
+                    return False
+                logger.info(f"进入会话: {buyer_name}")
                 return True
             return False
         except Exception as e:
@@ -237,162 +856,29 @@ class XianyuBrowser:
             await asyncio.sleep(0.5)
 
             # 使用JavaScript获取消息（包括图片）
-            messages_data = await self.page.evaluate("""
-                () => {
-                    const messages = [];
-                    const main = document.querySelector('main');
-                    if (!main) return messages;
-
-                    // 闲鱼系统消息关键词（下单、付款、发货等系统通知）
-                    const systemMessageKeywords = [
-                        '我已拍下，待付款',
-                        '我已付款，等待你发货',
-                        '请双方沟通及时确认价格',
-                        '请包装好商品',
-                        '你已发货',
-                        '已发货，等待买家确认',
-                        '买家已确认收货',
-                        '交易成功',
-                        '交易关闭',
-                        '订单已取消',
-                        '退款成功',
-                        '申请退款',
-                        '你撤回了一条消息',
-                        '对方撤回了一条消息',
-                        '对方正在输入',
-                    ];
-
-                    // 闲鱼消息结构: 使用 message-row 作为消息容器
-                    // 通过头像位置区分买家/卖家: 头像在右边是卖家消息，头像在左边是买家消息
-                    const msgRows = main.querySelectorAll('[class*="message-row--"]');
-
-                    msgRows.forEach(row => {
-                        // 获取消息内容元素
-                        const contentEl = row.querySelector('[class*="message-content--"]');
-                        const imageContainer = row.querySelector('[class*="image-container--"]');
-
-                        // 通过头像位置判断发送者（更可靠，不受"已读"状态影响）
-                        const avatar = row.querySelector('[class*="avatar"]');
-                        let sender = 'buyer';  // 默认为买家
-                        if (avatar && contentEl) {
-                            const avatarRect = avatar.getBoundingClientRect();
-                            const contentRect = contentEl.getBoundingClientRect();
-                            // 头像在消息内容右边 = 卖家消息
-                            sender = avatarRect.left > contentRect.left ? 'seller' : 'buyer';
-                        }
-
-                        // 提取图片URL（只提取原始格式，过滤掉处理过的webp预览版本）
-                        const imageUrls = [];
-                        if (imageContainer) {
-                            const images = imageContainer.querySelectorAll('img');
-                            images.forEach(img => {
-                                const src = img.src || img.getAttribute('data-src');
-                                if (src && src.includes('alicdn')) {
-                                    // 过滤掉：占位图、缩略图、处理过的webp预览版本
-                                    // 只保留原始格式（如 .heic, .jpg, .png 等，不带处理后缀）
-                                    if (!src.includes('2-tps-2-2') &&
-                                        !src.includes('_230x') &&
-                                        !src.includes('_.webp')) {
-                                        imageUrls.push(src);
-                                    }
-                                }
-                            });
-                        }
-
-                        // 提取文本内容（去掉"已读"和"未读"标记）
-                        let text = '';
-                        if (contentEl) {
-                            text = contentEl.innerText.replace('已读', '').replace('未读', '').trim();
-                            // 如果内容只是"图片"两个字，说明是纯图片消息
-                            if (text === '图片' && imageUrls.length > 0) {
-                                text = '';
-                            }
-                        }
-
-                        // 如果既没有文本也没有图片，跳过
-                        if (!text && imageUrls.length === 0) return;
-
-                        // 检查是否为系统消息
-                        let isSystemMsg = false;
-                        if (text) {
-                            for (const keyword of systemMessageKeywords) {
-                                if (text.includes(keyword)) {
-                                    isSystemMsg = true;
-                                    break;
-                                }
-                            }
-                        }
-
-                        messages.push({
-                            sender: sender,
-                            content: text,
-                            is_system: isSystemMsg,
-                            image_urls: imageUrls
-                        });
-                    });
-
-                    return messages;
-                }
-            """)
-
-            return [Message(
-                sender=m["sender"],
-                content=m["content"],
-                is_system=m.get("is_system", False),
-                image_urls=m.get("image_urls", [])
-            ) for m in messages_data]
+            await self._ensure_classifier()
+            messages_data = await self.page.evaluate(f"() => ({MESSAGES_JS})(document.querySelector('main'))")
+            return self._to_messages(messages_data)
 
         except Exception as e:
             logger.error(f"获取消息列表失败: {e}")
             return []
 
+    @staticmethod
+    def _to_messages(messages_data: List[Dict]) -> List[Message]:
+        """把页面脚本返回的消息数据转换为 Message 列表"""
+        return [Message(
+            sender=m["sender"],
+            content=m["content"],
+            is_system=m.get("is_system", False),
+            image_urls=m.get("image_urls", [])
+        ) for m in messages_data or []]
+
     async def get_product_info(self) -> Dict:
         """获取当前会话关联的商品信息"""
         try:
-            # 获取可配置的状态映射
-            status_mapping_js = self._get_status_mapping_js()
-
-            product = await self.page.evaluate(f"""
-                () => {{
-                    // 查找商品卡片（通常在聊天区域顶部）
-                    const main = document.querySelector('main');
-                    if (!main) return {{}};
-
-                    // 尝试多种选择器查找商品卡片
-                    const card = main.querySelector('a[href*="item"], [class*="product"], [class*="goods"], [class*="item-card"], [class*="order-card"]');
-                    if (!card) return {{}};
-
-                    const text = card.innerText;
-                    const lines = text.split('\\n').filter(l => l.trim());
-
-                    // 提取价格
-                    let price = '';
-                    const priceMatch = text.match(/[¥￥]([\\d.]+)/);
-                    if (priceMatch) {{
-                        price = priceMatch[1];
-                    }}
-
-                    // 订单状态映射表：从配置文件动态加载
-                    const statusMapping = {status_mapping_js};
-                    const orderStatusKeywords = Object.keys(statusMapping);
-
-                    // 提取订单状态并转换为简化状态
-                    let orderStatus = '';
-                    for (const keyword of orderStatusKeywords) {{
-                        if (text.includes(keyword)) {{
-                            orderStatus = statusMapping[keyword];
-                            break;
-                        }}
-                    }}
-
-                    return {{
-                        title: lines[0] || '',
-                        price: price,
-                        order_status: orderStatus,
-                        info: text
-                    }};
-                }}
-            """)
+            await self._ensure_classifier()
+            product = await self.page.evaluate(f"() => ({PRODUCT_INFO_JS})(document.querySelector('main'))")
             return product
         except Exception as e:
             logger.debug(f"获取商品信息失败: {e}")
@@ -413,38 +899,7 @@ class XianyuBrowser:
         """
         for attempt in range(max_retries):
             try:
-                user_id = await self.page.evaluate("""
-                    () => {
-                        const main = document.querySelector('main');
-                        if (!main) return null;
-
-                        // 查找包含 "闲鱼号" 的链接
-                        const links = main.querySelectorAll('a[href*="personal?userId="]');
-                        for (const link of links) {
-                            const href = link.href || link.getAttribute('href');
-                            if (href) {
-                                const match = href.match(/userId=(\d+)/);
-                                if (match) {
-                                    return match[1];
-                                }
-                            }
-                        }
-
-                        // 备选：查找所有链接，找包含 userId 参数的
-                        const allLinks = main.querySelectorAll('a');
-                        for (const link of allLinks) {
-                            const href = link.href || link.getAttribute('href');
-                            if (href && href.includes('userId=')) {
-                                const match = href.match(/userId=(\d+)/);
-                                if (match) {
-                                    return match[1];
-                                }
-                            }
-                        }
-
-                        return null;
-                    }
-                """)
+                user_id = await self.page.evaluate(f"() => ({USER_ID_JS})(document.querySelector('main'))")
 
                 if user_id:
                     logger.debug(f"获取到用户ID: {user_id}")
@@ -477,38 +932,7 @@ class XianyuBrowser:
         """
         for attempt in range(max_retries):
             try:
-                item_id = await self.page.evaluate("""
-                    () => {
-                        const main = document.querySelector('main');
-                        if (!main) return null;
-
-                        // 查找商品链接
-                        const itemLink = main.querySelector('a[href*="item?id="], a[href*="item.htm?id="]');
-                        if (itemLink) {
-                            const href = itemLink.href || itemLink.getAttribute('href');
-                            if (href) {
-                                const match = href.match(/[?&]id=(\d+)/);
-                                if (match) {
-                                    return match[1];
-                                }
-                            }
-                        }
-
-                        // 备选：查找所有包含 item 和 id 的链接
-                        const allLinks = main.querySelectorAll('a[href*="item"]');
-                        for (const link of allLinks) {
-                            const href = link.href || link.getAttribute('href');
-                            if (href) {
-                                const match = href.match(/[?&]id=(\d+)/);
-                                if (match) {
-                                    return match[1];
-                                }
-                            }
-                        }
-
-                        return null;
-                    }
-                """)
+                item_id = await self.page.evaluate(f"() => ({ITEM_ID_JS})(document.querySelector('main'))")
 
                 if item_id:
                     logger.debug(f"获取到商品ID: {item_id}")
@@ -526,6 +950,75 @@ class XianyuBrowser:
         logger.debug("未能获取商品ID（可能是已完成交易的会话）")
         return None
 
+    async def get_conversation_snapshot(self, require_user_id: bool = True, timeout_ms: int = None) -> Dict:
+        """
+        一次页面调用获取当前会话的商品信息、用户ID、商品ID和消息列表
+
+        先通过 page.wait_for_function 等待页面锚点出现（"闲鱼号"链接和消息行），
+        再在同一个页面脚本中完成全部抓取，替代分别调用 get_product_info / get_user_id /
+        get_item_id / get_current_conversation_messages 时的固定等待和重试。
+
+        Args:
+            require_user_id: 是否等待"闲鱼号"链接出现（已通过其他途径获取用户ID时可关闭）
+            timeout_ms: 等待锚点的超时时间（毫秒），默认 Config.SNAPSHOT_WAIT_TIMEOUT_MS
+
+        Returns:
+            dict: {
+                'product': 商品信息,
+                'user_id': 用户ID或None,
+                'item_id': 商品ID或None,
+                'messages': List[Message],
+                'waited_ms': 等待锚点耗时（毫秒）,
+                'ready': 锚点是否在超时前出现,
+            }
+        """
+        if timeout_ms is None:
+            timeout_ms = Config.SNAPSHOT_WAIT_TIMEOUT_MS
+
+        started_at = time.perf_counter()
+        ready = await self._wait_ready(
+            'snapshot',
+            """(requireUserId) => {
+                const main = document.querySelector('main');
+                if (!main || !main.querySelector('[class*="message-row--"]')) return false;
+                return !requireUserId || !!main.querySelector('a[href*="userId="]');
+            }""",
+            arg=require_user_id,
+            timeout_ms=timeout_ms,
+        )
+        waited_ms = (time.perf_counter() - started_at) * 1000
+
+        data = {}
+        try:
+            await self._ensure_classifier()
+            data = await self.page.evaluate(
+                f"""() => {{
+                    const main = document.querySelector('main');
+                    return {{
+                        product: ({PRODUCT_INFO_JS})(main),
+                        user_id: ({USER_ID_JS})(main),
+                        item_id: ({ITEM_ID_JS})(main),
+                        messages: ({MESSAGES_JS})(main),
+                    }};
+                }}"""
+            )
+        except Exception as e:
+            logger.error(f"获取会话快照失败: {e}")
+
+        if ready:
+            logger.debug(f"会话快照就绪，等待 {waited_ms:.0f}ms")
+        else:
+            logger.warning(f"等待会话页面锚点超时 ({waited_ms:.0f}ms)，使用当前页面内容")
+
+        return {
+            'product': data.get('product') or {},
+            'user_id': data.get('user_id'),
+            'item_id': data.get('item_id'),
+            'messages': self._to_messages(data.get('messages')),
+            'waited_ms': waited_ms,
+            'ready': ready,
+        }
+
     async def send_message(self, content: str) -> bool:
         """发送消息"""
         max_retries = 3
@@ -559,10 +1052,11 @@ class XianyuBrowser:
                         logger.error("未找到消息输入框，已达最大重试次数")
                         return False
 
+                # 记录发送前的卖家消息状态，用于确认发送成功
+                before = await self.page.evaluate(SELLER_STATE_JS)
+
                 await input_elem.click()
-                await asyncio.sleep(0.2)
                 await input_elem.fill(content)
-                await asyncio.sleep(0.2)
 
                 # 点击发送按钮或按回车
                 send_selectors = [
@@ -583,8 +1077,18 @@ class XianyuBrowser:
                 else:
                     await input_elem.press("Enter")
 
-                await asyncio.sleep(0.5)
-                logger.info(f"消息已发送: {content[:50]}...")
+                # 等待已发送的消息气泡出现在页面中
+                confirmed = await self._wait_ready(
+                    'send',
+                    SEND_CONFIRMED_JS,
+                    arg={'count': before['count'], 'last': before['last'], 'content': content},
+                    min_delay=Config.BROWSER_ACTION_MIN_DELAY,
+                )
+                if confirmed:
+                    logger.info(f"消息已发送: {content[:50]}...")
+                else:
+                    # 已点击发送，不再重试以免重复发送
+                    logger.warning(f"消息已提交但未在页面中确认: {content[:50]}...")
                 return True
 
             except Exception as e:
@@ -601,23 +1105,26 @@ class XianyuBrowser:
         """切换到通知消息，让其他会话的新消息能显示未读"""
         try:
             # 点击"通知消息"来取消当前会话的选中状态
-            await self.page.evaluate("""
+            target = await self.page.evaluate("""
                 () => {
                     const items = document.querySelectorAll('[class*="conversation-item--"]');
                     for (let item of items) {
                         if (item.innerText.includes('通知消息')) {
                             item.click();
-                            return true;
+                            return 'notice';
                         }
                     }
                     // 如果没有通知消息，点击第一个会话
                     if (items.length > 0) {
                         items[0].click();
-                        return true;
+                        return 'first';
                     }
-                    return false;
+                    return null;
                 }
             """)
-            await asyncio.sleep(0.3)  # 短暂等待页面响应
+            if target:
+                # 等待页面切换完成
+                await self._wait_ready('go_back', GO_BACK_READY_JS, arg=target,
+                                       min_delay=Config.BROWSER_ACTION_MIN_DELAY)
         except Exception as e:
             logger.debug(f"切换会话失败: {e}")
@@ -0,0 +1,232 @@
+"""闲鱼 IM WebSocket 消息采集模块 - 被动解析推送帧，无需进入会话即可获取买家消息"""
+import asyncio
+import base64
+import json
+import re
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional, Union
+from loguru import logger
+from config import Config, CozeVars
+from xianyu_browser import Message
+
+
+class FrameDecoder(ABC):
+    """
+    WebSocket 帧解码器基类
+
+    子类实现 decode()，把一个原始帧解析为 Message 列表（无法识别的帧返回空列表）。
+    可通过 WebSocketIngest(decoder=...) 替换为自定义实现（如处理加密载荷）。
+    """
+
+    @abstractmethod
+    def decode(self, payload: Union[str, bytes]) -> List[Message]:
+        ...
+
+
+class GoofishFrameDecoder(FrameDecoder):
+    """
+    闲鱼网页版 IM 推送帧解码器
+
+    推送帧结构（lwp 协议）:
+        {"lwp": "/s/para", "body": {"syncPushPackage": {"data": [{"data": "<base64>"}, ...]}}}
+
+    base64 解码后为 JSON 的消息体:
+        {"1": {"2": "会话ID@goofish", "5": 时间戳毫秒,
+               "6": {"3": {"5": "<内容JSON字符串>"}},
+               "10": {"reminderContent": 消息文本, "reminderTitle": 买家昵称,
+                      "senderUserId": 发送者ID, "reminderUrl": "...itemId=商品ID..."}}}
+
+    非 JSON 的载荷（加密消息）会被跳过。
+    """
+
+    ITEM_ID_PATTERN = re.compile(r'itemId=(\d+)')
+
+    def __init__(self, self_user_id: str = ""):
+        # 卖家自己的用户ID，用于区分买家/卖家消息
+        self.self_user_id = self_user_id
+
+    def decode(self, payload: Union[str, bytes]) -> List[Message]:
+        if isinstance(payload, bytes):
+            try:
+                payload = payload.decode('utf-8')
+            except UnicodeDecodeError:
+                return []
+        try:
+            frame = json.loads(payload)
+        except (json.JSONDecodeError, TypeError):
+            return []
+        if not isinstance(frame, dict):
+            return []
+
+        body = frame.get('body') or {}
+        if not isinstance(body, dict):
+            return []
+        packages = (body.get('syncPushPackage') or {}).get('data') or []
+
+        messages = []
+        for package in packages:
+            encoded = package.get('data') if isinstance(package, dict) else None
+            if not encoded:
+                continue
+            message = self._decode_package(encoded)
+            if message:
+                messages.append(message)
+        return messages
+
+    def _decode_package(self, encoded: str) -> Optional[Message]:
+        """解码单条推送数据"""
+        try:
+            data = json.loads(base64.b64decode(encoded).decode('utf-8'))
+        except Exception:
+            # 加密载荷或非消息数据
+            return None
+
+        body = data.get('1') if isinstance(data, dict) else None
+        if not isinstance(body, dict):
+            return None
+        meta = body.get('10')
+        if not isinstance(meta, dict) or 'senderUserId' not in meta:
+            return None
+
+        sender_id = str(meta.get('senderUserId', ''))
+        content = meta.get('reminderContent', '') or ''
+        item_match = self.ITEM_ID_PATTERN.search(meta.get('reminderUrl', '') or '')
+        timestamp = body.get('5')
+
+        image_urls = self._extract_image_urls(body)
+        if image_urls and content == '[图片]':
+            content = ''
+
+        is_seller = bool(self.self_user_id) and sender_id == self.self_user_id
+        return Message(
+            sender='seller' if is_seller else 'buyer',
+            content=content,
+            timestamp=str(timestamp) if timestamp else '',
+            is_system=CozeVars.get_classifier().is_system_message(content),
+            image_urls=image_urls,
+            user_id=sender_id,
+            item_id=item_match.group(1) if item_match else '',
+            buyer_name=meta.get('reminderTitle', '') or '',
+            chat_id=str(body.get('2', '')).split('@')[0],
+        )
+
+    @staticmethod
+    def _extract_image_urls(body: dict) -> List[str]:
+        """从消息内容 JSON 中提取图片URL"""
+        try:
+            raw = body['6']['3']['5']
+            content = json.loads(raw) if isinstance(raw, str) else raw
+            pics = content.get('image', {}).get('pics', [])
+            return [p['url'] for p in pics if p.get('url')]
+        except (KeyError, TypeError, AttributeError, json.JSONDecodeError):
+            return []
+
+
+class WebSocketIngest:
+    """
+    被动采集页面 IM WebSocket 推送帧
+
+    通过 Playwright page.on("websocket") / ws.on("framereceived") 监听，不发送任何数据，
+    解码出的消息回调 on_message，并放入有界的 messages 队列（队列满时丢弃最早的消息）。
+    配置 WS_RECORD_FILE 时把原始帧追加写入 JSONL 文件，用于离线测试。
+    """
+
+    def __init__(self, decoder: FrameDecoder = None, url_keyword: str = None,
+                 record_path: str = None, on_message: Callable[[Message], None] = None,
+                 max_queued: int = 1000):
+        self.decoder = decoder or GoofishFrameDecoder(Config.WS_SELF_USER_ID)
+        self.url_keyword = url_keyword if url_keyword is not None else Config.WS_URL_KEYWORD
+        self.record_path = Path(record_path) if record_path else None
+        self.on_message = on_message
+        # 供轮询方读取；只使用回调时没有消费者，必须有界
+        self.messages: asyncio.Queue = asyncio.Queue(maxsize=max_queued)
+        # 统计
+        self.frames_received = 0
+        self.messages_decoded = 0
+        self.messages_dropped = 0
+
+    def attach(self, page):
+        """开始监听页面的 WebSocket 连接"""
+        page.on("websocket", self._on_websocket)
+        logger.info(f"[WS] 已开始监听 IM WebSocket (URL 关键字: {self.url_keyword})")
+
+    def _on_websocket(self, ws):
+        if self.url_keyword and self.url_keyword not in ws.url:
+            return
+        logger.info(f"[WS] 捕获到 IM 连接: {ws.url}")
+        ws.on("framereceived", lambda payload: self.feed(payload, ws.url))
+
+    def feed(self, payload: Union[str, bytes], url: str = "") -> List[Message]:
+        """处理一个接收到的帧（也可用于离线回放）"""
+        self.frames_received += 1
+        if self.record_path:
+            self._record(payload, url)
+
+        try:
+            messages = self.decoder.decode(payload)
+        except Exception as e:
+            logger.debug(f"[WS] 解码帧失败: {e}")
+            return []
+
+        for message in messages:
+            self.messages_decoded += 1
+            self._enqueue(message)
+            if self.on_message:
+                try:
+                    self.on_message(message)
+                except Exception as e:
+                    logger.debug(f"[WS] 消息回调失败: {e}")
+        return messages
+
+    def _enqueue(self, message: Message):
+        """放入队列，队列已满时丢弃最早的消息"""
+        if self.messages.full():
+            self.messages.get_nowait()
+            self.messages_dropped += 1
+        self.messages.put_nowait(message)
+
+    def _record(self, payload: Union[str, bytes], url: str):
+        """追加记录原始帧（二进制帧使用 base64 编码）"""
+        binary = isinstance(payload, bytes)
+        record = {
+            'ts': time.time(),
+            'url': url,
+            'binary': binary,
+            'payload': base64.b64encode(payload).decode('ascii') if binary else payload,
+        }
+        try:
+            with open(self.record_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        except Exception as e:
+            logger.debug(f"[WS] 记录帧失败: {e}")
+
+    def get_stats(self) -> dict:
+        return {
+            'frames_received': self.frames_received,
+            'messages_decoded': self.messages_decoded,
+            'queued': self.messages.qsize(),
+            'dropped': self.messages_dropped,
+        }
+
+
+def load_recorded_frames(path: Union[str, Path]) -> Iterator[Union[str, bytes]]:
+    """读取 WS_RECORD_FILE 格式的帧记录文件"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            payload = record.get('payload', '')
+            yield base64.b64decode(payload) if record.get('binary') else payload
+
+
+def decode_recorded_frames(path: Union[str, Path], decoder: FrameDecoder = None) -> List[Message]:
+    """离线解码帧记录文件中的所有消息"""
+    decoder = decoder or GoofishFrameDecoder(Config.WS_SELF_USER_ID)
+    messages = []
+    for payload in load_recorded_frames(path):
+        messages.extend(decoder.decode(payload))
+    return messages